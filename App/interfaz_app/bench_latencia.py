@@ -0,0 +1,568 @@
+# bench_latencia.py
+"""
+Benchmark extremo a extremo, sin ventana, de las dos interfaces:
+ControlScreen (App/interfaz_app) y ControlBombaWidget (Arduino + Interfaz).
+`app-async` es ControlScreen con el transporte asyncio (bomba/asincrono.py)
+y el reloj de Kivy en el mismo bucle, como con App.async_run. `lib` y
+`lib-async` son la biblioteca sin Kivy (bomba/control.py: Pump y AsyncPump),
+con la misma bomba: ahí "UI" es cuando wait_for() devuelve el nuevo estado.
+
+Contra el emulador del firmware (emu://) mide por comando:
+  pulsar -> TX      (botón hasta que el byte sale por el puerto)
+  TX -> ACK         (hasta que la línea ACK llega al host)
+  ACK -> UI         (hasta que la vista muestra el nuevo estado)
+y después, con un puerto loop:// (un pty en app-async: hace falta un
+descriptor), el caudal de RX sostenido antes de que crezca el atraso y el
+CPU por mensaje. También cuánto tarda el cierre (stop_listening) y el
+arranque en frío: un proceso nuevo que importa la interfaz (o la
+biblioteca), construye sus widgets sin ventana, conecta con el emulador y
+completa el primer comando (reiniciar -> HOMING). Guarda todo en JSON para comparar versiones.
+
+Uso:  python bench_latencia.py [--frontend app|app-async|desktop|lib|lib-async|all] [--iter 30]
+                               [--scale 200] [--out latencia.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DESKTOP_DIR = os.path.join(HERE, '..', '..', 'Arduino + Interfaz')
+sys.path.insert(0, HERE)
+
+RATES = (10, 20, 50, 100, 200, 400, 800, 1600, 3200, 6400)
+RATE_SECONDS = 1.0
+THROUGHPUT_LINE = b'STATUS:EXPULSION\r\n'  # Sin coalescencia: cada línea cuenta
+FRONTENDS = ('app', 'app-async', 'desktop', 'lib', 'lib-async')
+STARTUP_RUNS = 3
+
+
+def percentiles(samples):
+    if not samples: return None
+    lat = sorted(samples)
+    pick = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000.0, 3)
+    return {'n': len(lat), 'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+def app_version():
+    try:
+        with open(os.path.join(HERE, 'buildozer.spec')) as f:
+            for line in f:
+                if line.startswith('version ='): return line.split('=', 1)[1].strip()
+    except OSError: pass
+    return 'desconocida'
+
+
+class Probe:
+    """ Marca los tiempos de un comando: pulsar -> TX -> ACK -> UI """
+
+    def __init__(self):
+        self.samples = {'press_to_tx': [], 'tx_to_ack': [], 'ack_to_ui': [], 'press_to_ui': []}
+        self.expected = None
+        self.done = True
+
+    def press(self, expected_state):
+        self.expected = expected_state
+        self.t_press = time.monotonic()
+        self.t_tx = self.t_ack = None
+        self.done = False
+
+    def on_tx(self, data):
+        if not self.done and self.t_tx is None: self.t_tx = time.monotonic()
+
+    def on_ack(self, t_rx=None):
+        if not self.done and self.t_tx is not None and self.t_ack is None:
+            self.t_ack = t_rx or time.monotonic()
+
+    def on_ui(self, state):
+        if self.done or self.t_ack is None or state != self.expected: return
+        t_ui = time.monotonic()
+        self.samples['press_to_tx'].append(self.t_tx - self.t_press)
+        self.samples['tx_to_ack'].append(self.t_ack - self.t_tx)
+        self.samples['ack_to_ui'].append(t_ui - self.t_ack)
+        self.samples['press_to_ui'].append(t_ui - self.t_press)
+        self.done = True
+
+
+def is_ack(line):
+    return line.startswith(b'ACK:') if isinstance(line, bytes) else type(line).__name__ == 'Ack'
+
+
+def load_desktop_module():
+    """ Importa 'Arduino + Interfaz/main.py' como módulo (no es un paquete) """
+    import importlib.util
+    os.chdir(DESKTOP_DIR)  # main.py carga 'interfaz.kv' con ruta relativa
+    spec = importlib.util.spec_from_file_location('desktop_main', os.path.join(DESKTOP_DIR, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ============================================================================
+# ADAPTADORES DE CADA INTERFAZ
+# ============================================================================
+class AppAdapter:
+    """ ControlScreen de App/interfaz_app/main.py """
+    name = 'app'
+
+    def __init__(self, probe):
+        import main
+        from kivy.lang import Builder
+        self.main = main
+        self.screen = Builder.load_file(os.path.join(HERE, 'interfaz.kv')).get_screen('control')
+        os.chdir(tempfile.mkdtemp(prefix='bench_'))  # Sin App en marcha las sesiones van a ./sesiones
+        self.probe = probe
+        screen = self.screen
+
+        write, on_line, update = screen.write_to_driver, screen.on_serial_line, screen.update_ui
+        def write_hook(data):
+            probe.on_tx(data)
+            write(data)
+        def line_hook(line, t_rx=None):
+            if is_ack(line): probe.on_ack(t_rx)
+            on_line(line, t_rx)
+        def update_hook(*args, **kwargs):
+            update(*args, **kwargs)
+            probe.on_ui(screen.current_state)
+        screen.write_to_driver, screen.on_serial_line, screen.update_ui = write_hook, line_hook, update_hook
+
+    def connect(self, port):
+        self.main.arduino_driver = port
+        self.screen.start_listening()
+
+    def disconnect(self):
+        self.screen.stop_listening()
+
+    def press_reset(self): self.screen.send_reset_command()
+    def press_select(self): self.screen.handle_select_press()
+
+    def backlog(self, port):
+        return port.in_waiting // len(THROUGHPUT_LINE) + len(self.screen.inbox)
+
+    def pump(self, until, timeout):
+        return pump_clock(until, timeout)
+
+    def throughput_port(self):
+        import serial
+        return serial.serial_for_url('loop://', timeout=1.0)
+
+
+class AppAsyncAdapter(AppAdapter):
+    """ ControlScreen con SerialTransport + PumpProtocol y Clock.async_tick en un bucle asyncio """
+    name = 'app-async'
+
+    def __init__(self, probe):
+        from kivy.clock import Clock
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        Clock.init_async_lib('asyncio')
+        super().__init__(probe)
+
+    def connect(self, port):
+        self.loop.run_until_complete(self._connect(port))
+
+    async def _connect(self, port):
+        from bomba.asincrono import PumpProtocol, SerialTransport
+        port.timeout = 0
+        self.main.arduino_driver = port
+        protocol = PumpProtocol()
+        transport = SerialTransport(self.loop, port, protocol)
+        self.screen.start_listening(link=(transport, protocol))
+
+    def pump(self, until, timeout):
+        return self.loop.run_until_complete(pump_async(until, timeout))
+
+    def throughput_port(self):
+        return PtyPort()
+
+
+class PtyPort:
+    """ Puerto serie real (el extremo esclavo de un pty) alimentado por el maestro """
+
+    def __init__(self):
+        import serial
+        self.master, slave = os.openpty()
+        self.serial = serial.Serial(os.ttyname(slave), timeout=0)
+        os.close(slave)
+
+    def __getattr__(self, name):
+        return getattr(self.serial, name)
+
+    def __setattr__(self, name, value):
+        # port.timeout = ... (SerialLineReader) tiene que llegar al puerto
+        if name in ('master', 'serial'): object.__setattr__(self, name, value)
+        else: setattr(self.serial, name, value)
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def close(self):
+        # Como serial.Serial.close(): se puede llamar dos veces
+        self.serial.close()
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+
+
+class DesktopAdapter:
+    """ ControlBombaWidget de Arduino + Interfaz/main.py """
+    name = 'desktop'
+
+    def __init__(self, probe):
+        self.main = load_desktop_module()
+        self.main.SESSIONS_DIR = tempfile.mkdtemp(prefix='bench_')
+        self.probe = probe
+
+    def connect(self, port):
+        from kivy.clock import Clock
+        probe = self.probe
+        self.main.arduino = port
+        self.widget = widget = self.main.ControlBombaWidget()
+
+        write, parse, update = widget.write_to_arduino, widget.parser.parse, widget.update_ui_for_state
+        def write_hook(data):
+            probe.on_tx(data)
+            write(data)
+        def parse_hook(line):
+            if is_ack(line): probe.on_ack()
+            return parse(line)
+        def update_hook(*args, **kwargs):
+            update(*args, **kwargs)
+            probe.on_ui(widget.current_state)
+        widget.write_to_arduino, widget.parser.parse, widget.update_ui_for_state = write_hook, parse_hook, update_hook
+        widget.inicializar_ui(0)
+
+    def disconnect(self):
+        self.widget.stop_reader()
+        if self.widget.writer: self.widget.writer.stop()
+        if self.widget.recorder: self.widget.recorder.stop()
+
+    def press_reset(self): self.widget.send_reset_command()
+    def press_select(self): self.widget.handle_select_press()
+
+    def backlog(self, port):
+        return port.in_waiting // len(THROUGHPUT_LINE) + len(self.widget.inbox)
+
+    def pump(self, until, timeout):
+        return pump_clock(until, timeout)
+
+    def throughput_port(self):
+        import serial
+        return serial.serial_for_url('loop://', timeout=1.0)
+
+
+class LibAdapter:
+    """ Pump de bomba/control.py: sin Kivy, E/S en el hilo del IOMultiplexer """
+    name = 'lib'
+
+    def __init__(self, probe):
+        from bomba import control
+        self.control = control
+        self.probe = probe
+        self.ack = None     # ACK que da por hecho el último comando
+
+    def connect(self, port):
+        from bomba.protocolo import Ack
+        from bomba.sesion import PumpManager
+        probe = self.probe
+        self.manager = PumpManager()
+        self.session = session = self.manager.attach('bench', port)
+        self.pump_ = self.control.Pump(session, self.manager)
+        write = session.writer.write_fn
+        def write_hook(data):
+            probe.on_tx(data)
+            write(data)
+        session.writer.write_fn = write_hook
+        session.listeners.append(lambda s, msg: probe.on_ack() if type(msg) is Ack else None)
+
+    def wait_synced(self):
+        self.pump_.wait_synced()
+
+    def disconnect(self):
+        self.manager.stop()
+
+    def press(self, cmd, ack):
+        self.ack = ack
+        self.pump_.send(cmd)
+
+    def press_reset(self): self.press(b'r', 'RESET')
+    def press_select(self): self.press(b's', 'ZERO_SET')
+
+    def backlog(self, port):
+        return port.in_waiting // len(THROUGHPUT_LINE)
+
+    def pump(self, until, timeout):
+        """ Lo que haría un script: send() y bloquearse en wait_for(ACK) """
+        deadline = time.monotonic() + timeout
+        while not until():
+            left = deadline - time.monotonic()
+            if left <= 0: break
+            if self.probe.done or self.ack is None:
+                time.sleep(min(left, 0.001))
+                continue
+            ack, self.ack = self.ack, None
+            if self.wait_ack(ack, left): self.probe.on_ui(self.pump_.state.state)
+        return until()
+
+    def wait_ack(self, ack, timeout):
+        try:
+            return self.pump_.wait_for(ack, timeout)
+        except self.control.PumpError:
+            return False
+
+    def throughput_port(self):
+        return PtyPort()
+
+
+class LibAsyncAdapter(LibAdapter):
+    """ AsyncPump sobre SerialTransport, en un bucle asyncio sin Kivy """
+    name = 'lib-async'
+
+    def __init__(self, probe):
+        super().__init__(probe)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def connect(self, port):
+        self.loop.run_until_complete(self._connect(port))
+
+    async def _connect(self, port):
+        from bomba.asincrono import PumpProtocol, SerialTransport
+        from bomba.protocolo import Ack
+        probe = self.probe
+        port.timeout = 0
+        protocol = PumpProtocol()
+        transport = SerialTransport(self.loop, port, protocol)
+        self.pump_ = self.control.AsyncPump(port, transport, protocol, name='bench')
+        self.session = session = self.pump_.session
+        write = session.writer.write_fn
+        def write_hook(data):
+            probe.on_tx(data)
+            write(data)
+        session.writer.write_fn = write_hook
+        session.listeners.append(lambda s, msg: probe.on_ack() if type(msg) is Ack else None)
+
+    def wait_synced(self):
+        self.loop.run_until_complete(self.pump_.wait_synced())
+
+    def disconnect(self):
+        # El puerto lo cierra quien lo abrió (run_latency / run_throughput)
+        self.pump_.session.closed = True
+        self.pump_.transport.close()
+
+    def pump(self, until, timeout):
+        return self.loop.run_until_complete(self._pump(until, timeout))
+
+    async def _pump(self, until, timeout):
+        deadline = time.monotonic() + timeout
+        while not until():
+            left = deadline - time.monotonic()
+            if left <= 0: break
+            if self.probe.done or self.ack is None:
+                await asyncio.sleep(min(left, 0.001))
+                continue
+            ack, self.ack = self.ack, None
+            if await self.wait_ack(ack, left): self.probe.on_ui(self.pump_.state.state)
+        return until()
+
+    async def wait_ack(self, ack, timeout):
+        try:
+            return await self.pump_.wait_for(ack, timeout)
+        except self.control.PumpError:
+            return False
+
+
+ADAPTERS = {'app': AppAdapter, 'app-async': AppAsyncAdapter, 'desktop': DesktopAdapter,
+            'lib': LibAdapter, 'lib-async': LibAsyncAdapter}
+
+
+# ============================================================================
+# ESCENARIOS
+# ============================================================================
+def pump_clock(until, timeout):
+    from kivy.clock import Clock
+    deadline = time.monotonic() + timeout
+    while not until() and time.monotonic() < deadline:
+        Clock.tick()
+    return until()
+
+
+async def pump_async(until, timeout):
+    """ pump_clock() con el reloj de Kivy esperando en el bucle asyncio (App.async_run) """
+    from kivy.clock import Clock
+    deadline = time.monotonic() + timeout
+    while not until() and time.monotonic() < deadline:
+        await Clock.async_tick()
+    return until()
+
+
+def run_latency(adapter, probe, iterations, scale):
+    import serial
+    from bomba import protocol_emu
+    protocol_emu.register()
+    port = serial.serial_for_url(f'emu://?scale={scale}', timeout=1.0)
+    adapter.connect(port)
+    adapter.pump(lambda: False, 0.3)  # Arranque y negociación
+    timeouts = 0
+    for _ in range(iterations):
+        for press, expected in ((adapter.press_reset, 'HOMING'), (adapter.press_select, 'LOAD_SETUP')):
+            probe.press(expected)
+            press()
+            if not adapter.pump(lambda: probe.done, 5.0): timeouts += 1
+    t0 = time.monotonic()
+    adapter.disconnect()
+    stop_ms = (time.monotonic() - t0) * 1000.0
+    port.close()
+    return timeouts, stop_ms
+
+
+def run_throughput(adapter):
+    """ Sube el caudal de líneas hasta que el atraso deja de estar acotado """
+    port = adapter.throughput_port()
+    adapter.connect(port)
+    results = []
+    sustained = 0
+    for rate in RATES:
+        stop = threading.Event()
+        def feeder():
+            period = 1.0 / rate
+            batch = max(1, int(rate / 100))  # Escrituras de ~10 ms
+            next_t = time.monotonic()
+            while not stop.is_set():
+                port.write(THROUGHPUT_LINE * batch)
+                next_t += period * batch
+                time.sleep(max(0.0, next_t - time.monotonic()))
+        thread = threading.Thread(target=feeder, daemon=True)
+        parsed_before = adapter_parsed(adapter)
+        cpu_before = time.process_time()
+        thread.start()
+        adapter.pump(lambda: False, RATE_SECONDS)
+        stop.set()
+        thread.join()
+        backlog = adapter.backlog(port)
+        handled = adapter_parsed(adapter) - parsed_before
+        cpu = time.process_time() - cpu_before
+        ok = backlog <= max(2, rate / 30)  # Menos de ~2 frames de atraso
+        results.append({'rate_lines_s': rate, 'handled': handled, 'backlog_lines': backlog,
+                         'cpu_us_per_msg': round(cpu / handled * 1e6, 2) if handled else None,
+                         'sustained': ok})
+        # Vaciar antes del siguiente escalón
+        port.reset_input_buffer()
+        adapter.pump(lambda: adapter.backlog(port) == 0, 2.0)
+        if not ok: break
+        sustained = rate
+    adapter.disconnect()
+    port.close()
+    return sustained, results
+
+
+def adapter_parsed(adapter):
+    if adapter.name == 'desktop': parser = adapter.widget.parser
+    elif adapter.name.startswith('lib'): parser = adapter.session.parser
+    else: parser = adapter.screen.parser
+    return parser.parsed
+
+
+def run_startup(name, scale):
+    """ En un proceso nuevo: importar y construir, y conectar hasta completar el primer comando """
+    import serial
+    t0 = time.perf_counter()
+    probe = Probe()
+    adapter = ADAPTERS[name](probe)
+    t_built = time.perf_counter()
+    from bomba import protocol_emu
+    protocol_emu.register()
+    port = serial.serial_for_url(f'emu://?scale={scale}', timeout=1.0)
+    adapter.connect(port)
+    # Como Pump.open(): la biblioteca espera al SNAP inicial antes de mandar nada
+    if name.startswith('lib'): adapter.wait_synced()
+    probe.press('HOMING')
+    adapter.press_reset()
+    ok = adapter.pump(lambda: probe.done, 5.0)
+    t_ready = time.perf_counter()
+    adapter.disconnect()
+    port.close()
+    return {'ok': ok, 'build_ms': round((t_built - t0) * 1000.0, 2),
+            'connect_ms': round((t_ready - t_built) * 1000.0, 2)}
+
+
+def measure_startup(name, scale, runs=STARTUP_RUNS):
+    """ Arranque en frío (intérprete incluido): la mediana de `runs` procesos """
+    samples = []
+    for _ in range(runs):
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp: path = tmp.name
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--frontend', name, '--startup',
+                        '--scale', str(scale), '--out', path], check=True, cwd=HERE)
+        total_ms = (time.perf_counter() - t0) * 1000.0
+        with open(path) as f: res = json.load(f)
+        os.remove(path)
+        res['total_ms'] = round(total_ms, 1)
+        samples.append(res)
+    samples.sort(key=lambda r: r['total_ms'])
+    return samples[len(samples) // 2]
+
+
+def run_frontend(name, iterations, scale):
+    probe = Probe()
+    adapter = ADAPTERS[name](probe)
+    timeouts, stop_ms = run_latency(adapter, probe, iterations, scale)
+    sustained, steps = run_throughput(adapter)
+    from bomba.metricas import METRICS
+    return {
+        'frontend': name,
+        'iterations': iterations,
+        'timeouts': timeouts,
+        'stop_ms': round(stop_ms, 3),
+        'latency': {key: percentiles(samples) for key, samples in probe.samples.items()},
+        'rx_sustained_lines_s': sustained,
+        'rx_steps': steps,
+        'metrics': METRICS.snapshot(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de latencia extremo a extremo")
+    parser.add_argument('--frontend', choices=FRONTENDS + ('all',), default='all')
+    parser.add_argument('--iter', type=int, default=30)
+    parser.add_argument('--scale', type=float, default=200.0, help="aceleración del emulador")
+    parser.add_argument('--out', default='latencia.json')
+    parser.add_argument('--startup', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.frontend != 'all':
+        if args.startup: result = run_startup(args.frontend, args.scale)
+        else: result = run_frontend(args.frontend, args.iter, args.scale)
+        with open(args.out, 'w') as f: json.dump(result, f, indent=2, default=str)
+        return
+
+    # Cada interfaz en su propio proceso: los dos .kv definen las mismas reglas
+    report = {'version': app_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'scale': args.scale, 'frontends': {}}
+    for name in FRONTENDS:
+        tmp = f"{args.out}.{name}.tmp"
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--frontend', name,
+                        '--iter', str(args.iter), '--scale', str(args.scale), '--out', os.path.abspath(tmp)],
+                       check=True, cwd=HERE)
+        with open(tmp) as f: report['frontends'][name] = json.load(f)
+        os.remove(tmp)
+        report['frontends'][name]['startup'] = measure_startup(name, args.scale)
+    with open(args.out, 'w') as f: json.dump(report, f, indent=2)
+    for name, res in report['frontends'].items():
+        lat = res['latency']
+        print(f"{name:>9}: pulsar->UI p95 {lat['press_to_ui'] and lat['press_to_ui']['p95_ms']} ms, "
+              f"RX sostenido {res['rx_sustained_lines_s']} líneas/s, cierre {res['stop_ms']} ms, "
+              f"arranque {res['startup']['total_ms']} ms")
+    print(f"Resultados en {args.out}")
+
+
+if __name__ == '__main__':
+    main()
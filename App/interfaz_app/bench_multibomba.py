@@ -0,0 +1,178 @@
+# bench_multibomba.py
+"""
+CPU del host con N bombas emuladas (emu://), sin ventana.
+
+Cada bomba hace un ciclo completo (cero, carga y expulsión con el primer
+preset) y se mide, para N = 1, 2, 4, 8...:
+  mux      un PumpManager: un solo hilo de E/S para todos los puertos
+  threads  lo de la app con una bomba, repetido: un hilo lector bloqueado
+           en read() y un hilo escritor por puerto
+El CPU de los emuladores (un hilo FirmwareModel por bomba) se descuenta:
+lo que queda es lo que gasta el host en leer, decodificar y escribir.
+
+Uso:  python bench_multibomba.py [--pumps 1,2,4,8] [--mode mux|threads|all]
+                                 [--scale 60] [--volume 0.5] [--out multibomba.json]
+"""
+import argparse
+import json
+import threading
+import time
+
+import serial
+
+from bomba import protocol_emu
+from bomba.conexion import wait_ready
+from bomba.protocolo import cmd_set_volume
+from bomba.sesion import PumpManager, PumpSession
+
+STEP_TIMEOUT = 5.0
+
+
+def thread_cpu(thread):
+    """ CPU de otro hilo (Linux: reloj por hilo de pthread) """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError, TypeError):
+        return 0.0
+
+
+def open_emu(scale, index):
+    # `id` no lo usa el emulador: solo distingue las URLs
+    return serial.serial_for_url(f'emu://?scale={scale}&jeringa=0&id={index}', 9600, timeout=0.1)
+
+
+def run_cycle(session, volume, timeout):
+    """ Cero, carga de `volume` mL y expulsión; cada paso espera la respuesta (el firmware vacía la entrada) """
+    steps = (
+        ('s', lambda st: st.state == 'LOAD_SETUP', STEP_TIMEOUT),
+        (cmd_set_volume(volume), lambda st: abs(st.volume - volume) < 1e-3, STEP_TIMEOUT),
+        ('s', lambda st: st.state == 'MODE_SELECT', timeout),
+        ('1', lambda st: st.state == 'CAUDAL_SUBMENU', STEP_TIMEOUT),
+        ('1', lambda st: st.state == 'CAUDAL_PRESET', STEP_TIMEOUT),
+        ('s', lambda st: st.last_ack == 'EXPULSION_COMPLETE', timeout),
+    )
+    if not session.wait_synced(STEP_TIMEOUT) or session.state.state != 'HOMING': return False
+    for cmd, done, limit in steps:
+        session.send(cmd)
+        if not session.wait_for(done, limit): return False
+    return True
+
+
+# ============================================================================
+# LAS DOS FORMAS DE SERVIR N PUERTOS
+# ============================================================================
+class MuxRig:
+    name = 'mux'
+
+    def __init__(self, n, scale):
+        self.manager = PumpManager(open_port=lambda i: open_emu(scale, i))
+        self.sessions = [s for s in self.manager.connect_all(list(range(n))) if s]
+
+    def host_threads(self):
+        return [self.manager.mux.thread]
+
+    def close(self):
+        self.manager.stop()
+
+
+class ThreadsRig:
+    """ Un SerialLineReader.run + CommandWriter por puerto, con la misma PumpSession """
+    name = 'threads'
+
+    def __init__(self, n, scale):
+        self.stop = False
+        self.sessions, self.readers = [], []
+        for i in range(n):
+            port = open_emu(scale, i)
+            session = PumpSession(f"Bomba {i + 1}", port, wait_ready(port))
+            session.writer.start()
+            reader = threading.Thread(target=self.read_loop, args=(session,), daemon=True)
+            reader.start()
+            self.sessions.append(session.start())
+            self.readers.append(reader)
+
+    def read_loop(self, session):
+        port = session.port
+        while not self.stop:
+            try:
+                data = port.read(max(1, port.in_waiting))
+            except Exception:
+                break
+            if data: session.feed(data, time.monotonic())
+
+    def host_threads(self):
+        return self.readers + [s.writer.thread for s in self.sessions]
+
+    def close(self):
+        self.stop = True
+        for s in self.sessions:
+            s.writer.stop()
+            s.port.cancel_read()
+            s.close()
+
+
+RIGS = {'mux': MuxRig, 'threads': ThreadsRig}
+
+
+def run(mode, n, scale, volume):
+    rig = RIGS[mode](n, scale)
+    try:
+        if len(rig.sessions) != n: raise RuntimeError(f"{len(rig.sessions)}/{n} bombas conectadas")
+        models = [s.port.model.thread for s in rig.sessions]
+        emu0 = sum(thread_cpu(t) for t in models)
+        host0 = sum(thread_cpu(t) for t in rig.host_threads())
+        cpu0, t0 = time.process_time(), time.monotonic()
+        results = [None] * n
+        drivers = [threading.Thread(target=lambda i=i: results.__setitem__(
+            i, run_cycle(rig.sessions[i], volume, 120.0))) for i in range(n)]
+        for d in drivers: d.start()
+        for d in drivers: d.join()
+        wall = time.monotonic() - t0
+        cpu = time.process_time() - cpu0
+        emu = sum(thread_cpu(t) for t in models) - emu0
+        io = sum(thread_cpu(t) for t in rig.host_threads()) - host0
+        rx = sum(s.decoder.binary.stats()['frames'] if s.decoder.binary else 0 for s in rig.sessions)
+        return {
+            'pumps': n, 'mode': mode, 'ok': all(results),
+            'wall_s': round(wall, 3),
+            'process_cpu_s': round(cpu, 4),
+            'emulator_cpu_s': round(emu, 4),
+            'host_cpu_s': round(cpu - emu, 4),
+            'io_threads': len(rig.host_threads()),
+            'io_cpu_s': round(io, 4),
+            'host_cpu_pct': round((cpu - emu) / wall * 100.0, 2),
+            'rx_frames': rx,
+            'us_per_frame': round(io / rx * 1e6, 2) if rx else None,
+        }
+    finally:
+        rig.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU del host con N bombas emuladas")
+    parser.add_argument('--pumps', default='1,2,4,8', help="lista de N separada por comas")
+    parser.add_argument('--mode', choices=('mux', 'threads', 'all'), default='all')
+    parser.add_argument('--scale', type=float, default=60.0, help="aceleración del emulador")
+    parser.add_argument('--volume', type=float, default=0.5, help="mL por ciclo")
+    parser.add_argument('--out', default='multibomba.json')
+    args = parser.parse_args(argv)
+    protocol_emu.register()
+
+    modes = ('mux', 'threads') if args.mode == 'all' else (args.mode,)
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'scale': args.scale,
+              'volume': args.volume, 'runs': []}
+    print(f"{'N':>3} {'modo':>8} {'hilos E/S':>9} {'pared s':>8} {'CPU host s':>10} {'CPU E/S s':>9} "
+          f"{'host %':>7} {'us/trama':>8}")
+    for n in (int(x) for x in args.pumps.split(',')):
+        for mode in modes:
+            res = run(mode, n, args.scale, args.volume)
+            report['runs'].append(res)
+            print(f"{n:>3} {mode:>8} {res['io_threads']:>9} {res['wall_s']:>8.2f} {res['host_cpu_s']:>10.3f} "
+                  f"{res['io_cpu_s']:>9.3f} {res['host_cpu_pct']:>7.1f} {res['us_per_frame'] or 0:>8.1f}"
+                  + ("" if res['ok'] else "  FALLO"))
+    with open(args.out, 'w') as f: json.dump(report, f, indent=2)
+    print(f"Resultados en {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+# bomba/__init__.py
+"""
+Núcleo compartido (sin Kivy) de la bomba de jeringa.
+
+Lo importan tanto la app Android (App/interfaz_app/main.py) como la
+interfaz de escritorio (Arduino + Interfaz/main.py).
+"""
@@ -0,0 +1,52 @@
+# ajuste.py
+"""
+Ajuste local con aceleración mientras se mantiene pulsado +/-.
+
+La UI muestra el valor en cada tick sin tocar el enlace serie y, al
+soltar, se envía una única consigna absoluta (ver protocolo.cmd_set_*).
+"""
+
+# (ticks mantenidos, multiplicador del paso)
+ACCELERATION = ((0, 1), (6, 5), (16, 10))
+
+
+class HoldAdjuster:
+    def __init__(self, value, direction, step, minimum=0.0, maximum=None,
+                 acceleration=ACCELERATION):
+        self.value = value
+        self.direction = 1 if direction > 0 else -1
+        self.step = step
+        self.minimum = minimum
+        self.maximum = maximum
+        self.acceleration = acceleration
+        self.ticks = 0
+
+    def multiplier(self):
+        factor = 1
+        for after, mult in self.acceleration:
+            if self.ticks >= after: factor = mult
+        return factor
+
+    def tick(self, dt=0):
+        """ Aplica un paso (cada vez más grande) y devuelve el nuevo valor """
+        self.value += self.direction * self.step * self.multiplier()
+        self.value = max(self.minimum, self.value)
+        if self.maximum is not None:
+            self.value = min(self.maximum, self.value)
+        self.ticks += 1
+        return self.value
+
+
+class CyclicSelector:
+    """ Igual que HoldAdjuster pero recorriendo un índice circular (presets) """
+
+    def __init__(self, index, direction, size):
+        self.value = index
+        self.direction = 1 if direction > 0 else -1
+        self.size = size
+        self.ticks = 0
+
+    def tick(self, dt=0):
+        self.value = (self.value + self.direction) % self.size
+        self.ticks += 1
+        return self.value
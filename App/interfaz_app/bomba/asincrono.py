@@ -0,0 +1,266 @@
+# asincrono.py
+"""
+Transporte asyncio para el puerto serie de PC.
+
+En lugar de un hilo bloqueado en read() y un salto al hilo de la UI, el
+descriptor del puerto se vigila con `loop.add_reader` en el mismo bucle
+que ejecuta Kivy (App.async_run): lectura, escritura, esperas y la
+espera de "placa lista" son callbacks o corutinas de un solo hilo.
+
+- SerialTransport: asyncio.Transport sobre un serial.Serial abierto con
+  timeout=0 (o emu://, cuyo fileno() es un self-pipe).
+- PumpProtocol: asyncio.Protocol que pasa los bytes por un RxDecoder y
+  entrega líneas / mensajes binarios a `on_item(item, t_rx)`.
+- LoopWriter: CommandWriter sin hilo; los envíos se vacían una vez por
+  vuelta del bucle.
+
+close() es determinista: al volver no queda lector registrado y no llega
+ningún callback más (el hilo lector solo se podía esperar con join(timeout)).
+"""
+import asyncio
+import time
+
+from .binario import BinaryFramer
+from .conexion import PROBE, ReadyResult, ReadyScanner
+from .escritor import CommandWriter
+from .lector import ReaderStats, RxDecoder
+from .metricas import log
+
+
+def running_loop():
+    """ El bucle asyncio del hilo actual (App.async_run), o None """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class SerialTransport(asyncio.Transport):
+    """
+    Lectura no bloqueante con add_reader; write() va directo al puerto (los
+    comandos son de pocos bytes y no se hace flush(): tcdrain bloquearía el
+    bucle). El puerto lo cierra quien lo abrió.
+    """
+
+    def __init__(self, loop, port, protocol):
+        super().__init__({'serial': port})
+        self._loop = loop
+        self._port = port
+        self._protocol = protocol
+        self._closing = False
+        self._fd = port.fileno()
+        protocol.connection_made(self)
+        loop.add_reader(self._fd, self._read_ready)
+
+    def _read_ready(self):
+        try:
+            # Con timeout=0, read(1) sin bytes devuelve b'' (o lanza si el USB desapareció)
+            data = self._port.read(self._port.in_waiting or 1)
+        except Exception as e:
+            self._fatal(e)
+            return
+        if data: self._protocol.data_received(data)
+
+    def write(self, data):
+        if self._closing: return
+        try:
+            self._port.write(data)
+        except Exception as e:
+            self._fatal(e)
+
+    def can_write_eof(self):
+        return False
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        self._shutdown(None)
+
+    def abort(self):
+        self._shutdown(None)
+
+    def _fatal(self, error):
+        log.error("Error serie: %s", error)
+        self._shutdown(error)
+
+    def _shutdown(self, error):
+        if self._closing: return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        self._protocol.connection_lost(error)
+
+
+class PumpProtocol(asyncio.Protocol):
+    """
+    Bytes -> RxDecoder -> `on_item(item, t_rx)`, en el hilo del bucle.
+    Hasta que se asigna `on_item` lo recibido se guarda y se entrega al
+    asignarlo (lo que llega detrás de la respuesta de wait_ready()).
+    """
+
+    def __init__(self, on_item=None, on_lost=None):
+        self.decoder = RxDecoder(1024)
+        self.stats = ReaderStats()
+        self.transport = None
+        self.on_lost = on_lost
+        self._on_item = on_item
+        self._backlog = []
+        self._scanner = None
+        self._ready = None
+
+    @property
+    def binary(self):
+        return self.decoder.binary
+
+    @binary.setter
+    def binary(self, framer):
+        self.decoder.binary = framer
+
+    @property
+    def on_item(self):
+        return self._on_item
+
+    @on_item.setter
+    def on_item(self, fn):
+        self._on_item = fn
+        backlog, self._backlog = self._backlog, []
+        if fn:
+            for item, t_rx in backlog: fn(item, t_rx)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        t_rx = time.monotonic()
+        self.stats.wakeups += 1
+        self.stats.bytes += len(data)
+        if self._scanner is not None:
+            result = self._scanner.feed(data)
+            if result is None: return
+            self._scanner = None
+            if result.binary: self.decoder.binary = BinaryFramer()
+            if not self._ready.done(): self._ready.set_result(result)
+            data = result.rest
+        for item in self.decoder.feed(data):
+            self.stats.lines += 1
+            if self._on_item: self._on_item(item, t_rx)
+            else: self._backlog.append((item, t_rx))
+
+    def connection_lost(self, exc):
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_exception(ConnectionError(exc or "Puerto cerrado"))
+        if self.on_lost: self.on_lost(exc)
+
+    async def wait_ready(self, timeout=2.5, grace=0.25, probe_interval=0.25, retries=1, reset=True):
+        """ wait_ready() de conexion.py como corutina: mismos intentos, sonda y reinicio por DTR """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        lines = []
+        try:
+            for attempt in range(1 + retries):
+                if attempt and reset: await reset_board(self.transport.get_extra_info('serial'))
+                self._scanner = scanner = ReadyScanner(started, attempt + 1, lines)
+                self._ready = ready = loop.create_future()
+                deadline = loop.time() + timeout
+                next_probe = loop.time() + grace
+                while not ready.done():
+                    now = loop.time()
+                    if now >= deadline: break
+                    if now >= next_probe:
+                        self.transport.write(PROBE)
+                        scanner.probed = True
+                        next_probe = now + probe_interval
+                    await asyncio.wait([ready], timeout=min(next_probe, deadline) - now)
+                if ready.done(): return ready.result()
+            return ReadyResult(False, None, time.monotonic() - started, 1 + retries, lines)
+        finally:
+            self._scanner = None
+
+    def snapshot(self):
+        snap = self.stats.snapshot()
+        snap.update(self.decoder.snapshot())
+        return snap
+
+
+async def reset_board(port, pulse=0.05):
+    """ conexion.reset_board() sin bloquear el bucle """
+    try:
+        port.dtr = False
+        await asyncio.sleep(pulse)
+        port.dtr = True
+    except (AttributeError, OSError):
+        pass
+
+
+class LoopWriter(CommandWriter):
+    """
+    CommandWriter en modo `notify` para el bucle: el primer send() de cada
+    vuelta programa un drain() con call_soon y los demás se acumulan (la
+    prioridad y la coalescencia siguen valiendo dentro de la vuelta).
+    Solo se usa desde el hilo del bucle.
+    """
+
+    def __init__(self, write_fn, loop=None, **kwargs):
+        super().__init__(write_fn, notify=self._schedule, **kwargs)
+        self.loop = loop or asyncio.get_running_loop()
+        self._scheduled = False
+
+    def start(self):
+        return self
+
+    def _schedule(self):
+        if self._scheduled: return
+        self._scheduled = True
+        self.loop.call_soon(self._run_drain)
+
+    def _run_drain(self):
+        self._scheduled = False
+        self.drain()
+
+
+class SoonTrigger:
+    """
+    Como Clock.create_trigger pero en la siguiente vuelta del bucle, no en
+    el siguiente frame: varias llamadas en la misma vuelta disparan una vez.
+    """
+
+    def __init__(self, callback, loop=None):
+        self.callback = callback
+        self.loop = loop or asyncio.get_running_loop()
+        self._handle = None
+
+    def __call__(self, *args):
+        if self._handle is None: self._handle = self.loop.call_soon(self._fire)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self):
+        self._handle = None
+        self.callback()
+
+
+async def open_serial(url, baudrate=9600, protocol=None, **ready_kwargs):
+    """
+    Abre `url` sin bloqueo de lectura, lo registra en el bucle y espera al
+    firmware. Devuelve (port, transport, protocol, ready); si no responde,
+    el puerto ya está cerrado.
+    """
+    import serial
+    from . import protocol_emu
+    protocol_emu.register()
+    loop = asyncio.get_running_loop()
+    port = serial.serial_for_url(url, baudrate, timeout=0, dsrdtr=True)
+    protocol = protocol or PumpProtocol()
+    try:
+        transport = SerialTransport(loop, port, protocol)
+        ready = await protocol.wait_ready(**ready_kwargs)
+    except BaseException:
+        port.close()
+        raise
+    if not ready:
+        transport.close()
+        port.close()
+    return port, transport, protocol, ready
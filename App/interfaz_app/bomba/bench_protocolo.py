@@ -0,0 +1,66 @@
+# bench_protocolo.py
+"""
+Micro-benchmark del parser: mensajes/segundo sobre una traza del firmware.
+
+Uso:  python -m bomba.bench_protocolo [traza] [repeticiones]
+"""
+import os
+import sys
+import time
+
+from .protocolo import Parser
+
+TRAZA_DEFECTO = os.path.join(os.path.dirname(__file__), 'trazas', 'expulsion_presets.log')
+
+
+def load_trace(path):
+    with open(path, 'rb') as f:
+        return [line for line in f.read().split(b'\n') if line.strip()]
+
+
+def legacy_parse(raw):
+    """ Parser anterior: decodificar, strip y split(':') + cadena de if/elif """
+    line = raw.decode('utf-8', errors='ignore').strip()
+    parts = line.split(':')
+    if len(parts) < 2: return None
+    header = parts[0]
+    try:
+        if header in ("VOL", "PARAM", "PRESET", "CUSTOM", "TIME", "LOOP", "INC"):
+            return header, float(parts[1])
+        elif header == "PROG":
+            return header, int(parts[1])
+        elif header == "INFO":
+            return header, float(parts[1]), float(parts[2]), parts[3]
+        elif header in ("ACK", "STATUS"):
+            return header, parts[1]
+    except: pass
+    return None
+
+
+def run(lines, repeats):
+    results = {}
+    parser = Parser()
+    for name, parse in (('legacy', legacy_parse), ('tabla', parser.parse)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for raw in lines:
+                parse(raw)
+        elapsed = time.perf_counter() - start
+        results[name] = len(lines) * repeats / elapsed
+    return results, parser.counts
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else TRAZA_DEFECTO
+    repeats = int(argv[1]) if len(argv) > 1 else 200
+    lines = load_trace(path)
+    results, counts = run(lines, repeats)
+    print(f"Traza: {path} ({len(lines)} líneas x {repeats})")
+    for name, rate in results.items():
+        print(f"  {name:<8} {rate:>12,.0f} msg/s")
+    print(f"  contadores: {dict(counts)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# binario.py
+"""
+Modo binario opcional del enlace serie (se pide con el comando 'v').
+
+Trama:  COBS( tipo:u8 | payload | crc16:u16 LE ) + 0x00
+CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) sobre tipo + payload.
+Los campos son de ancho fijo, little-endian (float32 = float de AVR).
+
+El firmware responde "ACK:BINARY" en texto y a partir de ahí emite tramas;
+si el firmware no lo soporta, ignora 'v' y el enlace sigue en texto.
+"""
+import math
+import struct
+
+from .protocolo import (Ack, Credit, Custom, Inc, Info, Loop, Preset, Prog, Profile, Program, Snap, Status, Step,
+                        StreamStat, Telem, Time, Vol)
+
+CMD_BINARY = b'v'
+BINARY_ACK = b'ACK:BINARY'
+
+# Mismo orden que `CodigoAck` en Arduino.ino
+ACK_CODES = ('', 'ZERO_SET', 'LOAD_COMPLETE', 'CAUDAL_SUBMENU', 'EXPULSION_COMPLETE',
+             'RETURNED_TO_ZERO', 'STAYING_POSITION', 'RESET', 'BINARY', 'PROGRAM_COMPLETE',
+             'PROGRAM_ABORTED', 'STREAM_START', 'STREAM_END')
+ACK_BY_NAME = {name: code for code, name in enumerate(ACK_CODES) if name}
+
+# Mismo orden que `jeringas[]` en Arduino.ino
+SYRINGE_NAMES = ('Jeringa de 6 ml', 'Jeringa de 10 ml', 'Jeringa de 5 ml', 'Jeringa de 20 ml')
+
+# STATUS: 0..9 = ProgramState (8 PROGRAM, 9 STREAM), 0x80 | fase = STATUS:EXPULSION / STATUS:RECARGA
+PHASES = {0x81: 'EXPULSION', 0x82: 'RECARGA'}
+PHASE_BY_NAME = {name: code for code, name in PHASES.items()}
+MODES = ('FLOW', 'TIME')
+
+T_TEXT = 0x7F
+NAN = float('nan')
+
+
+def _opt(value):
+    return None if math.isnan(value) else value
+
+
+def _status_in(state, volume):
+    name = PHASES.get(state, str(state))
+    return Status(name, _opt(volume))
+
+
+def _status_out(msg):
+    state = PHASE_BY_NAME.get(msg.state)
+    if state is None: state = int(msg.state)
+    return state, NAN if msg.volume is None else msg.volume
+
+
+# tipo -> (mensaje, formato struct, desde campos, hacia campos)
+FRAMES = {
+    0x01: (Vol, '<f', Vol, tuple),
+    0x02: (Time, '<f', Time, tuple),
+    0x03: (Preset, '<fB', lambda v, l: Preset(v, float(l) if l else None),
+           lambda m: (m.value, int(m.loop or 0))),
+    0x04: (Custom, '<ff', lambda v, i: Custom(v, _opt(i)),
+           lambda m: (m.value, NAN if m.inc is None else m.inc)),
+    0x05: (Loop, '<f', Loop, tuple),
+    0x06: (Inc, '<f', Inc, tuple),
+    0x07: (Prog, '<B', Prog, tuple),
+    0x08: (Ack, '<B', lambda c: Ack(ACK_CODES[c]), lambda m: (ACK_BY_NAME[m.event],)),
+    0x09: (Status, '<Bf', _status_in, _status_out),
+    0x0A: (Telem, '<lL', Telem, tuple),
+    0x0C: (Info, '<ffBB', lambda v, p, m, j: Info(v, p, MODES[m], SYRINGE_NAMES[j]),
+           lambda m: (m.volume, m.param, MODES.index(m.mode), SYRINGE_NAMES.index(m.syringe))),
+    0x0D: (Snap, '<BBBlfffBfBfB', Snap, tuple),
+    0x0E: (Profile, '<BBH', Profile, tuple),
+    0x0F: (Program, '<BB', Program, tuple),
+    0x10: (Step, '<BBB', lambda i, c, o: Step(i, c, chr(o)), lambda m: (m.index, m.cycle, ord(m.op))),
+    0x11: (Credit, '<B', Credit, tuple),
+    0x12: (StreamStat, '<LHHH', StreamStat, tuple),
+}
+_STRUCTS = {t: struct.Struct(fmt) for t, (_, fmt, _, _) in FRAMES.items()}
+_TYPE_OF = {cls: t for t, (cls, _, _, _) in FRAMES.items()}
+
+
+def crc16(data, crc=0xFFFF):
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        crc &= 0xFFFF
+    return crc
+
+
+def cobs_encode(data):
+    out = bytearray(b'\x00')
+    code_idx, code = 0, 1
+    for byte in data:
+        if byte:
+            out.append(byte)
+            code += 1
+        if not byte or code == 0xFF:
+            out[code_idx] = code
+            code_idx, code = len(out), 1
+            out.append(0)
+    out[code_idx] = code
+    return bytes(out)
+
+
+def cobs_decode(data):
+    out = bytearray()
+    i, size = 0, len(data)
+    while i < size:
+        code = data[i]
+        if code == 0 or i + code > size:
+            raise ValueError("COBS inválido")
+        out += data[i + 1:i + code]
+        i += code
+        if code < 0xFF and i < size:
+            out.append(0)
+    return bytes(out)
+
+
+def encode(msg):
+    """ Mensaje tipado -> trama binaria completa (con delimitador) """
+    ftype = _TYPE_OF[type(msg)]
+    _, _, _, to_fields = FRAMES[ftype]
+    body = bytes((ftype,)) + _STRUCTS[ftype].pack(*to_fields(msg))
+    return cobs_encode(body + struct.pack('<H', crc16(body))) + b'\x00'
+
+
+def encode_text(text):
+    """ Texto libre del firmware (">>> CICLO 1/3", ...) como trama T_TEXT """
+    body = bytes((T_TEXT,)) + text.encode('utf-8')
+    return cobs_encode(body + struct.pack('<H', crc16(body))) + b'\x00'
+
+
+class BinaryFramer:
+    """
+    Separa tramas por 0x00, valida el CRC y devuelve mensajes tipados.
+
+    Contadores: frames, crc_errors, framing_errors, unknown (tipo no
+    registrado) y text (tramas de texto libre, se descartan).
+    """
+
+    def __init__(self, max_frame=256):
+        self.max_frame = max_frame
+        self._pending = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.framing_errors = 0
+        self.unknown = 0
+        self.text = 0
+
+    def feed(self, data):
+        messages = []
+        view = memoryview(data)
+        start = 0
+        while True:
+            end = data.find(b'\x00', start)
+            if end < 0:
+                self._pending += view[start:]
+                if len(self._pending) > self.max_frame:
+                    self.framing_errors += 1
+                    self._pending.clear()
+                break
+            if self._pending:
+                self._pending += view[start:end]
+                frame, self._pending = bytes(self._pending), bytearray()
+            else:
+                frame = view[start:end]
+            if len(frame):
+                msg = self.decode_frame(frame)
+                if msg is not None: messages.append(msg)
+            start = end + 1
+        return messages
+
+    def decode_frame(self, frame):
+        try:
+            body = cobs_decode(frame)
+        except ValueError:
+            self.framing_errors += 1
+            return None
+        if len(body) < 3:
+            self.framing_errors += 1
+            return None
+        payload = memoryview(body)[:-2]
+        if crc16(payload) != struct.unpack_from('<H', body, len(body) - 2)[0]:
+            self.crc_errors += 1
+            return None
+        self.frames += 1
+        ftype = body[0]
+        if ftype == T_TEXT:
+            self.text += 1
+            return None
+        entry = FRAMES.get(ftype)
+        packer = _STRUCTS.get(ftype)
+        if entry is None or packer.size != len(payload) - 1:
+            self.unknown += 1
+            return None
+        try:
+            return entry[2](*packer.unpack_from(payload, 1))
+        except (IndexError, ValueError):
+            self.unknown += 1
+            return None
+
+    def stats(self):
+        return {'frames': self.frames, 'crc_errors': self.crc_errors,
+                'framing_errors': self.framing_errors, 'unknown': self.unknown, 'text': self.text}
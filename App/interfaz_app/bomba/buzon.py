@@ -0,0 +1,66 @@
+# buzon.py
+"""
+Buzón entre el hilo lector y la UI: se vacía una vez por frame.
+"""
+import threading
+import time
+
+# Cabeceras cuyo último valor es el único que importa
+LATEST_WINS = ('VOL', 'PARAM', 'PROG')
+
+
+class Inbox:
+    """
+    Cola thread-safe de mensajes recibidos con coalescencia por cabecera.
+
+    - VOL / PARAM / PROG: gana el último valor (el anterior se descarta).
+    - ACK y el resto de cabeceras: en orden, nunca se descartan.
+    """
+
+    def __init__(self, latest_wins=LATEST_WINS):
+        self.latest_wins = frozenset(latest_wins)
+        self._lock = threading.Lock()
+        self._items = []   # [(mensaje, t_rx) | None]
+        self._slots = {}   # cabecera -> índice en _items
+        self._oldest = None  # Llegada del mensaje más antiguo sin vaciar
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def put(self, item, header, t_rx=None):
+        """ Devuelve True si el buzón estaba vacío (hay que programar un vaciado) """
+        with self._lock:
+            was_empty = not self._items
+            if was_empty: self._oldest = t_rx or time.monotonic()
+            if header in self.latest_wins:
+                old = self._slots.get(header)
+                if old is not None:
+                    self._items[old] = None
+                    self.coalesced += 1
+                self._slots[header] = len(self._items)
+            self._items.append((item, t_rx))
+            if len(self._items) > self.max_depth: self.max_depth = len(self._items)
+            return was_empty
+
+    def drain(self):
+        """ Saca todo en orden de llegada: lista de (mensaje, t_rx) """
+        with self._lock:
+            items, self._items, self._slots = self._items, [], {}
+            self._oldest = None
+        return [item for item in items if item is not None]
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for item in self._items if item is not None)
+
+    def age(self):
+        """ Segundos que lleva esperando el mensaje más antiguo (0 si está vacío) """
+        oldest = self._oldest
+        return time.monotonic() - oldest if oldest is not None else 0.0
+
+    def stats(self):
+        return {
+            'depth': len(self),
+            'max_depth': self.max_depth,
+            'age_ms': self.age() * 1000.0,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,121 @@
+# conexion.py
+"""
+Detección de "placa lista" al abrir el puerto, en lugar de dormir 2 s.
+
+Al abrir el puerto el Arduino se reinicia (DTR) y, al terminar setup(),
+imprime el banner. Si la placa no se reinicia (sin DTR, CH340 en Android,
+emulador...) el banner no llega: entonces se le pregunta con 'q' y basta
+con que conteste STATUS. Si sigue en modo binario de una sesión anterior,
+la respuesta llega como trama COBS (terminada en 0x00).
+"""
+import time
+
+from .binario import BinaryFramer
+from .framing import LineFramer
+
+BANNER = b'BOMBA DE JERINGA PRO'
+PROBE = b'q'
+STATUS_PREFIX = b'STATUS:'
+
+
+class ReadyResult:
+    """ Resultado de wait_ready(); se evalúa como bool """
+
+    def __init__(self, ok, method=None, elapsed=0.0, attempts=0, lines=(), rest=b''):
+        self.ok = ok
+        self.method = method      # 'banner' | 'status' | 'binary'
+        self.elapsed = elapsed
+        self.attempts = attempts
+        self.lines = list(lines)  # Líneas recibidas hasta la de "lista" incluida
+        self.rest = rest          # Bytes que llegaron detrás: para el lector
+
+    @property
+    def binary(self):
+        return self.method == 'binary'
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return f"ReadyResult(ok={self.ok}, method={self.method}, elapsed={self.elapsed:.3f}, attempts={self.attempts})"
+
+
+def reset_board(port, pulse=0.05):
+    """ Pulso de DTR: reinicia las placas con auto-reset (Uno/Nano) """
+    try:
+        port.dtr = False
+        time.sleep(pulse)
+        port.dtr = True
+    except Exception:
+        pass
+
+
+class ReadyScanner:
+    """
+    Lo que busca wait_ready() en los bytes de un intento: el banner, STATUS
+    tras la sonda o una trama binaria válida tras la sonda. La usan la
+    versión bloqueante y la de asyncio (asincrono.py).
+    """
+
+    def __init__(self, started, attempt, lines):
+        self.started = started
+        self.attempt = attempt
+        self.lines = lines
+        self.framer = LineFramer(1024)
+        self.frames = BinaryFramer()  # Sólo cuenta tramas con CRC válido
+        self.probed = False
+
+    def feed(self, data):
+        """
+        ReadyResult si `data` completa la respuesta; None si hay que seguir
+        esperando. `rest` son los bytes de `data` detrás de la línea o la
+        trama que la completa.
+        """
+        data = bytes(data)
+        pos, size = 0, len(data)
+        while pos < size:
+            # Hasta el siguiente '\n' o 0x00: así se sabe dónde acaba lo que dio la respuesta
+            ends = [i for i in (data.find(b'\n', pos), data.find(b'\x00', pos)) if i >= 0]
+            end = min(ends) + 1 if ends else size
+            chunk, pos = data[pos:end], end
+            if self.frames.feed(chunk) and self.probed:
+                return self._ready('binary', data[end:])
+            for line in self.framer.feed(chunk):
+                self.lines.append(line)
+                if BANNER in line: return self._ready('banner', data[end:])
+                if self.probed and line.startswith(STATUS_PREFIX): return self._ready('status', data[end:])
+        return None
+
+    def _ready(self, method, rest):
+        return ReadyResult(True, method, time.monotonic() - self.started, self.attempt, self.lines, rest)
+
+
+def wait_ready(port, timeout=2.5, grace=0.25, probe_interval=0.25, retries=1, reset=True, poll=0.02):
+    """
+    Espera a que el firmware responda. Vuelve en cuanto llega el banner o la
+    respuesta a 'q'; cada intento dura como mucho `timeout` s y entre
+    intentos (`retries` extra) se reinicia la placa por DTR si `reset`.
+    """
+    started = time.monotonic()
+    saved_timeout = port.timeout
+    port.timeout = poll
+    lines = []
+    try:
+        for attempt in range(1 + retries):
+            if attempt and reset: reset_board(port)
+            scanner = ReadyScanner(started, attempt + 1, lines)
+            t0 = time.monotonic()
+            next_probe = t0 + grace
+            while time.monotonic() - t0 < timeout:
+                now = time.monotonic()
+                if now >= next_probe:
+                    port.write(PROBE)
+                    scanner.probed = True
+                    next_probe = now + probe_interval
+                data = port.read(max(1, port.in_waiting))
+                if not data: continue
+                result = scanner.feed(data)
+                if result: return result
+        return ReadyResult(False, None, time.monotonic() - started, 1 + retries, lines)
+    finally:
+        port.timeout = saved_timeout
@@ -0,0 +1,443 @@
+# control.py
+"""
+La bomba desde un script, sin Kivy: lo que hacen los botones de
+ControlScreen y ControlBombaWidget, como llamadas.
+
+    with Pump.open('emu://?scale=50') as pump:
+        pump.zero()
+        pump.load(2.5)
+        pump.expel(flow=500, repeats=3)
+        pump.return_to_zero()
+
+`Pump` bloquea al hilo que llama; la E/S va en el hilo de un
+IOMultiplexer (PumpManager, como el panel de varias bombas). `AsyncPump`
+es lo mismo con corutinas sobre SerialTransport, en el bucle asyncio.
+
+Las dos recorren los mismos pasos (`zero_steps`, `load_steps`,
+`expel_steps`...): un comando y la respuesta que lo da por hecho. Cada
+comando de un carácter espera a la suya antes del siguiente: el firmware
+vacía la entrada al atenderlo. La respuesta se cuenta desde el envío
+(PumpState.received), así dos ACK iguales seguidos no se confunden.
+
+Las secuencias de texto (`parse_script`) usan las palabras de programa.py,
+pero las ejecuta el host paso a paso por los menús del firmware.
+"""
+import asyncio
+import time
+from collections import namedtuple
+
+from .firmware import BUCLES_POSIBLES
+from .protocolo import (PRESETS_CAUDAL, Custom, Loop, Preset, Time, Vol, cmd_select_preset, cmd_set_flow,
+                        cmd_set_time, cmd_set_volume)
+from .sesion import PumpManager, PumpSession
+
+# Respuesta a un comando que no mueve el motor (s)
+REPLY_TIMEOUT = 5.0
+
+# Un comando y lo que lo da por hecho: nombre de ACK, tipo de mensaje
+# (Vol, Preset...), una tupla de ellos (todos) o f(state).
+# timeout None = lo que tarde el movimiento.
+Action = namedtuple('Action', 'cmd until timeout')
+
+
+class PumpError(RuntimeError):
+    """ La bomba no puede hacer lo pedido (estado, rango o conexión perdida) """
+
+
+class PumpTimeout(PumpError):
+    """ La respuesta no llegó a tiempo """
+
+
+# ============================================================================
+# PASOS (comunes a Pump y AsyncPump)
+# ============================================================================
+# Los generadores leen `state` al reanudarse, con la respuesta anterior ya aplicada.
+# ZERO_SET, RETURNED_TO_ZERO y STAYING_POSITION llegan seguidos de VOL: el paso
+# espera también a ese VOL, que si no contestaría al '#V' de load_steps().
+def zero_steps(state):
+    """ HOMING: fija el cero donde está el émbolo; tras expulsar, vuelve a cero """
+    if state.state == 'HOMING':
+        yield Action(b's', ('ZERO_SET', Vol), REPLY_TIMEOUT)
+    elif state.state == 'POST_EXPULSION':
+        yield Action(b'z', ('RETURNED_TO_ZERO', Vol), None)
+    elif state.state != 'LOAD_SETUP':
+        raise PumpError(f"cero: la bomba está en {state.state}")
+
+
+def load_steps(state, ml):
+    if state.state != 'LOAD_SETUP': yield from zero_steps(state)
+    yield Action(cmd_set_volume(ml), Vol, REPLY_TIMEOUT)
+    if abs(state.volume - round(ml, 2)) > 1e-3:
+        raise PumpError(f"cargar {ml} mL: la placa admite {state.volume:.2f} mL con esta jeringa")
+    yield Action(b's', 'LOAD_COMPLETE', None)
+
+
+def expel_steps(state, flow=None, repeats=1, seconds=None):
+    """
+    Caudal (uL/min) o tiempo total (s). Las repeticiones solo existen con
+    los caudales preset (PRESETS_CAUDAL) y en los valores de BUCLES_POSIBLES.
+    """
+    if state.state != 'MODE_SELECT':
+        raise PumpError(f"expulsar: la bomba está en {state.state} (hay que cargar antes)")
+    if (flow is None) == (seconds is None):
+        raise PumpError("expulsar: hace falta el caudal o el tiempo (uno de los dos)")
+    if repeats not in BUCLES_POSIBLES:
+        raise PumpError(f"repeticiones {repeats}: la placa admite {', '.join(map(str, BUCLES_POSIBLES))}")
+    if repeats != 1 and flow not in PRESETS_CAUDAL:
+        raise PumpError(f"repeticiones solo con los caudales preset ({', '.join('%g' % p for p in PRESETS_CAUDAL)})")
+
+    if seconds is not None:
+        yield Action(b'2', Time, REPLY_TIMEOUT)
+        yield Action(cmd_set_time(seconds), Time, REPLY_TIMEOUT)
+    elif flow in PRESETS_CAUDAL:
+        yield Action(b'1', 'CAUDAL_SUBMENU', REPLY_TIMEOUT)
+        yield Action(b'1', Preset, REPLY_TIMEOUT)
+        yield Action(cmd_select_preset(PRESETS_CAUDAL.index(flow)), Preset, REPLY_TIMEOUT)
+        # 'b' recorre BUCLES_POSIBLES en círculo
+        for _ in BUCLES_POSIBLES:
+            if state.loops == repeats: break
+            yield Action(b'b', Loop, REPLY_TIMEOUT)
+    else:
+        yield Action(b'1', 'CAUDAL_SUBMENU', REPLY_TIMEOUT)
+        yield Action(b'2', Custom, REPLY_TIMEOUT)
+        yield Action(cmd_set_flow(flow), Custom, REPLY_TIMEOUT)
+        if abs(state.param - round(flow, 2)) > 1e-3:
+            raise PumpError(f"caudal {flow} uL/min: la placa admite {state.param:.2f}")
+    yield Action(b's', 'EXPULSION_COMPLETE', None)
+
+
+def return_steps(state):
+    """ Tras expulsar: el émbolo vuelve a cero ('z') """
+    if state.state != 'POST_EXPULSION': raise PumpError(f"volver a cero: la bomba está en {state.state}")
+    yield Action(b'z', ('RETURNED_TO_ZERO', Vol), None)
+
+
+def stay_steps(state):
+    """ Tras expulsar: se queda donde está ('k') y vuelve a la pantalla de carga """
+    if state.state != 'POST_EXPULSION': raise PumpError(f"quedarse: la bomba está en {state.state}")
+    yield Action(b'k', ('STAYING_POSITION', Vol), REPLY_TIMEOUT)
+
+
+def reset_steps(state):
+    yield Action(b'r', 'RESET', REPLY_TIMEOUT)
+
+
+def condition(until, mark):
+    """ f(state) para `until`, contando solo lo recibido después de `mark` """
+    if callable(until) and not isinstance(until, type): return until
+    if isinstance(until, tuple): return lambda st: all(st.received[u] > mark[u] for u in until)
+    return lambda st: st.received[until] > mark[until]
+
+
+def describe(until):
+    """ Texto de `until` para los errores de tiempo """
+    if isinstance(until, tuple): return '+'.join(map(describe, until))
+    return getattr(until, '__name__', until)
+
+
+# ============================================================================
+# API SÍNCRONA
+# ============================================================================
+class Pump:
+    """
+    Una bomba servida por un PumpManager. open() crea el suyo; open_all()
+    comparte uno (un hilo de E/S) entre varias.
+    """
+
+    def __init__(self, session, manager=None, owns_manager=False, move_timeout=None):
+        self.session = session
+        self.manager = manager
+        self.owns_manager = owns_manager
+        self.move_timeout = move_timeout  # Límite de los movimientos (None = sin límite)
+        self.mark = session.state.received.copy()
+
+    @classmethod
+    def open(cls, url, binary=True, move_timeout=None, name=None):
+        manager = PumpManager(binary=binary)
+        try:
+            session = manager.connect(url, name)
+            if session is None: raise PumpError(f"{url}: el firmware no responde")
+            pump = cls(session, manager, True, move_timeout)
+            pump.wait_synced()
+        except BaseException:
+            manager.stop()
+            raise
+        return pump
+
+    @classmethod
+    def open_all(cls, urls, binary=True, move_timeout=None):
+        """
+        Varias a la vez sobre un solo PumpManager: (manager, bombas), con None
+        donde no respondió. Cada una hace su wait_synced() antes de usarla.
+        """
+        manager = PumpManager(binary=binary)
+        sessions = manager.connect_all(urls, [f"Bomba {i + 1}" for i in range(len(urls))])
+        return manager, [cls(s, manager, False, move_timeout) if s else None for s in sessions]
+
+    @property
+    def name(self):
+        return self.session.name
+
+    @property
+    def state(self):
+        return self.session.state
+
+    def wait_synced(self, timeout=REPLY_TIMEOUT):
+        if not self.session.wait_synced(timeout):
+            raise PumpTimeout(f"{self.name}: sin SNAP inicial")
+
+    def send(self, cmd):
+        """ Las respuestas que espera wait_for() cuentan desde aquí """
+        self.mark = self.session.state.received.copy()
+        if not self.session.send(cmd): raise PumpError(f"{self.name}: cerrada")
+
+    def wait_for(self, until, timeout=None):
+        """ ACK (por nombre), tipo de mensaje o f(state), recibido después del último send() """
+        if not self.session.wait_for(condition(until, self.mark), timeout):
+            if not self.state.connected: raise PumpError(f"{self.name}: conexión perdida")
+            raise PumpTimeout(f"{self.name}: sin {describe(until)} en {timeout} s")
+        return self.state
+
+    def run(self, steps):
+        for action in steps:
+            self.send(action.cmd)
+            self.wait_for(action.until, action.timeout or self.move_timeout)
+        return self.state
+
+    def zero(self): return self.run(zero_steps(self.state))
+    def load(self, ml): return self.run(load_steps(self.state, ml))
+    def expel(self, flow=None, repeats=1, seconds=None): return self.run(expel_steps(self.state, flow, repeats, seconds))
+    def return_to_zero(self): return self.run(return_steps(self.state))
+    def stay(self): return self.run(stay_steps(self.state))
+    def reset(self): return self.run(reset_steps(self.state))
+
+    def stop(self):
+        """ 'p': para el motor; la secuencia en curso termina con su ACK de siempre """
+        self.send(b'p')
+
+    def pause(self, seconds):
+        time.sleep(seconds)
+
+    def close(self):
+        if self.owns_manager: self.manager.stop()
+        elif self.manager: self.manager.remove(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def snapshot(self):
+        return self.session.snapshot()
+
+
+# ============================================================================
+# API ASÍNCRONA
+# ============================================================================
+class AsyncPump:
+    """
+    Una bomba en el bucle asyncio: SerialTransport + PumpProtocol, la
+    misma PumpSession (comparte el RxDecoder del protocolo) y un
+    LoopWriter. Todo en el hilo del bucle.
+    """
+
+    def __init__(self, port, transport, protocol, binary=True, name='Bomba', move_timeout=None):
+        from .asincrono import LoopWriter
+        self.loop = asyncio.get_running_loop()
+        self.port = port
+        self.transport = transport
+        self.protocol = protocol
+        self.move_timeout = move_timeout
+        self.session = session = PumpSession(name, port, binary=binary, decoder=protocol.decoder)
+        session.writer = LoopWriter(transport.write, self.loop)
+        session.on_change = self._changed
+        self.mark = session.state.received.copy()
+        self._waiters = []
+        protocol.on_lost = session.lost
+        protocol.on_item = lambda item, t_rx: session.deliver((item,), t_rx)
+        session.start()
+
+    @classmethod
+    async def open(cls, url, binary=True, move_timeout=None, name=None, **ready_kwargs):
+        from .asincrono import open_serial
+        port, transport, protocol, ready = await open_serial(url, **ready_kwargs)
+        if not ready: raise PumpError(f"{url}: el firmware no responde")
+        pump = cls(port, transport, protocol, binary, name or url, move_timeout)
+        try:
+            await pump.wait_synced()
+        except BaseException:
+            pump.close()
+            raise
+        return pump
+
+    @property
+    def name(self):
+        return self.session.name
+
+    @property
+    def state(self):
+        return self.session.state
+
+    def _changed(self, session):
+        state = session.state
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            if future.done(): continue
+            if predicate(state): future.set_result(state)
+            elif not state.connected: future.set_exception(PumpError(f"{self.name}: conexión perdida"))
+
+    async def _wait(self, predicate, timeout, what):
+        state = self.session.state
+        if predicate(state): return state
+        if not state.connected: raise PumpError(f"{self.name}: conexión perdida")
+        waiter = (predicate, self.loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            raise PumpTimeout(f"{self.name}: sin {what} en {timeout} s") from None
+        finally:
+            self._waiters.remove(waiter)
+
+    async def wait_synced(self, timeout=REPLY_TIMEOUT):
+        await self._wait(lambda st: self.session.synced, timeout, "SNAP inicial")
+
+    def send(self, cmd):
+        self.mark = self.session.state.received.copy()
+        if not self.session.send(cmd): raise PumpError(f"{self.name}: cerrada")
+
+    async def wait_for(self, until, timeout=None):
+        return await self._wait(condition(until, self.mark), timeout, describe(until))
+
+    async def run(self, steps):
+        for action in steps:
+            self.send(action.cmd)
+            await self.wait_for(action.until, action.timeout or self.move_timeout)
+        return self.state
+
+    async def zero(self): return await self.run(zero_steps(self.state))
+    async def load(self, ml): return await self.run(load_steps(self.state, ml))
+    async def expel(self, flow=None, repeats=1, seconds=None):
+        return await self.run(expel_steps(self.state, flow, repeats, seconds))
+    async def return_to_zero(self): return await self.run(return_steps(self.state))
+    async def stay(self): return await self.run(stay_steps(self.state))
+    async def reset(self): return await self.run(reset_steps(self.state))
+
+    async def stop(self):
+        self.send(b'p')
+
+    async def pause(self, seconds):
+        await asyncio.sleep(seconds)
+
+    def close(self):
+        self.session.closed = True
+        self.transport.close()
+        self.port.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def snapshot(self):
+        snap = self.session.snapshot()
+        snap['rx'] = self.protocol.snapshot()
+        return snap
+
+
+# ============================================================================
+# SECUENCIAS DE TEXTO
+# ============================================================================
+# Mismas palabras que programa.py donde coinciden
+KEYWORDS = {
+    'cero': 'zero', 'zero': 'zero',
+    'cargar': 'load', 'load': 'load',
+    'expulsar': 'expel', 'expel': 'expel',
+    'volver': 'return_to_zero', 'return': 'return_to_zero',
+    'quedarse': 'stay', 'stay': 'stay',
+    'pausa': 'pause', 'pause': 'pause',
+    'esperar': 'wait_for', 'wait': 'wait_for',
+    'parar': 'stop', 'stop': 'stop',
+    'reiniciar': 'reset', 'reset': 'reset',
+}
+EXPEL_ARGS = {'caudal': 'flow', 'flow': 'flow', 'tiempo': 'seconds', 'time': 'seconds',
+              'repeticiones': 'repeats', 'repeats': 'repeats'}
+
+ScriptStep = namedtuple('ScriptStep', 'op kwargs text line')
+
+
+class ScriptError(ValueError):
+    """ Secuencia inválida; `line` es la línea del texto """
+
+    def __init__(self, message, line=None):
+        super().__init__(f"línea {line}: {message}" if line else message)
+        self.line = line
+
+
+def parse_script(text):
+    """
+    Una orden por línea ('#' comenta):
+
+        cero                            # fija el cero (o vuelve a cero tras expulsar)
+        cargar 2.5                      # mL
+        expulsar caudal 500 repeticiones 3
+        expulsar tiempo 60              # s
+        volver                          # vuelta a cero tras expulsar ('quedarse' = 'k')
+        pausa 2                         # s, en el host
+        esperar EXPULSION_COMPLETE 30   # ACK y límite (s) opcional
+
+    También en inglés (zero, load, expel flow/time/repeats, return, stay,
+    pause, wait, stop, reset).
+    """
+    steps = []
+    for number, raw in enumerate(text.splitlines(), 1):
+        words = raw.split('#', 1)[0].split()
+        if not words: continue
+        op = KEYWORDS.get(words[0].lower())
+        if op is None: raise ScriptError(f"orden desconocida '{words[0]}'", number)
+        args = words[1:]
+        try:
+            if op == 'load' or op == 'pause':
+                if len(args) != 1: raise ValueError
+                kwargs = {'ml' if op == 'load' else 'seconds': float(args[0])}
+            elif op == 'expel':
+                if len(args) % 2: raise ValueError
+                kwargs = {}
+                for key, value in zip(args[::2], args[1::2]):
+                    name = EXPEL_ARGS.get(key.lower())
+                    if name is None: raise ScriptError(f"parámetro desconocido '{key}'", number)
+                    kwargs[name] = int(value) if name == 'repeats' else float(value)
+            elif op == 'wait_for':
+                if len(args) not in (1, 2): raise ValueError
+                kwargs = {'until': args[0].upper()}
+                if len(args) == 2: kwargs['timeout'] = float(args[1])
+            else:
+                if args: raise ValueError
+                kwargs = {}
+        except ValueError as e:
+            if isinstance(e, ScriptError): raise
+            raise ScriptError(f"argumentos inválidos en '{raw.strip()}'", number) from None
+        steps.append(ScriptStep(op, kwargs, raw.split('#', 1)[0].strip(), number))
+    return steps
+
+
+def load_script(path):
+    with open(path, encoding='utf-8') as f:
+        return parse_script(f.read())
+
+
+def run_script(pump, steps, on_step=None):
+    """ Ejecuta `steps` en `pump`; on_step(step, segundos) tras cada una """
+    for step in steps:
+        t0 = time.monotonic()
+        getattr(pump, step.op)(**step.kwargs)
+        if on_step: on_step(step, time.monotonic() - t0)
+
+
+async def run_script_async(pump, steps, on_step=None):
+    for step in steps:
+        t0 = time.monotonic()
+        await getattr(pump, step.op)(**step.kwargs)
+        if on_step: on_step(step, time.monotonic() - t0)
@@ -0,0 +1,233 @@
+# descubrimiento.py
+"""
+Descubrimiento de dispositivos en segundo plano.
+
+Un "lister" es cualquier callable que devuelve la lista actual de
+`DeviceInfo` (pyserial en PC, UsbManager en Android o una lista en memoria
+en las pruebas). `DeviceWatcher` lo consulta en su propio hilo, guarda la
+última lista y avisa con los cambios (altas / bajas); la UI nunca enumera.
+`notify()` fuerza un escaneo inmediato (p. ej. desde el broadcast de
+USB_DEVICE_ATTACHED en Android).
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .metricas import log
+
+_DeviceInfo = namedtuple('DeviceInfo', 'path vid pid serial description handle')
+
+
+class DeviceInfo(_DeviceInfo):
+    """
+    Descriptor de un dispositivo. `handle` es el objeto nativo (UsbDevice en
+    Android) y no cuenta al comparar: cada escaneo crea uno nuevo.
+    """
+    __slots__ = ()
+
+    def __new__(cls, path, vid=None, pid=None, serial=None, description='', handle=None):
+        return super().__new__(cls, path, vid, pid, serial, description, handle)
+
+    @property
+    def key(self):
+        return (self.path, self.vid, self.pid, self.serial)
+
+    @property
+    def usb_id(self):
+        return f"{self.vid:04X}:{self.pid:04X}" if self.vid is not None and self.pid is not None else None
+
+    @property
+    def label(self):
+        """ Texto del spinner: la ruta va primero (connect_to_device la separa por espacios) """
+        return f"{self.path} ({self.usb_id})" if self.usb_id else self.path
+
+    def __eq__(self, other):
+        return isinstance(other, DeviceInfo) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def to_dict(self):
+        return {'path': self.path, 'vid': self.vid, 'pid': self.pid, 'serial': self.serial}
+
+
+# ============================================================================
+# LISTERS
+# ============================================================================
+def pyserial_lister():
+    """ Puertos serie del sistema (PC/Mac) sin los de Bluetooth """
+    from serial.tools import list_ports
+    return [DeviceInfo(p.device, p.vid, p.pid, p.serial_number, p.description or '')
+            for p in list_ports.comports() if 'Bluetooth' not in p.device]
+
+
+class AndroidUsbLister:
+    """ UsbManager.getDeviceList(); `manager` se obtiene del Activity """
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __call__(self):
+        devices = []
+        found = self.manager.getDeviceList()
+        for d in (found.values() if found else ()):
+            try:
+                # Android 10+: sin permiso sobre el dispositivo lanza SecurityException
+                serial = d.getSerialNumber()
+            except Exception:
+                serial = None
+            devices.append(DeviceInfo(d.getDeviceName(), d.getVendorId(), d.getProductId(),
+                                      serial, d.getProductName() or '', d))
+        return devices
+
+    def close(self):
+        """ El hilo del watcher se desengancha de la JVM al terminar """
+        try:
+            from jnius import detach
+            detach()
+        except Exception:
+            pass
+
+
+# ============================================================================
+# WATCHER
+# ============================================================================
+class DeviceWatcher:
+    """
+    Escanea con `lister` cada `interval` s en un hilo propio.
+
+    `on_change(added, removed, devices)` se llama desde ese hilo solo
+    cuando algo cambia; la UI debe reprogramarlo en su propio hilo.
+    """
+
+    def __init__(self, lister, interval=1.0, on_change=None):
+        self.lister = lister
+        self.interval = interval
+        self.on_change = on_change
+        self.devices = []   # Última lista (se sustituye entera: lectura sin lock)
+        self.thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.scanned = threading.Event()  # Primer escaneo hecho
+        # Métricas
+        self.scans = 0
+        self.errors = 0
+        self.changes = 0
+        self.last_scan_ms = None
+        self.max_scan_ms = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True, name='DeviceWatcher')
+            self.thread.start()
+        return self
+
+    def stop(self, join_timeout=2.0):
+        self._stop.set()
+        self._wake.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(join_timeout)
+        self.thread = None
+
+    def notify(self):
+        """ Aviso del sistema (o botón "Refrescar"): escanea ya """
+        self._wake.set()
+
+    def wait_scanned(self, timeout=None):
+        return self.scanned.wait(timeout)
+
+    def find(self, path):
+        return next((d for d in self.devices if d.path == path), None)
+
+    def run(self):
+        try:
+            while not self._stop.is_set():
+                self.scan()
+                self._wake.wait(self.interval)
+                self._wake.clear()
+        finally:
+            close = getattr(self.lister, 'close', None)
+            if close: close()
+
+    def scan(self):
+        """ Un escaneo; devuelve (altas, bajas) """
+        t0 = time.monotonic()
+        try:
+            current = list(self.lister())
+        except Exception as e:
+            self.errors += 1
+            log.error("Error listando dispositivos: %s", e)
+            return [], []
+        ms = (time.monotonic() - t0) * 1000.0
+        self.scans += 1
+        self.last_scan_ms = ms
+        self.max_scan_ms = max(self.max_scan_ms, ms)
+        old = set(self.devices)
+        new = set(current)
+        added = [d for d in current if d not in old]
+        removed = [d for d in self.devices if d not in new]
+        self.devices = current
+        first = not self.scanned.is_set()
+        self.scanned.set()
+        if (added or removed or first) and self.on_change:
+            if added or removed: self.changes += 1
+            self.on_change(added, removed, current)
+        return added, removed
+
+    def snapshot(self):
+        return {
+            'devices': [d.label for d in self.devices],
+            'scans': self.scans,
+            'changes': self.changes,
+            'errors': self.errors,
+            'last_scan_ms': self.last_scan_ms,
+            'max_scan_ms': self.max_scan_ms,
+        }
+
+
+# ============================================================================
+# ÚLTIMO DISPOSITIVO (reconexión automática)
+# ============================================================================
+def load_last(path):
+    """ Descriptor guardado de la última bomba usada (dict) o None """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_last(path, device):
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(device.to_dict(), f)
+    except OSError as e:
+        log.error("No se pudo guardar el último dispositivo: %s", e)
+
+
+def matches(last, device):
+    """
+    ¿Es `device` la bomba guardada? Por número de serie si ambos lo tienen;
+    si no, mismo VID:PID y misma ruta (Android renumera /dev/bus/usb al
+    reconectar, así que sin serie basta con el VID:PID si es el único).
+    """
+    if not last: return False
+    if last.get('serial') and device.serial:
+        return last['serial'] == device.serial
+    if (last.get('vid'), last.get('pid')) != (device.vid, device.pid): return False
+    return last.get('path') == device.path or last.get('vid') is not None
+
+
+def pick_last(last, devices):
+    """ El dispositivo de `devices` que corresponde a `last` (sin ambigüedad) o None """
+    same = lambda d: (last.get('serial') and d.serial == last['serial']) or d.path == last.get('path')
+    exact = [d for d in devices if matches(last, d) and same(d)]
+    if len(exact) == 1: return exact[0]
+    loose = [d for d in devices if matches(last, d)]
+    return loose[0] if len(loose) == 1 else None
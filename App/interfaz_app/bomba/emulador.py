@@ -0,0 +1,926 @@
+# emulador.py
+"""
+Emulador en Python del firmware (Arduino + Interfaz/Arduino.ino).
+
+Reproduce la máquina de estados, los handle*Commands, ejecutarExpulsion,
+el tiempo de moveAndTrackMotor (2 x delayMicroseconds por paso), los
+reportes PROG cada 200 ms y calcularPasosPorML. `time_scale` acelera el
+reloj: con 60, una expulsión de 10 minutos dura 10 segundos.
+
+Se expone de dos formas:
+  - EmulatorPTY: pseudo-terminal; `serial.Serial(emu.port)` funciona igual
+    que con la placa (pc_connect no cambia).
+  - URL "emu://?scale=60" vía serial.serial_for_url (ver protocol_emu.py).
+
+Uso:  python -m bomba.emulador [--scale 60]
+"""
+import argparse
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
+
+from . import binario
+from .firmware import (BUCLES_POSIBLES, FASE_MOVIMIENTO, FASE_PARADO, FASE_PAUSA, FASES, JERINGAS, MAX_DELAY_TECNICO,
+                       MIN_DELAY, PRESETS_CAUDAL, PROGRAMA_MAX, RAMPA_MAX, STREAM_COLA, STREAM_STAT_MS, STREAM_VENTANA,
+                       STREAM_WATCHDOG_MS, SUCCION_BASE, ProgramState, f32, flow_limits, flow_mode_delay,
+                       pasos_por_ml, ramp_delay, time_mode_delay)
+from .protocolo import (Ack, Credit, Custom, Inc, Info, Loop, Preset, Prog, Profile, Program, Snap, Status, Step,
+                        StreamStat, Telem, Time, Vol)
+
+# --- Constantes de Arduino.ino (las compartidas con el host están en firmware.py) ---
+BANNER = "BOMBA DE JERINGA PRO (NUEVA CALIBRACION)"
+REPORT_MS = 200
+REPORT_MS_BINARY = 50
+SERIAL_TIMEOUT_MS = 50
+
+
+class FirmwareModel:
+    """
+    Modelo del firmware. `write(bytes)` recibe todo lo que la placa
+    imprimiría por Serial; `feed(bytes)` entrega lo que envía el host.
+    """
+
+    def __init__(self, write, time_scale=1.0, jeringa=0):
+        self.write = write
+        self.time_scale = float(time_scale)
+        self._input = bytearray()
+        self._cond = threading.Condition()
+        self._t0 = time.monotonic()
+        self.running = False
+        self.thread = None
+
+        # Globales de Arduino.ino
+        self.velocidad_delay = 1000
+        self.position = 0                  # currentPositionInSteps
+        self.fase = FASE_PARADO            # faseActual
+        self.progreso = 0                  # progresoActual
+        self.state = ProgramState.STATE_HOMING
+        self.volumen_a_cargar = 1.0
+        self.incremento_volumen = 0.1
+        self.caudal_manual = 250.0
+        self.incremento_caudal = 10.0
+        self.caudal_minimo = 0.0
+        self.caudal_maximo = 0.0
+        self.presets = list(PRESETS_CAUDAL)
+        self.preset_index = 0
+        self.bucle_repeticiones = 1
+        self.bucle_index = 0
+        self.tiempo_final = 10.0
+        self.incremento_tiempo = 1.0
+        self.jog_direction = 0
+        self.jog_speed_delay = 300
+        self.suction_speed_delay = SUCCION_BASE
+        self.rampa = []                    # Perfil de movimiento ('#A'); vacío = retardo constante
+        self.rampa_seg = 1
+        self.jog_pasos = 0
+        self.last_move = None              # Resumen del último movimiento (verificación)
+        self.programa = []                 # [(op, a, b)] cargado con '#D'
+        self.programa_ciclos = 1
+        self.paso_actual = 0
+        self.ciclo_actual = 0
+        self.stream_cola = deque()         # [(t, semiperiodo, llegada)] en ms desde el '#Q'
+        self.stream_pendientes = 0
+        self.stream_periodo = 50
+        self.stream_delay = 0
+        self.stream_aplicadas = self.stream_underruns = self.stream_overruns = self.stream_tarde = 0
+        self.stream_log = []               # [(t, aplicada)]: jitter de cada consigna (verificación)
+        self.jeringa_index = jeringa
+        self.pasos_por_ml = 0.0
+        self.modo_binario = False
+        self._jog_since = None
+
+    # ------------------------------------------------------------------
+    # Reloj y E/S
+    # ------------------------------------------------------------------
+    def millis(self):
+        """ Tiempo del firmware (ms), acelerado por time_scale """
+        return (time.monotonic() - self._t0) * self.time_scale * 1000.0
+
+    def feed(self, data):
+        with self._cond:
+            self._input += data
+            self._cond.notify_all()
+
+    def available(self):
+        return len(self._input)
+
+    def _read_char(self):
+        with self._cond:
+            if not self._input: return None
+            char = self._input[0]
+            del self._input[0]
+        return chr(char).lower()
+
+    def _drain(self):
+        with self._cond:
+            self._input.clear()
+
+    def _wait_input(self, firmware_ms):
+        """ Espera hasta `firmware_ms` de tiempo del firmware o hasta que llegue algo """
+        with self._cond:
+            if not self._input and self.running:
+                self._cond.wait(max(0.0, firmware_ms / 1000.0 / self.time_scale))
+            return bool(self._input)
+
+    def _read_line(self):
+        """ Serial.readStringUntil('\\n') con el timeout de 50 ms """
+        deadline = self.millis() + SERIAL_TIMEOUT_MS
+        while True:
+            with self._cond:
+                nl = self._input.find(b'\n')
+                if nl >= 0:
+                    line = bytes(self._input[:nl])
+                    del self._input[:nl + 1]
+                    return line.decode('utf-8', errors='ignore')
+            remaining = deadline - self.millis()
+            if remaining <= 0 or not self.running:
+                with self._cond:
+                    line = bytes(self._input)
+                    self._input.clear()
+                return line.decode('utf-8', errors='ignore')
+            self._wait_input(remaining)
+
+    def delay(self, ms):
+        end = self.millis() + ms
+        while self.running and self.millis() < end:
+            with self._cond:
+                self._cond.wait((end - self.millis()) / 1000.0 / self.time_scale)
+
+    def println(self, text=""):
+        self.write(f"{text}\r\n".encode('utf-8'))
+
+    def _frame(self, msg):
+        self.write(binario.encode(msg))
+
+    # ------------------------------------------------------------------
+    # Ciclo principal
+    # ------------------------------------------------------------------
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(1.0)
+
+    def preload(self, position):
+        """
+        Atajo de banco de pruebas: cero ya fijado y émbolo en `position`
+        pasos, en LOAD_SETUP, sin esperar a la carga (que a escala 1 tarda
+        lo que en la placa).
+        """
+        with self._cond:
+            self.position = position
+            self.state = ProgramState.STATE_LOAD_SETUP
+
+    def run(self):
+        self.setup()
+        while self.running:
+            self.loop()
+
+    def setup(self):
+        self.println(BANNER)
+        self.calcular_pasos_por_ml()
+
+    def loop(self):
+        if self.state == ProgramState.STATE_STREAM:
+            # Sin readStringUntil ni vaciar la entrada: las consignas no paran el motor
+            self.handle_streaming()
+            if self.state == ProgramState.STATE_STREAM: self.leer_stream()
+            if self.state == ProgramState.STATE_STREAM: self.handle_streaming()
+            if self.state == ProgramState.STATE_STREAM: self._wait_input(self._stream_wait())
+            return
+        if self.available() > 0:
+            self._update_jog()
+            command = self._read_char()
+            if command == '#':
+                self.handle_setpoint_command()
+                return
+            self._drain()
+
+            if command == 'r':
+                self.jog_direction = 0
+                self.state = ProgramState.STATE_HOMING
+                self.send_ack('RESET')
+            elif command == 'q':
+                self.send_status()
+            elif command == 'x':
+                self.send_snapshot()
+            elif command == 'g':
+                # Sin cero fijado (HOMING) la posición no significa nada
+                if self.programa and self.state != ProgramState.STATE_HOMING: self.ejecutar_programa()
+                else: self.send_program()
+            elif command == 'v':
+                self.send_ack('BINARY')
+                self.modo_binario = True
+            else:
+                handler = self.HANDLERS.get(self.state)
+                if handler: handler(self, command)
+                # Los handlers bloquean hasta terminar el movimiento / la secuencia
+                self.fase = FASE_PARADO
+        if self.state == ProgramState.STATE_HOMING and self.jog_direction:
+            self._update_jog()
+            self._wait_input(REPORT_MS)
+        else:
+            self._jog_since = None
+            self._wait_input(1000)
+
+    def _update_jog(self):
+        """ handleContinuousJogging(): un paso cada 2 x retardoPaso(jogPasos) us """
+        now = self.millis()
+        if self.state == ProgramState.STATE_HOMING and self.jog_direction and self._jog_since is not None:
+            left_us = (now - self._jog_since) * 1000.0
+            steps = 0
+            # Rampa de arranque paso a paso; después, crucero en bloque
+            while self.rampa and self.jog_pasos + steps < len(self.rampa) * self.rampa_seg:
+                period = 2 * ramp_delay(self.rampa, self.rampa_seg, self.jog_speed_delay, self.jog_pasos + steps)
+                if left_us < period: break
+                left_us -= period
+                steps += 1
+            else:
+                cruise = steps + int(left_us // (2 * self.jog_speed_delay))
+                left_us -= (cruise - steps) * 2 * self.jog_speed_delay
+                steps = cruise
+            self.position += steps * self.jog_direction
+            self.jog_pasos += steps
+            self._jog_since = now - left_us / 1000.0
+        else:
+            self._jog_since = now
+
+    # ------------------------------------------------------------------
+    # Manejo de comandos (estados)
+    # ------------------------------------------------------------------
+    def handle_homing(self, cmd):
+        if cmd == '+': self.jog_direction = 1
+        elif cmd == '-': self.jog_direction = -1
+        elif cmd == 'p': self.jog_direction = 0
+        elif cmd == 's':
+            self.jog_direction = 0
+            self.position = 0
+            self.state = ProgramState.STATE_LOAD_SETUP
+            self.send_ack('ZERO_SET')
+            self.send_data('VOL', self.volumen_a_cargar)
+        self._jog_since = self.millis()
+        self.jog_pasos = 0
+
+    def handle_load_setup(self, cmd):
+        max_vol = JERINGAS[self.jeringa_index][1]
+        if cmd == '+':
+            self.volumen_a_cargar = f32(min(self.volumen_a_cargar + self.incremento_volumen, max_vol))
+            self.send_data('VOL', self.volumen_a_cargar)
+        elif cmd == '-':
+            self.volumen_a_cargar = f32(max(self.volumen_a_cargar - self.incremento_volumen, 0.0))
+            self.send_data('VOL', self.volumen_a_cargar)
+        elif cmd == 's':
+            target_steps = int(self.volumen_a_cargar * self.pasos_por_ml)
+            self.move_and_track_motor(target_steps - self.position, self.suction_speed_delay)
+            self.state = ProgramState.STATE_MODE_SELECT
+            self.send_ack('LOAD_COMPLETE')
+
+    def handle_mode_select(self, cmd):
+        if cmd == '1':
+            self.state = ProgramState.STATE_CAUDAL_SUBMENU
+            self.send_ack('CAUDAL_SUBMENU')
+        elif cmd == '2':
+            self.state = ProgramState.STATE_TIME_SETUP
+            self.send_data('TIME', self.tiempo_final)
+
+    def handle_caudal_submenu(self, cmd):
+        if cmd == '1':
+            self.state = ProgramState.STATE_CAUDAL_PRESET
+            if self.presets[self.preset_index] < self.caudal_minimo:
+                self.presets[self.preset_index] = self.caudal_minimo
+            self.send_preset(self.presets[self.preset_index], self.bucle_repeticiones)
+        elif cmd == '2':
+            self.state = ProgramState.STATE_CAUDAL_MANUAL
+            if self.caudal_manual < self.caudal_minimo: self.caudal_manual = self.caudal_minimo
+            self.send_custom(self.caudal_manual, self.incremento_caudal)
+
+    def _preset_value(self):
+        value = self.presets[self.preset_index]
+        return self.caudal_minimo if value < self.caudal_minimo else value
+
+    def handle_caudal_preset(self, cmd):
+        if cmd == '+':
+            self.preset_index = (self.preset_index + 1) % 5
+            self.send_preset(self._preset_value(), 0)
+        elif cmd == '-':
+            self.preset_index = (self.preset_index - 1 + 5) % 5
+            self.send_preset(self._preset_value(), 0)
+        elif cmd == 'b':
+            self.bucle_index = (self.bucle_index + 1) % 4
+            self.bucle_repeticiones = BUCLES_POSIBLES[self.bucle_index]
+            self.send_loop(self.bucle_repeticiones)
+        elif cmd == 's':
+            valor_final = self._preset_value()
+            self.send_config_summary()
+            self.state = ProgramState.STATE_POST_EXPULSION
+            self.ejecutar_expulsion(self.volumen_a_cargar, valor_final, self.bucle_repeticiones)
+            self.send_ack('EXPULSION_COMPLETE')
+
+    def handle_caudal_manual(self, cmd):
+        if cmd == '+':
+            self.caudal_manual = min(self.caudal_manual + self.incremento_caudal, self.caudal_maximo)
+            self.send_custom(self.caudal_manual, -1)
+        elif cmd == '-':
+            self.caudal_manual = max(self.caudal_manual - self.incremento_caudal, self.caudal_minimo)
+            self.send_custom(self.caudal_manual, -1)
+        elif cmd == 'm':
+            self.incremento_caudal = {10.0: 100.0, 100.0: 1000.0}.get(self.incremento_caudal, 10.0)
+            self.send_inc(self.incremento_caudal)
+        elif cmd == 's':
+            self.send_config_summary()
+            self.state = ProgramState.STATE_POST_EXPULSION
+            self.ejecutar_expulsion(self.volumen_a_cargar, self.caudal_manual, 1)
+            self.send_ack('EXPULSION_COMPLETE')
+
+    def handle_time_setup(self, cmd):
+        if cmd == '+':
+            self.tiempo_final += self.incremento_tiempo
+            self.send_data('TIME', self.tiempo_final)
+        elif cmd == '-':
+            self.tiempo_final = max(self.tiempo_final - self.incremento_tiempo, 0.0)
+            self.send_data('TIME', self.tiempo_final)
+        elif cmd == 's':
+            self.send_config_summary()
+            pasos_totales = int(self.volumen_a_cargar * self.pasos_por_ml)
+            self.velocidad_delay = time_mode_delay(self.tiempo_final, pasos_totales)
+            self.send_text("Expulsando...")
+            self.state = ProgramState.STATE_POST_EXPULSION
+            self.send_phase('EXPULSION')
+            self.move_and_track_motor(-pasos_totales, self.velocidad_delay)
+            self.send_ack('EXPULSION_COMPLETE')
+
+    def handle_post_expulsion(self, cmd):
+        if cmd == 'z':
+            self.move_and_track_motor(-self.position, self.suction_speed_delay)
+            self.state = ProgramState.STATE_LOAD_SETUP
+            self.send_ack('RETURNED_TO_ZERO')
+            self.send_data('VOL', self.volumen_a_cargar)
+        elif cmd == 'k':
+            self.state = ProgramState.STATE_LOAD_SETUP
+            self.send_ack('STAYING_POSITION')
+            self.send_data('VOL', self.volumen_a_cargar)
+
+    HANDLERS = {
+        ProgramState.STATE_HOMING: handle_homing,
+        ProgramState.STATE_LOAD_SETUP: handle_load_setup,
+        ProgramState.STATE_MODE_SELECT: handle_mode_select,
+        ProgramState.STATE_CAUDAL_SUBMENU: handle_caudal_submenu,
+        ProgramState.STATE_CAUDAL_PRESET: handle_caudal_preset,
+        ProgramState.STATE_CAUDAL_MANUAL: handle_caudal_manual,
+        ProgramState.STATE_TIME_SETUP: handle_time_setup,
+        ProgramState.STATE_POST_EXPULSION: handle_post_expulsion,
+    }
+
+    def handle_setpoint_command(self):
+        """ Consignas absolutas '#V5.80', '#F740', '#T37', '#P2', perfil '#A...', programa '#D...' y streaming '#Q...' """
+        line = self._read_line()
+        if len(line) < 2: return
+        kind = line[0].lower()
+        if kind == 'a':
+            self.cargar_rampa(line[1:])
+            return
+        if kind == 'd':
+            self.cargar_programa(line[1:])
+            return
+        if kind == 'q':
+            self.iniciar_stream(_to_int(line[1:]))
+            return
+        try:
+            value = float(line[1:])
+        except ValueError:
+            value = 0.0  # String.toFloat() devuelve 0 si no es un número
+        if kind == 'v':
+            max_vol = JERINGAS[self.jeringa_index][1]
+            self.volumen_a_cargar = f32(min(max(value, 0.0), max_vol))
+            self.send_data('VOL', self.volumen_a_cargar)
+        elif kind == 'f':
+            self.caudal_manual = min(max(value, self.caudal_minimo), self.caudal_maximo)
+            self.send_custom(self.caudal_manual, -1)
+        elif kind == 't':
+            self.tiempo_final = max(value, 0.0)
+            self.send_data('TIME', self.tiempo_final)
+        elif kind == 'p':
+            self.preset_index = min(max(int(value), 0), 4)
+            self.send_preset(self._preset_value(), 0)
+
+    def cargar_rampa(self, datos):
+        """ "seg:succion:d0,d1,..." (retardos en us); seg 0 vuelve al retardo constante """
+        fields = datos.split(':')
+        seg = _to_int(fields[0])
+        if seg <= 0 or len(fields) < 3:
+            self.rampa = []
+            self.suction_speed_delay = SUCCION_BASE
+        else:
+            self.rampa_seg = min(seg, 255)
+            self.suction_speed_delay = min(max(_to_int(fields[1]), MIN_DELAY), MAX_DELAY_TECNICO)
+            values = [v for v in fields[2].split(',') if v][:RAMPA_MAX]
+            self.rampa = [min(max(_to_int(v), MIN_DELAY), MAX_DELAY_TECNICO) for v in values]
+        self.send_profile()
+
+    def cargar_programa(self, datos):
+        """ "jeringa:ciclos:L<pos>/E<pasos>,<us>/W<ms>/Z"; se rechaza entero si algo no cuadra """
+        self.programa = []
+        fields = datos.split(':', 2)
+        if len(fields) < 3 or _to_int(fields[0]) != self.jeringa_index:
+            self.send_program()
+            return
+        self.programa_ciclos = min(max(_to_int(fields[1]), 1), 255)
+        max_pasos = int(f32(JERINGAS[self.jeringa_index][1] * self.pasos_por_ml))
+        programa = []
+        for paso in fields[2].split('/'):
+            if not paso: continue
+            op = paso[0].upper()
+            a, _, b = paso[1:].partition(',')
+            a, b = _to_int(a), _to_int(b)
+            if op == 'E': b = min(max(b, MIN_DELAY), MAX_DELAY_TECNICO)
+            if (len(programa) >= PROGRAMA_MAX or a < 0 or op not in 'ELWZ'
+                    or (op == 'L' and a > max_pasos)):
+                programa = []
+                break
+            programa.append((op, a, b))
+        self.programa = programa
+        self.send_program()
+
+    def ejecutar_programa(self):
+        """ ejecutarPrograma(): 'p' aborta; 'x'/'q' se contestan sin parar """
+        self.state = ProgramState.STATE_PROGRAM
+        abortado = False
+        for self.ciclo_actual in range(1, self.programa_ciclos + 1):
+            for self.paso_actual, (op, a, b) in enumerate(self.programa):
+                self.send_step()
+                if op == 'L':
+                    self.send_phase('RECARGA')
+                    abortado = self.move_and_track_motor(a - self.position, self.suction_speed_delay)
+                elif op == 'E':
+                    self.send_phase('EXPULSION')
+                    abortado = self.move_and_track_motor(-min(a, self.position), b)
+                elif op == 'W':
+                    self.fase = FASE_PAUSA
+                    abortado = self.esperar_programa(a)
+                elif op == 'Z':
+                    self.fase = FASE_MOVIMIENTO
+                    abortado = self.move_and_track_motor(-self.position, self.suction_speed_delay)
+                if abortado or not self.running: break
+            if abortado or not self.running: break
+        self.fase = FASE_PARADO
+        self.state = ProgramState.STATE_LOAD_SETUP if self.position == 0 else ProgramState.STATE_POST_EXPULSION
+        if abortado: self.send_text("ABORTADO por usuario")
+        self.send_ack('PROGRAM_ABORTED' if abortado else 'PROGRAM_COMPLETE')
+        self.send_snapshot()
+
+    def esperar_programa(self, ms):
+        """ Pausa de un programa con PROG periódicos; True si llegó 'p' """
+        interval = REPORT_MS_BINARY if self.modo_binario else REPORT_MS
+        start = self.millis()
+        last_report = None
+        while self.running:
+            now = self.millis()
+            if now - start >= ms: break
+            if last_report is None or now - last_report > interval:
+                last_report = now
+                self.progreso = int((now - start) / ms * 100.0)
+                self.send_prog(self.progreso, 0, self.position)
+            if self.available():
+                chars = self._consume_all()
+                if 'p' in chars: return True
+                if 'x' in chars: self.send_snapshot()
+                if 'q' in chars: self.send_status()
+            self._wait_input(min(last_report + interval + 1, start + ms) - self.millis())
+        self.progreso = 100
+        self.send_prog(100, 0, self.position)
+        return False
+
+    # ------------------------------------------------------------------
+    # Caudal variable (streaming)
+    # ------------------------------------------------------------------
+    def iniciar_stream(self, periodo):
+        """ '#Q<periodo_ms>'; sin cero fijado o con la jeringa vacía se contesta STATUS """
+        if self.state == ProgramState.STATE_HOMING or self.position <= 0:
+            self.send_status()
+            return
+        self.state = ProgramState.STATE_STREAM
+        self.stream_periodo = min(max(periodo, 10), 1000)
+        self.stream_cola.clear()
+        self.stream_pendientes = 0
+        self.stream_aplicadas = self.stream_underruns = self.stream_overruns = self.stream_tarde = 0
+        self.stream_delay = 0
+        self.stream_log = []
+        self._stream_linea = bytearray()
+        self._stream_inicio = self.millis()
+        self._stream_since = 0.0       # Hasta dónde (ms de stream) están contados los pasos
+        self._stream_frac = 0.0        # Fracción de paso en curso
+        self._stream_ultima_t = 0
+        self._stream_underrun = False
+        self._stream_last_stat = 0.0
+        self.fase = FASE_PAUSA
+        self.send_ack('STREAM_START')
+        self.conceder_creditos(True)
+
+    def _stream_ahora(self):
+        return self.millis() - self._stream_inicio
+
+    def leer_stream(self):
+        """ leerStream(): junta las líneas byte a byte; entre líneas, p/r/x/q """
+        while self.state == ProgramState.STATE_STREAM:
+            with self._cond:
+                if not self._input: return
+                c = self._input[0]
+                del self._input[0]
+            if c == 0x0A:
+                self.procesar_linea_stream(bytes(self._stream_linea))
+                self._stream_linea.clear()
+            elif not self._stream_linea and c != 0x23:
+                cmd = chr(c).lower()
+                if cmd == 'p':
+                    self.terminar_stream()
+                elif cmd == 'r':
+                    self.terminar_stream()
+                    self.jog_direction = 0
+                    self.state = ProgramState.STATE_HOMING
+                    self.send_ack('RESET')
+                elif cmd == 'x':
+                    self.send_snapshot()
+                elif cmd == 'q':
+                    self.send_status()
+            elif len(self._stream_linea) < 23:
+                self._stream_linea.append(c)
+
+    def procesar_linea_stream(self, linea):
+        """ '#S<t_ms>,<semiperiodo_us>' """
+        if len(linea) < 3 or linea[1:2].lower() != b's': return
+        t, sep, d = linea[2:].decode('latin-1').partition(',')
+        if not sep: return
+        if self.stream_pendientes > 0: self.stream_pendientes -= 1
+        if len(self.stream_cola) >= STREAM_COLA:
+            self.stream_overruns += 1
+            return
+        d = _to_int(d)
+        d = 0 if d <= 0 else min(max(d, MIN_DELAY), MAX_DELAY_TECNICO)
+        self.stream_cola.append((_to_int(t), d, self._stream_ahora()))
+        self.conceder_creditos(False)
+
+    def conceder_creditos(self, forzar):
+        """ Créditos de dos en dos (o el último si el host se ha quedado sin ninguno) """
+        libres = min(STREAM_COLA - len(self.stream_cola) - self.stream_pendientes,
+                     STREAM_VENTANA - self.stream_pendientes)
+        if libres <= 0 or (libres < 2 and self.stream_pendientes > 0 and not forzar): return
+        self.stream_pendientes += libres
+        self.send_credit(libres)
+
+    def _stream_avanzar(self, hasta):
+        """ Cuenta los pasos hasta `hasta` (ms de stream); True si la jeringa se vació """
+        if self.stream_delay > 0 and hasta > self._stream_since:
+            pasos = self._stream_frac + (hasta - self._stream_since) * 1000.0 / (2 * self.stream_delay)
+            enteros = int(pasos)
+            if enteros >= self.position:
+                self.position = 0
+                self.terminar_stream()
+                return True
+            self.position -= enteros
+            self._stream_frac = pasos - enteros
+        self._stream_since = max(self._stream_since, hasta)
+        return False
+
+    def handle_streaming(self):
+        """
+        handleStreaming() con tiempos exactos: cada consigna se aplica en su
+        instante o, si llegó tarde, al llegar.
+        """
+        ahora = self._stream_ahora()
+        periodo = self.stream_periodo
+        while self.stream_cola and self.stream_cola[0][0] <= ahora:
+            t, d, llegada = self.stream_cola.popleft()
+            aplicada = max(t, llegada)
+            if llegada > self._stream_ultima_t + periodo and not self._stream_underrun:
+                self.stream_underruns += 1  # Cola vacía cuando ya tocaba
+            if self._stream_avanzar(aplicada): return
+            if aplicada - t > periodo: self.stream_tarde += 1
+            self.stream_log.append((t, aplicada))
+            self.stream_delay = d
+            self._stream_ultima_t = t
+            self.stream_aplicadas += 1
+            self._stream_underrun = False
+            self.fase = FASES['EXPULSION'] if d else FASE_PAUSA
+            self.conceder_creditos(False)
+        if self._stream_avanzar(ahora): return
+        if not self.stream_cola:
+            sin_consigna = ahora - self._stream_ultima_t
+            if sin_consigna > periodo and not self._stream_underrun:
+                self.stream_underruns += 1
+                self._stream_underrun = True
+            if sin_consigna > STREAM_WATCHDOG_MS + periodo:
+                self.send_text("ABORTADO: sin consignas")
+                self.terminar_stream()
+                return
+        if ahora - self._stream_last_stat >= STREAM_STAT_MS:
+            self._stream_last_stat = ahora
+            self.send_stream_stat()
+
+    def _stream_wait(self):
+        """ ms hasta lo próximo que pasa: consigna, estadística, underrun, watchdog o jeringa vacía """
+        ahora = self._stream_ahora()
+        events = [self._stream_last_stat + STREAM_STAT_MS]
+        if self.stream_cola:
+            events.append(self.stream_cola[0][0])
+        else:
+            events.append(self._stream_ultima_t + self.stream_periodo + 1)
+            events.append(self._stream_ultima_t + STREAM_WATCHDOG_MS + self.stream_periodo + 1)
+        if self.stream_delay:
+            events.append(self._stream_since + (self.position - self._stream_frac) * 2 * self.stream_delay / 1000.0)
+        pending = [e - ahora for e in events if e > ahora]
+        return min(pending) if pending else 0.0
+
+    def terminar_stream(self):
+        """ Fin por 'p', jeringa vacía o watchdog: ACK, contadores finales y SNAP """
+        self.stream_delay = 0
+        self.fase = FASE_PARADO
+        self.state = ProgramState.STATE_LOAD_SETUP if self.position <= 0 else ProgramState.STATE_POST_EXPULSION
+        self.send_ack('STREAM_END')
+        self.send_stream_stat()
+        self.send_snapshot()
+
+    # ------------------------------------------------------------------
+    # Lógica de expulsión
+    # ------------------------------------------------------------------
+    def ejecutar_expulsion(self, volumen_total, caudal, repeticiones):
+        delay_expulsion = flow_mode_delay(caudal, self.pasos_por_ml, self.caudal_minimo)
+        pasos_full = int(volumen_total * self.pasos_por_ml)
+
+        self.send_text("Iniciando Secuencia...")
+        for i in range(1, repeticiones + 1):
+            self.send_text(f">>> CICLO {i}/{repeticiones}")
+            self.send_phase('EXPULSION')
+            if self.move_and_track_motor(-pasos_full, delay_expulsion):
+                self.send_text("ABORTADO por usuario")
+                return
+            if i == repeticiones:
+                self.send_text("Secuencia Finalizada (Jeringa Vacia).")
+                break
+            self.send_text("Pausa 1s...")
+            self.delay(1000)
+            self.send_phase('RECARGA')
+            if self.move_and_track_motor(pasos_full, self.suction_speed_delay):
+                self.send_text("ABORTADO por usuario")
+                return
+            self.send_text("Pausa 1s...")
+            self.delay(1000)
+
+    def move_and_track_motor(self, steps, custom_delay):
+        """
+        Mueve `steps` pasos de 2 x custom_delay us cada uno. Durante el
+        movimiento cualquier byte recibido se consume; 'p' detiene, 'x' y
+        'q' se responden sin parar. Devuelve True si se detuvo.
+        """
+        if steps == 0: return False
+        direction = 1 if steps > 0 else -1
+        step_count = abs(steps)
+        if self.rampa:
+            # Instante (ms) en que termina cada paso según el perfil cargado
+            delays = [ramp_delay(self.rampa, self.rampa_seg, custom_delay, i, step_count) for i in range(step_count)]
+            ends = list(accumulate(2 * d / 1000.0 for d in delays))
+            steps_at = lambda elapsed: bisect_right(ends, elapsed)
+            total_ms = ends[-1]
+            min_delay = min(delays)
+        else:
+            step_ms = 2 * custom_delay / 1000.0
+            steps_at = lambda elapsed: int(elapsed / step_ms)
+            total_ms = step_count * step_ms
+            min_delay = custom_delay
+        interval = REPORT_MS_BINARY if self.modo_binario else REPORT_MS
+        reporting = self.state in (ProgramState.STATE_POST_EXPULSION, ProgramState.STATE_LOAD_SETUP,
+                                   ProgramState.STATE_PROGRAM)
+        if self.fase == FASE_PARADO: self.fase = FASE_MOVIMIENTO
+
+        start = self.millis()
+        last_report = None
+        done = 0
+        stopped = False
+        while done < step_count and self.running:
+            now = self.millis()
+            done = min(step_count, steps_at(now - start))
+            if last_report is None or now - last_report > interval:
+                last_report = now
+                self.progreso = int(done / step_count * 100.0)
+                if reporting:
+                    delay = ramp_delay(self.rampa, self.rampa_seg, custom_delay, min(done, step_count - 1), step_count)
+                    self.send_prog(int(done / step_count * 100.0), delay, self.position + direction * done)
+            if self.available():
+                chars = self._consume_all()
+                if 'p' in chars:
+                    stopped = True
+                    break
+                if 'x' in chars: self.send_snapshot(self.position + direction * done)
+                if 'q' in chars: self.send_status()
+            end = start + total_ms
+            self._wait_input(min(last_report + interval + 1, end) - self.millis())
+        done = min(step_count, steps_at(self.millis() - start)) if stopped else step_count
+        self.position += direction * done
+        self.last_move = {
+            'steps': done, 'duration_ms': total_ms if not stopped else self.millis() - start,
+            'cruise_delay_us': custom_delay, 'min_delay_us': min_delay,
+            'peak_rate': 1e6 / (2 * min_delay), 'stopped': stopped,
+        }
+        if not stopped and reporting:
+            self.progreso = 100
+            self.send_prog(100, custom_delay, self.position)
+        return stopped
+
+    def _consume_all(self):
+        with self._cond:
+            chars = self._input.decode('latin-1').lower()
+            self._input.clear()
+        return chars
+
+    def calcular_pasos_por_ml(self):
+        self.pasos_por_ml = pasos_por_ml(JERINGAS[self.jeringa_index][2])
+        self.caudal_minimo, self.caudal_maximo = flow_limits(self.pasos_por_ml)
+        self.println(f"DEBUG:MinFlow:{self.caudal_minimo:.2f}")
+
+    # ------------------------------------------------------------------
+    # Salida (texto o tramas binarias)
+    # ------------------------------------------------------------------
+    def send_data(self, kind, value):
+        if self.modo_binario:
+            self._frame(Vol(value) if kind == 'VOL' else Time(value))
+        else:
+            self.println(f"{kind}:{value:.2f}")
+
+    def send_status(self):
+        if self.modo_binario:
+            self._frame(Status(str(int(self.state)), f32(self.volumen_a_cargar)))
+        else:
+            self.println(f"STATUS:{int(self.state)}:VOL:{self.volumen_a_cargar:.2f}")
+
+    def send_snapshot(self, position=None):
+        """ `position`: a mitad de un movimiento la posición aún no se ha actualizado """
+        snap = Snap(int(self.state), self.fase, self.progreso,
+                    self.position if position is None else position,
+                    f32(self.volumen_a_cargar), f32(self.caudal_manual), f32(self.incremento_caudal),
+                    self.preset_index, f32(self._preset_value()), self.bucle_repeticiones,
+                    f32(self.tiempo_final), self.jeringa_index)
+        if self.modo_binario:
+            self._frame(snap)
+        else:
+            self.println("SNAP:{}:{}:{}:{}:{:.2f}:{:.2f}:{:.2f}:{}:{:.2f}:{}:{:.2f}:{}".format(*snap))
+        # Con un programa en curso, también en qué paso va
+        if self.state == ProgramState.STATE_PROGRAM: self.send_step()
+
+    def send_program(self):
+        cycles = self.programa_ciclos if self.programa else 0
+        if self.modo_binario: self._frame(Program(len(self.programa), cycles))
+        else: self.println(f"PROGRAM:{len(self.programa)}:{cycles}")
+
+    def send_step(self):
+        op = self.programa[self.paso_actual][0]
+        if self.modo_binario: self._frame(Step(self.paso_actual, self.ciclo_actual, op))
+        else: self.println(f"STEP:{self.paso_actual}:{self.ciclo_actual}:{op}")
+
+    def send_profile(self):
+        if self.modo_binario:
+            self._frame(Profile(len(self.rampa), self.rampa_seg, self.suction_speed_delay))
+        else:
+            self.println(f"PROFILE:{len(self.rampa)}:{self.rampa_seg}:{self.suction_speed_delay}")
+
+    def send_credit(self, n):
+        if self.modo_binario: self._frame(Credit(n))
+        else: self.println(f"CREDIT:{n}")
+
+    def send_stream_stat(self):
+        stat = StreamStat(self.stream_aplicadas, self.stream_underruns, self.stream_overruns, self.stream_tarde)
+        if self.modo_binario: self._frame(stat)
+        else: self.println("STREAMSTAT:{}:{}:{}:{}".format(*stat))
+
+    def send_ack(self, event):
+        if self.modo_binario: self._frame(Ack(event))
+        else: self.println(f"ACK:{event}")
+
+    def send_phase(self, phase):
+        self.fase = FASES[phase]
+        if self.modo_binario: self._frame(Status(phase, None))
+        else: self.println(f"STATUS:{phase}")
+
+    def send_preset(self, value, repeticiones):
+        if self.modo_binario:
+            self._frame(Preset(value, float(repeticiones) if repeticiones > 0 else None))
+        elif repeticiones > 0:
+            self.println(f"PRESET:{value:.2f}:LOOP:{repeticiones}")
+        else:
+            self.println(f"PRESET:{value:.2f}")
+
+    def send_custom(self, value, incremento):
+        if self.modo_binario:
+            self._frame(Custom(value, incremento if incremento >= 0 else None))
+        elif incremento >= 0:
+            self.println(f"CUSTOM:{value:.2f}:INC:{incremento:.2f}")
+        else:
+            self.println(f"CUSTOM:{value:.2f}")
+
+    def send_loop(self, repeticiones):
+        if self.modo_binario: self._frame(Loop(float(repeticiones)))
+        else: self.println(f"LOOP:{repeticiones}")
+
+    def send_inc(self, incremento):
+        if self.modo_binario: self._frame(Inc(incremento))
+        else: self.println(f"INC:{incremento:.2f}")
+
+    def send_prog(self, porcentaje, custom_delay, position):
+        if self.modo_binario:
+            self._frame(Prog(porcentaje))
+            self._frame(Telem(position, custom_delay))
+        else:
+            self.println(f"PROG:{porcentaje}")
+
+    def send_text(self, text):
+        if self.modo_binario: self.write(binario.encode_text(text[:48]))
+        else: self.println(text)
+
+    def send_config_summary(self):
+        nombre = JERINGAS[self.jeringa_index][0]
+        if self.state == ProgramState.STATE_TIME_SETUP:
+            param, mode = self.tiempo_final, 'TIME'
+        else:
+            param = self.caudal_manual if self.state == ProgramState.STATE_CAUDAL_MANUAL else self.presets[self.preset_index]
+            mode = 'FLOW'
+        if self.modo_binario:
+            self._frame(Info(self.volumen_a_cargar, param, mode, nombre))
+        else:
+            self.println(f"INFO:{self.volumen_a_cargar:.2f}:{param:.2f}:{mode}:{nombre}")
+
+
+# ----------------------------------------------------------------------
+# Utilidades
+# ----------------------------------------------------------------------
+def _to_int(text):
+    """ String.toInt(): 0 si no es un número """
+    try:
+        return int(float(text))
+    except ValueError:
+        return 0
+
+
+# ----------------------------------------------------------------------
+# Exposición por pseudo-terminal
+# ----------------------------------------------------------------------
+class EmulatorPTY:
+    """
+    Conecta un FirmwareModel a un pty. `port` es la ruta del esclavo, que
+    se abre con serial.Serial como si fuera la placa.
+    """
+
+    def __init__(self, time_scale=1.0, **kwargs):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # Sin traducción de '\n' ni eco
+        self.port = os.ttyname(self.slave)
+        self.model = FirmwareModel(self._write, time_scale, **kwargs)
+        self._reader = None
+
+    def _write(self, data):
+        os.write(self.master, data)
+
+    def _pump(self):
+        while self.model.running:
+            try:
+                data = os.read(self.master, 256)
+            except OSError:
+                break
+            if data: self.model.feed(data)
+
+    def start(self):
+        self.model.start()
+        self._reader = threading.Thread(target=self._pump, daemon=True)
+        self._reader.start()
+        return self
+
+    def stop(self):
+        self.model.stop()
+        for fd in (self.master, self.slave):
+            try: os.close(fd)
+            except OSError: pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulador del firmware de la bomba")
+    parser.add_argument('--scale', type=float, default=1.0, help="factor de aceleración del reloj")
+    parser.add_argument('--jeringa', type=int, default=0, help="índice en jeringas[]")
+    args = parser.parse_args(argv)
+    emu = EmulatorPTY(args.scale, jeringa=args.jeringa).start()
+    print(f"Emulador escuchando en {emu.port} (x{args.scale})")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        emu.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# escritor.py
+"""
+Hilo escritor: la UI encola comandos y nunca se bloquea en write()/flush().
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from .metricas import log
+from .protocolo import SETPOINT_PREFIX, STREAM_SETPOINT_PREFIX
+
+# Parar y reiniciar se adelantan a todo lo encolado
+PRIORITY_COMMANDS = frozenset((b'p', b'r'))
+# Comandos de auto-repetición (+/-) que se fusionan si ya hay uno pendiente
+REPEAT_COMMANDS = frozenset((b'+', b'-'))
+
+HIGH, NORMAL = 0, 1
+
+
+class CommandWriter:
+    """
+    Cola acotada con prioridad y coalescencia delante de `write_fn(data)`.
+
+    - 'p' y 'r' saltan la cola y además descartan los '+'/'-' pendientes
+      (en HOMING un '+' tardío volvería a arrancar el motor).
+    - Un '+'/'-' igual a otro aún no enviado se descarta (`coalesced`).
+    - Una consigna '#X...' reemplaza a la pendiente del mismo tipo, salvo
+      las '#S' del streaming: cada una gasta un crédito y van todas.
+    - Con la cola llena se rechazan los comandos normales (`dropped`).
+
+    Con `notify` no hace falta start(): cada send() llama a `notify()` y
+    quien escribe (el multiplexor de varias bombas) vacía la cola con drain().
+    """
+
+    def __init__(self, write_fn, maxsize=32, samples=500, notify=None):
+        self.write_fn = write_fn
+        self.notify = notify
+        self.maxsize = maxsize
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self.thread = None
+        # Métricas
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.latencies = deque(maxlen=samples)       # encolado -> escrito
+        self.priority_latencies = deque(maxlen=samples)
+
+    def start(self):
+        self._running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, join_timeout=1.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(join_timeout)
+
+    def send(self, cmd):
+        """ Encola `cmd` (str o bytes). Devuelve False si se descartó """
+        data = cmd.encode('utf-8') if isinstance(cmd, str) else bytes(cmd)
+        priority = HIGH if data in PRIORITY_COMMANDS else NORMAL
+        with self._cond:
+            if priority == HIGH:
+                self._purge_repeats()
+            elif data in REPEAT_COMMANDS and any(item[3] == data for item in self._heap):
+                self.coalesced += 1
+                return False
+            elif (data[:1] == SETPOINT_PREFIX and data[:2] != STREAM_SETPOINT_PREFIX
+                  and self._replace_setpoint(data)):
+                return True
+            elif len(self._heap) >= self.maxsize:
+                self.dropped += 1
+                return False
+            heapq.heappush(self._heap, (priority, next(self._seq), time.monotonic(), data))
+            self.max_depth = max(self.max_depth, len(self._heap))
+            self._cond.notify()
+        if self.notify: self.notify()
+        return True
+
+    def _replace_setpoint(self, data):
+        for i, item in enumerate(self._heap):
+            if item[3][:2] == data[:2]:
+                # Mismo puesto en la cola, valor nuevo
+                self._heap[i] = item[:3] + (data,)
+                self.coalesced += 1
+                return True
+        return False
+
+    def _purge_repeats(self):
+        kept = [item for item in self._heap if item[3] not in REPEAT_COMMANDS]
+        self.coalesced += len(self._heap) - len(kept)
+        heapq.heapify(kept)
+        self._heap = kept
+
+    def depth(self):
+        with self._cond:
+            return len(self._heap)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._heap:
+                    self._cond.wait()
+                if not self._running: return
+                item = heapq.heappop(self._heap)
+            self._write(item)
+
+    def drain(self):
+        """ Escribe todo lo pendiente desde el hilo que llama (modo `notify`) """
+        while True:
+            with self._cond:
+                if not self._heap: return
+                item = heapq.heappop(self._heap)
+            self._write(item)
+
+    def _write(self, item):
+        priority, _, t_queued, data = item
+        try:
+            self.write_fn(data)
+        except Exception as e:
+            self.errors += 1
+            log.error("Error TX: %s", e)
+            return
+        latency = time.monotonic() - t_queued
+        self.sent += 1
+        self.latencies.append(latency)
+        if priority == HIGH: self.priority_latencies.append(latency)
+
+    def snapshot(self):
+        def pct(samples, q):
+            lat = sorted(samples)
+            return lat[min(len(lat) - 1, int(q * len(lat)))] * 1000.0 if lat else None
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'latency_ms_p50': pct(self.latencies, 0.50),
+            'latency_ms_p95': pct(self.latencies, 0.95),
+            'stop_latency_ms_p95': pct(self.priority_latencies, 0.95),
+        }
@@ -0,0 +1,95 @@
+# firmware.py
+"""
+Constantes y cuentas de Arduino.ino que necesita el host.
+
+Las usan el planificador, los perfiles, los programas, el streaming y la
+biblioteca sin Kivy, y también el emulador: el código de producción las
+toma de aquí, no del doble de pruebas (emulador.py). Los valores float
+pasan por f32() para dar los mismos resultados que el AVR.
+"""
+import math
+import struct
+from enum import IntEnum
+
+# --- Constantes de Arduino.ino ---
+PASOS_POR_CM = 9465.0
+MIN_DELAY = 100
+MAX_DELAY_TECNICO = 16000
+PRESETS_CAUDAL = (250.0, 350.0, 500.0, 750.0, 1000.0)
+BUCLES_POSIBLES = (1, 3, 5, 10)
+# (nombre, volumenTotalML, diametroInternoMM)
+JERINGAS = (
+    ("Jeringa de 6 ml", 6.0, 12.0), ("Jeringa de 10 ml", 10.0, 14.5),
+    ("Jeringa de 5 ml", 5.0, 12.0), ("Jeringa de 20 ml", 20.0, 20.0),
+)
+SUCCION_BASE = 250  # suctionSpeedDelay sin perfil cargado
+RAMPA_MAX = 32      # Entradas de `rampa[]`
+PROGRAMA_MAX = 16   # Pasos de `programa[]`
+STREAM_COLA = 8     # Consignas en `streamCola[]`
+STREAM_VENTANA = 3  # Líneas '#S' en vuelo como mucho (créditos)
+STREAM_WATCHDOG_MS = 1000
+STREAM_STAT_MS = 1000
+# faseActual
+FASE_PARADO, FASE_MOVIMIENTO = 0x00, 0x01
+FASES = {'EXPULSION': 0x81, 'RECARGA': 0x82}
+FASE_PAUSA = 0x83
+
+
+class ProgramState(IntEnum):
+    STATE_HOMING = 0
+    STATE_LOAD_SETUP = 1
+    STATE_MODE_SELECT = 2
+    STATE_CAUDAL_SUBMENU = 3
+    STATE_CAUDAL_PRESET = 4
+    STATE_CAUDAL_MANUAL = 5
+    STATE_TIME_SETUP = 6
+    STATE_POST_EXPULSION = 7
+    STATE_PROGRAM = 8
+    STATE_STREAM = 9
+
+
+def f32(value):
+    """ Redondeo a float de 32 bits (float de AVR) """
+    return struct.unpack('<f', struct.pack('<f', value))[0]
+
+
+def pasos_por_ml(diametro_mm):
+    """ calcularPasosPorML() para un diámetro interno dado """
+    radio = f32(diametro_mm / 2.0)
+    area_mm2 = f32(math.pi * radio * radio)
+    cm_por_ml = f32((1000.0 / area_mm2) / 10.0)
+    return f32(PASOS_POR_CM * cm_por_ml)
+
+
+def ramp_delay(rampa, seg, cruise, i, step_count=None):
+    """
+    retardoPaso(): semiperiodo del paso `i`. La misma rampa sirve para
+    acelerar (desde el inicio) y frenar (hasta el final); nunca más rápido
+    que el crucero. Sin `step_count` (jog) solo hay aceleración.
+    """
+    if not rampa: return cruise
+    idx = (i if step_count is None else min(i, step_count - 1 - i)) // seg
+    if idx >= len(rampa): return cruise
+    return max(rampa[idx], cruise)
+
+
+def flow_limits(pasos_ml):
+    """ (caudalMinimoPermitido, caudalMaximoPermitido) en uL/min """
+    minimo = f32((f32(30000000.0 / MAX_DELAY_TECNICO) / pasos_ml) * 1000.0)
+    maximo = f32((f32(30000000.0 / MIN_DELAY) / pasos_ml) * 1000.0)
+    return minimo, maximo
+
+
+def flow_mode_delay(caudal, pasos_ml, caudal_minimo=0.0):
+    """ delayExpulsion de ejecutarExpulsion() (us por semiperiodo) """
+    if caudal < caudal_minimo: caudal = caudal_minimo
+    pasos_por_minuto = f32(f32(caudal / 1000.0) * pasos_ml)
+    delay_us = int(f32(30000000.0 / pasos_por_minuto))
+    return max(delay_us, MIN_DELAY)
+
+
+def time_mode_delay(tiempo_final, pasos_totales):
+    """ velocidadDelay de handleTimeSetupCommands() (us por semiperiodo) """
+    if pasos_totales == 0: return MAX_DELAY_TECNICO
+    delay_us = int(f32(tiempo_final * 500000.0 / abs(pasos_totales)))
+    return min(max(delay_us, MIN_DELAY), MAX_DELAY_TECNICO)
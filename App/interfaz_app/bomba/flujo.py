@@ -0,0 +1,362 @@
+# flujo.py
+"""
+Caudal variable en streaming: perfiles (rampa, seno, pulsos) y emisor con
+control de flujo por créditos.
+
+El host entra en el modo con '#Q<periodo_ms>' y manda una consigna
+'#S<t_ms>,<semiperiodo_us>' por periodo (10-50 Hz), con `t` relativo al
+inicio. La placa las encola (STREAM_COLA), aplica cada una en su instante y
+devuelve créditos (CREDIT:n): sólo se envía con crédito, así nunca hay más
+de STREAM_VENTANA líneas en vuelo y no se desborda el buffer de 64 bytes.
+Las consignas salen `lead_ms` antes de su instante para absorber el jitter
+del host y del enlace; si aun así llegan tarde, el firmware lo cuenta
+(underruns / tarde) y mantiene el último caudal.
+
+A 9600 baudios cada línea '#S' (14-17 bytes) ocupa unos 15-18 ms: a 50 Hz
+el enlace va cerca del 80 % (ver link_load).
+"""
+import argparse
+import math
+import threading
+import time
+
+from .firmware import flow_mode_delay
+from .metricas import log
+from .planificador import syringe
+from .protocolo import Ack, Credit, Status, StreamStat, cmd_stream_setpoint, cmd_stream_start
+
+STOP = b'p'
+BAUD = 9600
+
+
+# ============================================================================
+# PERFILES DE CAUDAL
+# ============================================================================
+class FlowProfile:
+    """ Caudal (uL/min) en función del tiempo (s), durante `duration` s """
+
+    def __init__(self, fn, duration, name=''):
+        self.fn = fn
+        self.duration = float(duration)
+        self.name = name
+
+    def __call__(self, t):
+        return max(0.0, self.fn(min(max(t, 0.0), self.duration)))
+
+    def __repr__(self):
+        return f"FlowProfile({self.name or 'perfil'}, {self.duration:.1f} s)"
+
+
+def constant(flow, duration):
+    return FlowProfile(lambda t: flow, duration, f"constante {flow:g}")
+
+
+def ramp(start, end, duration):
+    """ De `start` a `end` uL/min en línea recta """
+    return FlowProfile(lambda t: start + (end - start) * t / duration, duration, f"rampa {start:g}->{end:g}")
+
+
+def sine(mean, amplitude, period, duration):
+    """ mean ± amplitude con periodo `period` s """
+    return FlowProfile(lambda t: mean + amplitude * math.sin(2.0 * math.pi * t / period), duration,
+                       f"seno {mean:g}±{amplitude:g}")
+
+
+def pulses(high, low, period, duration, duty=0.5):
+    """ `high` durante duty·period y `low` el resto de cada periodo """
+    return FlowProfile(lambda t: high if (t % period) < duty * period else low, duration,
+                       f"pulsos {high:g}/{low:g}")
+
+
+def sequence(*profiles):
+    """ Perfiles uno detrás de otro """
+    def fn(t):
+        for p in profiles:
+            if t < p.duration: return p(t)
+            t -= p.duration
+        return profiles[-1](profiles[-1].duration)
+    return FlowProfile(fn, sum(p.duration for p in profiles), ' + '.join(p.name for p in profiles))
+
+
+# ============================================================================
+# CONSIGNAS
+# ============================================================================
+class StreamPlan:
+    """
+    Perfil muestreado a `rate_hz` y convertido a semiperiodos con la misma
+    aritmética que la placa (flow_mode_delay). Caudal 0 = motor parado.
+    """
+
+    def __init__(self, profile, rate_hz=20.0, which=0):
+        self.profile = profile
+        self.syringe = syringe(which)
+        self.period_ms = int(round(1000.0 / rate_hz))
+        self.setpoints = []     # [(t_ms, semiperiodo_us)]
+        self.clipped = 0        # Consignas fuera de los límites de la jeringa
+        s = self.syringe
+        for i in range(int(profile.duration * 1000.0 // self.period_ms) + 1):
+            t_ms = i * self.period_ms
+            flow = profile(t_ms / 1000.0)
+            if flow <= 0.0:
+                delay = 0
+            else:
+                if not s.min_flow <= flow <= s.max_flow: self.clipped += 1
+                delay = flow_mode_delay(flow, s.pasos_ml, s.min_flow)
+            self.setpoints.append((t_ms, delay))
+
+    @property
+    def duration_ms(self):
+        return self.profile.duration * 1000.0
+
+    def steps(self):
+        """ Pasos que se expulsan si todas las consignas se aplican a su hora """
+        total = 0.0
+        ends = [t for t, _ in self.setpoints[1:]] + [self.duration_ms]
+        for (t, delay), end in zip(self.setpoints, ends):
+            if delay: total += (end - t) * 1000.0 / (2 * delay)
+        return total
+
+    def volume_ml(self):
+        return self.steps() / self.syringe.pasos_ml
+
+    def __repr__(self):
+        return (f"StreamPlan({self.profile.name}, {len(self.setpoints)} consignas cada {self.period_ms} ms, "
+                f"{self.volume_ml():.3f} mL)")
+
+
+def link_load(rate_hz, plan=None, baud=BAUD):
+    """ Fracción del enlace host -> placa que ocupan las líneas '#S' (10 bits por byte) """
+    if plan is not None and plan.setpoints:
+        size = max(len(cmd_stream_setpoint(t, d)) for t, d in plan.setpoints)
+    else:
+        size = len(cmd_stream_setpoint(99999, 9999))
+    return rate_hz * size * 10.0 / baud
+
+
+# ============================================================================
+# EMISOR CON CRÉDITOS
+# ============================================================================
+def _pct(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class FlowStreamer:
+    """
+    Envía un StreamPlan en su propio hilo.
+
+    `send(bytes)` escribe (CommandWriter.send o port.write); `feed(msg)`
+    recibe cada mensaje de la placa y conviene llamarlo desde el hilo lector,
+    sin pasar por la UI, para no retrasar los créditos un frame.
+
+    Contadores: `sent`, `credit_stalls` (consignas que esperaron crédito),
+    `late` (enviadas después de su instante) y el último STREAMSTAT del
+    firmware (`firmware`: aplicadas, underruns, overruns, tarde).
+    `use_credits=False` ignora los créditos (sirve para provocar overruns).
+    """
+
+    def __init__(self, send, plan, lead_ms=150.0, use_credits=True, start_timeout=2.0):
+        self.send = send
+        self.plan = plan
+        self.lead_ms = lead_ms
+        self.use_credits = use_credits
+        self.start_timeout = start_timeout
+        self._cond = threading.Condition()
+        self._abort = False
+        self.thread = None
+        self.credits = 0
+        self.started_at = None      # monotonic() del ACK:STREAM_START
+        self.ended = False
+        self.rejected = False
+        self.firmware = StreamStat(0, 0, 0, 0)
+        # Métricas
+        self.sent = 0
+        self.granted = 0
+        self.credit_stalls = 0
+        self.stall_ms = 0.0
+        self.late = 0
+        self.lateness_ms = []       # Envío real - instante de la consigna (negativo = adelantado)
+
+    def feed(self, msg):
+        """ Mensajes de la placa (cualquier hilo); ignora los que no son del streaming """
+        with self._cond:
+            if isinstance(msg, Credit):
+                self.credits += msg.credits
+                self.granted += msg.credits
+            elif isinstance(msg, StreamStat):
+                self.firmware = msg
+            elif isinstance(msg, Ack) and msg.event == 'STREAM_START':
+                self.started_at = time.monotonic()
+            elif isinstance(msg, Ack) and msg.event == 'STREAM_END':
+                self.ended = True
+            elif isinstance(msg, Status) and self.started_at is None:
+                self.rejected = True    # '#Q' fuera de lugar: contesta STATUS
+            else:
+                return
+            self._cond.notify_all()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True, name='FlowStreamer')
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Corta el streaming ('p' a la placa) """
+        with self._cond:
+            self._abort = True
+            self._cond.notify_all()
+        self.send(STOP)
+
+    def wait(self, timeout=None):
+        if self.thread: self.thread.join(timeout)
+        return self.ended
+
+    def _wait_until(self, predicate, deadline):
+        """ Espera a `predicate()` (con el lock tomado) o a `deadline`; False si se cortó """
+        while not predicate():
+            if self._abort or self.ended: return False
+            left = deadline - time.monotonic() if deadline is not None else None
+            if left is not None and left <= 0: return True
+            self._cond.wait(left)
+        return not (self._abort or self.ended)
+
+    def run(self):
+        self.send(cmd_stream_start(self.plan.period_ms))
+        with self._cond:
+            deadline = time.monotonic() + self.start_timeout
+            self._wait_until(lambda: self.started_at is not None or self.rejected, deadline)
+            if self.started_at is None:
+                log.error("La bomba no entró en modo streaming%s", " (rechazado)" if self.rejected else "")
+                self.rejected = True
+                return
+            t0 = self.started_at
+        for t_ms, delay in self.plan.setpoints:
+            with self._cond:
+                if not self._wait_until(lambda: False, t0 + (t_ms - self.lead_ms) / 1000.0): break
+                if self.use_credits and self.credits <= 0:
+                    self.credit_stalls += 1
+                    waited = time.monotonic()
+                    if not self._wait_until(lambda: self.credits > 0, None): break
+                    self.stall_ms += (time.monotonic() - waited) * 1000.0
+                self.credits -= 1
+            self.send(cmd_stream_setpoint(t_ms, delay))
+            lateness = (time.monotonic() - t0) * 1000.0 - t_ms
+            self.lateness_ms.append(lateness)
+            if lateness > 0: self.late += 1
+            self.sent += 1
+        with self._cond:
+            finished = self._wait_until(lambda: False, t0 + self.plan.duration_ms / 1000.0)
+        if finished: self.send(STOP)
+        with self._cond:
+            self._wait_until(lambda: self.ended, time.monotonic() + self.start_timeout)
+            self._abort = False
+
+    def snapshot(self):
+        return {
+            'sent': self.sent,
+            'granted': self.granted,
+            'credit_stalls': self.credit_stalls,
+            'stall_ms': self.stall_ms,
+            'late': self.late,
+            'lateness_ms_p50': _pct(self.lateness_ms, 0.50),
+            'lateness_ms_p95': _pct(self.lateness_ms, 0.95),
+            'lateness_ms_max': max(self.lateness_ms) if self.lateness_ms else None,
+            'applied': self.firmware.applied,
+            'underruns': self.firmware.underruns,
+            'overruns': self.firmware.overruns,
+            'firmware_late': self.firmware.late,
+        }
+
+
+# ============================================================================
+# PRUEBA (EMULADOR O PLACA)
+# ============================================================================
+PROFILES = {
+    'rampa': lambda a: ramp(a.low, a.high, a.seconds),
+    'seno': lambda a: sine((a.high + a.low) / 2.0, (a.high - a.low) / 2.0, a.cycle, a.seconds),
+    'pulsos': lambda a: pulses(a.high, a.low, a.cycle, a.seconds),
+    'constante': lambda a: constant(a.high, a.seconds),
+}
+
+
+def _open(args, plan):
+    """ Puerto listo para el streaming; con el emulador, jeringa precargada con lo que pide el plan """
+    import serial
+    from .conexion import wait_ready
+    from .protocol_emu import register
+    if args.port:
+        port = serial.Serial(args.port, BAUD, timeout=0.1)
+    else:
+        register()
+        port = serial.serial_for_url(f'emu://?scale=1&jeringa={plan.syringe.index}', timeout=0.1)
+    ready = wait_ready(port)
+    if not ready: raise TimeoutError("La bomba no responde")
+    model = getattr(port, 'model', None)
+    if model is not None: model.preload(plan.syringe.steps(plan.syringe.volume_ml))
+    return port, ready, model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caudal variable en streaming: perfil, créditos y jitter")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='seno')
+    parser.add_argument('--low', type=float, default=250.0, help="uL/min")
+    parser.add_argument('--high', type=float, default=1000.0, help="uL/min")
+    parser.add_argument('--cycle', type=float, default=4.0, help="periodo del seno / pulsos (s)")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=20.0, help="consignas por segundo (10-50)")
+    parser.add_argument('--lead', type=float, default=150.0, help="adelanto de envío (ms)")
+    parser.add_argument('--jeringa', type=int, default=0)
+    parser.add_argument('--port', help="puerto de la placa (por defecto, el emulador en tiempo real)")
+    parser.add_argument('--binary', action='store_true', help="respuestas en tramas binarias ('v')")
+    parser.add_argument('--no-credits', action='store_true', help="ignorar los créditos (provoca overruns)")
+    args = parser.parse_args(argv)
+
+    from .lector import SerialLineReader
+    from .protocolo import Parser
+
+    plan = StreamPlan(PROFILES[args.profile](args), args.rate, args.jeringa)
+    print(plan, f"({plan.clipped} fuera de límites)")
+    print(f"Enlace host->placa a {BAUD} baudios: {link_load(args.rate, plan) * 100:.0f} %")
+    port, ready, model = _open(args, plan)
+    text = Parser()
+    streamer = FlowStreamer(port.write, plan, args.lead, not args.no_credits)
+    closing = []
+
+    def on_line(item, t_rx):
+        msg = item if isinstance(item, tuple) else text.parse(item)
+        if msg is not None: streamer.feed(msg)
+
+    reader = SerialLineReader(port, on_line, lambda: bool(closing), timeout=0.1)
+    if ready.rest: reader.feed(ready.rest, time.monotonic())
+    reader.start()
+    try:
+        if args.binary:
+            port.write(b'v')
+            time.sleep(0.2)
+        start_pos = model.position if model else None
+        streamer.start()
+        streamer.wait(plan.profile.duration + 5.0)
+    finally:
+        closing.append(True)
+        reader.stop()
+        port.close()
+
+    snap = streamer.snapshot()
+    if streamer.rejected: return 1
+    print(f"Host: {snap['sent']} enviadas, {snap['granted']} créditos, {snap['credit_stalls']} esperas "
+          f"({snap['stall_ms']:.0f} ms), {snap['late']} tarde; adelanto p50 {-snap['lateness_ms_p50']:.1f} ms, "
+          f"peor {-snap['lateness_ms_max']:.1f} ms")
+    print(f"Firmware: {snap['applied']} aplicadas, {snap['underruns']} underruns, {snap['overruns']} overruns, "
+          f"{snap['firmware_late']} tarde")
+    if model is None: return 0
+    jitter = [applied - t for t, applied in model.stream_log]
+    span_s = (model.stream_log[-1][1] - model.stream_log[0][1]) / 1000.0 if len(jitter) > 1 else 0.0
+    print(f"Emulador: {len(jitter) / span_s if span_s else 0:.1f} consignas/s, retraso de aplicación "
+          f"p50 {_pct(jitter, 0.5) or 0:.2f} ms, p95 {_pct(jitter, 0.95) or 0:.2f} ms, máx {max(jitter, default=0):.2f} ms")
+    moved = start_pos - model.position
+    print(f"Expulsado {moved / plan.syringe.pasos_ml:.3f} mL (plan {plan.volume_ml():.3f} mL)")
+    return 0 if snap['applied'] == len(plan.setpoints) and not snap['overruns'] else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,58 @@
+# framing.py
+"""
+Separación de líneas sobre un buffer de recepción persistente.
+"""
+
+
+class LineFramer:
+    """
+    Buffer de recepción de tamaño fijo que entrega líneas completas ('\\n').
+
+    El bytearray se reserva una sola vez y vive lo mismo que la conexión;
+    la cola parcial de cada lectura se conserva para la siguiente.
+    Si una línea no cabe en el buffer se descarta y se cuenta en `dropped`.
+    """
+
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._end = 0             # Bytes de la línea parcial pendiente
+        self._discarding = False  # Saltando el resto de una línea desbordada
+        self.dropped = 0
+
+    def pending(self):
+        """ Bytes de la línea parcial que aún no tiene '\\n' """
+        return self._end
+
+    def reset(self):
+        self._end = 0
+        self._discarding = False
+
+    def feed(self, data):
+        """ Agrega `data` y devuelve la lista de líneas completas (bytes, sin '\\r\\n') """
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        lines = []
+        pos, size = 0, len(data)
+        while pos < size:
+            nl = data.find(b'\n', pos)
+            stop = size if nl < 0 else nl
+
+            if self._discarding:
+                if nl >= 0: self._discarding = False
+            elif self._end + (stop - pos) > self.capacity:
+                # La línea no cabe: se descarta completa
+                self.dropped += 1
+                self._end = 0
+                self._discarding = nl < 0
+            else:
+                self._buf[self._end:self._end + stop - pos] = data[pos:stop]
+                self._end += stop - pos
+                if nl >= 0:
+                    line = bytes(self._buf[:self._end]).rstrip(b'\r')
+                    self._end = 0
+                    if line: lines.append(line)
+
+            if nl < 0: break
+            pos = nl + 1
+        return lines
@@ -0,0 +1,239 @@
+# grabador.py
+"""
+Grabación de sesiones: registro binario de sólo-anexar con todo lo que
+entra y sale por el puerto serie, más los cambios de estado de la UI.
+
+Formato: cabecera de 96 bytes y registros fijos de 96 bytes (RECORD):
+
+    t       f8   segundos desde el inicio de la sesión
+    kind    u1   RX / TX / STATE
+    code    u1   índice de la cabecera en HEADERS (RX)
+    length  u2   longitud original de `text` antes de truncarlo
+    value   f4   primer campo numérico del mensaje (NaN si no hay)
+    value2  f4   segundo campo numérico (NaN si no hay)
+    text    72s  línea de texto / comando / nombre del estado (un SNAP entero)
+
+La UI sólo añade a una cola acotada; un hilo aparte la vacía cada
+`flush_interval`, empaqueta, escribe, hace fsync periódico y rota el fichero. Si la cola se llena se descarta el
+registro y se cuenta en `dropped`: la grabación nunca frena la interfaz.
+"""
+import os
+import struct
+import threading
+import time
+from collections import deque
+from numbers import Number
+
+from .metricas import log
+from .protocolo import Parser, to_line
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'BOMBAREC'
+VERSION = 2  # v1: texto de 40 bytes, cortaba las líneas SNAP
+TEXT_SIZE = 72
+RECORD = struct.Struct(f'<dBBHff4x{TEXT_SIZE}s')
+HEADER = struct.Struct('<8sHHdd')  # magic, versión, tamaño de registro, t0 (epoch), t0 (monotonic)
+HEADER_SIZE = RECORD.size
+
+RX, TX, STATE = 0, 1, 2
+KINDS = ('RX', 'TX', 'STATE')
+HEADERS = ('TEXT', 'VOL', 'PARAM', 'PRESET', 'CUSTOM', 'TIME', 'LOOP', 'INC',
+           'INFO', 'PROG', 'STATUS', 'ACK', 'TELEM', 'SNAP', 'PROFILE', 'PROGRAM', 'STEP',
+           'CREDIT', 'STREAMSTAT')
+CODES = {name: code for code, name in enumerate(HEADERS)}
+NAN = float('nan')
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([('t', '<f8'), ('kind', 'u1'), ('code', 'u1'), ('length', '<u2'),
+                             ('value', '<f4'), ('value2', '<f4'), ('pad', 'V4'), ('text', f'S{TEXT_SIZE}')])
+
+
+def _numbers(msg):
+    values = [v for v in msg if isinstance(v, Number)]
+    return (values + [NAN, NAN])[:2]
+
+
+class SessionRecorder:
+    """
+    Graba en `folder` ficheros `sesion_AAAAmmdd_HHMMSS_N.bin`.
+
+    rx(msg_o_linea, t_rx), tx(datos) y state(nombre) se pueden llamar desde
+    cualquier hilo; state() sólo graba cuando el estado cambia.
+    """
+
+    def __init__(self, folder, maxsize=8192, flush_interval=0.1, fsync_interval=1.0,
+                 max_bytes=64 * 1024 * 1024):
+        self.folder = folder
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        # deque.append/popleft son atómicos: sin locks en el camino caliente
+        self._items = deque()
+        self._stop = threading.Event()
+        self._t0 = time.monotonic()
+        self._stamp = time.strftime('%Y%m%d_%H%M%S')
+        self._part = 0
+        self._file = None
+        self._last_state = None
+        # Las líneas RX en texto se analizan aquí, en el hilo grabador, para llenar code/value
+        self.parser = Parser()
+        self.thread = None
+        self.path = None
+        # Métricas
+        self.records = 0
+        self.dropped = 0
+        self.files = 0
+        self.fsyncs = 0
+
+    # --- API (hilos de la UI / lector / escritor) ---
+    # Sólo se encola; la conversión a registro la hace el hilo grabador
+    def rx(self, item, t_rx=None):
+        self._put(((t_rx or time.monotonic()) - self._t0, RX, item))
+
+    def tx(self, data):
+        self._put((time.monotonic() - self._t0, TX, data))
+
+    def state(self, name):
+        if name == self._last_state: return
+        self._last_state = name
+        self._put((time.monotonic() - self._t0, STATE, name))
+
+    def _put(self, record):
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+        else:
+            self._items.append(record)
+
+    # --- Hilo grabador ---
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self._open()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, join_timeout=2.0):
+        self._stop.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(join_timeout)
+
+    def _open(self):
+        self._part += 1
+        self.path = os.path.join(self.folder, f"sesion_{self._stamp}_{self._part}.bin")
+        self._file = open(self.path, 'ab')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time(), self._t0).ljust(HEADER_SIZE, b'\0'))
+        self.files += 1
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+
+    def run(self):
+        last_sync = time.monotonic()
+        buf = bytearray()
+        running = True
+        while running:
+            running = not self._stop.wait(self.flush_interval)
+            # Todo lo acumulado en una sola escritura
+            items = self._items
+            for _ in range(len(items)):
+                buf += self._pack(*items.popleft())
+            try:
+                if buf:
+                    self._file.write(buf)
+                    self.records += len(buf) // RECORD.size
+                    buf.clear()
+                now = time.monotonic()
+                if not running or now - last_sync >= self.fsync_interval:
+                    self._sync()
+                    last_sync = now
+                if self._file.tell() >= self.max_bytes:
+                    self._sync()
+                    self._file.close()
+                    self._open()
+            except OSError as e:
+                log.error("Error grabando sesión: %s", e)
+                running = False
+        self._file.close()
+
+    def _pack(self, t, kind, item):
+        code, value, value2 = 0, NAN, NAN
+        if isinstance(item, tuple):
+            msg, text = item, to_line(item)
+        else:
+            text = item.encode('utf-8') if isinstance(item, str) else bytes(item)
+            # El texto sin cabecera conocida (">>> CICLO 1/3") se guarda con code 0
+            msg = self.parser.parse(text) if kind == RX else None
+        if msg is not None:
+            code = CODES.get(msg.header, 0)
+            value, value2 = _numbers(msg)
+        return RECORD.pack(t, kind, code, min(len(text), 0xFFFF), value, value2, text[:TEXT_SIZE])
+
+    def snapshot(self):
+        return {
+            'path': self.path,
+            'records': self.records,
+            'queued': len(self._items),
+            'dropped': self.dropped,
+            'files': self.files,
+            'fsyncs': self.fsyncs,
+        }
+
+
+# ============================================================================
+# LECTURA
+# ============================================================================
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic, version, size, t0_epoch, t0_mono = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path}: no es una sesión grabada")
+    if version != VERSION or size != RECORD.size:
+        raise ValueError(f"{path}: sesión grabada v{version}; esta versión lee v{VERSION}")
+    return {'version': version, 't0_epoch': t0_epoch, 't0_monotonic': t0_mono}
+
+
+def iter_records(path):
+    """ Registros uno a uno como tuplas (t, kind, code, length, value, value2, text); no requiere NumPy """
+    read_header(path)
+    with open(path, 'rb') as f:
+        f.seek(HEADER_SIZE)
+        while True:
+            chunk = f.read(RECORD.size)
+            if len(chunk) < RECORD.size: return
+            t, kind, code, length, value, value2, text = RECORD.unpack(chunk)
+            yield t, kind, code, length, value, value2, text.rstrip(b'\0')
+
+
+def load_session(path):
+    """
+    Mapea el fichero en memoria y devuelve un array estructurado (RECORD_DTYPE)
+    sin copiar nada: sirve para sesiones de horas. Un registro a medio
+    escribir al final se ignora.
+    """
+    if np is None:
+        raise ImportError("load_session() necesita NumPy; use iter_records()")
+    read_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD.size
+    if count <= 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def series(records, header, kind=RX):
+    """ (timestamps, value, value2) de una cabecera, p. ej. series(r, 'PROG') """
+    mask = (records['kind'] == kind) & (records['code'] == CODES[header])
+    sel = records[mask]
+    return sel['t'], sel['value'], sel['value2']
+
+
+def transitions(records):
+    """ [(t, estado)] con los cambios de estado de la UI """
+    sel = records[records['kind'] == STATE]
+    return [(float(t), text.decode('utf-8')) for t, text in zip(sel['t'], sel['text'])]
@@ -0,0 +1,147 @@
+# lector.py
+"""
+Hilo lector bloqueante para el puerto serie de PC (pyserial).
+"""
+import threading
+import time
+from collections import deque
+
+from .binario import BINARY_ACK, BinaryFramer
+from .framing import LineFramer
+from .metricas import log
+
+
+class ReaderStats:
+    """ Despertares del hilo y latencia RX -> despacho en la UI """
+
+    def __init__(self, samples=500):
+        self.started = time.monotonic()
+        self.wakeups = 0
+        self.lines = 0
+        self.bytes = 0
+        self.latencies = deque(maxlen=samples)
+
+    def record_dispatch(self, t_rx):
+        """ Llamar desde el hilo de la UI al procesar una línea leída en t_rx """
+        self.latencies.append(time.monotonic() - t_rx)
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lat = sorted(self.latencies)
+        pick = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000.0 if lat else None
+        return {
+            'wakeups_per_s': self.wakeups / elapsed,
+            'lines_per_s': self.lines / elapsed,
+            'bytes_per_s': self.bytes / elapsed,
+            'latency_ms_p50': pick(0.50),
+            'latency_ms_p95': pick(0.95),
+        }
+
+
+class RxDecoder:
+    """
+    Bytes recibidos -> líneas de texto (bytes) hasta "ACK:BINARY" (respuesta
+    al comando 'v'); a partir de ahí, mensajes ya tipados de las tramas binarias.
+    """
+
+    def __init__(self, capacity=1024):
+        self.framer = LineFramer(capacity)
+        self.binary = None  # BinaryFramer una vez negociado el modo binario
+
+    def feed(self, data):
+        if self.binary is not None:
+            return self.binary.feed(data)
+        return self.feed_text(data)
+
+    def feed_text(self, data):
+        """ Líneas de texto hasta "ACK:BINARY"; lo que sigue ya son tramas binarias """
+        nl = data.find(b'\n')
+        if nl < 0:
+            return self.framer.feed(data)
+        # La primera línea puede completar una parcial de la lectura anterior
+        items = self.framer.feed(data[:nl + 1])
+        rest = data[nl + 1:]
+        if not items or items[-1] != BINARY_ACK:
+            pos = rest.find(BINARY_ACK)
+            cut = rest.find(b'\n', pos) + 1 if pos >= 0 else 0
+            items += self.framer.feed(rest[:cut] if cut else rest)
+            rest = rest[cut:] if cut else b''
+        if items and items[-1] == BINARY_ACK:
+            self.binary = BinaryFramer()
+            items += self.binary.feed(rest)
+        return items
+
+    def snapshot(self):
+        snap = {'dropped_partial': self.framer.dropped, 'pending_bytes': self.framer.pending()}
+        if self.binary is not None: snap['binary'] = self.binary.stats()
+        return snap
+
+
+class SerialLineReader:
+    """
+    Lee en un hilo bloqueado en el SO (`serial.Serial.read`) y entrega cada
+    línea completa, en bytes y sin decodificar, a `on_line(raw, t_rx)`.
+
+    Si llega "ACK:BINARY" (respuesta al comando 'v') el lector pasa a
+    decodificar tramas binarias y entrega mensajes ya tipados.
+
+    El hilo termina cuando `should_stop()` es verdadero; `stop()` además
+    cancela la lectura pendiente para que el cierre sea inmediato.
+    """
+
+    def __init__(self, port, on_line, should_stop, timeout=1.0):
+        self.port = port
+        self.on_line = on_line
+        self.should_stop = should_stop
+        self.decoder = RxDecoder(1024)
+        self.stats = ReaderStats()
+        self.thread = None
+        # Timeout de respaldo: solo define cada cuánto se revisa should_stop
+        # si el puerto no soporta cancel_read().
+        self.port.timeout = timeout
+
+    @property
+    def binary(self):
+        return self.decoder.binary
+
+    @binary.setter
+    def binary(self, framer):
+        """ El firmware ya estaba en binario (wait_ready lo detectó) """
+        self.decoder.binary = framer
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, join_timeout=1.0):
+        cancel = getattr(self.port, 'cancel_read', None)
+        if cancel:
+            try: cancel()
+            except Exception: pass
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(join_timeout)
+
+    def run(self):
+        while not self.should_stop():
+            try:
+                # Bloquea hasta que llegue al menos un byte y trae todo lo disponible
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as e:
+                log.error("Error RX: %s", e)
+                break
+            t_rx = time.monotonic()
+            self.stats.wakeups += 1
+            if not data: continue
+            self.stats.bytes += len(data)
+            self.feed(data, t_rx)
+
+    def snapshot(self):
+        snap = self.stats.snapshot()
+        snap.update(self.decoder.snapshot())
+        return snap
+
+    def feed(self, data, t_rx):
+        for item in self.decoder.feed(data):
+            self.stats.lines += 1
+            self.on_line(item, t_rx)
@@ -0,0 +1,206 @@
+# metricas.py
+"""
+Contadores, histogramas y registro (logging) fuera del camino caliente.
+
+Pensado para técnicos de campo: `METRICS.snapshot()` junta todo en un dict
+que la interfaz muestra en su overlay de depuración o vuelca a JSON.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from bisect import bisect_left
+from collections import Counter
+
+log = logging.getLogger('bomba')
+log.setLevel(os.environ.get('BOMBA_LOG', 'WARNING').upper())
+
+# Límites superiores de las cubetas (ms); la última recoge todo lo demás
+BOUNDS_MS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+LOG_LEVELS = ('WARNING', 'INFO', 'DEBUG')
+
+
+class Histogram:
+    """ Histograma de latencias con cubetas fijas: observe() es O(log n) y sin memoria extra """
+
+    __slots__ = ('counts', 'n', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000.0
+        self.counts[bisect_left(BOUNDS_MS, ms)] += 1
+        self.n += 1
+        self.total += ms
+        if ms > self.max: self.max = ms
+
+    def percentile(self, q):
+        """ Cota superior de la cubeta que contiene el percentil q """
+        if not self.n: return None
+        target = q * self.n
+        acc = 0
+        for i, count in enumerate(self.counts):
+            acc += count
+            if acc >= target:
+                return min(BOUNDS_MS[i], self.max) if i < len(BOUNDS_MS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'n': self.n,
+            'mean_ms': self.total / self.n if self.n else None,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max if self.n else None,
+        }
+
+
+class Metrics:
+    """
+    Registro de métricas del proceso.
+
+    - inc(nombre, n): contadores; el snapshot incluye también su tasa por segundo.
+    - observe(nombre, segundos): histogramas de latencia por etapa.
+    - add_source(nombre, fn): componentes que ya llevan sus propias cuentas
+      (lector, escritor, parser...) y se consultan solo al hacer snapshot.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = Counter()
+        self.histograms = {}
+        self.sources = {}
+
+    def inc(self, name, n=1):
+        self.counters[name] += n
+
+    def observe(self, name, seconds):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        hist.observe(seconds)
+
+    def add_source(self, name, fn):
+        self.sources[name] = fn
+
+    def remove_source(self, name):
+        self.sources.pop(name, None)
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.counters.clear()
+        self.histograms.clear()
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        snap = {
+            'uptime_s': elapsed,
+            'counters': dict(self.counters),
+            'rates_per_s': {name: n / elapsed for name, n in self.counters.items()},
+            'stages': {name: hist.snapshot() for name, hist in self.histograms.items()},
+        }
+        for name, fn in list(self.sources.items()):
+            try: snap[name] = fn()
+            except Exception as e: snap[name] = {'error': str(e)}
+        return snap
+
+    def dump(self, path):
+        """ Escribe el snapshot en JSON y devuelve la ruta """
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, default=str)
+        return path
+
+
+def format_snapshot(snap):
+    """ Texto compacto para el overlay: una línea por contador, etapa o componente """
+    def fmt(value):
+        if isinstance(value, float): return f"{value:.3g}"
+        if isinstance(value, dict): return ' '.join(f"{k}={fmt(v)}" for k, v in value.items() if v is not None)
+        return str(value)
+    lines = [f"uptime {snap['uptime_s']:.0f} s  log {logging.getLevelName(log.getEffectiveLevel())}"]
+    rates = snap['rates_per_s']
+    lines += [f"{name}: {n} ({rates[name]:.1f}/s)" for name, n in sorted(snap['counters'].items())]
+    for name, hist in sorted(snap['stages'].items()):
+        lines.append(f"{name}: n={hist['n']} p50<={fmt(hist['p50_ms'])} p95<={fmt(hist['p95_ms'])} max={fmt(hist['max_ms'])} ms")
+    for name, value in snap.items():
+        if name in ('uptime_s', 'counters', 'rates_per_s', 'stages'): continue
+        lines.append(f"{name}: {fmt(value)}")
+    return '\n'.join(lines)
+
+
+# Instancia del proceso
+METRICS = Metrics()
+
+
+# ============================================================================
+# REGISTRO (LOGGING) FUERA DEL CAMINO CALIENTE
+# ============================================================================
+_listener = None
+_side_listeners = []
+
+
+def setup_logging(level=None, handler=None):
+    """
+    Los hilos del camino caliente solo encolan el registro; un hilo aparte lo formatea y
+    lo escribe (en Android stderr acaba en logcat). El nivel inicial sale de
+    la variable de entorno BOMBA_LOG (WARNING por defecto).
+    """
+    global _listener
+    if _listener is not None: return _listener
+    records = queue.SimpleQueue()
+    handler = handler or logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(threadName)s %(levelname)s %(message)s'))
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.propagate = False
+    set_level(level or os.environ.get('BOMBA_LOG', 'WARNING'))
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    return _listener
+
+
+def set_level(level):
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def next_level():
+    """ Rota WARNING -> INFO -> DEBUG -> WARNING (botón del overlay) """
+    current = logging.getLevelName(log.getEffectiveLevel())
+    index = LOG_LEVELS.index(current) if current in LOG_LEVELS else -1
+    level = LOG_LEVELS[(index + 1) % len(LOG_LEVELS)]
+    set_level(level)
+    return level
+
+
+def side_log(name, path):
+    """
+    Registro aparte en `path` (p. ej. el texto de depuración del firmware),
+    también a través de una cola. No se mezcla con el registro principal.
+    """
+    logger = log.getChild(name)
+    if logger.handlers: return logger
+    records = queue.SimpleQueue()
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    _side_listeners.append(listener)
+    return logger
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    while _side_listeners:
+        _side_listeners.pop().stop()
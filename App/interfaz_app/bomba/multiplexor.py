@@ -0,0 +1,194 @@
+# multiplexor.py
+"""
+Un solo hilo de E/S para todas las bombas.
+
+Los puertos con descriptor (pyserial en Linux/Mac, el pty del emulador o
+emu://) se esperan con `selectors`: el hilo duerme hasta que alguno tiene
+bytes o hay algo que escribir. Los que no tienen (driver USB de Android)
+se sondean con `read_available()` cada `poll_interval` s. Las escrituras
+se encolan en el CommandWriter de cada sesión (modo `notify`) y las hace
+este mismo hilo, despertado por un self-pipe.
+
+Los callbacks de las sesiones (`feed`, `lost`) corren en este hilo: no
+deben bloquear.
+"""
+import os
+import selectors
+import threading
+import time
+
+from .metricas import log
+
+
+class IOMultiplexer:
+
+    def __init__(self, poll_interval=0.01):
+        self.poll_interval = poll_interval
+        self.selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._signalled = False
+        self._calls = []        # Altas / bajas pendientes: se aplican en el hilo
+        self._tx = set()        # Sesiones con escrituras pendientes
+        self._polled = []       # Sesiones sin fileno()
+        self.sessions = set()
+        self.thread = None
+        self._stop = False
+        # Métricas
+        self.wakeups = 0
+        self.reads = 0
+        self.bytes = 0
+        self.flushes = 0
+        self.errors = 0
+        self.cpu_s = 0.0        # CPU del hilo de E/S (time.thread_time)
+        self.max_loop_ms = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self._stop = False
+            self.thread = threading.Thread(target=self.run, daemon=True, name='IOMultiplexer')
+            self.thread.start()
+        return self
+
+    def stop(self, join_timeout=2.0):
+        self._stop = True
+        self._wake()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(join_timeout)
+        self.thread = None
+
+    def close(self):
+        self.stop()
+        self.selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    # ------------------------------------------------------------------
+    # API (cualquier hilo)
+    # ------------------------------------------------------------------
+    def add(self, session):
+        self._call(lambda: self._register(session))
+
+    def remove(self, session, then=None):
+        """ `then()` corre en el hilo tras darla de baja (p. ej. cerrar el puerto sin que su fd siga en el selector) """
+        def call():
+            self._unregister(session)
+            if then: then()
+        self._call(call)
+
+    def want_write(self, session):
+        """ `notify` del CommandWriter de la sesión """
+        with self._lock:
+            self._tx.add(session)
+        self._wake()
+
+    def _call(self, fn):
+        with self._lock:
+            self._calls.append(fn)
+        self._wake()
+        if self.thread is None: self._run_pending()
+
+    def _wake(self):
+        with self._lock:
+            if self._signalled: return
+            self._signalled = True
+        try: os.write(self._wake_w, b'\x00')
+        except OSError: pass
+
+    # ------------------------------------------------------------------
+    # Hilo de E/S
+    # ------------------------------------------------------------------
+    def _register(self, session):
+        fileno = getattr(session.port, 'fileno', None)
+        try:
+            fd = fileno() if fileno else None
+        except Exception:
+            fd = None
+        if fd is None: self._polled.append(session)
+        else: self.selector.register(fd, selectors.EVENT_READ, session)
+        self.sessions.add(session)
+
+    def _unregister(self, session):
+        if session not in self.sessions: return
+        self.sessions.discard(session)
+        if session in self._polled:
+            self._polled.remove(session)
+        else:
+            for key in list(self.selector.get_map().values()):
+                if key.data is session: self.selector.unregister(key.fileobj)
+        with self._lock:
+            self._tx.discard(session)
+
+    def _run_pending(self):
+        with self._lock:
+            calls, self._calls = self._calls, []
+            tx, self._tx = self._tx, set()
+            self._signalled = False
+        for fn in calls: fn()
+        for session in tx:
+            if session in self.sessions:
+                self.flushes += 1
+                session.writer.drain()
+
+    def run(self):
+        while not self._stop:
+            events = self.selector.select(self.poll_interval if self._polled else None)
+            t0 = time.monotonic()
+            self.wakeups += 1
+            for key, _ in events:
+                if key.data is None:
+                    try: os.read(self._wake_r, 64)
+                    except BlockingIOError: pass
+                else:
+                    self._read(key.data, t0)
+            for session in list(self._polled):
+                self._read_polled(session, t0)
+            self._run_pending()
+            self.max_loop_ms = max(self.max_loop_ms, (time.monotonic() - t0) * 1000.0)
+            self.cpu_s = time.thread_time()
+
+    def _read(self, session, t_rx):
+        port = session.port
+        try:
+            waiting = port.in_waiting
+            # Legible y sin bytes: el dispositivo ya no está
+            if not waiting: raise OSError("sin datos (desconectado)")
+            data = port.read(waiting)
+        except Exception as e:
+            self._lost(session, e)
+            return
+        self.reads += 1
+        self.bytes += len(data)
+        session.feed(data, t_rx)
+
+    def _read_polled(self, session, t_rx):
+        try:
+            data = session.port.read_available(0)
+        except Exception as e:
+            self._lost(session, e)
+            return
+        if not data: return
+        self.reads += 1
+        self.bytes += len(data)
+        session.feed(data, t_rx)
+
+    def _lost(self, session, error):
+        self.errors += 1
+        log.error("E/S %s: %s", session.name, error)
+        self._unregister(session)
+        session.lost(error)
+
+    def snapshot(self):
+        return {
+            'sessions': len(self.sessions),
+            'polled': len(self._polled),
+            'wakeups': self.wakeups,
+            'reads': self.reads,
+            'bytes': self.bytes,
+            'flushes': self.flushes,
+            'errors': self.errors,
+            'cpu_s': self.cpu_s,
+            'max_loop_ms': self.max_loop_ms,
+        }
@@ -0,0 +1,254 @@
+# perfiles.py
+"""
+Perfiles de movimiento (rampas de aceleración) calculados en el host.
+
+El firmware mueve el motor con un semiperiodo constante: arranca y para
+"en seco", lo que obliga a usar retardos conservadores (succión a 250 us).
+Aquí se calcula una rampa trapezoidal o en S como tabla de semiperiodos,
+se comprime a `RAMPA_MAX` entradas (cada una vale para `seg` pasos) y se
+sube con '#A'. La placa la recorre al acelerar y al revés al frenar
+(retardoPaso en Arduino.ino, `ramp_delay` en el emulador) sin hacer
+cálculos en coma flotante dentro del bucle de pasos.
+
+Los valores de MotionLimits son de partida: hay que ajustarlos con el
+motor y la carga reales.
+"""
+import argparse
+import math
+import time
+
+from .firmware import MAX_DELAY_TECNICO, MIN_DELAY, RAMPA_MAX, SUCCION_BASE, ramp_delay
+from .metricas import log
+from .protocolo import cmd_profile_off, cmd_set_profile, cmd_set_volume
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+KINDS = ('trapezoid', 'scurve')
+
+
+def _numpy():
+    if np is None:
+        raise ImportError("Los perfiles de movimiento necesitan NumPy")
+    return np
+
+
+def rate_of_delay(delay_us):
+    """ Pasos por segundo con un semiperiodo de `delay_us` """
+    return 1e6 / (2.0 * delay_us)
+
+
+def delay_of_rate(rate):
+    return 1e6 / (2.0 * rate)
+
+
+class MotionLimits:
+    """
+    start_delay_us: semiperiodo con el que el motor arranca sin perder pasos.
+    min_delay_us: el más rápido al que se llega (crucero máximo).
+    accel: aceleración en pasos/s^2 (pico en la curva S).
+    """
+
+    def __init__(self, start_delay_us=1000, min_delay_us=150, accel=20000.0):
+        self.start_delay_us = min(max(start_delay_us, MIN_DELAY), MAX_DELAY_TECNICO)
+        self.min_delay_us = min(max(min_delay_us, MIN_DELAY), self.start_delay_us)
+        self.accel = float(accel)
+
+    @property
+    def start_rate(self):
+        return rate_of_delay(self.start_delay_us)
+
+    @property
+    def max_rate(self):
+        return rate_of_delay(self.min_delay_us)
+
+    def __repr__(self):
+        return (f"MotionLimits(start={self.start_delay_us} us, min={self.min_delay_us} us, "
+                f"accel={self.accel:.0f} pasos/s²)")
+
+
+# ============================================================================
+# RAMPAS (NumPy)
+# ============================================================================
+def trapezoid_delays(limits):
+    """ Semiperiodo de cada paso de la aceleración: v_k = sqrt(v0² + 2·a·k) """
+    np = _numpy()
+    v0, vmax = limits.start_rate, limits.max_rate
+    n = max(1, int(math.ceil((vmax * vmax - v0 * v0) / (2.0 * limits.accel))))
+    rates = np.sqrt(v0 * v0 + 2.0 * limits.accel * np.arange(n))
+    return delay_of_rate(np.minimum(rates, vmax))
+
+
+def scurve_delays(limits, samples=4096):
+    """
+    Aceleración a(t) = a·sen²(pi·t/T): empieza y acaba en 0 (sin tirón).
+    Se integra velocidad y posición en el tiempo y se interpola el instante
+    de cada paso.
+    """
+    np = _numpy()
+    v0, vmax, a = limits.start_rate, limits.max_rate, limits.accel
+    T = 2.0 * (vmax - v0) / a   # Aceleración media a/2
+    if T <= 0: return np.array([float(limits.min_delay_us)])
+    t = np.linspace(0.0, T, samples)
+    v = v0 + a * (t / 2.0 - T / (4.0 * math.pi) * np.sin(2.0 * math.pi * t / T))
+    x = np.concatenate(([0.0], np.cumsum((v[1:] + v[:-1]) / 2.0 * np.diff(t))))
+    n = max(1, int(x[-1]))
+    step_t = np.interp(np.arange(n), x, t)
+    return delay_of_rate(np.minimum(np.interp(step_t, t, v), vmax))
+
+
+class RampTable:
+    """ Tabla comprimida tal como la guarda la placa: `seg` pasos por entrada """
+
+    def __init__(self, kind, seg, delays, limits):
+        self.kind = kind
+        self.seg = seg
+        self.delays = delays   # [int] us, de arranque a crucero
+        self.limits = limits
+
+    @property
+    def ramp_steps(self):
+        return self.seg * len(self.delays)
+
+    def command(self, suction_us=None):
+        """ Línea '#A' para subirla; succión por defecto al crucero máximo """
+        suction = self.limits.min_delay_us if suction_us is None else suction_us
+        return cmd_set_profile(self.seg, suction, self.delays)
+
+    def __repr__(self):
+        return f"RampTable({self.kind}, {len(self.delays)} x {self.seg} pasos)"
+
+
+def ramp_table(kind='trapezoid', limits=None, max_entries=RAMPA_MAX):
+    """
+    Rampa `kind` comprimida a `max_entries`. Cada entrada toma el semiperiodo
+    del primer paso de su tramo (el más lento), así nunca se acelera más
+    de lo que permite `limits`.
+    """
+    limits = limits or MotionLimits()
+    if kind not in KINDS: raise ValueError(f"Perfil desconocido: {kind}")
+    steps = trapezoid_delays(limits) if kind == 'trapezoid' else scurve_delays(limits)
+    seg = max(1, int(math.ceil(len(steps) / max_entries)))
+    if seg > 255:
+        raise ValueError(f"La rampa necesita {len(steps)} pasos: sube `accel` o el semiperiodo mínimo")
+    picked = np.ceil(steps[::seg][:max_entries]).astype(int)
+    delays = [int(min(max(d, limits.min_delay_us), MAX_DELAY_TECNICO)) for d in picked]
+    return RampTable(kind, seg, delays, limits)
+
+
+def profile_command(kind, limits=None):
+    """ Línea '#A' para enviar al conectar; None (y aviso) si no hay NumPy o los límites no caben """
+    try:
+        return ramp_table(kind, limits).command()
+    except (ImportError, ValueError) as e:
+        log.warning("Perfil de movimiento '%s' desactivado: %s", kind, e)
+        return None
+
+
+def expand(table, steps, cruise_us):
+    """ retardoPaso() vectorizado: semiperiodo de cada paso de un movimiento """
+    np = _numpy()
+    if table is None or not table.delays:
+        return np.full(steps, cruise_us, dtype=np.int64)
+    rampa = np.asarray(table.delays, dtype=np.int64)
+    i = np.arange(steps)
+    idx = np.minimum(i, steps - 1 - i) // table.seg
+    ramped = np.maximum(rampa[np.minimum(idx, len(rampa) - 1)], cruise_us)
+    return np.where(idx < len(rampa), ramped, cruise_us)
+
+
+def move_stats(delays):
+    """ Duración, semiperiodo mínimo y velocidad pico de un movimiento """
+    if not len(delays): return {'steps': 0, 'duration_ms': 0.0, 'min_delay_us': None, 'peak_rate': 0.0}
+    fastest = int(delays.min())
+    return {
+        'steps': len(delays),
+        'duration_ms': float(delays.sum(dtype='int64')) * 2.0 / 1000.0,
+        'min_delay_us': fastest,
+        'peak_rate': rate_of_delay(fastest),
+    }
+
+
+def check_table(table, steps=2000, cruise_us=None):
+    """ expand() contra ramp_delay() del emulador, paso a paso; devuelve los pasos distintos """
+    cruise = table.limits.min_delay_us if cruise_us is None else cruise_us
+    fast = expand(table, steps, cruise)
+    return [i for i in range(steps) if fast[i] != ramp_delay(table.delays, table.seg, cruise, i, steps)]
+
+
+# ============================================================================
+# VERIFICACIÓN CON EL EMULADOR
+# ============================================================================
+class _Sink:
+    def __init__(self):
+        self.data = bytearray()
+
+    def __call__(self, data):
+        self.data += data
+
+    def wait_for(self, text, timeout):
+        deadline = time.monotonic() + timeout
+        while text not in self.data:
+            if time.monotonic() > deadline: raise TimeoutError(text.decode())
+            time.sleep(0.005)
+
+
+def emulate_load(volume, profile=None, scale=200.0, jeringa=0):
+    """
+    Fija cero, sube `profile` (línea '#A') y carga `volume` mL en el
+    emulador. Devuelve (pasos, last_move del emulador).
+    """
+    from .emulador import FirmwareModel
+    sink = _Sink()
+    model = FirmwareModel(sink, scale, jeringa=jeringa).start()
+    try:
+        model.feed(b's')
+        sink.wait_for(b'ZERO_SET', 2.0)
+        model.feed(profile or cmd_profile_off())
+        sink.wait_for(b'PROFILE:', 2.0)
+        model.feed(cmd_set_volume(volume))
+        sink.wait_for(b'VOL:%.2f' % volume, 2.0)
+        model.feed(b's')
+        sink.wait_for(b'LOAD_COMPLETE', 60.0)
+        return model.position, model.last_move
+    finally:
+        model.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rampas de movimiento: tabla, comando '#A' y prueba en el emulador")
+    parser.add_argument('--kind', choices=KINDS, default='trapezoid')
+    parser.add_argument('--start', type=int, default=1000, help="semiperiodo de arranque (us)")
+    parser.add_argument('--min', type=int, default=150, help="semiperiodo de crucero máximo (us)")
+    parser.add_argument('--accel', type=float, default=20000.0, help="pasos/s²")
+    parser.add_argument('--volume', type=float, default=2.0, help="mL a cargar en el emulador (0: no emular)")
+    parser.add_argument('--scale', type=float, default=200.0)
+    args = parser.parse_args(argv)
+
+    limits = MotionLimits(args.start, args.min, args.accel)
+    table = ramp_table(args.kind, limits)
+    print(f"{limits}\n{table}: rampa de {table.ramp_steps} pasos")
+    print("Comando:", table.command().decode().strip())
+    mismatches = check_table(table)
+    print(f"expand() vs ramp_delay(): {len(mismatches)} pasos distintos")
+    if args.volume <= 0: return 1 if mismatches else 0
+
+    steps, flat = emulate_load(args.volume, None, args.scale)
+    _, ramped = emulate_load(args.volume, table.command(), args.scale)
+    planned = move_stats(expand(table, steps, limits.min_delay_us))
+    baseline = move_stats(expand(None, steps, SUCCION_BASE))
+    print(f"Carga de {args.volume} mL ({steps} pasos):")
+    print(f"  sin perfil  {flat['duration_ms']:8.1f} ms  pico {flat['peak_rate']:6.0f} pasos/s"
+          f"  (plan {baseline['duration_ms']:.1f} ms)")
+    print(f"  con perfil  {ramped['duration_ms']:8.1f} ms  pico {ramped['peak_rate']:6.0f} pasos/s"
+          f"  (plan {planned['duration_ms']:.1f} ms)")
+    ok = (ramped['steps'] == planned['steps'] and abs(ramped['duration_ms'] - planned['duration_ms']) < 1e-3
+          and ramped['peak_rate'] == planned['peak_rate'] and not mismatches)
+    print("Emulador y planificador coinciden" if ok else "DIFERENCIAS entre emulador y planificador")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
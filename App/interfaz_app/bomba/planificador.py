@@ -0,0 +1,269 @@
+# planificador.py
+"""
+Planificador de dosificación: qué caudal y qué duración salen de verdad.
+
+El firmware convierte el caudal pedido en un semiperiodo entero de paso
+(`delayExpulsion = 30000000.0 / pasos_por_minuto`, ver ejecutarExpulsion)
+y el modo tiempo en `tiempoFinal * 500000.0 / pasosTotales`. Al truncar a
+microsegundos el caudal real no es el pedido; aquí se calcula el error, la
+duración real y, como referencia, un reparto ("dither") de semiperiodos
+que daría el caudal medio exacto. El dither es sólo un cálculo del host:
+Arduino.ino no lo implementa.
+
+Los cálculos de un solo punto (plan_flow, plan_time) no necesitan NumPy;
+las tablas y la expansión de calendarios sí.
+"""
+import math
+
+from .firmware import (JERINGAS, MAX_DELAY_TECNICO, MIN_DELAY, PRESETS_CAUDAL,
+                       f32, flow_limits, flow_mode_delay, pasos_por_ml, time_mode_delay)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Retardos fijos de ejecutarExpulsion(): succión entre ciclos y pausas de 1 s
+SUCTION_DELAY_US = 250
+CYCLE_PAUSE_S = 1.0
+# Sobrecoste por paso del bucle de moveAndTrackMotor (digitalWrite, millis...)
+# que no está en los delayMicroseconds; 0 hasta medirlo en la placa
+STEP_OVERHEAD_US = 0.0
+
+
+def _numpy():
+    if np is None:
+        raise ImportError("Esta función del planificador necesita NumPy")
+    return np
+
+
+# ============================================================================
+# PERFILES DE JERINGA (calcularPasosPorML)
+# ============================================================================
+class SyringePlan:
+    """ calcularPasosPorML() para una entrada de `jeringas[]` """
+
+    def __init__(self, index):
+        self.index = index
+        self.name, self.volume_ml, self.diameter_mm = JERINGAS[index]
+        self.pasos_ml = pasos_por_ml(self.diameter_mm)
+        self.min_flow, self.max_flow = flow_limits(self.pasos_ml)
+
+    def steps(self, volume_ml):
+        """ long(volumen * pasosPorML), en float de 32 bits como en la placa """
+        return int(f32(volume_ml * self.pasos_ml))
+
+    def flow_of_delay(self, delay_us):
+        """ Caudal real (uL/min) con un semiperiodo de `delay_us` """
+        period_us = 2.0 * delay_us + STEP_OVERHEAD_US
+        return 60e6 / period_us / self.pasos_ml * 1000.0
+
+    def ideal_delay(self, flow):
+        """ Semiperiodo exacto (sin truncar) que daría `flow` uL/min """
+        return (60e6 / (flow / 1000.0 * self.pasos_ml) - STEP_OVERHEAD_US) / 2.0
+
+    def __repr__(self):
+        return f"SyringePlan({self.name!r}, pasos/mL={self.pasos_ml:.1f})"
+
+
+SYRINGES = tuple(SyringePlan(i) for i in range(len(JERINGAS)))
+
+
+def syringe(which):
+    """ Por índice de `jeringas[]` o por nombre (el de INFO) """
+    if isinstance(which, SyringePlan): return which
+    if isinstance(which, str):
+        for s in SYRINGES:
+            if s.name == which: return s
+        raise KeyError(which)
+    return SYRINGES[which]
+
+
+# ============================================================================
+# UN PUNTO (sin NumPy)
+# ============================================================================
+class Plan:
+    """ Resultado de plan_flow / plan_time """
+
+    def __init__(self, syringe, volume, requested_flow, delay_us, steps, loops, duration_s):
+        self.syringe = syringe
+        self.volume = volume
+        self.requested_flow = requested_flow
+        self.delay_us = delay_us
+        self.steps = steps
+        self.loops = loops
+        self.flow = syringe.flow_of_delay(delay_us)     # uL/min reales
+        self.duration_s = duration_s                    # Total, con recargas y pausas
+        self.expel_s = steps * (2.0 * delay_us + STEP_OVERHEAD_US) / 1e6
+
+    @property
+    def error_pct(self):
+        """ (real - pedido) / pedido, en % """
+        if not self.requested_flow: return 0.0
+        return (self.flow - self.requested_flow) / self.requested_flow * 100.0
+
+    @property
+    def delivered_ml(self):
+        """ Volumen que mueven los pasos enteros (el resto se pierde al truncar) """
+        return self.steps / self.syringe.pasos_ml * self.loops
+
+    def as_dict(self):
+        return {
+            'syringe': self.syringe.name, 'volume_ml': self.volume, 'loops': self.loops,
+            'requested_flow': self.requested_flow, 'flow': self.flow, 'error_pct': self.error_pct,
+            'delay_us': self.delay_us, 'steps': self.steps,
+            'expel_s': self.expel_s, 'duration_s': self.duration_s,
+        }
+
+
+def _sequence_s(steps, expel_delay, loops):
+    """ Duración de ejecutarExpulsion(): expulsiones, recargas y pausas """
+    expel = steps * (2.0 * expel_delay + STEP_OVERHEAD_US) / 1e6
+    reload = steps * (2.0 * SUCTION_DELAY_US + STEP_OVERHEAD_US) / 1e6
+    return loops * expel + (loops - 1) * (reload + 2 * CYCLE_PAUSE_S)
+
+
+def plan_flow(volume, flow, which=0, loops=1):
+    """ Modo caudal (preset o manual): semiperiodo, caudal real y duración """
+    s = syringe(which)
+    delay = flow_mode_delay(flow, s.pasos_ml, s.min_flow)
+    steps = s.steps(volume)
+    return Plan(s, volume, flow, delay, steps, loops, _sequence_s(steps, delay, loops))
+
+
+def plan_time(volume, seconds, which=0):
+    """ Modo tiempo: el semiperiodo sale de tiempoFinal y se acota a MIN/MAX_DELAY """
+    s = syringe(which)
+    steps = s.steps(volume)
+    delay = time_mode_delay(seconds, steps)
+    requested = volume * 1000.0 / (seconds / 60.0) if seconds > 0 else 0.0
+    return Plan(s, volume, requested, delay, steps, 1, _sequence_s(steps, delay, 1))
+
+
+# ============================================================================
+# TABLAS (NumPy)
+# ============================================================================
+def achievable_flows(which=0):
+    """ (semiperiodos, caudales) de todos los retardos enteros que el firmware puede usar """
+    np = _numpy()
+    s = syringe(which)
+    delays = np.arange(MIN_DELAY, MAX_DELAY_TECNICO + 1)
+    flows = 60e6 / (2.0 * delays + STEP_OVERHEAD_US) / s.pasos_ml * 1000.0
+    return delays, flows
+
+
+def flow_delays(flows, which=0):
+    """ flow_mode_delay() vectorizado, con la misma aritmética float32 que la placa """
+    np = _numpy()
+    s = syringe(which)
+    f = np.maximum(np.asarray(flows, dtype=np.float32), np.float32(s.min_flow))
+    per_minute = (f / np.float32(1000.0)) * np.float32(s.pasos_ml)
+    delays = (np.float32(30000000.0) / per_minute).astype(np.int64)  # (long) trunca
+    return np.maximum(delays, MIN_DELAY)
+
+
+def flow_errors(flows, which=0):
+    """
+    Para cada consigna: semiperiodo, caudal real, error (%) y, con el mejor
+    entero posible, el error mínimo alcanzable sin dither.
+    """
+    np = _numpy()
+    s = syringe(which)
+    flows = np.asarray(flows, dtype=np.float64)
+    delays = flow_delays(flows, s)
+    real = 60e6 / (2.0 * delays + STEP_OVERHEAD_US) / s.pasos_ml * 1000.0
+    ideal = (60e6 / (flows / 1000.0 * s.pasos_ml) - STEP_OVERHEAD_US) / 2.0
+    best = np.clip(np.rint(ideal), MIN_DELAY, MAX_DELAY_TECNICO)
+    best_real = 60e6 / (2.0 * best + STEP_OVERHEAD_US) / s.pasos_ml * 1000.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'flow': flows,
+            'delay_us': delays,
+            'real_flow': real,
+            'error_pct': (real - flows) / flows * 100.0,
+            'ideal_delay_us': ideal,
+            'best_error_pct': (best_real - flows) / flows * 100.0,
+        }
+
+
+def flow_table(flows=PRESETS_CAUDAL):
+    """ Errores de `flows` para todas las jeringas: [(jeringa, flow_errors)] """
+    return [(s, flow_errors(flows, s)) for s in SYRINGES]
+
+
+# ============================================================================
+# DITHER DE SEMIPERIODOS
+# ============================================================================
+class DitherPlan:
+    """
+    Semiperiodo fraccionario como base entera + fracción Q16, calculado en
+    el host. schedule() reparte la fracción con un acumulador (Bresenham):
+    cada vez que desborda 65536 ese paso dura 1 us más. La placa no hace
+    nada de esto (usa un semiperiodo entero); sirve para comparar con
+    plan_flow/plan_time cuánto caudal se pierde al truncar.
+    """
+
+    Q = 1 << 16
+
+    def __init__(self, ideal_delay_us):
+        ideal = min(max(ideal_delay_us, MIN_DELAY), MAX_DELAY_TECNICO)
+        self.ideal_us = ideal
+        self.base_us = int(math.floor(ideal))
+        self.frac_q16 = int(round((ideal - self.base_us) * self.Q))
+        if self.frac_q16 == self.Q:
+            self.base_us, self.frac_q16 = self.base_us + 1, 0
+
+    @property
+    def mean_delay_us(self):
+        return self.base_us + self.frac_q16 / self.Q
+
+    def schedule(self, steps):
+        """ Semiperiodo de cada paso (array int32) según el reparto del acumulador """
+        np = _numpy()
+        acc = (np.arange(1, steps + 1, dtype=np.int64) * self.frac_q16) >> 16
+        extra = np.diff(acc, prepend=0)
+        return (self.base_us + extra).astype(np.int32)
+
+    def __repr__(self):
+        return f"DitherPlan(base={self.base_us} us, frac={self.frac_q16}/65536)"
+
+
+def dither_flow(flow, which=0):
+    """ Dither que consigue `flow` uL/min de media (acotado a los límites de la jeringa) """
+    s = syringe(which)
+    flow = min(max(flow, s.min_flow), s.max_flow)
+    return DitherPlan(s.ideal_delay(flow))
+
+
+def dither_time(volume, seconds, which=0):
+    """ Dither que reparte `volume` en exactamente `seconds` (si cabe en MIN/MAX_DELAY) """
+    s = syringe(which)
+    steps = s.steps(volume)
+    if not steps or seconds <= 0: return DitherPlan(MAX_DELAY_TECNICO)
+    return DitherPlan((seconds * 1e6 / steps - STEP_OVERHEAD_US) / 2.0)
+
+
+def schedule_stats(schedule, which=0):
+    """ Caudal medio y duración de un calendario de semiperiodos """
+    s = syringe(which)
+    total_us = float(schedule.sum(dtype='int64')) * 2.0 + STEP_OVERHEAD_US * len(schedule)
+    return {
+        'steps': len(schedule),
+        'duration_s': total_us / 1e6,
+        'flow': len(schedule) / s.pasos_ml * 1000.0 / (total_us / 60e6) if total_us else 0.0,
+    }
+
+
+def main():
+    """ Tabla de presets por jeringa: caudal real, error y duración de 1 mL """
+    for s, table in flow_table():
+        print(f"{s.name}: pasos/mL={s.pasos_ml:.1f}  caudal {s.min_flow:.1f}..{s.max_flow:.1f} uL/min")
+        for flow, delay, real, err, best in zip(table['flow'], table['delay_us'], table['real_flow'],
+                                                table['error_pct'], table['best_error_pct']):
+            plan = plan_flow(1.0, flow, s)
+            print(f"  {flow:7.1f} -> {delay:5d} us  {real:8.2f} uL/min  error {err:+.3f}% "
+                  f"(mejor entero {best:+.3f}%)  1 mL en {plan.expel_s:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
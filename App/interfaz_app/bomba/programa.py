@@ -0,0 +1,288 @@
+# programa.py
+"""
+Programas de dosificación: una secuencia de pasos que la placa ejecuta
+sola, sin esperar al host (ejecutarPrograma en Arduino.ino).
+
+Formato de texto, una instrucción por línea ('#' comenta):
+
+    jeringa 0                   # índice de jeringas[] (opcional)
+    ciclos 8                    # repetir el programa entero
+    cargar 5                    # hasta 5 mL (posición absoluta)
+    expulsar 1 caudal 250       # 1 mL a 250 uL/min
+    expulsar 2 tiempo 600       # 2 mL en 600 s
+    pausa 300                   # s
+    cero                        # vuelta a cero
+
+También en inglés (syringe, cycles, load, expel ... flow/time, pause, zero).
+El host lo compila a pasos y semiperiodos con las mismas cuentas que la
+placa (planificador.py), lo valida simulando la posición y lo sube en una
+sola línea '#D'; 'g' lo arranca.
+"""
+import argparse
+import time
+
+from .firmware import MAX_DELAY_TECNICO, MIN_DELAY, PROGRAMA_MAX, flow_mode_delay, time_mode_delay
+from .planificador import STEP_OVERHEAD_US, SUCTION_DELAY_US, syringe
+from .protocolo import CMD_RUN_PROGRAM, cmd_load_program
+
+# Serial.readStringUntil() guarda la línea entera en RAM (2 kB en un Uno)
+MAX_LINE = 240
+MAX_CYCLES = 255
+
+KEYWORDS = {
+    'jeringa': 'syringe', 'syringe': 'syringe',
+    'ciclos': 'cycles', 'cycles': 'cycles',
+    'cargar': 'L', 'load': 'L',
+    'expulsar': 'E', 'expel': 'E',
+    'pausa': 'W', 'pause': 'W',
+    'cero': 'Z', 'zero': 'Z',
+}
+UNITS = {'caudal': 'flow', 'flow': 'flow', 'tiempo': 'time', 'time': 'time'}
+# Para mostrar un STEP sin el programa compilado (p. ej. tras reconectar)
+OP_NAMES = {'L': 'Carga', 'E': 'Expulsión', 'W': 'Pausa', 'Z': 'Vuelta a cero'}
+
+
+class ProgramError(ValueError):
+    """ Programa inválido; `line` es la línea del texto (o None) """
+
+    def __init__(self, message, line=None):
+        super().__init__(f"línea {line}: {message}" if line else message)
+        self.line = line
+
+
+class Instruction:
+    """ Paso compilado: `op` ('L', 'E', 'W', 'Z') con `a`/`b` en unidades de la placa """
+
+    def __init__(self, op, a=0, b=0, text='', line=None):
+        self.op = op
+        self.a = a        # L: posición (pasos); E: pasos; W: ms
+        self.b = b        # E: semiperiodo (us)
+        self.text = text  # Descripción para la UI
+        self.line = line
+
+    def as_tuple(self):
+        return self.op, self.a, self.b
+
+    def __repr__(self):
+        return f"Instruction({self.op!r}, {self.a}, {self.b})"
+
+
+class CompiledProgram:
+    """ Resultado de compile_text(): lo que se sube y lo que se espera que dure """
+
+    def __init__(self, syringe, cycles, instructions):
+        self.syringe = syringe
+        self.cycles = cycles
+        self.instructions = instructions
+
+    def command(self):
+        """ Línea '#D' para subirlo """
+        return cmd_load_program(self.syringe.index, self.cycles, [i.as_tuple() for i in self.instructions])
+
+    def commands(self):
+        """ Subida y arranque: '#D' no vacía la entrada del firmware, 'g' puede ir detrás """
+        return [self.command(), CMD_RUN_PROGRAM]
+
+    def describe(self, index):
+        return self.instructions[index].text if 0 <= index < len(self.instructions) else ''
+
+    def step_label(self, step):
+        """ Texto de un STEP: "2/5 · ciclo 1/8" y la instrucción """
+        return (f"Paso {step.index + 1}/{len(self.instructions)} · ciclo {step.cycle}/{self.cycles}",
+                self.describe(step.index) or OP_NAMES.get(step.op, step.op))
+
+    def simulate(self, start_position=0):
+        """
+        Posición y duración paso a paso, como la placa (sin rampas):
+        [(ciclo, índice, posición final, segundos)]. Lanza ProgramError si
+        se expulsa más de lo cargado.
+        """
+        position = start_position
+        out = []
+        for cycle in range(1, self.cycles + 1):
+            for index, ins in enumerate(self.instructions):
+                if ins.op == 'L':
+                    seconds = _move_s(ins.a - position, SUCTION_DELAY_US)
+                    position = ins.a
+                elif ins.op == 'E':
+                    if ins.a > position:
+                        raise ProgramError(f"expulsa {ins.a} pasos con {position} cargados "
+                                           f"(ciclo {cycle})", ins.line)
+                    seconds = _move_s(ins.a, ins.b)
+                    position -= ins.a
+                elif ins.op == 'W':
+                    seconds = ins.a / 1000.0
+                else:
+                    seconds = _move_s(position, SUCTION_DELAY_US)
+                    position = 0
+                out.append((cycle, index, position, seconds))
+        return out
+
+    def duration_s(self, start_position=0):
+        return sum(s for *_, s in self.simulate(start_position))
+
+    def expelled_ml(self):
+        steps = sum(i.a for i in self.instructions if i.op == 'E') * self.cycles
+        return steps / self.syringe.pasos_ml
+
+    def __repr__(self):
+        return (f"CompiledProgram({self.syringe.name!r}, {len(self.instructions)} pasos "
+                f"x {self.cycles} ciclos)")
+
+
+def _move_s(steps, delay_us):
+    return abs(steps) * (2.0 * delay_us + STEP_OVERHEAD_US) / 1e6
+
+
+def _number(text, what, line):
+    try:
+        value = float(text.replace(',', '.'))
+    except ValueError:
+        raise ProgramError(f"{what} no es un número: {text!r}", line) from None
+    if value < 0: raise ProgramError(f"{what} negativo", line)
+    return value
+
+
+def parse(text):
+    """ Texto -> (jeringa o None, ciclos, [(op, args, línea)]) sin validar contra la jeringa """
+    which, cycles, steps = None, 1, []
+    for n, raw in enumerate(text.splitlines(), 1):
+        words = raw.split('#', 1)[0].lower().split()
+        if not words: continue
+        key = KEYWORDS.get(words[0])
+        if key is None: raise ProgramError(f"instrucción desconocida: {words[0]!r}", n)
+        args = words[1:]
+        if key == 'syringe':
+            if len(args) != 1: raise ProgramError("jeringa <índice>", n)
+            which = int(_number(args[0], "jeringa", n))
+        elif key == 'cycles':
+            if len(args) != 1: raise ProgramError("ciclos <n>", n)
+            cycles = int(_number(args[0], "ciclos", n))
+            if not 1 <= cycles <= MAX_CYCLES: raise ProgramError(f"ciclos entre 1 y {MAX_CYCLES}", n)
+        else:
+            steps.append((key, args, n))
+    return which, cycles, steps
+
+
+def compile_text(text, which=None, start_position=0):
+    """
+    Compila y valida `text` para la jeringa `which` (índice, nombre o
+    SyringePlan). Una línea 'jeringa N' del programa debe coincidir;
+    `start_position` (pasos) es lo que hay cargado al arrancarlo.
+    """
+    declared, cycles, steps = parse(text)
+    if which is None: which = 0 if declared is None else declared
+    s = syringe(which)
+    if declared is not None and declared != s.index:
+        raise ProgramError(f"el programa es para la jeringa {declared} y está puesta la {s.index}")
+    if not steps: raise ProgramError("programa vacío")
+    if len(steps) > PROGRAMA_MAX: raise ProgramError(f"más de {PROGRAMA_MAX} pasos")
+    max_steps = s.steps(s.volume_ml)
+    instructions = []
+    for op, args, n in steps:
+        if op == 'L':
+            if len(args) != 1: raise ProgramError("cargar <mL>", n)
+            volume = _number(args[0], "volumen", n)
+            if volume > s.volume_ml: raise ProgramError(f"{volume} mL no caben en la {s.name}", n)
+            target = min(s.steps(volume), max_steps)
+            instructions.append(Instruction('L', target, 0, f"Cargar hasta {volume:.2f} mL", n))
+        elif op == 'E':
+            if len(args) != 3 or UNITS.get(args[1]) is None:
+                raise ProgramError("expulsar <mL> caudal <uL/min> | expulsar <mL> tiempo <s>", n)
+            volume = _number(args[0], "volumen", n)
+            value = _number(args[2], args[1], n)
+            steps_e = s.steps(volume)
+            if UNITS[args[1]] == 'flow':
+                if not s.min_flow <= value <= s.max_flow:
+                    raise ProgramError(f"caudal fuera de {s.min_flow:.1f}..{s.max_flow:.1f} uL/min", n)
+                delay = flow_mode_delay(value, s.pasos_ml, s.min_flow)
+                label = f"Expulsar {volume:.2f} mL a {value:g} uL/min"
+            else:
+                ideal = value * 500000.0 / steps_e if steps_e else 0
+                if steps_e and not MIN_DELAY <= ideal <= MAX_DELAY_TECNICO:
+                    raise ProgramError(f"{volume} mL en {value:g} s no es posible: divídelo en pasos "
+                                       f"con pausas", n)
+                delay = time_mode_delay(value, steps_e)
+                label = f"Expulsar {volume:.2f} mL en {value:g} s"
+            instructions.append(Instruction('E', steps_e, delay, label, n))
+        elif op == 'W':
+            if len(args) != 1: raise ProgramError("pausa <s>", n)
+            seconds = _number(args[0], "pausa", n)
+            instructions.append(Instruction('W', int(round(seconds * 1000)), 0, f"Pausa {seconds:g} s", n))
+        else:
+            if args: raise ProgramError("cero no lleva argumentos", n)
+            instructions.append(Instruction('Z', 0, 0, "Volver a cero", n))
+    program = CompiledProgram(s, cycles, instructions)
+    if len(program.command()) > MAX_LINE:
+        raise ProgramError(f"el programa ocupa {len(program.command())} bytes (máx. {MAX_LINE})")
+    program.simulate(start_position)
+    return program
+
+
+def step_label(step, program=None):
+    """ Como CompiledProgram.step_label() aunque no se tenga el programa """
+    if program is not None and step.index < len(program.instructions): return program.step_label(step)
+    return f"Paso {step.index + 1} · ciclo {step.cycle}", OP_NAMES.get(step.op, step.op)
+
+
+def load(path, which=None, start_position=0):
+    with open(path, encoding='utf-8') as f:
+        return compile_text(f.read(), which, start_position)
+
+
+# ============================================================================
+# EJECUCIÓN EN EL EMULADOR
+# ============================================================================
+def run_in_emulator(program, scale=600.0, timeout=120.0):
+    """
+    Fija cero, sube y ejecuta `program` en el emulador. Devuelve
+    (líneas recibidas, segundos de firmware, posición final).
+    """
+    from .emulador import FirmwareModel
+    out = bytearray()
+    model = FirmwareModel(out.extend, scale, jeringa=program.syringe.index).start()
+    try:
+        model.feed(b's')
+        deadline = time.monotonic() + timeout
+        while b'ZERO_SET' not in out:
+            if time.monotonic() > deadline: raise TimeoutError('ZERO_SET')
+            time.sleep(0.005)
+        t0 = model.millis()
+        for cmd in program.commands(): model.feed(cmd)
+        while b'ACK:PROGRAM_' not in out:
+            if time.monotonic() > deadline: raise TimeoutError('PROGRAM_COMPLETE')
+            time.sleep(0.01)
+        elapsed = (model.millis() - t0) / 1000.0
+        time.sleep(0.05)
+        return bytes(out).decode('utf-8', errors='ignore').splitlines(), elapsed, model.position
+    finally:
+        model.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compila un programa de dosificación y lo prueba en el emulador")
+    parser.add_argument('path')
+    parser.add_argument('--jeringa', type=int, help="índice en jeringas[] (por defecto el del programa)")
+    parser.add_argument('--emulate', action='store_true', help="ejecutarlo en el emulador")
+    parser.add_argument('--scale', type=float, default=600.0)
+    args = parser.parse_args(argv)
+    try:
+        program = load(args.path, args.jeringa)
+    except ProgramError as e:
+        print(f"ERROR: {e}")
+        return 1
+    print(program)
+    for ins in program.instructions: print(f"  {ins.op} {ins.a:>7} {ins.b:>6}  {ins.text}")
+    print(f"Línea: {program.command().decode().strip()} ({len(program.command())} bytes)")
+    print(f"Expulsa {program.expelled_ml():.2f} mL en ~{program.duration_s():.0f} s")
+    if args.emulate:
+        lines, elapsed, position = run_in_emulator(program, args.scale)
+        steps = sum(1 for l in lines if l.startswith('STEP:'))
+        result = next((l for l in lines if l.startswith('ACK:PROGRAM_')), '?')
+        print(f"Emulador: {result}, {steps} pasos, {elapsed:.1f} s de firmware, posición final {position}")
+        return 0 if result == 'ACK:PROGRAM_COMPLETE' else 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
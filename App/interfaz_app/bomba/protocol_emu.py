@@ -0,0 +1,121 @@
+# protocol_emu.py
+"""
+Manejador de URL para pyserial: serial.serial_for_url('emu://?scale=60&jeringa=0').
+
+El emulador corre en el mismo proceso, sin pty. Hay que registrar el
+paquete una vez con `bomba.protocol_emu.register()`.
+
+`fileno()` es un self-pipe que se vuelve legible cuando hay bytes
+pendientes: el puerto se puede esperar con `selectors` como uno real.
+"""
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import serial
+from serial.serialutil import SerialBase, SerialException
+
+from .emulador import FirmwareModel
+
+
+def register():
+    if 'bomba' not in serial.protocol_handler_packages:
+        serial.protocol_handler_packages.append('bomba')
+
+
+class Serial(SerialBase):
+    """ Puerto serie virtual conectado a un FirmwareModel """
+
+    def open(self):
+        if self._port is None:
+            raise SerialException("Falta el puerto (emu://...)")
+        if self.is_open:
+            raise SerialException("El puerto ya está abierto")
+        query = parse_qs(urlparse(self._port).query)
+        scale = float(query.get('scale', ['1'])[0])
+        jeringa = int(query.get('jeringa', ['0'])[0])
+        self._rx = bytearray()
+        self._cond = threading.Condition()
+        self._cancel = False
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._signalled = False
+        self.model = FirmwareModel(self._from_model, scale, jeringa=jeringa)
+        self.is_open = True
+        self.model.start()
+
+    def _from_model(self, data):
+        with self._cond:
+            self._rx += data
+            if not self._signalled and self.is_open:
+                self._signalled = True
+                os.write(self._wake_w, b'\x00')
+            self._cond.notify_all()
+
+    def _clear_signal(self):
+        """ Con el lock tomado y sin bytes pendientes: el pipe deja de estar legible """
+        if self._signalled and not self._rx:
+            self._signalled = False
+            try: os.read(self._wake_r, 64)
+            except BlockingIOError: pass
+
+    def fileno(self):
+        return self._wake_r
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.model.stop()
+            with self._cond:
+                self._cond.notify_all()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def _reconfigure_port(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise SerialException("Puerto cerrado")
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        with self._cond:
+            while len(self._rx) < size and self.is_open and not self._cancel:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0: break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            self._cancel = False
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            self._clear_signal()
+        return data
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancel = True
+            self._cond.notify_all()
+
+    def write(self, data):
+        if not self.is_open:
+            raise SerialException("Puerto cerrado")
+        data = bytes(data)
+        self.model.feed(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._rx.clear()
+            self._clear_signal()
+
+    def reset_output_buffer(self):
+        pass
@@ -0,0 +1,250 @@
+# protocolo.py
+"""
+Protocolo de texto del firmware (Arduino.ino): mensajes tipados y parser por tabla.
+
+Cada línea es `CABECERA:campo:campo...`. El parser trabaja directamente
+sobre bytes (float()/int() aceptan bytes) y cuenta los errores en vez de
+tragárselos.
+"""
+from collections import Counter, namedtuple
+
+from .firmware import PRESETS_CAUDAL
+
+
+def _message(name, fields, header):
+    cls = namedtuple(name, fields)
+    return type(name, (cls,), {'__slots__': (), 'header': header})
+
+
+Vol = _message('Vol', 'value', 'VOL')
+Param = _message('Param', 'value', 'PARAM')
+Preset = _message('Preset', 'value loop', 'PRESET')
+Custom = _message('Custom', 'value inc', 'CUSTOM')
+Time = _message('Time', 'value', 'TIME')
+Loop = _message('Loop', 'value', 'LOOP')
+Inc = _message('Inc', 'value', 'INC')
+Info = _message('Info', 'volume param mode syringe', 'INFO')
+Prog = _message('Prog', 'percent', 'PROG')
+Status = _message('Status', 'state volume', 'STATUS')
+Ack = _message('Ack', 'event', 'ACK')
+# Solo en modo binario: posición (pasos) y semiperiodo del paso (us)
+Telem = _message('Telem', 'position half_period_us', 'TELEM')
+
+# Perfil de movimiento cargado con '#A': entradas de la rampa, pasos por entrada y
+# semiperiodo de succión (us)
+Profile = _message('Profile', 'entries seg suction', 'PROFILE')
+
+# Programa de dosificación: respuesta a '#D' (pasos y ciclos cargados; 0 = rechazado)
+# y paso en curso mientras se ejecuta (índice desde 0, ciclo desde 1, instrucción)
+Program = _message('Program', 'steps cycles', 'PROGRAM')
+Step = _message('Step', 'index cycle op', 'STEP')
+
+# Caudal variable en streaming: créditos concedidos (líneas '#S' que se pueden enviar)
+# y contadores del firmware (consignas aplicadas, underruns, overruns y aplicadas tarde)
+Credit = _message('Credit', 'credits', 'CREDIT')
+StreamStat = _message('StreamStat', 'applied underruns overruns late', 'STREAMSTAT')
+
+# Mismo orden que `ProgramState` en Arduino.ino
+FIRMWARE_STATES = ('HOMING', 'LOAD_SETUP', 'MODE_SELECT', 'CAUDAL_SUBMENU',
+                   'CAUDAL_PRESET', 'CAUDAL_MANUAL', 'TIME_SETUP', 'POST_EXPULSION', 'PROGRAM', 'STREAM')
+# `faseActual` del firmware: parado, moviendo (carga / vuelta a cero) o fase de la expulsión
+PHASE_NAMES = {0x00: None, 0x01: 'MOVING', 0x81: 'EXPULSION', 0x82: 'RECARGA', 0x83: 'PAUSA'}
+
+
+class Snap(_message('Snap', 'state phase progress position volume flow flow_inc '
+                            'preset preset_flow loops time syringe', 'SNAP')):
+    """ Respuesta a 'x': todas las variables de estado del firmware de una vez """
+    __slots__ = ()
+
+    @property
+    def state_name(self):
+        return FIRMWARE_STATES[self.state] if 0 <= self.state < len(FIRMWARE_STATES) else None
+
+    @property
+    def phase_name(self):
+        return PHASE_NAMES.get(self.phase)
+
+    @property
+    def running(self):
+        """ El motor se está moviendo (o la secuencia de expulsión sigue en curso) """
+        return self.phase != 0
+
+
+def _text(raw):
+    return raw.decode('utf-8', errors='ignore').strip()
+
+
+def _tail(fields, key):
+    """ Valor opcional `:KEY:valor` al final de la línea (PRESET:..:LOOP:1) """
+    if len(fields) >= 3 and fields[1] == key:
+        return float(fields[2])
+    return None
+
+
+# Cabecera -> (mensaje, conversión). Con float/int el resto de la línea es
+# un único número y no hace falta partirla; si no, la función recibe los
+# campos ya separados (bytes).
+PARSERS = {
+    b'VOL':    (Vol, float),
+    b'PARAM':  (Param, float),
+    b'PRESET': (Preset, lambda f: (float(f[0]), _tail(f, b'LOOP'))),
+    b'CUSTOM': (Custom, lambda f: (float(f[0]), _tail(f, b'INC'))),
+    b'TIME':   (Time, float),
+    b'LOOP':   (Loop, float),
+    b'INC':    (Inc, float),
+    b'INFO':   (Info, lambda f: (float(f[0]), float(f[1]), _text(f[2]), _text(b':'.join(f[3:])))),
+    b'PROG':   (Prog, int),
+    b'STATUS': (Status, lambda f: (_text(f[0]), _tail(f, b'VOL'))),
+    b'ACK':    (Ack, lambda f: (_text(f[0]),)),
+    b'PROFILE': (Profile, lambda f: (int(f[0]), int(f[1]), int(f[2]))),
+    b'PROGRAM': (Program, lambda f: (int(f[0]), int(f[1]))),
+    b'STEP':   (Step, lambda f: (int(f[0]), int(f[1]), _text(f[2]))),
+    b'CREDIT': (Credit, int),
+    b'STREAMSTAT': (StreamStat, lambda f: (int(f[0]), int(f[1]), int(f[2]), int(f[3]))),
+    b'SNAP':   (Snap, lambda f: (int(f[0]), int(f[1]), int(f[2]), int(f[3]), float(f[4]), float(f[5]),
+                                 float(f[6]), int(f[7]), float(f[8]), int(f[9]), float(f[10]), int(f[11]))),
+}
+
+_new = tuple.__new__
+
+
+class Parser:
+    """
+    Convierte líneas (bytes o str) en mensajes tipados.
+
+    `counts` lleva un contador por cabecera más 'unknown' (texto sin
+    cabecera conocida, p. ej. ">>> CICLO 1/3" o "DEBUG:..."), 'error'
+    (cabecera conocida con campos inválidos) y 'handler_error' (excepciones
+    de la UI en dispatch()).
+    """
+
+    def __init__(self, parsers=PARSERS):
+        self.parsers = parsers
+        self.counts = Counter()
+        self.last_error = None
+
+    def parse(self, raw):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        header, sep, rest = raw.partition(b':')
+        entry = self.parsers.get(header) if sep else None
+        if entry is None:
+            self.counts['unknown'] += 1
+            return None
+        cls, convert = entry
+        try:
+            if convert is float or convert is int:
+                msg = _new(cls, (convert(rest),))
+            else:
+                msg = _new(cls, convert(rest.split(b':')))
+        except (ValueError, IndexError) as e:
+            self.counts['error'] += 1
+            self.last_error = f"{raw!r}: {e}"
+            return None
+        self.counts[cls.header] += 1
+        return msg
+
+    @property
+    def parsed(self):
+        """ Mensajes válidos en total """
+        return sum(self.counts[cls.header] for cls, _ in self.parsers.values())
+
+    def dispatch(self, msg, handlers):
+        """ Llama al handler registrado para el tipo de `msg` (dict tipo -> función) """
+        handler = handlers.get(type(msg))
+        if handler is None: return False
+        try:
+            handler(msg)
+        except Exception as e:
+            self.counts['handler_error'] += 1
+            self.last_error = f"{msg}: {e}"
+            return False
+        return True
+
+
+# Campo opcional que el firmware imprime como `:CLAVE:valor` al final
+_TAILS = {Preset: b'LOOP', Custom: b'INC', Status: b'VOL'}
+
+
+def to_line(msg):
+    """ Línea de texto equivalente a `msg` (p. ej. para grabar lo recibido en binario) """
+    def field(value):
+        if isinstance(value, str): return value.encode('utf-8')
+        # Los float de las tramas binarias son de 32 bits: 7 cifras bastan y la línea no crece
+        if isinstance(value, float): return format(value, '.7g').encode()
+        return str(value).encode()
+    tail = _TAILS.get(type(msg))
+    if tail is not None:
+        head, extra = msg
+        parts = [field(head)] if extra is None else [field(head), tail, field(extra)]
+    else:
+        parts = [field(value) for value in msg]
+    return msg.header.encode() + b':' + b':'.join(parts)
+
+
+# --- Comandos host -> firmware ---
+
+SETPOINT_PREFIX = b'#'
+# Las consignas en streaming no se sustituyen en la cola: cada una gasta un crédito
+STREAM_SETPOINT_PREFIX = b'#S'
+
+# Instantánea de estado (SNAP); la responde también a mitad de un movimiento
+CMD_SNAPSHOT = b'x'
+
+# Ejecuta el programa cargado con '#D' (fuera de HOMING)
+CMD_RUN_PROGRAM = b'g'
+
+
+def cmd_set_volume(ml):
+    """ Volumen a cargar (mL); el firmware responde VOL:x """
+    return b'#V%.2f\n' % ml
+
+
+def cmd_set_flow(ul_min):
+    """ Caudal manual (uL/min); el firmware responde CUSTOM:x """
+    return b'#F%.2f\n' % ul_min
+
+
+def cmd_set_time(seconds):
+    """ Tiempo de expulsión (s); el firmware responde TIME:x """
+    return b'#T%.2f\n' % seconds
+
+
+def cmd_select_preset(index):
+    """ Índice en PRESETS_CAUDAL; el firmware responde PRESET:x """
+    return b'#P%d\n' % index
+
+
+def cmd_set_profile(seg, suction_us, delays):
+    """
+    Perfil de movimiento: semiperiodos (us) de la rampa, `seg` pasos por
+    entrada y semiperiodo de succión; el firmware responde PROFILE:x
+    """
+    return b'#A%d:%d:%s\n' % (seg, suction_us, b','.join(b'%d' % d for d in delays))
+
+
+def cmd_profile_off():
+    """ Vuelve al retardo constante y a la succión de siempre """
+    return b'#A0\n'
+
+
+def cmd_load_program(syringe, cycles, ops):
+    """
+    Programa de dosificación ya compilado (ver programa.py): `ops` son
+    tuplas (instrucción, a, b) en pasos / us / ms; el firmware responde PROGRAM:x
+    """
+    def op(code, a, b):
+        if code == 'E': return b'E%d,%d' % (a, b)
+        if code == 'Z': return b'Z'
+        return code.encode() + b'%d' % a
+    return b'#D%d:%d:%s\n' % (syringe, cycles, b'/'.join(op(*o) for o in ops))
+
+
+def cmd_stream_start(period_ms):
+    """ Modo streaming con consignas cada `period_ms`; responde ACK:STREAM_START y CREDIT:n """
+    return b'#Q%d\n' % period_ms
+
+
+def cmd_stream_setpoint(t_ms, half_period_us):
+    """ Consigna en el instante `t_ms` (desde el '#Q'); semiperiodo 0 = motor parado """
+    return b'#S%d,%d\n' % (t_ms, half_period_us)
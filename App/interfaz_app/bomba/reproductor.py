@@ -0,0 +1,148 @@
+# reproductor.py
+"""
+Reproducción de sesiones grabadas (grabador.py) o trazas de texto.
+
+Sirve para repetir en la UI, sin hardware ni emulador, lo que recibió una
+unidad en campo: `load_recording()` devuelve las líneas RX con sus tiempos
+(y los estados que registró la UI) y `ReplayPort` las entrega como un
+puerto pyserial a 1x, 10x o a velocidad máxima.
+"""
+import time
+
+from .grabador import MAGIC, RX, STATE, TEXT_SIZE, iter_records
+
+# Las trazas de texto no tienen tiempos: una línea cada 50 ms
+TRACE_INTERVAL = 0.05
+
+
+class Recording:
+    """ rx: [(t, línea)]; states: [(t, estado)] (vacío en trazas de texto) """
+
+    def __init__(self, path, rx, states, truncated=0):
+        self.path = path
+        self.rx = rx
+        self.states = states
+        self.truncated = truncated  # Líneas cortadas a TEXT_SIZE al grabar
+
+    @property
+    def initial_state(self):
+        """ Estado de la UI al empezar a grabar: la reproducción arranca desde él """
+        return self.states[0][1] if self.states else None
+
+    @property
+    def duration(self):
+        return self.rx[-1][0] - self.rx[0][0] if self.rx else 0.0
+
+    def expected_states(self):
+        """ Secuencia de estados sin repeticiones consecutivas """
+        return dedupe(state for _, state in self.states)
+
+
+def dedupe(states):
+    out = []
+    for state in states:
+        if not out or out[-1] != state: out.append(state)
+    return out
+
+
+def load_recording(path):
+    with open(path, 'rb') as f:
+        is_session = f.read(len(MAGIC)) == MAGIC
+    if not is_session:
+        with open(path, 'rb') as f:
+            lines = [line.rstrip(b'\r\n') for line in f if line.strip()]
+        return Recording(path, [(i * TRACE_INTERVAL, line) for i, line in enumerate(lines)], [])
+    rx, states, truncated = [], [], 0
+    for t, kind, code, length, value, value2, text in iter_records(path):
+        if kind == RX:
+            rx.append((t, text))
+            if length > TEXT_SIZE: truncated += 1
+        elif kind == STATE:
+            states.append((t, text.decode('utf-8')))
+    return Recording(path, rx, states, truncated)
+
+
+class ReplayClock:
+    """ Reloj de la reproducción; speed=None es velocidad máxima (todo ya vencido) """
+
+    def __init__(self, speed=None, t_first=0.0):
+        self.speed = speed
+        self.t_first = t_first
+        self.started = time.monotonic()
+
+    def now(self):
+        """ Tiempo de la grabación que corresponde a este instante """
+        if self.speed is None: return float('inf')
+        return self.t_first + (time.monotonic() - self.started) * self.speed
+
+    def due(self, t):
+        return t <= self.now()
+
+
+class ReplayPort:
+    """
+    Puerto de sólo lectura: in_waiting, read() y readline() sólo ven las
+    líneas cuyo tiempo ya venció. Lo escrito se guarda en `tx`.
+    """
+
+    POLL_S = 0.001
+
+    def __init__(self, rx, speed=None):
+        self.rx = rx
+        self.clock = ReplayClock(speed, rx[0][0] if rx else 0.0)
+        self.pos = 0
+        self.is_open = True
+        self.timeout = None
+        self._cancel = False
+        self.tx = []
+
+    def _due(self):
+        now = self.clock.now()
+        end = self.pos
+        while end < len(self.rx) and self.rx[end][0] <= now: end += 1
+        return end
+
+    @property
+    def in_waiting(self):
+        return sum(len(line) + 2 for _, line in self.rx[self.pos:self._due()])
+
+    def backlog(self):
+        """ Líneas vencidas que aún no se han leído """
+        return self._due() - self.pos
+
+    @property
+    def finished(self):
+        return self.pos >= len(self.rx)
+
+    def read(self, size=1):
+        """ Como serial.Serial.read(): líneas vencidas completas, esperando hasta `timeout` """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while self.is_open and not self._cancel and self.pos >= self._due():
+            if self.finished or (deadline is not None and time.monotonic() >= deadline): break
+            time.sleep(self.POLL_S)
+        self._cancel = False
+        data = bytearray()
+        end = self._due()
+        while self.pos < end and (not data or len(data) + len(self.rx[self.pos][1]) + 2 <= size):
+            data += self.rx[self.pos][1] + b'\r\n'
+            self.pos += 1
+        return bytes(data)
+
+    def cancel_read(self):
+        self._cancel = True
+
+    def readline(self):
+        if self.pos >= self._due(): return b''
+        line = self.rx[self.pos][1]
+        self.pos += 1
+        return line + b'\r\n'
+
+    def write(self, data):
+        self.tx.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
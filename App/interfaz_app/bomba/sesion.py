@@ -0,0 +1,304 @@
+# sesion.py
+"""
+Varias bombas desde un solo proceso.
+
+`PumpSession` reúne lo que ControlScreen tiene repartido en globales para
+una sola bomba: el puerto, el decodificador RX, el parser, el estado y la
+cola TX. `PumpManager` abre N sesiones y las sirve todas con un único
+IOMultiplexer (un hilo para todos los puertos, no un lector y un escritor
+por bomba).
+
+Los mensajes se aplican en el hilo de E/S; la UI solo recibe el aviso
+`on_change(session)` y lee `session.state` cuando le toca pintar.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .binario import CMD_BINARY, BinaryFramer
+from .conexion import wait_ready
+from .escritor import CommandWriter
+from .lector import RxDecoder
+from .metricas import log
+from .multiplexor import IOMultiplexer
+from .protocolo import (CMD_SNAPSHOT, FIRMWARE_STATES, Ack, Custom, Loop, Parser, Preset, Prog, Snap, Status,
+                        Step, Telem, Time, Vol)
+
+# ACK -> estado (el resto llega en el SNAP de detrás); también lo usan los handle_ack de las dos interfaces
+ACK_STATES = {
+    'ZERO_SET': 'LOAD_SETUP',
+    'LOAD_COMPLETE': 'MODE_SELECT',
+    'EXPULSION_COMPLETE': 'POST_EXPULSION',
+    'RETURNED_TO_ZERO': 'LOAD_SETUP',
+    'STAYING_POSITION': 'LOAD_SETUP',
+    'RESET': 'HOMING',
+    'CAUDAL_SUBMENU': 'CAUDAL_SUBMENU',
+    'STREAM_START': 'STREAM',
+}
+# Valor que el firmware manda al entrar en cada pantalla de parámetro
+ARG_STATES = {Preset: 'CAUDAL_PRESET', Custom: 'CAUDAL_MANUAL', Time: 'TIME_SETUP'}
+
+
+class PumpState:
+    """ Lo que el panel muestra de cada bomba """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = None       # Nombre de FIRMWARE_STATES (None hasta el primer SNAP)
+        self.phase = None       # PHASE_NAMES: None parado, 'MOVING', 'EXPULSION'...
+        self.progress = 0       # % de la expulsión en curso
+        self.position = 0       # Pasos desde el cero
+        self.volume = 0.0
+        self.syringe = 0
+        self.param = None       # Último caudal / tiempo de la pantalla de parámetro
+        self.loops = 0          # Repeticiones de la expulsión con preset
+        self.step = None        # Paso del programa en curso (Step)
+        self.last_ack = None
+        # Mensajes recibidos por tipo y ACK por evento: distingue dos respuestas iguales seguidas
+        self.received = Counter()
+        self.connected = True
+        self.updated = 0.0
+
+    def apply(self, msg):
+        """ Actualiza con un mensaje; devuelve True si cambió algo visible """
+        kind = type(msg)
+        if kind is Snap:
+            self.state = msg.state_name
+            self.phase = msg.phase_name
+            self.progress = msg.progress
+            self.position = msg.position
+            self.volume = msg.volume
+            self.syringe = msg.syringe
+            self.loops = msg.loops
+        elif kind is Prog:
+            self.progress = msg.percent
+        elif kind is Telem:
+            self.position = msg.position
+        elif kind is Vol:
+            self.volume = msg.value
+        elif kind is Status:
+            # Respuesta a 'q' (número de estado) o cambio de fase ('EXPULSION', 'RECARGA')
+            if msg.state.isdigit():
+                index = int(msg.state)
+                self.state = FIRMWARE_STATES[index] if index < len(FIRMWARE_STATES) else self.state
+            else:
+                self.phase = msg.state
+            if msg.volume is not None: self.volume = msg.volume
+        elif kind in ARG_STATES:
+            self.state = ARG_STATES[kind]
+            self.param = msg.value
+            if kind is Preset and msg.loop is not None: self.loops = int(msg.loop)
+        elif kind is Loop:
+            self.loops = int(msg.value)
+        elif kind is Step:
+            self.state = 'PROGRAM'
+            self.step = msg
+        elif kind is Ack:
+            self.last_ack = msg.event
+            if msg.event in ACK_STATES:
+                self.state = ACK_STATES[msg.event]
+                if self.state != 'STREAM': self.phase = None
+            if msg.event == 'EXPULSION_COMPLETE': self.progress = 100
+        else:
+            return False
+        self.received[msg.event if kind is Ack else kind] += 1
+        self.updated = time.monotonic()
+        return True
+
+    def as_dict(self):
+        return {
+            'name': self.name, 'state': self.state, 'phase': self.phase, 'progress': self.progress,
+            'position': self.position, 'volume': self.volume, 'syringe': self.syringe,
+            'last_ack': self.last_ack, 'connected': self.connected,
+        }
+
+
+class PumpSession:
+    """
+    Una bomba: puerto, RxDecoder, Parser, PumpState y CommandWriter en modo
+    `notify`. feed() y lost() los llama el multiplexor desde su hilo.
+    """
+
+    on_change = None    # f(session) en el hilo de E/S
+
+    def __init__(self, name, port, ready=None, binary=True, notify=None, decoder=None):
+        self.name = name
+        self.port = port
+        # `decoder`: el de un PumpProtocol que ya separa los mensajes (deliver() en vez de feed())
+        self.decoder = decoder or RxDecoder(1024)
+        self.parser = Parser()
+        self.state = PumpState(name)
+        self.writer = CommandWriter(self.write_to_port, notify=(lambda: notify(self)) if notify else None)
+        self.listeners = []     # f(session, msg) en el hilo de E/S
+        self.closed = False
+        self._changed = threading.Condition()
+        if ready is not None and ready.binary and self.decoder.binary is None: self.decoder.binary = BinaryFramer()
+        # 'v' espera al SNAP: el firmware descarta lo que llega pegado a un comando
+        self.binary = binary
+        self.binary_pending = binary and self.decoder.binary is None
+        self.rest = ready.rest if ready is not None else b''
+
+    def start(self):
+        """ Bytes que llegaron con la respuesta de wait_ready y primer SNAP """
+        if self.rest:
+            self.feed(self.rest, time.monotonic())
+            self.rest = b''
+        self.send(CMD_SNAPSHOT)
+        return self
+
+    def send(self, cmd):
+        if self.closed: return False
+        return self.writer.send(cmd)
+
+    def write_to_port(self, data):
+        """ Hilo de E/S (drain del escritor). Sin flush(): tcdrain de un puerto lento pararía a todas las bombas """
+        self.port.write(data)
+
+    def feed(self, data, t_rx):
+        self.deliver(self.decoder.feed(data), t_rx)
+
+    def deliver(self, items, t_rx):
+        """ Líneas o mensajes binarios ya separados """
+        parse = self.parser.parse
+        msgs = [item if isinstance(item, tuple) else parse(item) for item in items]
+        changed = False
+        # Un solo aviso por lectura, no por mensaje
+        with self._changed:
+            for msg in msgs:
+                if msg is not None and self.state.apply(msg): changed = True
+            self._changed.notify_all()
+        for msg in msgs:
+            if msg is None: continue
+            if type(msg) is Snap and self.binary_pending:
+                self.binary_pending = False
+                self.send(CMD_BINARY)
+            for listener in self.listeners:
+                try: listener(self, msg)
+                except Exception as e: log.error("Bomba %s: %s", self.name, e)
+        if changed and self.on_change: self.on_change(self)
+
+    def lost(self, error):
+        with self._changed:
+            self.state.connected = False
+            self._changed.notify_all()
+        if self.on_change: self.on_change(self)
+
+    @property
+    def synced(self):
+        """ Primer SNAP recibido y, si se pidió, ya en binario: se le pueden mandar comandos """
+        return self.state.state is not None and (not self.binary or self.decoder.binary is not None)
+
+    def wait_synced(self, timeout=None):
+        return self.wait_for(lambda st: self.synced, timeout)
+
+    def wait_for(self, predicate, timeout=None):
+        """ Espera (fuera del hilo de E/S) a que `predicate(state)` se cumpla """
+        with self._changed:
+            return self._changed.wait_for(lambda: predicate(self.state) or not self.state.connected, timeout) \
+                and predicate(self.state)
+
+    def close(self):
+        self.closed = True
+        try: self.port.close()
+        except Exception: pass
+
+    def snapshot(self):
+        snap = self.state.as_dict()
+        snap['rx'] = self.decoder.snapshot()
+        snap['tx'] = self.writer.snapshot()
+        snap['parser'] = dict(self.parser.counts, parsed=self.parser.parsed)
+        return snap
+
+
+class PumpManager:
+    """
+    N bombas, un hilo de E/S. `on_change(session)` se llama desde el hilo
+    de E/S con cada cambio de estado.
+    """
+
+    def __init__(self, on_change=None, binary=True, open_port=None):
+        self.on_change = on_change
+        self.binary = binary
+        self.open_port = open_port or _serial_open
+        self.mux = IOMultiplexer().start()
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def connect(self, url, name=None):
+        """ Abre `url`, espera al firmware y añade la sesión; None si no responde """
+        port = self.open_port(url)
+        ready = wait_ready(port)
+        log.info("Conexión %s: %s", url, ready)
+        if not ready:
+            port.close()
+            return None
+        return self.attach(name or url, port, ready)
+
+    def connect_all(self, urls, names=None):
+        """ Todas a la vez: cada wait_ready tarda lo suyo y no deben sumarse """
+        if not urls: return []
+        names = names or [f"Bomba {i + 1}" for i in range(len(urls))]
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            futures = [pool.submit(self._try_connect, url, name) for url, name in zip(urls, names)]
+            return [f.result() for f in futures]
+
+    def _try_connect(self, url, name):
+        try:
+            return self.connect(url, name)
+        except Exception as e:
+            log.error("Conexión %s: %s", url, e)
+            return None
+
+    def attach(self, name, port, ready=None):
+        """
+        Puerto ya abierto (p. ej. el driver USB de Android, sin wait_ready).
+        Una sesión con el mismo nombre se cierra y se sustituye.
+        """
+        session = PumpSession(name, port, ready, self.binary, notify=self.mux.want_write)
+        session.on_change = self.on_change
+        with self._lock:
+            old = self.sessions.pop(name, None)
+            self.sessions[name] = session
+        if old: self._drop(old)
+        self.mux.add(session)
+        return session.start()
+
+    def remove(self, name):
+        with self._lock:
+            session = self.sessions.pop(name, None)
+        if session: self._drop(session)
+
+    def _drop(self, session):
+        session.closed = True
+        self.mux.remove(session, then=session.close)
+
+    def get(self, name):
+        return self.sessions.get(name)
+
+    def broadcast(self, cmd):
+        """ El mismo comando a todas (p. ej. 'p' para pararlas todas) """
+        for session in list(self.sessions.values()): session.send(cmd)
+
+    def states(self):
+        return [s.state for s in list(self.sessions.values())]
+
+    def stop(self):
+        self.mux.stop()
+        with self._lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        for session in sessions: session.close()
+        self.mux.close()
+
+    def snapshot(self):
+        return {
+            'mux': self.mux.snapshot(),
+            'pumps': {name: s.snapshot() for name, s in list(self.sessions.items())},
+        }
+
+
+def _serial_open(url):
+    import serial
+    from . import protocol_emu
+    protocol_emu.register()
+    return serial.serial_for_url(url, 9600, timeout=0.1, dsrdtr=True)
@@ -0,0 +1,334 @@
+# usb_android.py
+"""
+Driver USB nativo para Android (CH340 / CDC) sobre UsbDeviceConnection.
+
+No importa Kivy ni jnius al cargar: las constantes de USB se inyectan,
+así el driver se puede probar en Linux con una conexión falsa.
+
+Recepción: en vez de encadenar bulkTransfer() síncronos con timeout (cada
+sondeo sin datos es un viaje JNI y entre dos llamadas no hay ninguna
+transferencia IN pendiente), se mantienen `RX_QUEUED` UsbRequest IN
+encoladas y se recogen con requestWait(): el hilo duerme en el SO hasta
+que una termina y se vuelve a encolar antes de procesarla. La parte que
+habla con Java está detrás de la interfaz de cola (submit / wait / data /
+close): `UsbRequestQueue` en Android; las pruebas (tests/) usan una cola
+en memoria con la misma interfaz. Sin UsbRequest (API < 26) se usa bulkTransfer.
+"""
+import time
+
+from .framing import LineFramer
+from .metricas import log
+
+# Valores de android.hardware.usb.UsbConstants
+USB_ENDPOINT_XFER_BULK = 2
+USB_DIR_IN = 0x80
+
+# Paquetes completos que caben en el buffer de líneas
+RX_PACKETS = 8
+# Transferencias IN encoladas a la vez (0 = bulkTransfer síncrono, como antes)
+RX_QUEUED = 4
+
+
+# ============================================================================
+# COLA DE TRANSFERENCIAS IN
+# ============================================================================
+class UsbRequestQueue:
+    """
+    `count` UsbRequest IN sobre `endpoint`, cada una con su ByteBuffer.
+    requestWait(timeout) necesita API 26; el número de hueco viaja en
+    setClientData para saber cuál ha terminado.
+    """
+
+    def __init__(self, connection, endpoint, count, size):
+        from jnius import autoclass
+        UsbRequest = autoclass('android.hardware.usb.UsbRequest')
+        ByteBuffer = autoclass('java.nio.ByteBuffer')
+        Integer = autoclass('java.lang.Integer')
+        self.connection = connection
+        self.requests = []
+        self.buffers = []
+        self.chunk = bytearray(size)
+        for slot in range(count):
+            request = UsbRequest()
+            if not request.initialize(connection, endpoint):
+                self.close()
+                raise OSError("UsbRequest.initialize falló")
+            request.setClientData(Integer.valueOf(slot))
+            self.requests.append(request)
+            self.buffers.append(ByteBuffer.allocate(size))
+
+    def __len__(self):
+        return len(self.requests)
+
+    def submit(self, slot):
+        buffer = self.buffers[slot]
+        buffer.clear()
+        if not self.requests[slot].queue(buffer):
+            raise OSError("UsbRequest.queue falló")
+
+    def wait(self, timeout_ms):
+        """ (hueco, bytes) de la primera que termine; None si vence `timeout_ms` """
+        from jnius import JavaException
+        try:
+            # En requestWait() 0 es "sin límite": el mínimo real es 1 ms
+            request = self.connection.requestWait(max(1, int(timeout_ms)))
+        except JavaException as e:
+            if 'TimeoutException' in str(e): return None
+            raise OSError(str(e))
+        if request is None: raise OSError("requestWait: conexión cerrada")
+        slot = request.getClientData().intValue()
+        return slot, self.buffers[slot].position()
+
+    def data(self, slot, count):
+        buffer = self.buffers[slot]
+        buffer.flip()
+        buffer.get(self.chunk, 0, count)  # jnius copia el byte[] de vuelta al bytearray
+        return bytes(memoryview(self.chunk)[:count])
+
+    def close(self):
+        for request in self.requests:
+            try:
+                request.cancel()
+                request.close()
+            except Exception:
+                pass
+        self.requests = []
+
+
+class QueuedReader:
+    """
+    Mantiene todas las peticiones de `requests` encoladas: cada una que
+    termina se vuelve a encolar antes de tocar sus datos, así siempre hay
+    transferencias IN pendientes. Las líneas completas pasan por un LineFramer.
+    """
+
+    def __init__(self, requests, packet=64, capacity=1024):
+        self.requests = requests
+        self.packet = packet
+        self.framer = LineFramer(capacity)
+        self.reaped = 0
+        self.timeouts = 0
+        self.rx_bytes = 0
+        for slot in range(len(requests)): requests.submit(slot)
+
+    def poll(self, timeout_ms):
+        """ Bytes de una transferencia terminada, o b'' si vence `timeout_ms` """
+        done = self.requests.wait(timeout_ms)
+        if done is None:
+            self.timeouts += 1
+            return b''
+        slot, count = done
+        data = self.requests.data(slot, count) if count > 0 else b''
+        self.requests.submit(slot)
+        self.reaped += 1
+        self.rx_bytes += len(data)
+        return data
+
+    def read(self, timeout_ms):
+        """
+        Bytes crudos: espera una transferencia y recoge las siguientes
+        mientras lleguen paquetes llenos (uno corto cierra la ráfaga).
+        """
+        data = self.poll(timeout_ms)
+        chunks = [data]
+        while len(data) == self.packet and len(chunks) < len(self.requests):
+            data = self.poll(0)
+            chunks.append(data)
+        return b''.join(chunks)
+
+    def readlines(self, timeout):
+        """ Líneas completas; espera (dormido en requestWait) hasta `timeout` s solo si no hay ninguna """
+        deadline = time.monotonic() + timeout
+        lines = []
+        while not lines:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            data = self.poll(remaining * 1000.0)
+            if data: lines = self.framer.feed(data)
+        return lines
+
+    def close(self):
+        self.requests.close()
+
+    def snapshot(self):
+        return {
+            'queued': len(self.requests),
+            'reaped': self.reaped,
+            'timeouts': self.timeouts,
+            'dropped_partial': self.framer.dropped,
+            'pending_bytes': self.framer.pending(),
+        }
+
+
+class AndroidUSBSerial:
+    """ 
+    Driver nativo para CH340 configurado a 115200 baudios.
+    """
+    def __init__(self, device, manager, constants=None, queued=RX_QUEUED, request_queue=UsbRequestQueue):
+        self.device = device
+        self.manager = manager
+        self.connection = manager.openDevice(device)
+        self.iface = None
+        self.ep_in = None
+        self.ep_out = None
+        self.is_open = False
+        
+        if not self.connection:
+            raise Exception("No se pudo abrir la conexión USB")
+
+        self.iface = device.getInterface(0)
+        if not self.connection.claimInterface(self.iface, True):
+            raise Exception("No se pudo reclamar la interfaz")
+
+        xfer_bulk = constants.USB_ENDPOINT_XFER_BULK if constants else USB_ENDPOINT_XFER_BULK
+        dir_in = constants.USB_DIR_IN if constants else USB_DIR_IN
+
+        # Buscar Endpoints
+        for i in range(self.iface.getEndpointCount()):
+            ep = self.iface.getEndpoint(i)
+            if ep.getType() == xfer_bulk:
+                if ep.getDirection() == dir_in:
+                    self.ep_in = ep
+                else:
+                    self.ep_out = ep
+        
+        if not self.ep_in or not self.ep_out:
+            raise Exception("Error: Endpoints no encontrados")
+
+        # Buffers de recepción: se reservan una vez por conexión
+        packet = self.ep_in.getMaxPacketSize() or 64
+        self.rx_chunk = bytearray(packet)
+        self.framer = LineFramer(packet * RX_PACKETS)
+        self._lines = []
+        self.transfers = 0  # Llamadas JNI a bulkTransfer (IN)
+        self.rx_bytes = 0
+        self.queued = None  # QueuedReader si hay UsbRequest
+
+        # Inicialización forzada para CH340 a 115200
+        # No importa el VID, forzamos la secuencia CH340 ya que sabemos que es ese chip.
+        self.init_ch340_115200()
+
+        # Las peticiones IN se encolan con el chip ya configurado: si la inicialización falla no queda ninguna abierta
+        if queued:
+            try:
+                self.queued = QueuedReader(request_queue(self.connection, self.ep_in, queued, packet),
+                                           packet, packet * RX_PACKETS)
+                self.framer = self.queued.framer
+            except Exception as e:
+                log.warning("Sin UsbRequest encoladas (se usa bulkTransfer): %s", e)
+        self.is_open = True
+
+    def init_ch340_115200(self):
+        """
+        Configuración EXACTA para CH340 a 115200 Baudios, 8 Data Bits, No Parity, 1 Stop Bit.
+        """
+        ctrl = self.connection.controlTransfer
+        # Constantes: 0x40 = Vendor Out
+        
+        # 1. Handshake / Reset
+        ctrl(0x40, 0xA1, 0, 0, None, 0, 1000)
+        ctrl(0x40, 0x9A, 0x1312, 0xCC00, None, 0, 1000) # Configuración base
+        ctrl(0x40, 0x0F, 0x00, 0, None, 0, 1000) 
+        
+        # 2. Configurar Baud Rate: 115200
+        # Valores mágicos: 0xCC00 y 0x0003 son para 115200 en CH340G/C/E
+        ctrl(0x40, 0x9A, 0x1312, 0xCC00, None, 0, 1000)
+        ctrl(0x40, 0x9A, 0x0F2C, 0x0003, None, 0, 1000)
+        
+        # 3. Configurar Line Control (8N1) - ¡ESTO FALTABA ANTES!
+        # Reg 0x2518, Valor 0x00C3 activa LCR (Line Control Register)
+        # Esto asegura que el chip sepa dónde termina un byte.
+        ctrl(0x40, 0x9A, 0x2518, 0x00C3, None, 0, 1000)
+        
+        # 4. Handshake Final
+        ctrl(0x40, 0xA4, 0x00DA, 0, None, 0, 1000)
+        
+        log.info("Driver CH340 inicializado a 115200 baudios (8N1)")
+
+    def write(self, data):
+        if not self.is_open: return
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.connection.bulkTransfer(self.ep_out, data, len(data), 100)
+
+    def _transfer(self, timeout_ms):
+        """ Una transferencia IN; las líneas completas quedan en self._lines """
+        self.transfers += 1
+        cnt = self.connection.bulkTransfer(self.ep_in, self.rx_chunk, len(self.rx_chunk), timeout_ms)
+        if cnt > 0:
+            self.rx_bytes += cnt
+            self._lines.extend(self.framer.feed(memoryview(self.rx_chunk)[:cnt]))
+        return cnt
+
+    def _reap(self, read, timeout):
+        """ requestWait falla si se desconectó o se cerró: la conexión queda cerrada y no se reintenta """
+        try:
+            return read(timeout)
+        except OSError:
+            self.is_open = False
+            raise
+
+    def read_available(self, timeout_ms=0):
+        """ Una transferencia IN sin separar líneas: bytes crudos para el multiplexor """
+        if not self.is_open: return b''
+        if self.queued:
+            data = self._reap(self.queued.read, timeout_ms)
+            self.rx_bytes = self.queued.rx_bytes
+            return data
+        self.transfers += 1
+        cnt = self.connection.bulkTransfer(self.ep_in, self.rx_chunk, len(self.rx_chunk), timeout_ms)
+        if cnt <= 0: return b''
+        self.rx_bytes += cnt
+        return bytes(self.rx_chunk[:cnt])
+
+    def readlines(self, timeout=0.1, raw=False):
+        """
+        Devuelve TODAS las líneas completas disponibles (str, o bytes con raw=True).
+        Espera hasta `timeout` segundos solo si no hay ninguna pendiente;
+        la cola parcial se guarda para la siguiente llamada.
+        """
+        if not self.is_open: return []
+        if self.queued and not self._lines:
+            self._lines = self._reap(self.queued.readlines, timeout)
+            self.rx_bytes = self.queued.rx_bytes
+        start_time = time.time()
+        while not self._lines and not self.queued:
+            self._transfer(50)
+            if time.time() - start_time > timeout:
+                break
+        lines, self._lines = self._lines, []
+        if raw: return lines
+        return [line.decode('utf-8', errors='ignore') for line in lines]
+
+    def readline(self):
+        """ Compatibilidad: una sola línea, sin perder las siguientes """
+        if not self._lines:
+            self._lines = self.readlines(raw=True)
+        return self._lines.pop(0).decode('utf-8', errors='ignore') if self._lines else ""
+
+    def __iter__(self):
+        """ Itera líneas mientras la conexión siga abierta """
+        while self.is_open:
+            for line in self.readlines():
+                yield line
+
+    def snapshot(self):
+        if self.queued:
+            snap = self.queued.snapshot()
+            snap['bytes'] = self.rx_bytes
+            return snap
+        return {
+            'transfers': self.transfers,
+            'bytes': self.rx_bytes,
+            'dropped_partial': self.framer.dropped,
+            'pending_bytes': self.framer.pending(),
+        }
+
+    def close(self):
+        self.is_open = False
+        # Las peticiones pendientes se cancelan antes de soltar la interfaz
+        if self.queued: self.queued.close()
+        try:
+            self.connection.releaseInterface(self.iface)
+            self.connection.close()
+        except: pass
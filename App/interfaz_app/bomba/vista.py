@@ -0,0 +1,61 @@
+# vista.py
+"""
+Render declarativo: tabla estado -> propiedades de widgets, aplicando solo diferencias.
+"""
+
+
+def build_view(table, state, base=None, **values):
+    """
+    Calcula las propiedades objetivo para `state`.
+
+    `table[state]` es un dict {'widget_id.propiedad': valor}; los str con
+    llaves se formatean con `values`. Las claves de `base` se aplican en
+    todos los estados y la tabla las sobrescribe.
+    """
+    target = dict(base or {})
+    target.update(table.get(state, {}))
+    for key, value in target.items():
+        if isinstance(value, str) and '{' in value:
+            target[key] = value.format(**values)
+    return target
+
+
+class ViewDiff:
+    """
+    Aplica un dict de propiedades a `owner.ids` escribiendo solo las que difieren.
+
+    Se compara con el valor actual del widget (no con una caché), así los
+    cambios hechos fuera de la tabla (p. ej. deshabilitar el panel al
+    iniciar) no dejan la vista desincronizada.
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.writes = 0      # Escrituras de propiedades acumuladas
+        self.renders = 0     # Llamadas a apply()
+        self.messages = 0    # Mensajes que originaron esos renders
+        self.skipped = 0     # Propiedades que ya tenían el valor objetivo
+
+    def apply(self, target, messages=1):
+        writes = 0
+        ids = self.owner.ids
+        for key, value in target.items():
+            widget_id, prop = key.split('.', 1)
+            widget = ids[widget_id]
+            if getattr(widget, prop) != value:
+                setattr(widget, prop, value)
+                writes += 1
+            else:
+                self.skipped += 1
+        self.writes += writes
+        self.renders += 1
+        self.messages += messages
+        return writes
+
+    def stats(self):
+        return {
+            'renders': self.renders,
+            'writes': self.writes,
+            'skipped': self.skipped,
+            'writes_per_message': self.writes / self.messages if self.messages else 0.0,
+        }
@@ -4,6 +4,7 @@ package.name = bombajeringausb
 package.domain = org.tuproyecto
 source.dir = .
 source.include_exts = py,kv,png,jpg,xml
+source.exclude_dirs = tests
 version = 0.3
 
 # <<--- ESTA ES LA SECCIÓN MÁS IMPORTANTE --- >>
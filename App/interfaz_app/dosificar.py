@@ -0,0 +1,160 @@
+# dosificar.py
+"""
+Secuencias de dosificación desde la línea de comandos, sin Kivy ni ventana
+(bomba/control.py), contra bombas reales o emuladas.
+
+Cada bomba ejecuta los ficheros en orden, `--repeat` veces; con varias
+(--port repetido o --pumps N emuladas) van todas a la vez. Formato de las
+secuencias en control.parse_script():
+
+    cero
+    cargar 2.5
+    expulsar caudal 500 repeticiones 3
+    volver
+
+Uso:  python dosificar.py SECUENCIA [SECUENCIA...] [--port URL]... [--pumps N --scale 50]
+                          [--repeat 1] [--async] [--text] [--move-timeout S] [--out informe.json]
+Sale con código 1 si alguna bomba falla.
+"""
+import time
+
+T0 = time.perf_counter()
+
+import argparse
+import asyncio
+import json
+import sys
+import threading
+
+from bomba.control import AsyncPump, Pump, PumpError, ScriptError, load_script, run_script, run_script_async
+
+IMPORT_S = time.perf_counter() - T0
+
+
+class Run:
+    """ Lo que hizo una bomba: pasos con su duración, y el error si lo hubo """
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.steps = []
+        self.error = None
+        self.connect_s = None
+        self.run_s = None
+
+    def on_step(self, path, repeat):
+        def note(step, seconds):
+            self.steps.append({'script': path, 'repeat': repeat, 'line': step.line, 'text': step.text,
+                               's': round(seconds, 4)})
+            print(f"[{self.name}] {path}:{step.line} {step.text:<40} {seconds:8.3f} s", flush=True)
+        return note
+
+    def as_dict(self, pump=None):
+        return {
+            'name': self.name, 'url': self.url, 'ok': self.error is None, 'error': self.error,
+            'connect_s': self.connect_s and round(self.connect_s, 4),
+            'run_s': self.run_s and round(self.run_s, 3),
+            'steps': self.steps,
+            'final': pump.state.as_dict() if pump else None,
+        }
+
+
+def run_sync(urls, scripts, args):
+    runs = [Run(f"Bomba {i + 1}", url) for i, url in enumerate(urls)]
+    t0 = time.perf_counter()
+    manager, pumps = Pump.open_all(urls, not args.text, args.move_timeout)
+    connected = time.perf_counter() - t0
+
+    def worker(run, pump):
+        run.connect_s = connected
+        if pump is None:
+            run.error = "el firmware no responde"
+            return
+        t_run = time.perf_counter()
+        try:
+            pump.wait_synced()
+            for repeat in range(args.repeat):
+                for path, steps in scripts:
+                    run_script(pump, steps, run.on_step(path, repeat + 1))
+        except PumpError as e:
+            run.error = str(e)
+        run.run_s = time.perf_counter() - t_run
+
+    threads = [threading.Thread(target=worker, args=(r, p)) for r, p in zip(runs, pumps)]
+    try:
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return [r.as_dict(p) for r, p in zip(runs, pumps)], manager.snapshot()['mux']
+    finally:
+        manager.stop()
+
+
+async def run_async(urls, scripts, args):
+    runs = [Run(f"Bomba {i + 1}", url) for i, url in enumerate(urls)]
+
+    async def one(run):
+        t0 = time.perf_counter()
+        try:
+            pump = await AsyncPump.open(run.url, not args.text, args.move_timeout, run.name)
+        except (PumpError, OSError) as e:
+            run.error = str(e)
+            return run.as_dict()
+        run.connect_s = time.perf_counter() - t0
+        try:
+            for repeat in range(args.repeat):
+                for path, steps in scripts:
+                    await run_script_async(pump, steps, run.on_step(path, repeat + 1))
+        except PumpError as e:
+            run.error = str(e)
+        run.run_s = time.perf_counter() - t0 - run.connect_s
+        result = run.as_dict(pump)
+        pump.close()
+        return result
+
+    return await asyncio.gather(*(one(r) for r in runs)), None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Secuencias de dosificación sin interfaz gráfica")
+    parser.add_argument('scripts', nargs='+', help="ficheros de secuencia")
+    parser.add_argument('--port', action='append', help="URL de pyserial (repetible); por defecto emu://")
+    parser.add_argument('--pumps', type=int, default=1, help="bombas emuladas si no se da --port")
+    parser.add_argument('--scale', type=float, default=50.0, help="aceleración del emulador")
+    parser.add_argument('--repeat', type=int, default=1, help="veces que se repite la lista de secuencias")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="AsyncPump en un bucle asyncio")
+    parser.add_argument('--text', action='store_true', help="sin pasar el enlace a binario")
+    parser.add_argument('--move-timeout', type=float, help="límite de cada movimiento (s)")
+    parser.add_argument('--out', help="informe JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        scripts = [(path, load_script(path)) for path in args.scripts]
+    except (OSError, ScriptError) as e:
+        print(f"ERROR: {e}")
+        return 1
+    urls = args.port or [f'emu://?scale={args.scale}&jeringa=0&id={i}' for i in range(args.pumps)]
+
+    t0 = time.perf_counter()
+    if args.use_async: pumps, io = asyncio.run(run_async(urls, scripts, args))
+    else: pumps, io = run_sync(urls, scripts, args)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': 'async' if args.use_async else 'sync',
+        'import_s': round(IMPORT_S, 4),
+        'wall_s': round(time.perf_counter() - t0, 3),
+        'pumps': pumps,
+        'io': io,
+    }
+    if args.out:
+        with open(args.out, 'w') as f: json.dump(report, f, indent=2, default=str)
+
+    print(f"Importar {IMPORT_S * 1000:.0f} ms, total {report['wall_s']:.2f} s")
+    for res in pumps:
+        status = "OK" if res['ok'] else f"FALLO: {res['error']}"
+        connect = f"{res['connect_s'] * 1000:.0f} ms" if res['connect_s'] is not None else "-"
+        print(f"  {res['name']}: conexión {connect}, {len(res['steps'])} órdenes, {status}")
+    return 0 if all(res['ok'] for res in pumps) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,7 @@
-import time
+import asyncio
+import os
 import threading
+import time
 from kivy.app import App
 from kivy.uix.screenmanager import Screen, ScreenManager
 from kivy.uix.modalview import ModalView
@@ -9,6 +11,26 @@ from kivy.clock import Clock
 from kivy.factory import Factory
 from kivy.utils import platform
 
+from bomba.ajuste import HoldAdjuster
+from bomba.asincrono import LoopWriter, SoonTrigger, open_serial, running_loop
+from bomba.binario import CMD_BINARY, BinaryFramer
+from bomba.conexion import wait_ready
+from bomba.descubrimiento import (AndroidUsbLister, DeviceInfo, DeviceWatcher, load_last,
+                                  pick_last, pyserial_lister, save_last)
+from bomba.buzon import Inbox
+from bomba.escritor import CommandWriter
+from bomba.grabador import SessionRecorder
+from bomba.lector import SerialLineReader
+from bomba.metricas import METRICS, format_snapshot, log, next_level, setup_logging, stop_logging
+from bomba.perfiles import profile_command
+from bomba.planificador import syringe
+from bomba.programa import ProgramError, load as load_program, step_label
+from bomba.protocolo import (CMD_SNAPSHOT, Ack, Param, Parser, Program, Snap, Step, Vol, cmd_set_flow,
+                             cmd_set_time, cmd_set_volume)
+from bomba.sesion import ACK_STATES, PumpManager
+from bomba.usb_android import AndroidUSBSerial
+from bomba.vista import ViewDiff, build_view
+
 # ============================================================================
 # CONFIGURACIÓN DE PLATAFORMA Y DRIVERS
 # ============================================================================
@@ -28,7 +50,7 @@ if platform_android:
         PendingIntent = autoclass('android.app.PendingIntent')
         Intent = autoclass('android.content.Intent')
     except Exception as e:
-        print(f"Error importando JNIUS: {e}")
+        log.error("Error importando JNIUS: %s", e)
 else:
     # Librerías para PC/Mac
     import serial
@@ -37,105 +59,100 @@ else:
 # Variable global para manejar la conexión (sea PC o Android)
 arduino_driver = None
 
-# ============================================================================
-# CLASE: DRIVER USB NATIVO PARA ANDROID (CH340 / CDC)
-# ============================================================================
-class AndroidUSBSerial:
-    """ 
-    Driver nativo para CH340 configurado a 115200 baudios.
-    """
-    def __init__(self, device, manager):
-        self.device = device
-        self.manager = manager
-        self.connection = manager.openDevice(device)
-        self.iface = None
-        self.ep_in = None
-        self.ep_out = None
-        self.is_open = False
-        
-        if not self.connection:
-            raise Exception("No se pudo abrir la conexión USB")
-
-        self.iface = device.getInterface(0)
-        if not self.connection.claimInterface(self.iface, True):
-            raise Exception("No se pudo reclamar la interfaz")
-
-        # Buscar Endpoints
-        for i in range(self.iface.getEndpointCount()):
-            ep = self.iface.getEndpoint(i)
-            if ep.getType() == UsbConstants.USB_ENDPOINT_XFER_BULK:
-                if ep.getDirection() == UsbConstants.USB_DIR_IN:
-                    self.ep_in = ep
-                else:
-                    self.ep_out = ep
-        
-        if not self.ep_in or not self.ep_out:
-            raise Exception("Error: Endpoints no encontrados")
+# Pedir el protocolo binario (COBS + CRC) al conectar por PC
+BINARY_PROTOCOL = True
 
-        # Inicialización forzada para CH340 a 115200
-        # No importa el VID, forzamos la secuencia CH340 ya que sabemos que es ese chip.
-        self.init_ch340_115200()
-        self.is_open = True
+# PC: leer el puerto con asyncio (add_reader) en el bucle de Kivy (App.async_run)
+# en vez de con un hilo lector; sin bucle asyncio en marcha se usa el hilo
+ASYNC_TRANSPORT = True
 
-    def init_ch340_115200(self):
-        """
-        Configuración EXACTA para CH340 a 115200 Baudios, 8 Data Bits, No Parity, 1 Stop Bit.
-        """
-        ctrl = self.connection.controlTransfer
-        # Constantes: 0x40 = Vendor Out
-        
-        # 1. Handshake / Reset
-        ctrl(0x40, 0xA1, 0, 0, None, 0, 1000)
-        ctrl(0x40, 0x9A, 0x1312, 0xCC00, None, 0, 1000) # Configuración base
-        ctrl(0x40, 0x0F, 0x00, 0, None, 0, 1000) 
-        
-        # 2. Configurar Baud Rate: 115200
-        # Valores mágicos: 0xCC00 y 0x0003 son para 115200 en CH340G/C/E
-        ctrl(0x40, 0x9A, 0x1312, 0xCC00, None, 0, 1000)
-        ctrl(0x40, 0x9A, 0x0F2C, 0x0003, None, 0, 1000)
-        
-        # 3. Configurar Line Control (8N1) - ¡ESTO FALTABA ANTES!
-        # Reg 0x2518, Valor 0x00C3 activa LCR (Line Control Register)
-        # Esto asegura que el chip sepa dónde termina un byte.
-        ctrl(0x40, 0x9A, 0x2518, 0x00C3, None, 0, 1000)
-        
-        # 4. Handshake Final
-        ctrl(0x40, 0xA4, 0x00DA, 0, None, 0, 1000)
-        
-        print("Driver CH340 inicializado a 115200 baudios (8N1)")
-
-    def write(self, data):
-        if not self.is_open: return
-        if isinstance(data, str):
-            data = data.encode('utf-8')
-        self.connection.bulkTransfer(self.ep_out, data, len(data), 100)
-
-    def readline(self):
-        if not self.is_open: return b''
-        line_buffer = bytearray()
-        temp_buff = bytearray(64)
-        start_time = time.time()
-        
-        while True:
-            cnt = self.connection.bulkTransfer(self.ep_in, temp_buff, len(temp_buff), 50)
-            if cnt > 0:
-                chunk = temp_buff[:cnt]
-                if b'\n' in chunk:
-                    parts = chunk.split(b'\n', 1)
-                    line_buffer.extend(parts[0])
-                    return line_buffer.decode('utf-8', errors='ignore')
-                else:
-                    line_buffer.extend(chunk)
-            if time.time() - start_time > 0.1: 
-                break
-        return line_buffer.decode('utf-8', errors='ignore') if line_buffer else ""
+# Grabar cada sesión (RX/TX/estados) en <user_data_dir>/sesiones
+RECORD_SESSIONS = True
+
+# Rampa de aceleración que se sube al conectar ('trapezoid' | 'scurve'); None = la de siempre.
+# Necesita NumPy (no está en la build de Android)
+MOTION_PROFILE = None
+
+# Programa de dosificación (ver bomba/programa.py) en <user_data_dir>; se lanza
+# desde "Programa" en la selección de modo
+PROGRAM_FILE = 'programa.txt'
+
+# Bombas del panel "Varias bombas": puertos o URLs de pyserial (p. ej.
+# 'emu://?scale=60&id=1'); None = todas las de la lista de dispositivos
+MULTI_PUMP_PORTS = None
+
+# ============================================================================
+# TABLA DE VISTAS (estado -> propiedades de widgets)
+# ============================================================================
+CONTROL_VIEW_BASE = {
+    'control_panel.disabled': False,
+    'plus_button.disabled': False,
+    'minus_button.disabled': False,
+    'select_button.disabled': False,
+}
+
+CONTROL_VIEWS = {
+    'HOMING': {
+        'title_label.text': 'PUESTA A CERO',
+        'value_display.text': 'Ajustar Posición',
+        'plus_button.text': '+',
+        'minus_button.text': '-',
+        'select_button.text': 'Fijar CERO',
+    },
+    'LOAD_SETUP': {
+        'title_label.text': 'VOLUMEN A CARGAR',
+        'value_display.text': '{volume:.1f} mL',
+        'plus_button.text': '+',
+        'minus_button.text': '-',
+        'select_button.text': 'Cargar',
+    },
+    'MODE_SELECT': {
+        'title_label.text': 'MODO DE OPERACIÓN',
+        'value_display.text': 'Seleccione:',
+        'plus_button.text': 'Caudal',
+        'minus_button.text': 'Tiempo',
+        'select_button.text': 'Programa',
+    },
+    'PARAMETER_SETUP': {
+        'title_label.text': 'AJUSTAR {lbl}',
+        'value_display.text': '{param} {unit}',
+        'plus_button.text': '+',
+        'minus_button.text': '-',
+        'select_button.text': 'INICIAR',
+    },
+    'POST_EXPULSION': {
+        'title_label.text': 'FINALIZADO',
+        'value_display.text': '...',
+    },
+    'PROGRAM': {
+        'title_label.text': 'PROGRAMA',
+        'value_display.text': '{step}',
+        'control_panel.disabled': True,
+    },
+    # Consignas de caudal en streaming (bomba/flujo.py)
+    'STREAM': {
+        'title_label.text': 'CAUDAL VARIABLE',
+        'value_display.text': 'Streaming',
+        'control_panel.disabled': True,
+    },
+}
+
+# Panel de varias bombas: estado del firmware y fase en curso -> texto
+PUMP_STATE_LABELS = {
+    None: 'Conectando...',
+    'HOMING': 'Puesta a cero',
+    'LOAD_SETUP': 'Volumen a cargar',
+    'MODE_SELECT': 'Modo de operación',
+    'CAUDAL_SUBMENU': 'Modo caudal',
+    'CAUDAL_PRESET': 'Caudal (preset)',
+    'CAUDAL_MANUAL': 'Caudal manual',
+    'TIME_SETUP': 'Modo tiempo',
+    'POST_EXPULSION': 'Finalizado',
+    'PROGRAM': 'Programa',
+    'STREAM': 'Caudal variable',
+}
+PUMP_PHASE_LABELS = {'MOVING': 'moviendo', 'EXPULSION': 'expulsando', 'RECARGA': 'recargando', 'PAUSA': 'pausa'}
 
-    def close(self):
-        self.is_open = False
-        try:
-            self.connection.releaseInterface(self.iface)
-            self.connection.close()
-        except: pass
 # ============================================================================
 # INTERFAZ KIVY (SCREENS & APP)
 # ============================================================================
@@ -143,99 +160,235 @@ class AndroidUSBSerial:
 class ReturnToZeroPopup(ModalView):
     pass
 
+class DebugOverlay(BoxLayout):
+    """ Métricas en vivo sobre la interfaz; solo se refresca mientras está visible """
+    refresh_event = None
+
+    def toggle(self):
+        if self.refresh_event: self.hide()
+        else: self.show()
+
+    def show(self):
+        from kivy.core.window import Window
+        self.size = (Window.width * 0.95, Window.height * 0.6)
+        self.pos = (Window.width * 0.025, Window.height * 0.38)
+        Window.add_widget(self)
+        self.refresh()
+        self.refresh_event = Clock.schedule_interval(self.refresh, 0.5)
+
+    def hide(self):
+        from kivy.core.window import Window
+        if self.refresh_event:
+            self.refresh_event.cancel()
+            self.refresh_event = None
+        Window.remove_widget(self)
+
+    def refresh(self, dt=0):
+        self.ids.metrics_text.text = format_snapshot(METRICS.snapshot())
+
+    def cycle_log_level(self):
+        self.ids.level_button.text = f"Log: {next_level()}"
+        self.refresh()
+
+    def dump(self):
+        app = App.get_running_app()
+        folder = app.user_data_dir if app else '.'
+        path = METRICS.dump(os.path.join(folder, time.strftime('metricas_%Y%m%d_%H%M%S.json')))
+        self.ids.dump_button.text = "Guardado"
+        log.warning("Métricas volcadas en %s", path)
+
 class ConnectionScreen(Screen):
+    watcher = None
+    connect_task = None
+    usb_receiver = None
+    connected = None    # DeviceInfo de la bomba conectada
+    connecting = None   # DeviceInfo mientras se abre / se espera a la placa
+    autoconnect = True  # Reconectar solo a la última bomba usada
+
     def on_pre_enter(self, *args):
         if platform_android:
             from android.permissions import request_permissions, Permission
             request_permissions([Permission.READ_EXTERNAL_STORAGE, Permission.WRITE_EXTERNAL_STORAGE])
-        Clock.schedule_once(self.list_devices, 0)
+        self.start_watcher()
+        # La lista en caché se muestra ya (en el primer frame los ids aún no existen)
+        Clock.schedule_once(lambda dt: self.show_devices(self.watcher.devices if self.watcher else []), 0)
 
-    def list_devices(self, *args):
-        self.ids.device_spinner.values = []
-        device_list = []
-        
+    # --- Descubrimiento en segundo plano ---
+    def start_watcher(self):
+        if self.watcher: return
         if platform_android:
-            if UsbManager:
-                try:
-                    activity = PythonActivity.mActivity
-                    manager = activity.getSystemService(Context.USB_SERVICE)
-                    devices = manager.getDeviceList()
-                    if devices:
-                        for d in devices.values():
-                            # Muestra Nombre + VID:PID para depuración
-                            device_list.append(f"{d.getDeviceName()} ({d.getVendorId()}:{d.getProductId()})")
-                    else:
-                        self.ids.connect_status.text = "Sin USB detectado"
-                except Exception as e:
-                    self.ids.connect_status.text = f"Error Listando: {e}"
+            if not UsbManager:
+                self.ids.connect_status.text = "Sin soporte USB"
+                return
+            manager = PythonActivity.mActivity.getSystemService(Context.USB_SERVICE)
+            lister = AndroidUsbLister(manager)
         else:
-            # Lógica para PC/Mac
-            ports = serial.tools.list_ports.comports()
-            for port in ports:
-                if "Bluetooth" not in port.device:
-                    device_list.append(f"{port.device}")
-
-        if device_list:
-            self.ids.device_spinner.values = device_list
-            self.ids.device_spinner.text = device_list[0]
+            lister = pyserial_lister
+        self.watcher = DeviceWatcher(lister, on_change=self.on_devices_changed).start()
+        METRICS.add_source('devices', self.watcher.snapshot)
+        if platform_android:
+            # Conectar/desconectar el USB despierta al watcher sin esperar al sondeo
+            try:
+                from android.broadcast import BroadcastReceiver
+                self.usb_receiver = BroadcastReceiver(
+                    lambda context, intent: self.watcher.notify(),
+                    actions=[UsbManager.ACTION_USB_DEVICE_ATTACHED, UsbManager.ACTION_USB_DEVICE_DETACHED])
+                self.usb_receiver.start()
+            except Exception as e:
+                log.error("Sin aviso de USB (se sigue sondeando): %s", e)
+
+    def stop_watcher(self):
+        if self.usb_receiver:
+            self.usb_receiver.stop()
+            self.usb_receiver = None
+        if self.watcher:
+            self.watcher.stop()
+            METRICS.remove_source('devices')
+
+    def refresh_devices(self):
+        """ Botón "Refrescar Lista" """
+        if self.watcher: self.watcher.notify()
+
+    def on_devices_changed(self, added, removed, devices):
+        """ Hilo del watcher """
+        Clock.schedule_once(lambda dt: self.apply_devices(added, removed, devices))
+
+    def apply_devices(self, added, removed, devices):
+        self.show_devices(devices)
+        if self.connected and self.connected in removed:
+            self.connection_lost()
+        if self.connected or self.connecting or not self.autoconnect: return
+        if self.manager and self.manager.current != 'connect': return
+        last = pick_last(load_last(self.last_device_path()), devices)
+        if last:
+            self.ids.device_spinner.text = last.label
+            self.connect_to_device(last.label)
+
+    def show_devices(self, devices):
+        labels = [d.label for d in devices]
+        self.ids.device_spinner.values = labels
+        if self.connecting: return
+        if labels:
+            if self.ids.device_spinner.text not in labels:
+                self.ids.device_spinner.text = labels[0]
             self.ids.connect_status.text = "Listo para conectar."
+        elif self.watcher and self.watcher.scanned.is_set():
+            self.ids.connect_status.text = "Sin USB detectado" if platform_android else "No se encontraron dispositivos."
         else:
-            self.ids.connect_status.text = "No se encontraron dispositivos."
+            self.ids.connect_status.text = "Buscando dispositivos..."
+
+    def last_device_path(self):
+        app = App.get_running_app()
+        return os.path.join(app.user_data_dir if app else '.', 'ultimo_dispositivo.json')
+
+    def connected_to(self, device):
+        self.connecting = None
+        self.connected = device
+        if device: save_last(self.last_device_path(), device)
+
+    def connection_lost(self):
+        """ La bomba conectada desapareció: volver a esperar a que reaparezca """
+        global arduino_driver
+        log.warning("Dispositivo desconectado: %s", self.connected.label)
+        self.manager.get_screen('control').stop_listening()
+        if arduino_driver:
+            try: arduino_driver.close()
+            except Exception: pass
+        arduino_driver = None
+        self.connected = None
+        self.manager.current = 'connect'
+        self.ids.connect_status.text = "Bomba desconectada. Esperando reconexión..."
 
     def connect_to_device(self, device_text):
         if not device_text or "Selecciona" in device_text: return
+        if self.connecting: return
         
         # Extraer la ruta limpia (quitamos el VID:PID del texto)
         path = device_text.split(' ')[0]
+        device = self.watcher.find(path) if self.watcher else None
         
         if platform_android:
-            self.android_connect(path)
+            self.android_connect(device)
         else:
+            # En PC también vale una ruta que no esté en la lista (emu://, socket://...)
+            self.connecting = device or DeviceInfo(path)
             self.pc_connect(path)
 
-    def android_connect(self, path):
+    def android_connect(self, device):
         try:
             activity = PythonActivity.mActivity
             manager = activity.getSystemService(Context.USB_SERVICE)
             
-            # Buscar el objeto dispositivo por su nombre
-            device = next((d for d in manager.getDeviceList().values() if d.getDeviceName() == path), None)
-            
-            if not device: 
+            # El descriptor en caché ya trae el UsbDevice
+            if not device or not device.handle: 
                 self.ids.connect_status.text = "Dispositivo perdido."
                 return
             
-            if not manager.hasPermission(device):
+            if not manager.hasPermission(device.handle):
                 self.ids.connect_status.text = "Pidiendo permiso..."
                 # Intent para pedir permiso
                 intent = Intent("com.android.example.USB_PERMISSION")
                 # Flag Mutable (33554432) necesario para Android 12+
                 pIntent = PendingIntent.getBroadcast(activity, 0, intent, 33554432)
-                manager.requestPermission(device, pIntent)
+                manager.requestPermission(device.handle, pIntent)
             else:
                 self.start_driver(device, manager)
         except Exception as e:
             self.ids.connect_status.text = f"Error Permisos: {e}"
 
     def pc_connect(self, port):
+        self.ids.connect_status.text = "Esperando a la placa..."
+        if ASYNC_TRANSPORT and running_loop():
+            self.connect_task = asyncio.ensure_future(self.pc_connect_async(port))
+        else:
+            threading.Thread(target=self.pc_connect_worker, args=(port,), daemon=True).start()
+
+    async def pc_connect_async(self, port):
+        """ Abrir y esperar al firmware como corutina, en el bucle de la UI """
         try:
-            global arduino_driver
-            arduino_driver = serial.Serial(port, 9600, timeout=0.1, dsrdtr=True)
-            self.ids.connect_status.text = "Reiniciando Arduino..."
-            Clock.schedule_once(self.finish_pc_connect, 2.0) 
+            driver, transport, protocol, ready = await open_serial(port)
+        except asyncio.CancelledError:
+            self.connecting = None
+            raise
         except Exception as e:
-            self.ids.connect_status.text = f"Error PC: {e}"
+            self.fail_connect(f"Error PC: {e}")
+            return
+        self.finish_pc_connect(driver, ready, (transport, protocol))
 
-    def finish_pc_connect(self, dt):
-        self.ids.connect_status.text = "¡Conectado!"
-        self.manager.get_screen('control').start_listening()
+    def pc_connect_worker(self, port):
+        """ Hilo aparte: abre el puerto y espera al firmware sin congelar la UI """
+        try:
+            driver = serial.serial_for_url(port, 9600, timeout=0.1, dsrdtr=True)
+        except Exception as e:
+            error = f"Error PC: {e}"
+            Clock.schedule_once(lambda dt: self.fail_connect(error))
+            return
+        ready = wait_ready(driver)
+        Clock.schedule_once(lambda dt: self.finish_pc_connect(driver, ready))
+
+    def fail_connect(self, error):
+        self.connecting = None
+        self.ids.connect_status.text = error
+
+    def finish_pc_connect(self, driver, ready, link=None):
+        global arduino_driver
+        log.info("Conexión %s: %s", driver.port, ready)
+        if not ready:
+            driver.close()
+            self.fail_connect("La placa no responde. Reintente.")
+            return
+        arduino_driver = driver
+        self.connected_to(self.connecting)
+        self.ids.connect_status.text = f"¡Conectado! ({ready.elapsed:.1f} s)"
+        self.manager.get_screen('control').start_listening(ready, link)
         self.manager.current = 'control'
 
     def start_driver(self, device, manager):
         try:
             global arduino_driver
             # Instanciamos nuestra clase personalizada
-            arduino_driver = AndroidUSBSerial(device, manager)
+            arduino_driver = AndroidUSBSerial(device.handle, manager, UsbConstants)
+            self.connected_to(device)
             self.ids.connect_status.text = "Conectado (Driver Nativo)"
             self.manager.get_screen('control').start_listening()
             self.manager.current = 'control'
@@ -248,125 +401,321 @@ class ControlScreen(BoxLayout, Screen):
     current_parameter = 100.0
     is_caudal_mode = True
     adjustment_event = None
+    adjuster = None
+    adjust_command = None
     stop_thread = False
+    reader = None
+    writer = None
+    link = None         # (SerialTransport, PumpProtocol) con ASYNC_TRANSPORT
+    recorder = None
+    homing_bound = False
+    jogging = False
+    binary_pending = False
+    program = None
+    program_step = ''
+    syringe_index = 0
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.return_popup = Factory.ReturnToZeroPopup()
-
-    def start_listening(self):
+        self.view = ViewDiff(self)
+        self.parser = Parser()
+        self.handlers = {
+            Vol: self.on_vol,
+            Param: self.on_param,
+            Ack: lambda msg: self.handle_ack(msg.event),
+            Snap: self.on_snapshot,
+            Program: self.on_program,
+            Step: self.on_step,
+        }
+        self.inbox = Inbox()
+        # Trigger: como mucho un vaciado del buzón por frame
+        self.drain_trigger = Clock.create_trigger(self.drain_inbox)
+        self.debug_overlay = None
+        METRICS.add_source('parser', lambda: dict(self.parser.counts, parsed=self.parser.parsed))
+        METRICS.add_source('inbox', self.inbox.stats)
+        METRICS.add_source('view', self.view.stats)
+
+    # --- Overlay de depuración (doble toque en la barra de estado o F12) ---
+    def on_status_touch(self, touch):
+        if touch.is_double_tap and self.ids.status_label.collide_point(*touch.pos):
+            self.toggle_debug_overlay()
+
+    def toggle_debug_overlay(self):
+        if self.debug_overlay is None:
+            self.debug_overlay = DebugOverlay()
+        self.debug_overlay.toggle()
+
+    def start_listening(self, ready=None, link=None):
+        """
+        `ready`: resultado de wait_ready(); lo que llegó tras la respuesta pasa
+        al lector. Con una conexión real se pide primero la instantánea del
+        firmware (SNAP) para retomar donde estaba. `link`: transporte y
+        protocolo asyncio que sustituyen al hilo lector y al escritor.
+        """
         self.stop_thread = False
-        threading.Thread(target=self.read_loop, daemon=True).start()
+        if RECORD_SESSIONS:
+            app = App.get_running_app()
+            folder = os.path.join(app.user_data_dir if app else '.', 'sesiones')
+            self.recorder = SessionRecorder(folder).start()
+            METRICS.add_source('recorder', self.recorder.snapshot)
+        self.link = link
+        if link: self.writer = LoopWriter(self.write_to_driver)
+        else: self.writer = CommandWriter(self.write_to_driver).start()
+        METRICS.add_source('writer', self.writer.snapshot)
+        if platform_android:
+            METRICS.add_source('usb', arduino_driver.snapshot)
+            threading.Thread(target=self.read_loop, daemon=True).start()
+            self.send_motion_profile()
+            self.send(CMD_SNAPSHOT)
+        else:
+            if link:
+                # Mismo hilo que la UI: se aplica en la siguiente vuelta del bucle, sin esperar al frame
+                self.drain_trigger = SoonTrigger(self.drain_inbox)
+                link[1].on_item = self.on_serial_line
+                METRICS.add_source('reader', link[1].snapshot)
+            else:
+                # En PC el hilo queda bloqueado en el SO hasta que llegan bytes
+                self.reader = SerialLineReader(arduino_driver, self.on_serial_line,
+                                               lambda: self.stop_thread)
+                if ready is not None:
+                    # El firmware seguía en binario desde una sesión anterior
+                    if ready.binary: self.reader.binary = BinaryFramer()
+                    self.reader.feed(ready.rest, time.monotonic())
+                self.reader.start()
+                METRICS.add_source('reader', self.reader.snapshot)
+            # Si el firmware no lo soporta ignora 'v' y seguimos en texto
+            self.binary_pending = BINARY_PROTOCOL and not (ready and ready.binary)
+            if ready is not None:
+                # 'v' espera a la respuesta: el firmware descarta lo que llega pegado a un comando
+                self.send_motion_profile()
+                self.send(CMD_SNAPSHOT)
+            elif self.binary_pending:
+                self.binary_pending = False
+                self.send(CMD_BINARY)
+
+    def send_motion_profile(self):
+        """ La línea '#A' no vacía la entrada del firmware: puede ir justo antes de 'x' """
+        line = profile_command(MOTION_PROFILE) if MOTION_PROFILE else None
+        if line: self.send(line)
+
+    def stop_listening(self):
+        self.stop_thread = True
+        if self.writer:
+            self.writer.stop()
+            log.info("Escritor: %s", self.writer.snapshot())
+            self.writer = None
+        if self.reader:
+            self.reader.stop()
+            log.info("Lector PC: %s", self.reader.snapshot())
+            self.reader = None
+        if self.link:
+            # Sin join ni timeouts: al volver ya no llega ningún callback
+            transport, protocol = self.link
+            transport.close()
+            self.drain_trigger.cancel()
+            self.drain_trigger = Clock.create_trigger(self.drain_inbox)
+            log.info("Lector asyncio: %s", protocol.snapshot())
+            self.link = None
+        if self.recorder:
+            self.recorder.stop()
+            log.info("Sesión: %s", self.recorder.snapshot())
+            self.recorder = None
+        for name in ('writer', 'reader', 'usb', 'recorder'): METRICS.remove_source(name)
+
+    def on_serial_line(self, line, t_rx=None):
+        """ Llamado desde el hilo lector (o el bucle asyncio) por cada línea (bytes/str) o mensaje binario ya decodificado """
+        msg = line if isinstance(line, tuple) else self.parser.parse(line)
+        if self.recorder: self.recorder.rx(line, t_rx)
+        if msg is None: return
+        METRICS.inc('rx_messages')
+        log.debug("RX: %s", msg)  # Solo se encola si el nivel es DEBUG
+        if self.inbox.put(msg, msg.header, t_rx):
+            self.drain_trigger()
+
+    def drain_inbox(self, dt=0):
+        """ Una vez por frame: aplica todo lo recibido y refresca la UI una sola vez """
+        items = self.inbox.drain()
+        if not items: return
+        t0 = time.monotonic()
+        for msg, t_rx in items:
+            if t_rx is not None:
+                METRICS.observe('rx_to_ui', t0 - t_rx)
+                if self.reader: self.reader.stats.record_dispatch(t_rx)
+            self.parser.dispatch(msg, self.handlers)
+        self.update_ui(messages=len(items))
+        METRICS.observe('drain_inbox', time.monotonic() - t0)
 
     def read_loop(self):
-        """ Bucle de lectura en segundo plano """
+        """ Bucle de lectura en segundo plano (driver USB de Android) """
         while not self.stop_thread:
-            if not arduino_driver: break
+            driver = arduino_driver
+            if not driver or not driver.is_open: break
             try:
-                line = ""
-                if platform_android:
-                    line = arduino_driver.readline() # Usa nuestro driver
-                else:
-                    if arduino_driver.in_waiting:
-                        line = arduino_driver.readline().decode('utf-8', errors='ignore').strip()
-                
-                if line and len(line) > 1: # Ignorar líneas vacías
-                    print(f"RX: {line}")
-                    Clock.schedule_once(lambda dt, l=line: self.process_message(l))
-                else:
-                    time.sleep(0.01) # Pequeña pausa para no saturar CPU
-            except: 
-                pass
-
-    def process_message(self, line):
-        """ Procesa la respuesta del Arduino """
-        try:
-            line = line.strip()
-            parts = line.split(':')
-            if len(parts) < 2: return
-            
-            msg_type = parts[0]
-            if msg_type == "VOL":
-                self.current_volume = float(parts[1])
-            elif msg_type == "PARAM":
-                self.current_parameter = float(parts[1])
-                self.current_state = 'PARAMETER_SETUP'
-            elif msg_type == "ACK":
-                self.handle_ack(parts[1])
-            elif msg_type == "STATUS":
-                # Si implementas status completo, procésalo aquí
-                pass
-            
-            self.update_ui()
-        except: pass
+                # Todas las líneas de la transferencia
+                lines = driver.readlines(raw=True)
+                t_rx = time.monotonic()
+                for line in lines:
+                    self.on_serial_line(line, t_rx)
+            except OSError as e:
+                # requestWait tras desconectar o cerrar: no queda nada que leer
+                if not self.stop_thread: log.error("Error RX, lector detenido: %s", e)
+                break
+            except Exception as e:
+                log.error("Error RX: %s", e)
+
+    def process_message(self, line, refresh=True):
+        """ Procesa una respuesta del Arduino directamente en el hilo de la UI """
+        t0 = time.monotonic()
+        msg = self.parser.parse(line)
+        if msg is None: return
+        self.parser.dispatch(msg, self.handlers)
+        if refresh: self.update_ui()
+        METRICS.observe('process_message', time.monotonic() - t0)
+
+    def on_vol(self, msg):
+        self.current_volume = msg.value
+
+    def on_param(self, msg):
+        self.current_parameter = msg.value
+        self.current_state = 'PARAMETER_SETUP'
+
+    def on_snapshot(self, msg):
+        """ SNAP: reconstruye la pantalla desde el estado del firmware en un solo viaje """
+        name = msg.state_name
+        log.info("Resincronizado: %s", msg)
+        self.current_volume = msg.volume
+        self.syringe_index = msg.syringe
+        self.is_caudal_mode = name != 'TIME_SETUP'
+        if name in ('CAUDAL_PRESET', 'CAUDAL_MANUAL', 'TIME_SETUP'):
+            self.current_state = 'PARAMETER_SETUP'
+            self.current_parameter = {'CAUDAL_PRESET': msg.preset_flow, 'CAUDAL_MANUAL': msg.flow}.get(name, msg.time)
+        elif name == 'CAUDAL_SUBMENU':
+            self.current_state = 'MODE_SELECT'
+        else:
+            self.current_state = name or 'HOMING'
+        # Terminada y esperando z/k: la misma pregunta que tras EXPULSION_COMPLETE
+        if self.current_state == 'POST_EXPULSION' and not msg.running: self.return_popup.open()
+        elif self.current_state != 'POST_EXPULSION': self.return_popup.dismiss()
+        if self.binary_pending:
+            self.binary_pending = False
+            self.send(CMD_BINARY)
+
+    def on_program(self, msg):
+        """ Respuesta a '#D' """
+        if msg.steps: self.ids.status_label.text = f"Programa: {msg.steps} pasos x {msg.cycles} ciclos"
+        else: self.ids.status_label.text = "Programa rechazado por la bomba"
+
+    def on_step(self, msg):
+        self.current_state = 'PROGRAM'
+        self.program_step = '\n'.join(step_label(msg, self.program))
 
     def handle_ack(self, msg):
-        if msg == "ZERO_SET": self.current_state = 'LOAD_SETUP'
-        elif msg == "LOAD_COMPLETE": self.current_state = 'MODE_SELECT'
-        elif msg == "EXPULSION_COMPLETE": 
-            self.current_state = 'POST_EXPULSION'
-            self.return_popup.open()
-        elif msg in ["RETURNED_TO_ZERO", "STAYING_POSITION"]: self.current_state = 'LOAD_SETUP'
-        elif msg == "RESET": self.current_state = 'HOMING'
-        self.update_ui()
+        # Estado tras el ACK: la tabla de PumpState; el submenú de caudal se muestra como MODE_SELECT
+        state = ACK_STATES.get(msg)
+        if state: self.current_state = 'MODE_SELECT' if state == 'CAUDAL_SUBMENU' else state
+        if msg == "EXPULSION_COMPLETE": self.return_popup.open()
+        # El estado final llega en el SNAP que el firmware manda detrás
+        elif msg == "PROGRAM_COMPLETE": self.ids.status_label.text = "Programa completado"
+        elif msg == "PROGRAM_ABORTED": self.ids.status_label.text = "Programa abortado"
+        elif msg == "STREAM_END": self.ids.status_label.text = "Streaming terminado"
 
     def send(self, cmd):
-        """ Envía datos al Arduino """
-        if arduino_driver:
-            try:
-                data = cmd.encode('utf-8') if isinstance(cmd, str) else cmd
-                arduino_driver.write(data)
-                # En PC se requiere flush, en nuestro driver Android es directo
-                if not platform_android:
-                    arduino_driver.flush()
-            except Exception as e:
-                print(f"Error TX: {e}")
+        """ Encola datos para el Arduino; el hilo escritor hace el write() """
+        if self.writer:
+            METRICS.inc('tx_commands')
+            self.writer.send(cmd)
+
+    def write_to_driver(self, data):
+        """ Ejecutado en el hilo escritor """
+        arduino_driver.write(data)
+        if self.recorder: self.recorder.tx(data)
+        # En PC se requiere flush, en nuestro driver Android es directo; en el
+        # bucle asyncio no (tcdrain bloquearía la UI)
+        if not platform_android and not self.link:
+            arduino_driver.flush()
 
     # --- Lógica de Botones (Igual que antes) ---
-    def start_adjustment(self, amount, dt=0):
-        cmd = '+' if amount > 0 else '-'
-        self.send(cmd)
-        # Feedback visual optimista
+    def start_adjustment(self, amount):
+        """ Ajuste local acelerado; la consigna absoluta se envía al soltar """
         if self.current_state == 'LOAD_SETUP':
-            self.current_volume = max(0, self.current_volume + amount * 0.1)
+            self.adjuster = HoldAdjuster(self.current_volume, amount, 0.1)
+            self.adjust_command = cmd_set_volume
         elif self.current_state == 'PARAMETER_SETUP':
             incr = 50.0 if self.is_caudal_mode else 1.0
-            self.current_parameter = max(0, self.current_parameter + amount * incr)
+            self.adjuster = HoldAdjuster(self.current_parameter, amount, incr)
+            self.adjust_command = cmd_set_flow if self.is_caudal_mode else cmd_set_time
+        else:
+            return
+        self.adjust_tick()
+        self.adjustment_event = Clock.schedule_interval(self.adjust_tick, 0.15)
+
+    def adjust_tick(self, dt=0):
+        value = self.adjuster.tick()
+        if self.adjust_command is cmd_set_volume: self.current_volume = value
+        else: self.current_parameter = value
         self.update_ui()
 
     def stop_adjustment(self, *args):
         if self.adjustment_event:
             Clock.unschedule(self.adjustment_event)
             self.adjustment_event = None
-        if self.current_state == 'HOMING': self.send('p')
+        if self.adjuster:
+            # Un solo viaje: el valor final del ajuste
+            self.send(self.adjust_command(self.adjuster.value))
+            self.adjuster = None
+        if self.jogging:
+            # Solo si hay un jog en curso: una 'p' suelta haría que el firmware
+            # descartara el comando que llega justo detrás (p. ej. 's')
+            self.send('p')
+            self.jogging = False
 
     def handle_plus_press(self):
         self.stop_adjustment()
         # Invertido: '+' en UI envía '-' (Avanzar)
-        if self.current_state == 'HOMING': self.send('-')
+        if self.current_state == 'HOMING':
+            self.send('-')
+            self.jogging = True
         elif self.current_state == 'MODE_SELECT':
             self.is_caudal_mode = True
             self.send('1')
         else:
             self.start_adjustment(1)
-            self.adjustment_event = Clock.schedule_interval(lambda dt: self.start_adjustment(1, dt), 0.15)
 
     def handle_minus_press(self):
         self.stop_adjustment()
         # Invertido: '-' en UI envía '+' (Retroceder)
-        if self.current_state == 'HOMING': self.send('+')
+        if self.current_state == 'HOMING':
+            self.send('+')
+            self.jogging = True
         elif self.current_state == 'MODE_SELECT':
             self.is_caudal_mode = False
             self.send('2')
         else:
             self.start_adjustment(-1)
-            self.adjustment_event = Clock.schedule_interval(lambda dt: self.start_adjustment(-1, dt), 0.15)
 
     def handle_select_press(self):
         self.stop_adjustment()
+        if self.current_state == 'MODE_SELECT':
+            self.start_program()
+            return
         self.send('s')
         if self.current_state == 'PARAMETER_SETUP': self.ids.control_panel.disabled = True
 
+    def start_program(self):
+        """ Compila PROGRAM_FILE para la jeringa puesta, lo sube y lo arranca """
+        app = App.get_running_app()
+        path = os.path.join(app.user_data_dir if app else '.', PROGRAM_FILE)
+        try:
+            s = syringe(self.syringe_index)
+            self.program = load_program(path, s, s.steps(self.current_volume))
+        except (OSError, ProgramError) as e:
+            log.error("Programa %s: %s", path, e)
+            self.ids.status_label.text = f"Programa: {e}"
+            return
+        log.info("Programa: %s, ~%.0f s", self.program, self.program.duration_s())
+        for cmd in self.program.commands(): self.send(cmd)
+
     def confirm_return_to_zero(self, decision):
         self.return_popup.dismiss()
         self.send(decision)
@@ -379,57 +728,160 @@ class ControlScreen(BoxLayout, Screen):
         self.stop_adjustment()
         self.send('p')
 
-    def update_ui(self):
-        self.ids.control_panel.disabled = False
-        self.ids.plus_button.disabled = False
-        self.ids.minus_button.disabled = False
-        self.ids.select_button.disabled = False
-        
-        # Binding dinámico para el botón stop
-        self.ids.plus_button.funbind('on_release', self.stop_adjustment)
-        self.ids.minus_button.funbind('on_release', self.stop_adjustment)
-        if self.current_state == 'HOMING':
-            self.ids.plus_button.fbind('on_release', self.stop_adjustment)
-            self.ids.minus_button.fbind('on_release', self.stop_adjustment)
+    def update_ui(self, messages=1):
+        t0 = time.monotonic()
+        # Binding dinámico para el botón stop: solo cambia al entrar/salir de HOMING
+        is_homing = self.current_state == 'HOMING'
+        if is_homing != self.homing_bound:
+            for btn in (self.ids.plus_button, self.ids.minus_button):
+                if is_homing: btn.fbind('on_release', self.stop_adjustment)
+                else: btn.funbind('on_release', self.stop_adjustment)
+            self.homing_bound = is_homing
+
+        target = build_view(CONTROL_VIEWS, self.current_state, CONTROL_VIEW_BASE,
+                            volume=self.current_volume,
+                            param=int(self.current_parameter),
+                            lbl="CAUDAL" if self.is_caudal_mode else "TIEMPO",
+                            step=self.program_step,
+                            unit="uL/min" if self.is_caudal_mode else "s")
+        self.view.apply(target, messages)
+        if self.recorder: self.recorder.state(self.current_state)
+        METRICS.observe('update_ui', time.monotonic() - t0)
+
+
+class PumpCard(BoxLayout):
+    """ Tarjeta de una bomba en el panel """
+    session = None
+
+    def stop_pump(self):
+        if self.session: self.session.send('p')
+
+    def show(self, state):
+        self.ids.name_label.text = state.name
+        if not state.connected:
+            self.ids.state_label.text = 'Desconectada'
+            return
+        label = PUMP_STATE_LABELS.get(state.state, state.state)
+        phase = PUMP_PHASE_LABELS.get(state.phase)
+        if phase: label = f"{label} · {phase}"
+        self.ids.state_label.text = f"{label}\n{state.volume:.2f} mL · {state.progress}%"
+        self.ids.progress_bar.value = state.progress
+
+
+class DashboardScreen(Screen):
+    """
+    Varias bombas a la vez: un PumpManager (un solo hilo de E/S para todos
+    los puertos) y una tarjeta por bomba. ControlScreen sigue siendo el
+    control completo de una sola.
+    """
+    pumps = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.cards = {}
+        # Como mucho un repintado por frame, avise el hilo de E/S las veces que avise
+        self.refresh_trigger = Clock.create_trigger(self.refresh)
+
+    def on_pre_enter(self, *args):
+        self.pumps = PumpManager(on_change=lambda session: self.refresh_trigger(),
+                                 binary=BINARY_PROTOCOL and not platform_android)
+        METRICS.add_source('pumps', self.pumps.snapshot)
+        self.ids.dashboard_status.text = "Conectando..."
+        if platform_android:
+            self.android_attach()
+        else:
+            threading.Thread(target=self.connect_worker, args=(self.pc_ports(),), daemon=True).start()
+
+    def on_leave(self, *args):
+        self.stop()
+
+    def pc_ports(self):
+        if MULTI_PUMP_PORTS: return list(MULTI_PUMP_PORTS)
+        watcher = self.manager.get_screen('connect').watcher
+        return [d.path for d in watcher.devices] if watcher else []
+
+    def connect_worker(self, ports):
+        """ Hilo aparte: abre todas a la vez y espera a cada firmware """
+        pumps = self.pumps
+        sessions = pumps.connect_all(ports, ports)
+        ok = sum(1 for s in sessions if s)
+        Clock.schedule_once(lambda dt: self.connected(pumps, ok, len(ports)))
+
+    def android_attach(self):
+        """ Las que ya tienen permiso; el driver USB no tiene fileno(): el multiplexor lo sondea """
+        manager = PythonActivity.mActivity.getSystemService(Context.USB_SERVICE)
+        watcher = self.manager.get_screen('connect').watcher
+        ok = 0
+        for device in (watcher.devices if watcher else []):
+            if not device.handle or not manager.hasPermission(device.handle): continue
+            try:
+                self.pumps.attach(device.label, AndroidUSBSerial(device.handle, manager, UsbConstants))
+                ok += 1
+            except Exception as e:
+                log.error("Bomba %s: %s", device.label, e)
+        self.connected(self.pumps, ok, len(watcher.devices) if watcher else 0)
+
+    def connected(self, pumps, ok, total):
+        if pumps is not self.pumps: return  # Se salió del panel mientras conectaba
+        self.ids.dashboard_status.text = f"{ok} de {total} bombas conectadas"
+        self.refresh()
+
+    def refresh(self, dt=0):
+        if not self.pumps: return
+        grid = self.ids.pump_grid
+        sessions = dict(self.pumps.sessions)
+        # Las que ya no están (remove) se quitan del panel
+        for name in [n for n in self.cards if n not in sessions]:
+            grid.remove_widget(self.cards.pop(name))
+        for name, session in sessions.items():
+            card = self.cards.get(name)
+            if card is None:
+                card = self.cards[name] = PumpCard()
+                grid.add_widget(card)
+            # attach() sustituye la sesión de una bomba que se reconecta con el mismo nombre
+            card.session = session
+            card.show(session.state)
+
+    def stop_all(self):
+        if self.pumps: self.pumps.broadcast('p')
+
+    def go_back(self):
+        self.manager.current = 'connect'
+
+    def stop(self):
+        if self.pumps:
+            log.info("Panel: %s", self.pumps.snapshot()['mux'])
+            self.pumps.stop()
+            self.pumps = None
+            METRICS.remove_source('pumps')
+        self.ids.pump_grid.clear_widgets()
+        self.cards = {}
 
-        if self.current_state == 'HOMING':
-            self.ids.title_label.text = 'PUESTA A CERO'
-            self.ids.value_display.text = 'Ajustar Posición'
-            self.ids.plus_button.text = '+'
-            self.ids.minus_button.text = '-'
-            self.ids.select_button.text = 'Fijar CERO'
-        elif self.current_state == 'LOAD_SETUP':
-            self.ids.title_label.text = 'VOLUMEN A CARGAR'
-            self.ids.value_display.text = f"{self.current_volume:.1f} mL"
-            self.ids.plus_button.text = '+'
-            self.ids.minus_button.text = '-'
-            self.ids.select_button.text = 'Cargar'
-        elif self.current_state == 'MODE_SELECT':
-            self.ids.title_label.text = 'MODO DE OPERACIÓN'
-            self.ids.value_display.text = "Seleccione:"
-            self.ids.plus_button.text = 'Caudal'
-            self.ids.minus_button.text = 'Tiempo'
-            self.ids.select_button.text = '...'
-            self.ids.select_button.disabled = True
-        elif self.current_state == 'PARAMETER_SETUP':
-            lbl = "CAUDAL" if self.is_caudal_mode else "TIEMPO"
-            unit = "uL/min" if self.is_caudal_mode else "s"
-            self.ids.title_label.text = f'AJUSTAR {lbl}'
-            self.ids.value_display.text = f"{int(self.current_parameter)} {unit}"
-            self.ids.plus_button.text = '+'
-            self.ids.minus_button.text = '-'
-            self.ids.select_button.text = 'INICIAR'
-        elif self.current_state == 'POST_EXPULSION':
-            self.ids.title_label.text = 'FINALIZADO'
-            self.ids.value_display.text = '...'
 
 class BombaApp(App):
     def build(self):
+        setup_logging()
+        from kivy.core.window import Window
+        Window.bind(on_keyboard=self.on_keyboard)
         return Builder.load_file('interfaz.kv')
+    def on_keyboard(self, window, key, *args):
+        if key == 293:  # F12: overlay de métricas
+            self.root.get_screen('control').toggle_debug_overlay()
+            return True
     def on_stop(self):
+        connect = self.root.get_screen('connect')
+        if connect.connect_task: connect.connect_task.cancel()
+        connect.stop_watcher()
+        self.root.get_screen('control').stop_listening()
+        self.root.get_screen('dashboard').stop()
         if arduino_driver:
             try: arduino_driver.close()
             except: pass
+        stop_logging()
 
 if __name__ == '__main__':
-    BombaApp().run()
\ No newline at end of file
+    if ASYNC_TRANSPORT and not platform_android:
+        # Kivy y el puerto serie en el mismo bucle asyncio
+        asyncio.run(BombaApp().async_run(async_lib='asyncio'))
+    else:
+        BombaApp().run()
\ No newline at end of file
@@ -0,0 +1,200 @@
+# replay_sesion.py
+"""
+Reproduce una sesión grabada (sesion_*.bin) o una traza de texto en la UI,
+sin ventana y sin hardware.
+
+- App: cada línea entra por ControlScreen.process_message().
+- Escritorio: las líneas salen de un puerto simulado; las lee el hilo
+  lector del ControlBombaWidget y la UI las aplica en read_serial_data().
+
+Comprueba la secuencia de `current_state` (la grabada en la sesión o la de
+--expect), señala popups superpuestos o que quedan abiertos, y mide el coste
+de la UI por mensaje.
+
+Uso:  python replay_sesion.py FICHERO [--frontend app|desktop] [--speed 1|10|max]
+                              [--expect HOMING,LOAD_SETUP,...] [--out informe.json]
+Sale con código 1 si la secuencia no coincide.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bomba.reproductor import ReplayClock, ReplayPort, dedupe, load_recording
+
+MAX_IDLE_S = 2.0  # Margen para que la UI termine de leer tras la última línea
+
+
+class Observer:
+    """
+    Cambios de (estado, popups abiertos) tras cada mensaje despachado
+    (aunque la UI aplique varios por frame) y coste de cada llamada a la UI.
+    """
+
+    def __init__(self, target, popups):
+        self.target = target
+        self.open_popups = set()
+        self.sequence = []   # [(mensaje, estado, [popups])]
+        self.costs = []
+        self.messages = 0
+        for name, popup in popups.items():
+            self.track(name, popup)
+        dispatch = target.parser.dispatch
+        def dispatch_hook(msg, handlers):
+            result = dispatch(msg, handlers)
+            self.messages += 1
+            self.note()
+            return result
+        target.parser.dispatch = dispatch_hook
+
+    def track(self, name, popup):
+        """ open()/dismiss() pedidos por la UI; sin reloj la animación de cierre no termina """
+        open_, dismiss = popup.open, popup.dismiss
+        def open_hook(*args, **kwargs):
+            self.open_popups.add(name)
+            open_(*args, **kwargs)
+        def dismiss_hook(*args, **kwargs):
+            self.open_popups.discard(name)
+            dismiss(*args, **kwargs)
+        popup.open, popup.dismiss = open_hook, dismiss_hook
+
+    def note(self):
+        state = (self.target.current_state, sorted(self.open_popups))
+        if not self.sequence or self.sequence[-1][1:] != state:
+            self.sequence.append((self.messages, *state))
+
+    def timed(self, fn, *args):
+        t0 = time.perf_counter()
+        fn(*args)
+        self.costs.append(time.perf_counter() - t0)
+
+    def anomalies(self):
+        found = [f"mensaje {i}: {state} con popups superpuestos {popups}"
+                 for i, state, popups in self.sequence if len(popups) > 1]
+        if self.sequence and self.sequence[-1][2]:
+            found.append(f"al terminar quedan abiertos {self.sequence[-1][2]}")
+        return found
+
+
+def replay_app(recording, speed):
+    import main
+    from kivy.clock import Clock
+    from kivy.lang import Builder
+    main.RECORD_SESSIONS = False
+    screen = Builder.load_file(os.path.join(HERE, 'interfaz.kv')).get_screen('control')
+    obs = Observer(screen, {'return': screen.return_popup})
+    if recording.initial_state:
+        screen.current_state = recording.initial_state
+        screen.update_ui()
+    obs.note()
+    clock = ReplayClock(speed, recording.rx[0][0] if recording.rx else 0.0)
+    for t, line in recording.rx:
+        while not clock.due(t):
+            Clock.tick()
+        obs.timed(screen.process_message, line)
+    Clock.tick()
+    return obs, {}
+
+
+def replay_desktop(recording, speed):
+    from bench_latencia import load_desktop_module
+    from kivy.clock import Clock
+    desktop = load_desktop_module()
+    desktop.RECORD_SESSIONS = False
+    port = desktop.arduino = ReplayPort(recording.rx, speed)
+    widget = desktop.ControlBombaWidget()
+    obs = Observer(widget, {'progress': widget.progress_popup, 'return': widget.return_popup})
+
+    read = widget.read_serial_data
+    max_backlog = 0
+    def read_hook(dt=0):
+        nonlocal max_backlog
+        max_backlog = max(max_backlog, port.backlog() + len(widget.inbox))
+        if len(widget.inbox): obs.timed(read, dt)
+    widget.read_serial_data = read_hook
+    widget.inicializar_ui(0)
+    if recording.initial_state:
+        widget.current_state = recording.initial_state
+        widget.update_ui_for_state()
+    obs.note()
+
+    t_start = time.monotonic()
+    done = lambda: port.finished and not len(widget.inbox)
+    if speed is None:
+        # Velocidad máxima: sin esperar al siguiente frame
+        while not done():
+            read_hook()
+            time.sleep(0)
+    else:
+        deadline = t_start + recording.duration / speed + MAX_IDLE_S
+        while not done() and time.monotonic() < deadline:
+            Clock.tick()
+    widget.stop_reader()
+    if widget.writer: widget.writer.stop()
+    return obs, {
+        'max_backlog_lines': max_backlog,
+        'unread_lines': len(port.rx) - port.pos + len(widget.inbox),
+        'coalesced': widget.inbox.coalesced,
+        'wall_s': time.monotonic() - t_start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproduce una sesión grabada en la UI")
+    parser.add_argument('path')
+    parser.add_argument('--frontend', choices=('app', 'desktop'), default='app')
+    parser.add_argument('--speed', default='max', help="1, 10, ... o max")
+    parser.add_argument('--expect', help="estados esperados separados por comas")
+    parser.add_argument('--out', help="informe JSON")
+    args = parser.parse_args(argv)
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    recording = load_recording(args.path)
+    runner = replay_app if args.frontend == 'app' else replay_desktop
+    obs, extra = runner(recording, speed)
+
+    observed = dedupe(state for _, state, _ in obs.sequence)
+    expected = args.expect.split(',') if args.expect else recording.expected_states()
+    costs = sorted(obs.costs)
+    pick = lambda q: round(costs[min(len(costs) - 1, int(q * len(costs)))] * 1e6, 1) if costs else None
+    report = {
+        'path': args.path,
+        'frontend': args.frontend,
+        'speed': args.speed,
+        'lines': len(recording.rx),
+        'truncated_lines': recording.truncated,
+        'messages_processed': obs.messages,
+        'ui_us_per_message': round(sum(costs) / max(obs.messages, 1) * 1e6, 1),
+        'ui_calls': len(costs),
+        'ui_call_us_p50': pick(0.50),
+        'ui_call_us_p99': pick(0.99),
+        'observed_states': observed,
+        'expected_states': expected or None,
+        'match': observed == expected if expected else None,
+        'anomalies': obs.anomalies(),
+        'sequence': obs.sequence,
+        **extra,
+    }
+    if args.out:
+        with open(args.out, 'w') as f: json.dump(report, f, indent=2)
+
+    print(f"{report['lines']} líneas, {report['ui_us_per_message']} us de UI por mensaje")
+    print("Estados: " + " -> ".join(observed))
+    if extra.get('unread_lines'):
+        print(f"ATRASO: {extra['unread_lines']} líneas sin leer (máx. {extra['max_backlog_lines']} en cola)")
+    for anomaly in report['anomalies']: print(f"AVISO: {anomaly}")
+    if expected and not report['match']:
+        print("ESPERADO: " + " -> ".join(expected))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+# conftest.py
+""" Las pruebas importan `bomba` como lo hacen main.py y los bench: desde App/interfaz_app """
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,93 @@
+# fakes.py
+""" Dobles de prueba de los puntos de extensión de `bomba` (no van en el APK) """
+import threading
+import time
+from collections import deque
+
+from bomba.usb_android import RX_QUEUED
+
+
+class FakeLister:
+    """ Lister en memoria para pruebas: plug()/unplug() simulan conectar y desconectar """
+
+    def __init__(self, devices=(), delay=0.0):
+        self.devices = {d.path: d for d in devices}
+        self.delay = delay  # Simula una enumeración lenta
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        self.calls += 1
+        if self.delay: time.sleep(self.delay)
+        with self._lock:
+            return list(self.devices.values())
+
+    def plug(self, device):
+        with self._lock:
+            self.devices[device.path] = device
+
+    def unplug(self, path):
+        with self._lock:
+            self.devices.pop(path, None)
+
+
+class FakeRequestQueue:
+    """
+    Cola en memoria para pruebas: push() hace de dispositivo y reparte los
+    bytes en paquetes de `packet` entre las peticiones encoladas, en orden.
+    Sin peticiones encoladas los bytes esperan (como en la FIFO del CH340).
+    """
+
+    def __init__(self, count=RX_QUEUED, packet=64):
+        self.count = count
+        self.packet = packet
+        self.data_slots = [b''] * count
+        self.queued = deque()
+        self.completed = deque()
+        self.device = bytearray()
+        self.submits = 0
+        self.waits = 0
+        self.stalls = 0         # push() sin ninguna petición encolada
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self.count
+
+    def submit(self, slot):
+        with self._cond:
+            if self.closed: raise OSError("cola cerrada")
+            self.submits += 1
+            self.queued.append(slot)
+            self._complete()
+
+    def wait(self, timeout_ms):
+        with self._cond:
+            self.waits += 1
+            self._cond.wait_for(lambda: self.completed or self.closed, max(1, timeout_ms) / 1000.0)
+            if self.completed: return self.completed.popleft()
+            if self.closed: raise OSError("requestWait: conexión cerrada")
+            return None
+
+    def data(self, slot, count):
+        return self.data_slots[slot][:count]
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def push(self, data):
+        """ El dispositivo envía `data` """
+        with self._cond:
+            if not self.queued: self.stalls += 1
+            self.device += data
+            self._complete()
+
+    def _complete(self):
+        while self.device and self.queued:
+            slot = self.queued.popleft()
+            chunk, self.device = bytes(self.device[:self.packet]), self.device[self.packet:]
+            self.data_slots[slot] = chunk
+            self.completed.append((slot, len(chunk)))
+            self._cond.notify_all()
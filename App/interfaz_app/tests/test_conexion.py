@@ -0,0 +1,45 @@
+# test_conexion.py
+""" ReadyScanner: qué bytes pasan al lector detrás de la respuesta de "lista" """
+import time
+
+from bomba.binario import BinaryFramer, encode
+from bomba.conexion import ReadyScanner
+from bomba.protocolo import Status, Vol
+
+BANNER = b'BOMBA DE JERINGA PRO (NUEVA CALIBRACION)\r\n'
+
+
+def scanner(probed=False):
+    scan = ReadyScanner(time.monotonic(), 1, [])
+    scan.probed = probed
+    return scan
+
+
+def test_rest_starts_after_the_banner_despite_empty_lines():
+    result = scanner().feed(b'\r\n\r\n' + BANNER + b'VOL:0.00\r\nSTA')
+    assert result.method == 'banner' and result.rest == b'VOL:0.00\r\nSTA'
+
+
+def test_rest_starts_after_the_banner_despite_a_dropped_line():
+    result = scanner().feed(b'x' * 2000 + b'\n' + BANNER + b'ACK:RESET\n')
+    assert result.method == 'banner' and result.rest == b'ACK:RESET\n'
+
+
+def test_status_is_only_accepted_after_the_probe():
+    assert scanner().feed(b'STATUS:1:VOL:0.00\n') is None
+    result = scanner(probed=True).feed(b'>>> hola\nSTATUS:1:VOL:0.00\nVOL:1.00\n')
+    assert result.method == 'status' and result.lines[-1] == b'STATUS:1:VOL:0.00'
+    assert result.rest == b'VOL:1.00\n'
+
+
+def test_frames_behind_the_binary_reply_are_kept():
+    result = scanner(probed=True).feed(encode(Status('1', 0.0)) + encode(Vol(2.5)))
+    assert result.binary and result.rest == encode(Vol(2.5))
+    assert BinaryFramer().feed(result.rest) == [Vol(2.5)]
+
+
+def test_reply_split_across_reads():
+    scan = scanner(probed=True)
+    frame = encode(Status('1', 0.0))
+    assert scan.feed(frame[:3]) is None
+    assert scan.feed(frame[3:] + b'tail').rest == b'tail'
@@ -0,0 +1,55 @@
+# test_control.py
+""" Pump y AsyncPump (bomba/control.py) contra el emulador """
+import asyncio
+
+import pytest
+
+from bomba.control import AsyncPump, Pump, PumpError, condition
+from bomba.protocolo import Ack, Vol
+from bomba.sesion import PumpState
+
+URL = 'emu://?scale=400&jeringa=0'
+
+
+def test_ack_step_also_waits_for_the_trailing_vol():
+    state = PumpState('Bomba')
+    done = condition(('ZERO_SET', Vol), state.received.copy())
+    state.apply(Ack('ZERO_SET'))
+    assert not done(state)
+    state.apply(Vol(0.0))
+    assert done(state)
+
+
+def test_load_after_each_ack_reports_its_own_volume():
+    with Pump.open(URL) as pump:
+        for ml in (0.5, 1.25, 2.0):
+            pump.load(ml)
+            assert pump.state.volume == ml and pump.state.state == 'MODE_SELECT'
+            pump.expel(flow=1000.0)
+            pump.stay()
+        pump.load(0.75)
+        pump.expel(flow=1000.0)
+        pump.return_to_zero()
+        pump.load(1.5)
+        assert pump.state.volume == 1.5
+
+
+def test_load_beyond_the_syringe_is_refused():
+    with Pump.open(URL) as pump:
+        with pytest.raises(PumpError, match="6.00 mL"):
+            pump.load(7.0)
+
+
+def test_async_pump_runs_the_same_steps():
+    async def main():
+        pump = await AsyncPump.open(URL)
+        try:
+            for ml in (0.5, 1.25):
+                await pump.load(ml)
+                assert pump.state.volume == ml
+                await pump.expel(flow=1000.0)
+                await pump.stay()
+            return pump.state.state
+        finally:
+            pump.close()
+    assert asyncio.run(main()) == 'LOAD_SETUP'
@@ -0,0 +1,86 @@
+# test_descubrimiento.py
+""" DeviceWatcher y la reconexión a la última bomba, con FakeLister """
+import threading
+
+from bomba.descubrimiento import DeviceInfo, DeviceWatcher, load_last, pick_last, save_last
+from fakes import FakeLister
+
+CH340 = dict(vid=0x1A86, pid=0x7523)
+PUMP_A = DeviceInfo('/dev/ttyUSB0', serial='A1', description='CH340', **CH340)
+PUMP_B = DeviceInfo('/dev/ttyUSB1', serial='B2', description='CH340', **CH340)
+
+
+def test_first_scan_reports_every_device():
+    changes = []
+    watcher = DeviceWatcher(FakeLister([PUMP_A, PUMP_B]), on_change=lambda *c: changes.append(c))
+    assert watcher.scan() == ([PUMP_A, PUMP_B], [])
+    assert changes == [([PUMP_A, PUMP_B], [], [PUMP_A, PUMP_B])]
+    assert watcher.find('/dev/ttyUSB1') == PUMP_B
+
+
+def test_plug_and_unplug_are_reported_as_deltas():
+    lister = FakeLister([PUMP_A])
+    changes = []
+    watcher = DeviceWatcher(lister, on_change=lambda *c: changes.append(c))
+    watcher.scan()
+    assert watcher.scan() == ([], [])          # Sin cambios no se avisa
+    lister.plug(PUMP_B)
+    assert watcher.scan() == ([PUMP_B], [])
+    lister.unplug(PUMP_A.path)
+    assert watcher.scan() == ([], [PUMP_A])
+    assert len(changes) == 3 and watcher.snapshot()['changes'] == 3
+
+
+def test_handle_does_not_count_as_a_change():
+    lister = FakeLister([PUMP_A])
+    watcher = DeviceWatcher(lister)
+    watcher.scan()
+    lister.plug(PUMP_A._replace(handle=object()))
+    assert watcher.scan() == ([], [])
+
+
+def test_lister_errors_keep_the_last_list():
+    calls = []
+    def lister():
+        calls.append(1)
+        if len(calls) > 1: raise OSError("USB ocupado")
+        return [PUMP_A]
+    watcher = DeviceWatcher(lister)
+    watcher.scan()
+    assert watcher.scan() == ([], [])
+    assert watcher.devices == [PUMP_A] and watcher.errors == 1
+
+
+def test_background_thread_scans_without_blocking_and_notify_rescans():
+    lister = FakeLister([PUMP_A], delay=0.05)
+    seen = threading.Event()
+    watcher = DeviceWatcher(lister, interval=60.0,
+                            on_change=lambda added, removed, devs: PUMP_B in added and seen.set()).start()
+    try:
+        assert watcher.wait_scanned(2.0)
+        lister.plug(PUMP_B)
+        watcher.notify()                       # Sin esperar al intervalo de 60 s
+        assert seen.wait(2.0)
+    finally:
+        watcher.stop()
+    assert watcher.thread is None
+
+
+def test_last_device_roundtrip_and_selection(tmp_path):
+    path = str(tmp_path / 'ultimo_dispositivo.json')
+    assert load_last(path) is None
+    save_last(path, PUMP_B)
+    last = load_last(path)
+    assert pick_last(last, [PUMP_A, PUMP_B]) == PUMP_B
+    # Android renumera la ruta al reconectar: el número de serie manda
+    moved = PUMP_B._replace(path='/dev/bus/usb/001/007')
+    assert pick_last(last, [PUMP_A, moved]) == moved
+
+
+def test_without_serial_an_ambiguous_vid_pid_is_not_picked():
+    last = DeviceInfo('/dev/bus/usb/001/002', **CH340).to_dict()
+    one = DeviceInfo('/dev/bus/usb/001/005', **CH340)
+    two = DeviceInfo('/dev/bus/usb/001/006', **CH340)
+    assert pick_last(last, [one]) == one
+    assert pick_last(last, [one, two]) is None
+    assert pick_last(last, [DeviceInfo('/dev/bus/usb/001/002', **CH340), two]).path == '/dev/bus/usb/001/002'
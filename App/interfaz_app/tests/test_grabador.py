@@ -0,0 +1,43 @@
+# test_grabador.py
+""" SessionRecorder: lo grabado se puede analizar con NumPy y reproducir """
+import pytest
+
+from bomba.firmware import f32
+from bomba.grabador import RX, TEXT_SIZE, SessionRecorder, iter_records, load_session, series
+from bomba.protocolo import Parser, Prog, Snap, Vol, to_line
+from bomba.reproductor import load_recording
+
+np = pytest.importorskip('numpy')
+
+
+def record(folder, items):
+    recorder = SessionRecorder(str(folder), flush_interval=0.01).start()
+    for t, item in enumerate(items): recorder.rx(item, recorder._t0 + t)
+    recorder.stop()
+    return recorder.path
+
+
+def test_text_lines_are_stored_with_their_code_and_values(tmp_path):
+    path = record(tmp_path, ['PROG:50', b'VOL:2.50', b'>>> CICLO 1/3', Prog(75), Vol(1.25)])
+    records = load_session(path)
+    t, value, _ = series(records, 'PROG')
+    assert list(t) == [0.0, 3.0] and list(value) == [50.0, 75.0]
+    t, value, _ = series(records, 'VOL')
+    assert list(t) == [1.0, 4.0] and list(value) == [2.5, 1.25]
+    # La línea original se conserva tal cual
+    texts = [r[6] for r in iter_records(path) if r[1] == RX]
+    assert texts[:3] == [b'PROG:50', b'VOL:2.50', b'>>> CICLO 1/3']
+    assert records['code'][2] == 0 and np.isnan(records['value'][2])
+
+
+def test_snap_fits_and_replays(tmp_path):
+    # Peor caso: floats de 32 bits de una trama binaria y la posición más larga
+    snap = Snap(9, 0x83, 100, -2**31, f32(19.99), f32(99999.99), f32(999.99), 4, f32(1000.0), 10,
+                f32(99999.99), 3)
+    assert len(to_line(snap)) <= TEXT_SIZE
+    recording = load_recording(record(tmp_path, [snap, to_line(snap)]))
+    assert recording.truncated == 0
+    parser = Parser()
+    replayed = [parser.parse(line) for _, line in recording.rx]
+    assert parser.counts['error'] == 0 and parser.counts['SNAP'] == 2
+    assert [to_line(msg) for msg in replayed] == [to_line(snap)] * 2
@@ -0,0 +1,58 @@
+# test_sesion.py
+""" Varias PumpSession en un solo IOMultiplexer (PumpManager) contra bombas emu:// """
+import pytest
+
+from bomba.protocolo import cmd_set_volume
+from bomba.sesion import PumpManager
+
+TIMEOUT = 5.0
+N = 3
+
+
+def emu_urls(n, scale=200.0):
+    # Cada bomba con otra jeringa: el SNAP dice de qué emulador viene cada respuesta
+    return [f'emu://?scale={scale}&jeringa={i}&id={i}' for i in range(n)]
+
+
+@pytest.fixture(params=[True, False], ids=['binario', 'texto'])
+def manager(request):
+    manager = PumpManager(binary=request.param)
+    yield manager
+    manager.stop()
+
+
+@pytest.fixture
+def sessions(manager):
+    sessions = manager.connect_all(emu_urls(N))
+    assert all(sessions)
+    for s in sessions: assert s.wait_synced(TIMEOUT)
+    return sessions
+
+
+def test_every_session_shares_one_io_thread(manager, sessions):
+    assert manager.mux.snapshot()['sessions'] == N
+    assert [s.name for s in sessions] == [f"Bomba {i + 1}" for i in range(N)]
+    assert all((s.decoder.binary is not None) == manager.binary for s in sessions)
+    assert [s.state.state for s in sessions] == ['HOMING'] * N
+
+
+def test_replies_are_routed_to_their_own_session(manager, sessions):
+    assert [s.state.syringe for s in sessions] == list(range(N))
+    manager.broadcast('s')
+    for s in sessions: assert s.wait_for(lambda st: st.state == 'LOAD_SETUP', TIMEOUT)
+    # Un volumen distinto por bomba, todos enviados antes de esperar a ninguno
+    for i, s in enumerate(sessions): s.send(cmd_set_volume(i + 1))
+    for i, s in enumerate(sessions):
+        assert s.wait_for(lambda st, ml=i + 1.0: abs(st.volume - ml) < 1e-3, TIMEOUT)
+    assert [s.state.volume for s in sessions] == [1.0, 2.0, 3.0]
+    assert all(s.state.received['ZERO_SET'] == 1 for s in sessions)
+
+
+def test_removed_session_does_not_stop_the_others(manager, sessions):
+    first, *rest = sessions
+    manager.remove(first.name)
+    assert manager.get(first.name) is None and first.closed
+    for s in rest: s.send('s')
+    for s in rest: assert s.wait_for(lambda st: st.state == 'LOAD_SETUP', TIMEOUT)
+    assert first.state.state == 'HOMING'
+    assert len(manager.snapshot()['pumps']) == N - 1
@@ -0,0 +1,193 @@
+# test_usb_android.py
+""" AndroidUSBSerial contra una UsbDeviceConnection falsa (sin jnius) """
+import threading
+import time
+from collections import deque
+
+import pytest
+
+from bomba.usb_android import AndroidUSBSerial, QueuedReader
+from fakes import FakeRequestQueue
+
+
+class FakeEndpoint:
+    def __init__(self, direction, packet=64):
+        self.direction = direction
+        self.packet = packet
+
+    def getType(self): return 2
+    def getDirection(self): return self.direction
+    def getMaxPacketSize(self): return self.packet
+
+
+class FakeInterface:
+    def __init__(self, packet=64):
+        self.endpoints = [FakeEndpoint(0x80, packet), FakeEndpoint(0x00, packet)]
+
+    def getEndpointCount(self): return len(self.endpoints)
+    def getEndpoint(self, i): return self.endpoints[i]
+
+
+class FakeConnection:
+    """ bulkTransfer IN devuelve los trozos de `chunks` en orden (0 = timeout) """
+
+    def __init__(self, chunks=()):
+        self.chunks = deque(chunks)
+        self.written = []
+        self.control = []
+        self.released = False
+        self.closed = False
+
+    def claimInterface(self, iface, force): return True
+    def releaseInterface(self, iface): self.released = True
+    def close(self): self.closed = True
+
+    def controlTransfer(self, *args):
+        self.control.append(args)
+        return 0
+
+    def bulkTransfer(self, ep, buf, length, timeout):
+        if ep.getDirection() == 0x00:
+            self.written.append(bytes(buf[:length]))
+            return length
+        if not self.chunks: return 0
+        chunk = self.chunks.popleft()
+        buf[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class FakeDevice:
+    def __init__(self, packet=64):
+        self.iface = FakeInterface(packet)
+
+    def getInterface(self, i): return self.iface
+
+
+class FakeManager:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def openDevice(self, device): return self.connection
+
+
+def open_driver(chunks=(), **kwargs):
+    conn = FakeConnection(chunks)
+    return AndroidUSBSerial(FakeDevice(), FakeManager(conn), queued=0, **kwargs), conn
+
+
+def test_readlines_returns_every_line_of_one_transfer():
+    driver, conn = open_driver([b'PROG:10\r\nACK:ZERO_SET\r\nVOL:1.00\r\n'])
+    assert driver.readlines(raw=True) == [b'PROG:10', b'ACK:ZERO_SET', b'VOL:1.00']
+    assert driver.snapshot()['transfers'] == 1
+
+
+def test_partial_tail_is_kept_for_the_next_call():
+    driver, conn = open_driver([b'PROG:5\r\nACK:LOAD', b'_COMPLETE\r\n'])
+    assert driver.readlines() == ['PROG:5']
+    assert driver.snapshot()['pending_bytes'] == len(b'ACK:LOAD')
+    assert driver.readlines() == ['ACK:LOAD_COMPLETE']
+
+
+def test_readline_does_not_lose_the_following_lines():
+    driver, conn = open_driver([b'A:1\nB:2\nC:3\n'])
+    assert [driver.readline(), driver.readline(), driver.readline()] == ['A:1', 'B:2', 'C:3']
+    assert driver.snapshot()['transfers'] == 1
+
+
+def test_readlines_times_out_without_data():
+    driver, conn = open_driver()
+    assert driver.readlines(timeout=0.05) == []
+
+
+def test_init_configures_ch340_and_write_goes_to_ep_out():
+    driver, conn = open_driver()
+    assert conn.control and conn.control[0][:2] == (0x40, 0xA1)
+    driver.write('s')
+    assert conn.written == [b's']
+    driver.close()
+    assert conn.released and conn.closed and driver.readlines() == []
+
+
+# --- Peticiones IN encoladas (QueuedReader + FakeRequestQueue) ---
+def test_completed_request_is_queued_again_before_returning():
+    requests = FakeRequestQueue(count=2, packet=8)
+    reader = QueuedReader(requests, packet=8)
+    assert requests.submits == 2 and len(requests.queued) == 2
+    requests.push(b'A' * 8 * 5)                 # Más paquetes que peticiones: el resto espera
+    assert len(requests.completed) == 2 and len(requests.device) == 8 * 3
+    received = b''
+    while len(received) < 8 * 5:
+        data = reader.poll(100)
+        assert data and len(requests.queued) + len(requests.completed) == 2
+        received += data
+    assert received == b'A' * 8 * 5
+    assert reader.reaped == 5 and requests.submits == 2 + 5 and not requests.device
+
+
+def test_burst_split_in_packets_is_framed_into_lines():
+    requests = FakeRequestQueue(count=4, packet=8)
+    reader = QueuedReader(requests, packet=8)
+    requests.push(b'PROG:10\r\nACK:ZERO_SET\r\nVOL:1.00\r\nST')
+    lines = []
+    while len(lines) < 3: lines += reader.readlines(0.5)
+    assert lines == [b'PROG:10', b'ACK:ZERO_SET', b'VOL:1.00']
+    assert reader.snapshot()['pending_bytes'] == 2
+    requests.push(b'ATUS:1\n')
+    assert reader.readlines(0.5) == [b'STATUS:1']
+
+
+def test_read_collects_full_packets_until_a_short_one():
+    requests = FakeRequestQueue(count=4, packet=8)
+    reader = QueuedReader(requests, packet=8)
+    requests.push(b'0123456789ABCDEFxyz')
+    assert reader.read(100) == b'0123456789ABCDEFxyz'
+    assert reader.read(10) == b'' and reader.timeouts == 1
+
+
+def test_close_unblocks_a_pending_request_wait():
+    requests = FakeRequestQueue(count=2)
+    reader = QueuedReader(requests)
+    errors = []
+    def waiter():
+        try: reader.poll(5000)
+        except OSError as e: errors.append(e)
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while not requests.waits: time.sleep(0.001)
+    t0 = time.monotonic()
+    reader.close()
+    thread.join(2.0)
+    assert not thread.is_alive() and time.monotonic() - t0 < 1.0
+    assert len(errors) == 1
+
+
+def test_driver_reads_lines_through_the_request_queue():
+    requests = FakeRequestQueue(packet=64)
+    conn = FakeConnection()
+    driver = AndroidUSBSerial(FakeDevice(), FakeManager(conn), request_queue=lambda *args: requests)
+    requests.push(b'ACK:LOAD_COMPLETE\r\n' * 8)    # 152 bytes: tres paquetes
+    lines = []
+    while len(lines) < 8: lines += driver.readlines(timeout=0.5)
+    assert lines == ['ACK:LOAD_COMPLETE'] * 8
+    assert driver.snapshot()['reaped'] == 3 and driver.transfers == 0   # Sin bulkTransfer IN
+    driver.close()
+    assert requests.closed and driver.readlines() == []
+
+
+def test_requests_are_queued_only_after_init():
+    conn = FakeConnection()
+    def broken(*args): raise OSError("controlTransfer")
+    conn.controlTransfer = broken
+    created = []
+    with pytest.raises(OSError):
+        AndroidUSBSerial(FakeDevice(), FakeManager(conn), request_queue=lambda *args: created.append(args))
+    assert created == []
+
+
+def test_failed_request_wait_closes_the_driver():
+    requests = FakeRequestQueue()
+    driver = AndroidUSBSerial(FakeDevice(), FakeManager(FakeConnection()), request_queue=lambda *args: requests)
+    requests.close()                             # El dispositivo desaparece
+    with pytest.raises(OSError):
+        driver.readlines(timeout=0.5)
+    assert not driver.is_open and driver.readlines() == [] and driver.read_available() == b''
@@ -22,11 +22,14 @@ const long MAX_DELAY_TECNICO = 16000;
 
 long velocidadDelay = 1000;
 long currentPositionInSteps = 0;
+uint8_t faseActual = 0;      // FASE_*: qué está haciendo el motor (para la instantánea 'x')
+uint8_t progresoActual = 0;  // Último PROG enviado (%)
 
 // -- ESTADOS --
 enum ProgramState {
   STATE_HOMING, STATE_LOAD_SETUP, STATE_MODE_SELECT, STATE_CAUDAL_SUBMENU, 
-  STATE_CAUDAL_PRESET, STATE_CAUDAL_MANUAL, STATE_TIME_SETUP, STATE_POST_EXPULSION
+  STATE_CAUDAL_PRESET, STATE_CAUDAL_MANUAL, STATE_TIME_SETUP, STATE_POST_EXPULSION,
+  STATE_PROGRAM, STATE_STREAM
 };
 ProgramState currentState = STATE_HOMING;
 
@@ -53,7 +56,62 @@ float incrementoTiempo = 1.0;
 // -- JOGGING --
 int jogDirection = 0;
 long jogSpeedDelay = 300;
-long suctionSpeedDelay = 250;
+long jogPasos = 0;             // Pasos desde que empezó el jog (rampa de arranque)
+const long SUCCION_BASE = 250;
+long suctionSpeedDelay = SUCCION_BASE;
+
+// -- PERFIL DE MOVIMIENTO ('#A') --
+// Semiperiodos (us) de la rampa calculada en el host; cada entrada vale para
+// `rampaSeg` pasos. Se usa para acelerar y, al revés, para frenar; sin perfil
+// (rampaLen = 0) el motor arranca y para a la velocidad de crucero.
+const uint8_t RAMPA_MAX = 32;
+uint16_t rampa[RAMPA_MAX];
+uint8_t rampaLen = 0;
+uint8_t rampaSeg = 1;
+
+// -- PROGRAMA DE DOSIFICACIÓN ('#D', se ejecuta con 'g') --
+// Compilado en el host (App/interfaz_app/bomba/programa.py) a pasos y semiperiodos:
+//   'L' a = posición absoluta (pasos) a la velocidad de succión
+//   'E' a = pasos a expulsar, b = semiperiodo (us)
+//   'W' a = pausa (ms)
+//   'Z'     vuelta a cero
+const uint8_t PROGRAMA_MAX = 16;
+struct PasoPrograma { char op; long a; long b; };
+PasoPrograma programa[PROGRAMA_MAX];
+uint8_t programaLen = 0;
+uint8_t programaCiclos = 1;
+uint8_t pasoActual = 0;
+uint8_t cicloActual = 0;
+
+// -- CAUDAL VARIABLE EN STREAMING ('#Q' inicia, '#S' consigna, 'p' termina) --
+// El host manda consignas "#S<t_ms>,<semiperiodo_us>" con t relativo al inicio;
+// aquí se encolan y se aplican al llegar su instante. Sólo se pueden mandar con
+// crédito (CREDIT:n): como mucho STREAM_VENTANA líneas en vuelo (3 x 17 bytes
+// caben en los 64 del buffer de recepción) y nunca más de las que caben en la cola.
+const uint8_t STREAM_COLA = 8;
+const uint8_t STREAM_VENTANA = 3;
+const unsigned long STREAM_WATCHDOG_MS = 1000;  // Sin consignas: se para y sale del modo
+const unsigned long STREAM_STAT_MS = 1000;
+struct Consigna { unsigned long t; long d; };
+Consigna streamCola[STREAM_COLA];
+uint8_t streamInicioCola = 0;
+uint8_t streamCuenta = 0;
+uint8_t streamPendientes = 0;       // Créditos concedidos cuyas líneas aún no han llegado
+unsigned long streamInicio = 0;     // millis() del '#Q'
+unsigned long streamPeriodo = 50;
+unsigned long streamUltimaT = 0;    // Instante de la última consigna aplicada
+long streamDelay = 0;               // Semiperiodo actual (0 = parado)
+unsigned long streamFlanco = 0;     // micros() del último flanco de reloj
+bool streamPulso = false;
+bool streamEnUnderrun = false;
+unsigned long streamLastStat = 0;
+char streamLinea[24];
+uint8_t streamLineaLen = 0;
+// Contadores (STREAMSTAT)
+unsigned long streamAplicadas = 0;
+uint16_t streamUnderruns = 0;       // Cola vacía cuando ya tocaba la siguiente consigna
+uint16_t streamOverruns = 0;        // Consigna descartada con la cola llena (host sin crédito)
+uint16_t streamTarde = 0;           // Aplicada más de un periodo después de su instante
 
 // =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 //      CALIBRACIÓN (MODO RAW - NEUTRALIZADO)
@@ -68,6 +126,34 @@ SyringeProfile jeringas[] = {
 int jeringaActualIndex = 0;
 float pasosPorML;
 
+// =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+//      PROTOCOLO BINARIO (OPCIONAL, SE ACTIVA CON 'v')
+// =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+// Trama: COBS( tipo | payload | crc16 LE ) + 0x00. Campos little-endian.
+// Debe coincidir con App/interfaz_app/bomba/binario.py
+bool modoBinario = false;
+enum TipoTrama {
+  T_VOL = 0x01, T_TIME = 0x02, T_PRESET = 0x03, T_CUSTOM = 0x04, T_LOOP = 0x05,
+  T_INC = 0x06, T_PROG = 0x07, T_ACK = 0x08, T_STATUS = 0x09, T_TELEM = 0x0A,
+  T_INFO = 0x0C, T_SNAP = 0x0D, T_PROFILE = 0x0E, T_PROGRAM = 0x0F, T_STEP = 0x10,
+  T_CREDIT = 0x11, T_STREAMSTAT = 0x12, T_TEXT = 0x7F
+};
+enum CodigoAck {
+  ACK_ZERO_SET = 1, ACK_LOAD_COMPLETE, ACK_CAUDAL_SUBMENU, ACK_EXPULSION_COMPLETE,
+  ACK_RETURNED_TO_ZERO, ACK_STAYING_POSITION, ACK_RESET, ACK_BINARY, ACK_PROGRAM_COMPLETE,
+  ACK_PROGRAM_ABORTED, ACK_STREAM_START, ACK_STREAM_END
+};
+const char* const nombresAck[] = {
+  "", "ZERO_SET", "LOAD_COMPLETE", "CAUDAL_SUBMENU", "EXPULSION_COMPLETE",
+  "RETURNED_TO_ZERO", "STAYING_POSITION", "RESET", "BINARY", "PROGRAM_COMPLETE",
+  "PROGRAM_ABORTED", "STREAM_START", "STREAM_END"
+};
+const uint8_t FASE_PARADO = 0x00;
+const uint8_t FASE_MOVIMIENTO = 0x01;  // Carga o vuelta a cero
+const uint8_t FASE_EXPULSION = 0x81;
+const uint8_t FASE_RECARGA = 0x82;
+const uint8_t FASE_PAUSA = 0x83;       // Pausa de un programa
+
 // =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 //      PROTOTIPOS
 // =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -82,11 +168,39 @@ void handleCaudalPresetCommands(char cmd);
 void handleCaudalManualCommands(char cmd);
 void handleTimeSetupCommands(char cmd);
 void handlePostExpulsionCommands(char cmd);
+void handleSetpointCommand();
 void ejecutarExpulsion(float volumen, float caudal, int repeticiones);
 bool moveAndTrackMotor(long steps, long customDelay);
+long retardoPaso(long i, long stepCount, long crucero);
+void cargarRampa(String datos);
+void sendProfile();
+void cargarPrograma(String datos);
+void ejecutarPrograma();
+bool esperarPrograma(unsigned long ms);
+void sendProgram();
+void sendStep();
+void iniciarStream(unsigned long periodo);
+void leerStream();
+void procesarLineaStream();
+void handleStreaming();
+void terminarStream();
+void concederCreditos(bool forzar);
+void sendCredit(uint8_t n);
+void sendStreamStat();
 void sendData(String type, float value);
 void sendStatus();
+void sendSnapshot();
 void sendConfigSummary(); 
+void sendAck(uint8_t codigo);
+void sendPhase(uint8_t fase);
+void sendPreset(float valor, int repeticiones);
+void sendCustom(float valor, float incremento);
+void sendLoop(int repeticiones);
+void sendInc(float incremento);
+void sendProg(int porcentaje, long customDelay);
+void sendText(String texto);
+void sendFrame(uint8_t tipo, const uint8_t* payload, uint8_t len);
+uint16_t crc16(const uint8_t* data, uint8_t len);
 
 // =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 //      SETUP & LOOP
@@ -96,19 +210,41 @@ void setup() {
   pinMode(ledVerdePin, OUTPUT); pinMode(ledRojoPin, OUTPUT);
   digitalWrite(enPin, LOW);
   Serial.begin(9600);
+  Serial.setTimeout(50); // Para las consignas '#...\n'
   Serial.println("BOMBA DE JERINGA PRO (NUEVA CALIBRACION)");
   calcularPasosPorML();
 }
 
 void loop() {
+  if (currentState == STATE_STREAM) {
+    // Sin readStringUntil ni vaciar la entrada: las consignas no paran el motor
+    leerStream();
+    if (currentState == STATE_STREAM) handleStreaming();
+    return;
+  }
   if (Serial.available() > 0) {
     char command = tolower(Serial.read());
+    if (command == '#') {
+      // Consigna absoluta: se lee la línea completa en vez de descartarla
+      handleSetpointCommand();
+      return;
+    }
     while (Serial.available() > 0) Serial.read();
 
     if (command == 'r') {
-      jogDirection = 0; currentState = STATE_HOMING; Serial.println("ACK:RESET");
+      jogDirection = 0; currentState = STATE_HOMING; sendAck(ACK_RESET);
     } else if (command == 'q') {
       sendStatus();
+    } else if (command == 'x') {
+      sendSnapshot();
+    } else if (command == 'g') {
+      // Sin cero fijado (HOMING) la posición no significa nada
+      if (programaLen > 0 && currentState != STATE_HOMING) ejecutarPrograma();
+      else sendProgram();
+    } else if (command == 'v') {
+      // El ACK sale en texto; desde aquí todo va en tramas binarias
+      sendAck(ACK_BINARY);
+      modoBinario = true;
     } else {
       switch (currentState) {
         case STATE_HOMING:          handleHomingCommands(command); break;
@@ -119,7 +255,11 @@ void loop() {
         case STATE_CAUDAL_MANUAL:   handleCaudalManualCommands(command); break;
         case STATE_TIME_SETUP:      handleTimeSetupCommands(command); break;
         case STATE_POST_EXPULSION:  handlePostExpulsionCommands(command); break;
+        case STATE_PROGRAM:         break;
+        case STATE_STREAM:          break;
       }
+      // Los handlers bloquean hasta terminar el movimiento / la secuencia
+      faseActual = FASE_PARADO;
     }
   }
   if (currentState == STATE_HOMING) handleContinuousJogging();
@@ -144,9 +284,10 @@ void handleHomingCommands(char cmd) {
   else if (cmd == 's') {
     jogDirection = 0; currentPositionInSteps = 0;
     currentState = STATE_LOAD_SETUP;
-    Serial.println("ACK:ZERO_SET");
+    sendAck(ACK_ZERO_SET);
     sendData("VOL", volumenACargar);
   }
+  jogPasos = 0;
 }
 
 void handleLoadSetupCommands(char cmd) {
@@ -159,12 +300,12 @@ void handleLoadSetupCommands(char cmd) {
     long stepsToMove = targetSteps - currentPositionInSteps;
     moveAndTrackMotor(stepsToMove, suctionSpeedDelay);
     currentState = STATE_MODE_SELECT;
-    Serial.println("ACK:LOAD_COMPLETE");
+    sendAck(ACK_LOAD_COMPLETE);
   }
 }
 
 void handleModeSelectCommands(char cmd) {
-  if (cmd == '1') { currentState = STATE_CAUDAL_SUBMENU; Serial.println("ACK:CAUDAL_SUBMENU"); }
+  if (cmd == '1') { currentState = STATE_CAUDAL_SUBMENU; sendAck(ACK_CAUDAL_SUBMENU); }
   else if (cmd == '2') { currentState = STATE_TIME_SETUP; sendData("TIME", tiempoFinal); }
 }
 
@@ -172,11 +313,11 @@ void handleCaudalSubmenuCommands(char cmd) {
   if (cmd == '1') { 
     currentState = STATE_CAUDAL_PRESET;
     if (presetsCaudal[presetIndex] < caudalMinimoPermitido) presetsCaudal[presetIndex] = caudalMinimoPermitido; 
-    Serial.print("PRESET:"); Serial.print(presetsCaudal[presetIndex]); Serial.print(":LOOP:"); Serial.println(bucleRepeticiones);
+    sendPreset(presetsCaudal[presetIndex], bucleRepeticiones);
   } else if (cmd == '2') { 
     currentState = STATE_CAUDAL_MANUAL;
     if (caudalManual < caudalMinimoPermitido) caudalManual = caudalMinimoPermitido;
-    Serial.print("CUSTOM:"); Serial.print(caudalManual); Serial.print(":INC:"); Serial.println(incrementoCaudal);
+    sendCustom(caudalManual, incrementoCaudal);
   }
 }
 
@@ -184,21 +325,21 @@ void handleCaudalPresetCommands(char cmd) {
   if (cmd == '+') {
     presetIndex = (presetIndex + 1) % 5; 
     float valorAUsar = (presetsCaudal[presetIndex] < caudalMinimoPermitido) ? caudalMinimoPermitido : presetsCaudal[presetIndex];
-    Serial.print("PRESET:"); Serial.println(valorAUsar);
+    sendPreset(valorAUsar, 0);
   } else if (cmd == '-') {
     presetIndex = (presetIndex - 1 + 5) % 5;
     float valorAUsar = (presetsCaudal[presetIndex] < caudalMinimoPermitido) ? caudalMinimoPermitido : presetsCaudal[presetIndex];
-    Serial.print("PRESET:"); Serial.println(valorAUsar);
+    sendPreset(valorAUsar, 0);
   } else if (cmd == 'b') {
     bucleIndex = (bucleIndex + 1) % 4;
     bucleRepeticiones = buclesPosibles[bucleIndex];
-    Serial.print("LOOP:"); Serial.println(bucleRepeticiones);
+    sendLoop(bucleRepeticiones);
   } else if (cmd == 's') { 
     float valorFinal = (presetsCaudal[presetIndex] < caudalMinimoPermitido) ? caudalMinimoPermitido : presetsCaudal[presetIndex];
     sendConfigSummary(); 
     currentState = STATE_POST_EXPULSION; 
     ejecutarExpulsion(volumenACargar, valorFinal, bucleRepeticiones);
-    Serial.println("ACK:EXPULSION_COMPLETE");
+    sendAck(ACK_EXPULSION_COMPLETE);
   }
 }
 
@@ -206,21 +347,21 @@ void handleCaudalManualCommands(char cmd) {
   if (cmd == '+') {
     caudalManual += incrementoCaudal;
     if (caudalManual > caudalMaximoPermitido) caudalManual = caudalMaximoPermitido; 
-    Serial.print("CUSTOM:"); Serial.println(caudalManual);
+    sendCustom(caudalManual, -1);
   } else if (cmd == '-') {
     caudalManual -= incrementoCaudal;
     if (caudalManual < caudalMinimoPermitido) caudalManual = caudalMinimoPermitido; 
-    Serial.print("CUSTOM:"); Serial.println(caudalManual);
+    sendCustom(caudalManual, -1);
   } else if (cmd == 'm') {
     if (incrementoCaudal == 10.0) incrementoCaudal = 100.0;
     else if (incrementoCaudal == 100.0) incrementoCaudal = 1000.0;
     else incrementoCaudal = 10.0;
-    Serial.print("INC:"); Serial.println(incrementoCaudal);
+    sendInc(incrementoCaudal);
   } else if (cmd == 's') { 
     sendConfigSummary();
     currentState = STATE_POST_EXPULSION;
     ejecutarExpulsion(volumenACargar, caudalManual, 1);
-    Serial.println("ACK:EXPULSION_COMPLETE");
+    sendAck(ACK_EXPULSION_COMPLETE);
   }
 }
 
@@ -237,11 +378,11 @@ void handleTimeSetupCommands(char cmd) {
     if (velocidadDelay > MAX_DELAY_TECNICO) velocidadDelay = MAX_DELAY_TECNICO;
     if (velocidadDelay < MIN_DELAY) velocidadDelay = MIN_DELAY;
     
-    Serial.println("Expulsando...");
+    sendText("Expulsando...");
     currentState = STATE_POST_EXPULSION;
-    Serial.println("STATUS:EXPULSION"); 
+    sendPhase(FASE_EXPULSION);
     moveAndTrackMotor(-pasosTotales, velocidadDelay);
-    Serial.println("ACK:EXPULSION_COMPLETE");
+    sendAck(ACK_EXPULSION_COMPLETE);
   }
 }
 
@@ -249,15 +390,264 @@ void handlePostExpulsionCommands(char cmd) {
     if (cmd == 'z') {
         moveAndTrackMotor(-currentPositionInSteps, suctionSpeedDelay); 
         currentState = STATE_LOAD_SETUP;
-        Serial.println("ACK:RETURNED_TO_ZERO");
+        sendAck(ACK_RETURNED_TO_ZERO);
         sendData("VOL", volumenACargar);
     } else if (cmd == 'k') {
         currentState = STATE_LOAD_SETUP;
-        Serial.println("ACK:STAYING_POSITION");
+        sendAck(ACK_STAYING_POSITION);
         sendData("VOL", volumenACargar);
     }
 }
 
+// Consignas absolutas: "#V5.80" volumen, "#F740" caudal manual (uL/min),
+// "#T37" tiempo (s), "#P2" índice de preset. Se responde con el eco habitual.
+// "#A<seg>:<succion>:<d0>,<d1>,..." carga el perfil de movimiento (responde PROFILE).
+// "#D<jeringa>:<ciclos>:<paso>/<paso>..." carga un programa (responde PROGRAM).
+// "#Q<periodo_ms>" entra en modo streaming (responde ACK:STREAM_START y CREDIT).
+void handleSetpointCommand() {
+  String linea = Serial.readStringUntil('\n');
+  if (linea.length() < 2) return;
+  char tipo = tolower(linea.charAt(0));
+  if (tipo == 'a') { cargarRampa(linea.substring(1)); return; }
+  if (tipo == 'd') { cargarPrograma(linea.substring(1)); return; }
+  if (tipo == 'q') { iniciarStream(linea.substring(1).toInt()); return; }
+  float valor = linea.substring(1).toFloat();
+
+  if (tipo == 'v') {
+    float maxVol = jeringas[jeringaActualIndex].volumenTotalML;
+    volumenACargar = constrain(valor, 0.0f, maxVol);
+    sendData("VOL", volumenACargar);
+  } else if (tipo == 'f') {
+    caudalManual = constrain(valor, caudalMinimoPermitido, caudalMaximoPermitido);
+    sendCustom(caudalManual, -1);
+  } else if (tipo == 't') {
+    tiempoFinal = max(valor, 0.0f);
+    sendData("TIME", tiempoFinal);
+  } else if (tipo == 'p') {
+    presetIndex = constrain((int)valor, 0, 4);
+    float valorAUsar = (presetsCaudal[presetIndex] < caudalMinimoPermitido) ? caudalMinimoPermitido : presetsCaudal[presetIndex];
+    sendPreset(valorAUsar, 0);
+  }
+}
+
+void cargarRampa(String datos) {
+  int c1 = datos.indexOf(':');
+  int c2 = (c1 < 0) ? -1 : datos.indexOf(':', c1 + 1);
+  long seg = datos.substring(0, c1 < 0 ? datos.length() : c1).toInt();
+  if (seg <= 0 || c2 < 0) {
+    rampaLen = 0;
+    suctionSpeedDelay = SUCCION_BASE;
+  } else {
+    rampaSeg = (uint8_t)min(seg, 255L);
+    suctionSpeedDelay = constrain(datos.substring(c1 + 1, c2).toInt(), MIN_DELAY, MAX_DELAY_TECNICO);
+    rampaLen = 0;
+    int inicio = c2 + 1;
+    while (inicio < (int)datos.length() && rampaLen < RAMPA_MAX) {
+      int coma = datos.indexOf(',', inicio);
+      if (coma < 0) coma = datos.length();
+      if (coma > inicio) rampa[rampaLen++] = constrain(datos.substring(inicio, coma).toInt(), MIN_DELAY, MAX_DELAY_TECNICO);
+      inicio = coma + 1;
+    }
+  }
+  sendProfile();
+}
+
+// Se rechaza entero (PROGRAM:0:0) si es para otra jeringa, tiene instrucciones
+// desconocidas o carga más de lo que cabe.
+void cargarPrograma(String datos) {
+  programaLen = 0;
+  int c1 = datos.indexOf(':');
+  int c2 = (c1 < 0) ? -1 : datos.indexOf(':', c1 + 1);
+  if (c2 < 0 || datos.substring(0, c1).toInt() != jeringaActualIndex) { sendProgram(); return; }
+  programaCiclos = constrain(datos.substring(c1 + 1, c2).toInt(), 1, 255);
+  long maxPasos = long(jeringas[jeringaActualIndex].volumenTotalML * pasosPorML);
+  int inicio = c2 + 1;
+  bool valido = true;
+  while (inicio < (int)datos.length() && valido) {
+    int fin = datos.indexOf('/', inicio);
+    if (fin < 0) fin = datos.length();
+    char op = toupper(datos.charAt(inicio));
+    int coma = datos.indexOf(',', inicio);
+    if (coma < 0 || coma > fin) coma = fin;
+    long a = datos.substring(inicio + 1, coma).toInt();
+    long b = (coma < fin) ? datos.substring(coma + 1, fin).toInt() : 0;
+    if (op == 'E') b = constrain(b, MIN_DELAY, MAX_DELAY_TECNICO);
+    valido = programaLen < PROGRAMA_MAX && a >= 0 &&
+             (op == 'E' || op == 'W' || op == 'Z' || (op == 'L' && a <= maxPasos));
+    if (valido) { programa[programaLen].op = op; programa[programaLen].a = a; programa[programaLen].b = b; programaLen++; }
+    inicio = fin + 1;
+  }
+  if (!valido) programaLen = 0;
+  sendProgram();
+}
+
+// Ejecuta el programa sin esperar al host; 'p' lo aborta y 'x'/'q' se contestan
+// sin pararlo. Al terminar se envía SNAP para que la UI sepa dónde quedó.
+void ejecutarPrograma() {
+  currentState = STATE_PROGRAM;
+  bool abortado = false;
+  for (cicloActual = 1; cicloActual <= programaCiclos && !abortado; cicloActual++) {
+    for (pasoActual = 0; pasoActual < programaLen && !abortado; pasoActual++) {
+      PasoPrograma paso = programa[pasoActual];
+      sendStep();
+      if (paso.op == 'L') {
+        sendPhase(FASE_RECARGA);
+        abortado = moveAndTrackMotor(paso.a - currentPositionInSteps, suctionSpeedDelay);
+      } else if (paso.op == 'E') {
+        sendPhase(FASE_EXPULSION);
+        abortado = moveAndTrackMotor(-min(paso.a, currentPositionInSteps), paso.b);
+      } else if (paso.op == 'W') {
+        faseActual = FASE_PAUSA;
+        abortado = esperarPrograma(paso.a);
+      } else if (paso.op == 'Z') {
+        faseActual = FASE_MOVIMIENTO;
+        abortado = moveAndTrackMotor(-currentPositionInSteps, suctionSpeedDelay);
+      }
+    }
+  }
+  faseActual = FASE_PARADO;
+  currentState = (currentPositionInSteps == 0) ? STATE_LOAD_SETUP : STATE_POST_EXPULSION;
+  if (abortado) sendText("ABORTADO por usuario");
+  sendAck(abortado ? ACK_PROGRAM_ABORTED : ACK_PROGRAM_COMPLETE);
+  sendSnapshot();
+}
+
+bool esperarPrograma(unsigned long ms) {
+  unsigned long inicio = millis();
+  unsigned long lastReportTime = 0;
+  unsigned long reportInterval = modoBinario ? 50 : 200;
+  while (millis() - inicio < ms) {
+    if (Serial.available() > 0) {
+      char cmd = tolower(Serial.read());
+      if (cmd == 'p') return true;
+      else if (cmd == 'x') sendSnapshot();
+      else if (cmd == 'q') sendStatus();
+    }
+    if (millis() - lastReportTime > reportInterval) {
+      lastReportTime = millis();
+      progresoActual = (int)((float)(millis() - inicio) / (float)ms * 100.0);
+      sendProg(progresoActual, 0);
+    }
+  }
+  progresoActual = 100;
+  sendProg(100, 0);
+  return false;
+}
+
+// =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+//      CAUDAL VARIABLE (STREAMING)
+// =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+// Sin cero fijado o con la jeringa vacía se rechaza (responde STATUS).
+void iniciarStream(unsigned long periodo) {
+  if (currentState == STATE_HOMING || currentPositionInSteps <= 0) { sendStatus(); return; }
+  currentState = STATE_STREAM;
+  streamPeriodo = constrain(periodo, 10UL, 1000UL);
+  streamInicioCola = 0; streamCuenta = 0; streamPendientes = 0;
+  streamAplicadas = 0; streamUnderruns = 0; streamOverruns = 0; streamTarde = 0;
+  streamDelay = 0; streamPulso = false; streamEnUnderrun = false; streamLineaLen = 0;
+  streamInicio = millis(); streamUltimaT = 0; streamLastStat = 0;
+  faseActual = FASE_PAUSA;
+  digitalWrite(cwPin, LOW);
+  sendAck(ACK_STREAM_START);
+  concederCreditos(true);
+}
+
+// Lectura sin bloquear: se junta la línea byte a byte entre paso y paso
+void leerStream() {
+  while (Serial.available() > 0) {
+    char c = Serial.read();
+    if (c == '\n') { procesarLineaStream(); streamLineaLen = 0; }
+    else if (streamLineaLen == 0 && c != '#') {
+      // Comandos de un carácter entre consignas
+      c = tolower(c);
+      if (c == 'p') terminarStream();
+      else if (c == 'r') { terminarStream(); jogDirection = 0; currentState = STATE_HOMING; sendAck(ACK_RESET); }
+      else if (c == 'x') sendSnapshot();
+      else if (c == 'q') sendStatus();
+      if (currentState != STATE_STREAM) return;
+    }
+    else if (streamLineaLen < sizeof(streamLinea) - 1) streamLinea[streamLineaLen++] = c;
+  }
+}
+
+// "#S<t_ms>,<semiperiodo_us>"
+void procesarLineaStream() {
+  streamLinea[streamLineaLen] = 0;
+  if (streamLineaLen < 3 || tolower(streamLinea[1]) != 's') return;
+  char* coma = strchr(streamLinea, ',');
+  if (coma == NULL) return;
+  if (streamPendientes > 0) streamPendientes--;
+  if (streamCuenta >= STREAM_COLA) { streamOverruns++; return; }
+  long d = atol(coma + 1);
+  Consigna& c = streamCola[(streamInicioCola + streamCuenta) % STREAM_COLA];
+  c.t = strtoul(streamLinea + 2, NULL, 10);
+  c.d = (d <= 0) ? 0 : constrain(d, MIN_DELAY, MAX_DELAY_TECNICO);
+  streamCuenta++;
+  concederCreditos(false);
+}
+
+// Créditos de dos en dos (o el último si el host se ha quedado sin ninguno)
+void concederCreditos(bool forzar) {
+  uint8_t libres = min(STREAM_COLA - streamCuenta - streamPendientes, STREAM_VENTANA - streamPendientes);
+  if (libres == 0 || (libres < 2 && streamPendientes > 0 && !forzar)) return;
+  streamPendientes += libres;
+  sendCredit(libres);
+}
+
+void handleStreaming() {
+  unsigned long ahora = millis() - streamInicio;
+  // Consignas cuyo instante ya ha llegado (si llegó tarde, en cuanto se lee)
+  while (streamCuenta > 0 && (long)(ahora - streamCola[streamInicioCola].t) >= 0) {
+    Consigna& c = streamCola[streamInicioCola];
+    if (ahora - c.t > streamPeriodo) streamTarde++;
+    streamDelay = c.d;
+    streamUltimaT = c.t;
+    streamInicioCola = (streamInicioCola + 1) % STREAM_COLA;
+    streamCuenta--;
+    streamAplicadas++;
+    streamEnUnderrun = false;
+    faseActual = streamDelay ? FASE_EXPULSION : FASE_PAUSA;
+    concederCreditos(false);
+  }
+  if (streamCuenta == 0) {
+    unsigned long sinConsigna = ahora - streamUltimaT;
+    if (sinConsigna > streamPeriodo && !streamEnUnderrun) { streamUnderruns++; streamEnUnderrun = true; }
+    if (sinConsigna > STREAM_WATCHDOG_MS + streamPeriodo) { sendText("ABORTADO: sin consignas"); terminarStream(); return; }
+  }
+  // Paso sin delayMicroseconds: un flanco cada semiperiodo
+  if (streamDelay > 0 && micros() - streamFlanco >= (unsigned long)streamDelay) {
+    streamFlanco = micros();
+    streamPulso = !streamPulso;
+    digitalWrite(clkPin, streamPulso ? HIGH : LOW);
+    digitalWrite(ledVerdePin, HIGH);
+    if (!streamPulso && --currentPositionInSteps <= 0) { terminarStream(); return; }
+  } else if (streamDelay == 0) {
+    digitalWrite(ledVerdePin, LOW);
+  }
+  if (ahora - streamLastStat >= STREAM_STAT_MS) { streamLastStat = ahora; sendStreamStat(); }
+}
+
+// Fin por 'p', jeringa vacía o watchdog: ACK, contadores finales y SNAP
+void terminarStream() {
+  digitalWrite(clkPin, LOW); digitalWrite(ledVerdePin, LOW);
+  streamDelay = 0;
+  faseActual = FASE_PARADO;
+  currentState = (currentPositionInSteps <= 0) ? STATE_LOAD_SETUP : STATE_POST_EXPULSION;
+  sendAck(ACK_STREAM_END);
+  sendStreamStat();
+  sendSnapshot();
+}
+
+// Semiperiodo del paso i: rampa al arrancar y al frenar, nunca más rápido que el crucero.
+// stepCount < 0 (jog): sólo aceleración.
+long retardoPaso(long i, long stepCount, long crucero) {
+  if (rampaLen == 0) return crucero;
+  long desdeBorde = (stepCount < 0) ? i : min(i, stepCount - 1 - i);
+  long idx = desdeBorde / rampaSeg;
+  if (idx >= rampaLen) return crucero;
+  return max((long)rampa[idx], crucero);
+}
+
 // =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 //      LÓGICA DE EXPULSIÓN
 // =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -277,32 +667,32 @@ void ejecutarExpulsion(float volumenTotal, float caudal, int repeticiones) {
   long stepsToExpel = -pasosFull; 
   long stepsToReload = pasosFull; 
 
-  Serial.println("Iniciando Secuencia...");
+  sendText("Iniciando Secuencia...");
 
   for (int i = 1; i <= repeticiones; i++) {
-    Serial.print(">>> CICLO "); Serial.print(i); Serial.print("/"); Serial.println(repeticiones);
+    sendText(String(">>> CICLO ") + i + "/" + repeticiones);
     
-    Serial.println("STATUS:EXPULSION"); 
+    sendPhase(FASE_EXPULSION);
     if (moveAndTrackMotor(stepsToExpel, delayExpulsion)) {
-      Serial.println("ABORTADO por usuario");
+      sendText("ABORTADO por usuario");
       return;
     }
 
     if (i == repeticiones) {
-      Serial.println("Secuencia Finalizada (Jeringa Vacia).");
+      sendText("Secuencia Finalizada (Jeringa Vacia).");
       break;
     }
 
-    Serial.println("Pausa 1s...");
+    sendText("Pausa 1s...");
     delay(1000); 
 
-    Serial.println("STATUS:RECARGA"); 
+    sendPhase(FASE_RECARGA);
     if (moveAndTrackMotor(stepsToReload, suctionSpeedDelay)) {
-      Serial.println("ABORTADO por usuario");
+      sendText("ABORTADO por usuario");
       return;
     }
 
-    Serial.println("Pausa 1s...");
+    sendText("Pausa 1s...");
     delay(1000);
   }
 }
@@ -316,24 +706,33 @@ bool moveAndTrackMotor(long steps, long customDelay) {
   long stepCount = abs(steps);
   bool stopped = false;
   unsigned long lastReportTime = 0; 
+  // En binario el reporte es más frecuente (trama PROG + TELEM de pocos bytes)
+  unsigned long reportInterval = modoBinario ? 50 : 200;
+  if (faseActual == FASE_PARADO) faseActual = FASE_MOVIMIENTO;
   for (long i = 0; i < stepCount; i++) {
     if (Serial.available() > 0) {
       char cmd = tolower(Serial.read());
       if (cmd == 'p') { stopped = true; break; }
+      // Un host que se reconecta a mitad de la expulsión se resincroniza sin pararla
+      else if (cmd == 'x') sendSnapshot();
+      else if (cmd == 'q') sendStatus();
     }
-    digitalWrite(clkPin, HIGH); delayMicroseconds(customDelay);
-    digitalWrite(clkPin, LOW); delayMicroseconds(customDelay);
+    long d = retardoPaso(i, stepCount, customDelay);
+    digitalWrite(clkPin, HIGH); delayMicroseconds(d);
+    digitalWrite(clkPin, LOW); delayMicroseconds(d);
     if (direction == HIGH) currentPositionInSteps++; else currentPositionInSteps--;
-    if (millis() - lastReportTime > 200) {
+    if (millis() - lastReportTime > reportInterval) {
       lastReportTime = millis();
       int porcentaje = (int)((float)i / (float)stepCount * 100.0);
-      if (currentState == STATE_POST_EXPULSION || currentState == STATE_LOAD_SETUP) {
-         Serial.print("PROG:"); Serial.println(porcentaje);
+      progresoActual = porcentaje;
+      if (currentState == STATE_POST_EXPULSION || currentState == STATE_LOAD_SETUP || currentState == STATE_PROGRAM) {
+         sendProg(porcentaje, d);
       }
     }
   }
-  if (!stopped && (currentState == STATE_POST_EXPULSION || currentState == STATE_LOAD_SETUP)) {
-      Serial.println("PROG:100");
+  if (!stopped && (currentState == STATE_POST_EXPULSION || currentState == STATE_LOAD_SETUP || currentState == STATE_PROGRAM)) {
+      progresoActual = 100;
+      sendProg(100, customDelay);
   }
   digitalWrite(ledVerdePin, LOW); digitalWrite(ledRojoPin, LOW);
   return stopped;
@@ -346,14 +745,143 @@ void handleContinuousJogging() {
   digitalWrite(cwPin, direction); 
   digitalWrite(ledVerdePin, direction == LOW);
   digitalWrite(ledRojoPin, direction == HIGH);
-  digitalWrite(clkPin, HIGH); delayMicroseconds(jogSpeedDelay);
-  digitalWrite(clkPin, LOW); delayMicroseconds(jogSpeedDelay);
+  long d = retardoPaso(jogPasos, -1, jogSpeedDelay);
+  digitalWrite(clkPin, HIGH); delayMicroseconds(d);
+  digitalWrite(clkPin, LOW); delayMicroseconds(d);
   if (direction == HIGH) currentPositionInSteps++; else currentPositionInSteps--;
+  if (jogPasos < (long)rampaLen * rampaSeg) jogPasos++;
 }
 
-void sendData(String type, float value) { Serial.print(type); Serial.print(":"); Serial.println(value, 2); }
-void sendStatus() { Serial.print("STATUS:"); Serial.print(currentState); Serial.print(":VOL:"); Serial.println(volumenACargar, 2); }
+void sendData(String type, float value) {
+  if (modoBinario) { sendFrame(type == "VOL" ? T_VOL : T_TIME, (const uint8_t*)&value, 4); return; }
+  Serial.print(type); Serial.print(":"); Serial.println(value, 2);
+}
+void sendStatus() {
+  if (modoBinario) {
+    uint8_t p[5] = { (uint8_t)currentState }; memcpy(p + 1, &volumenACargar, 4);
+    sendFrame(T_STATUS, p, 5); return;
+  }
+  Serial.print("STATUS:"); Serial.print(currentState); Serial.print(":VOL:"); Serial.println(volumenACargar, 2);
+}
+// SNAP:estado:fase:progreso:pasos:volumen:caudal:incCaudal:preset:caudalPreset:bucles:tiempo:jeringa
+void sendSnapshot() {
+  float caudalPreset = max(presetsCaudal[presetIndex], caudalMinimoPermitido);
+  if (modoBinario) {
+    uint8_t p[30];
+    p[0] = currentState; p[1] = faseActual; p[2] = progresoActual;
+    memcpy(p + 3, &currentPositionInSteps, 4); memcpy(p + 7, &volumenACargar, 4);
+    memcpy(p + 11, &caudalManual, 4); memcpy(p + 15, &incrementoCaudal, 4);
+    p[19] = presetIndex; memcpy(p + 20, &caudalPreset, 4);
+    p[24] = bucleRepeticiones; memcpy(p + 25, &tiempoFinal, 4); p[29] = jeringaActualIndex;
+    sendFrame(T_SNAP, p, 30);
+  } else {
+    Serial.print("SNAP:"); Serial.print(currentState); Serial.print(":"); Serial.print(faseActual);
+    Serial.print(":"); Serial.print(progresoActual); Serial.print(":"); Serial.print(currentPositionInSteps);
+    Serial.print(":"); Serial.print(volumenACargar, 2); Serial.print(":"); Serial.print(caudalManual, 2);
+    Serial.print(":"); Serial.print(incrementoCaudal, 2); Serial.print(":"); Serial.print(presetIndex);
+    Serial.print(":"); Serial.print(caudalPreset, 2); Serial.print(":"); Serial.print(bucleRepeticiones);
+    Serial.print(":"); Serial.print(tiempoFinal, 2); Serial.print(":"); Serial.println(jeringaActualIndex);
+  }
+  // Con un programa en curso, también en qué paso va
+  if (currentState == STATE_PROGRAM) sendStep();
+}
+// PROFILE:entradas:pasosPorEntrada:succion
+void sendProfile() {
+  if (modoBinario) {
+    uint8_t p[4] = { rampaLen, rampaSeg }; uint16_t s = suctionSpeedDelay; memcpy(p + 2, &s, 2);
+    sendFrame(T_PROFILE, p, 4); return;
+  }
+  Serial.print("PROFILE:"); Serial.print(rampaLen); Serial.print(":"); Serial.print(rampaSeg);
+  Serial.print(":"); Serial.println(suctionSpeedDelay);
+}
+// PROGRAM:pasos:ciclos
+void sendProgram() {
+  if (modoBinario) { uint8_t p[2] = { programaLen, (uint8_t)(programaLen ? programaCiclos : 0) }; sendFrame(T_PROGRAM, p, 2); return; }
+  Serial.print("PROGRAM:"); Serial.print(programaLen); Serial.print(":"); Serial.println(programaLen ? programaCiclos : 0);
+}
+// STEP:indice:ciclo:instruccion
+void sendStep() {
+  char op = programa[pasoActual].op;
+  if (modoBinario) { uint8_t p[3] = { pasoActual, cicloActual, (uint8_t)op }; sendFrame(T_STEP, p, 3); return; }
+  Serial.print("STEP:"); Serial.print(pasoActual); Serial.print(":"); Serial.print(cicloActual);
+  Serial.print(":"); Serial.println(op);
+}
+// CREDIT:n
+void sendCredit(uint8_t n) {
+  if (modoBinario) { sendFrame(T_CREDIT, &n, 1); return; }
+  Serial.print("CREDIT:"); Serial.println(n);
+}
+// STREAMSTAT:aplicadas:underruns:overruns:tarde
+void sendStreamStat() {
+  if (modoBinario) {
+    uint8_t p[10]; memcpy(p, &streamAplicadas, 4); memcpy(p + 4, &streamUnderruns, 2);
+    memcpy(p + 6, &streamOverruns, 2); memcpy(p + 8, &streamTarde, 2);
+    sendFrame(T_STREAMSTAT, p, 10); return;
+  }
+  Serial.print("STREAMSTAT:"); Serial.print(streamAplicadas); Serial.print(":"); Serial.print(streamUnderruns);
+  Serial.print(":"); Serial.print(streamOverruns); Serial.print(":"); Serial.println(streamTarde);
+}
+void sendAck(uint8_t codigo) {
+  if (modoBinario) { sendFrame(T_ACK, &codigo, 1); return; }
+  Serial.print("ACK:"); Serial.println(nombresAck[codigo]);
+}
+void sendPhase(uint8_t fase) {
+  faseActual = fase;
+  if (modoBinario) {
+    float nan = NAN; uint8_t p[5] = { fase }; memcpy(p + 1, &nan, 4);
+    sendFrame(T_STATUS, p, 5); return;
+  }
+  Serial.println(fase == FASE_EXPULSION ? "STATUS:EXPULSION" : "STATUS:RECARGA");
+}
+// repeticiones <= 0: sin campo LOOP
+void sendPreset(float valor, int repeticiones) {
+  if (modoBinario) {
+    uint8_t p[5]; memcpy(p, &valor, 4); p[4] = repeticiones > 0 ? repeticiones : 0;
+    sendFrame(T_PRESET, p, 5); return;
+  }
+  Serial.print("PRESET:"); Serial.print(valor);
+  if (repeticiones > 0) { Serial.print(":LOOP:"); Serial.print(repeticiones); }
+  Serial.println();
+}
+// incremento < 0: sin campo INC
+void sendCustom(float valor, float incremento) {
+  if (modoBinario) {
+    float inc = incremento < 0 ? NAN : incremento;
+    uint8_t p[8]; memcpy(p, &valor, 4); memcpy(p + 4, &inc, 4);
+    sendFrame(T_CUSTOM, p, 8); return;
+  }
+  Serial.print("CUSTOM:"); Serial.print(valor);
+  if (incremento >= 0) { Serial.print(":INC:"); Serial.print(incremento); }
+  Serial.println();
+}
+void sendLoop(int repeticiones) {
+  if (modoBinario) { float v = repeticiones; sendFrame(T_LOOP, (const uint8_t*)&v, 4); return; }
+  Serial.print("LOOP:"); Serial.println(repeticiones);
+}
+void sendInc(float incremento) {
+  if (modoBinario) { sendFrame(T_INC, (const uint8_t*)&incremento, 4); return; }
+  Serial.print("INC:"); Serial.println(incremento);
+}
+void sendProg(int porcentaje, long customDelay) {
+  if (modoBinario) {
+    uint8_t pct = porcentaje; sendFrame(T_PROG, &pct, 1);
+    uint8_t p[8]; memcpy(p, &currentPositionInSteps, 4); memcpy(p + 4, &customDelay, 4);
+    sendFrame(T_TELEM, p, 8); return;
+  }
+  Serial.print("PROG:"); Serial.println(porcentaje);
+}
+void sendText(String texto) {
+  if (modoBinario) { sendFrame(T_TEXT, (const uint8_t*)texto.c_str(), min((unsigned int)texto.length(), 48u)); return; }
+  Serial.println(texto);
+}
 void sendConfigSummary() {
+  if (modoBinario) {
+    float param = (currentState == STATE_TIME_SETUP) ? tiempoFinal
+                : (currentState == STATE_CAUDAL_MANUAL) ? caudalManual : presetsCaudal[presetIndex];
+    uint8_t p[10]; memcpy(p, &volumenACargar, 4); memcpy(p + 4, &param, 4);
+    p[8] = (currentState == STATE_TIME_SETUP) ? 1 : 0; p[9] = jeringaActualIndex;
+    sendFrame(T_INFO, p, 10); return;
+  }
   Serial.print("INFO:"); Serial.print(volumenACargar, 2); Serial.print(":");
   if (currentState == STATE_TIME_SETUP) { Serial.print(tiempoFinal, 2); Serial.print(":TIME"); } 
   else {
@@ -378,4 +906,29 @@ void calcularPasosPorML() {
   caudalMaximoPermitido = (pasosPorMinutoMaximos / pasosPorML) * 1000.0;
   
   Serial.print("DEBUG:MinFlow:"); Serial.println(caudalMinimoPermitido);
-}
\ No newline at end of file
+}
+
+uint16_t crc16(const uint8_t* data, uint8_t len) {
+  // CRC-16/CCITT-FALSE: poly 0x1021, init 0xFFFF
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t b = 0; b < 8; b++) crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t tipo, const uint8_t* payload, uint8_t len) {
+  uint8_t raw[60];
+  raw[0] = tipo; memcpy(raw + 1, payload, len);
+  uint16_t crc = crc16(raw, len + 1);
+  raw[len + 1] = crc & 0xFF; raw[len + 2] = crc >> 8;
+  // COBS: ningún byte de la trama es 0x00, así el 0x00 final la delimita
+  uint8_t out[62]; uint8_t codeIdx = 0, code = 1, o = 1;
+  for (uint8_t i = 0; i < len + 3; i++) {
+    if (raw[i] == 0) { out[codeIdx] = code; codeIdx = o++; code = 1; }
+    else { out[o++] = raw[i]; code++; }
+  }
+  out[codeIdx] = code;
+  Serial.write(out, o); Serial.write((uint8_t)0);
+}
@@ -9,7 +9,9 @@ Config.set('graphics', 'width', '400')
 Config.set('graphics', 'height', '750')
 # ---------------------------------------------
 
+import sys
 import serial
+import threading
 import time
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
@@ -18,19 +20,141 @@ from kivy.lang import Builder
 from kivy.clock import Clock
 from kivy.factory import Factory
 
+# Núcleo compartido con la app Android (App/interfaz_app/bomba)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'App', 'interfaz_app'))
+from bomba.ajuste import CyclicSelector, HoldAdjuster
+from bomba.binario import BinaryFramer
+from bomba.buzon import Inbox
+from bomba.conexion import wait_ready
+from bomba.escritor import CommandWriter
+from bomba.grabador import SessionRecorder
+from bomba.lector import SerialLineReader
+from bomba.metricas import METRICS, log, setup_logging, side_log, stop_logging
+from bomba.perfiles import profile_command
+from bomba.planificador import plan_flow, plan_time, syringe
+from bomba.programa import ProgramError, load as load_program, step_label
+from bomba.protocolo import (Ack, Custom, Inc, Info, Loop, Parser, Preset, Prog, Program, Snap, Status, Step, Time,
+                             Vol, CMD_SNAPSHOT, PRESETS_CAUDAL, cmd_select_preset, cmd_set_flow, cmd_set_time,
+                             cmd_set_volume)
+from bomba.sesion import ACK_STATES
+from bomba.vista import ViewDiff, build_view
+
 # --- CONFIGURACIÓN ARDUINO ---
-try:
-    # Ajusta tu puerto aquí (COM3 o /dev/cu.usbserial...)
-    # Asegúrate de que coincida con la velocidad de tu Arduino (9600 según tu último código)
-    arduino = serial.Serial('/dev/cu.usbserial-110', 9600, timeout=1)
-    time.sleep(2) 
-except serial.SerialException as e:
-    print(f"ERROR: {e}")
-    arduino = None
+# Ajusta tu puerto aquí (COM3 o /dev/cu.usbserial...) o con BOMBA_PORT
+# (también acepta URLs de pyserial; emu://?scale=60 abre el emulador).
+# Asegúrate de que coincida con la velocidad de tu Arduino (9600 según tu último código)
+SERIAL_PORT = os.environ.get('BOMBA_PORT', '/dev/cu.usbserial-110')
+SERIAL_BAUD = 9600
+# Se abre al arrancar la UI (inicializar_ui), no al importar
+arduino = None
 # -----------------------------
 
 Builder.load_file('interfaz.kv')
 
+# Grabar cada sesión (RX/TX/estados) junto a este fichero, en sesiones/
+RECORD_SESSIONS = True
+SESSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sesiones')
+# Texto sin cabecera conocida (DEBUG:, >>> CICLO...) va a un registro aparte
+FIRMWARE_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'firmware.log')
+firmware_log = log.getChild('firmware')
+
+# Rampa de aceleración que se sube al conectar ('trapezoid' | 'scurve'); None = la de siempre
+MOTION_PROFILE = None
+
+# Programa de dosificación (ver bomba/programa.py); se lanza con PROGRAMA en la selección de modo
+PROGRAM_FILE = os.environ.get('BOMBA_PROGRAM', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'programa.txt'))
+
+# Mensaje de consigna -> pantalla que lo muestra
+SETPOINT_STATES = {Preset: 'CAUDAL_PRESET', Custom: 'CAUDAL_MANUAL', Time: 'TIME_SETUP'}
+
+# --- TABLA DE VISTAS (estado -> propiedades de widgets) ---
+WIDGET_VIEW_BASE = {
+    'control_panel.disabled': False,
+    'extra_panel.opacity': 0,
+    'extra_panel.disabled': True,
+    'sub_display.text': "",
+    'center_btn.disabled': False,
+}
+
+WIDGET_VIEWS = {
+    'HOMING': {
+        'title_label.text': 'CALIBRACIÓN INICIAL',
+        'value_display.text': 'Ajustar Posición',
+        'left_btn.text': '-',
+        'right_btn.text': '+',
+        'center_btn.text': 'FIJAR CERO',
+    },
+    'LOAD_SETUP': {
+        'title_label.text': 'CARGAR VOLUMEN',
+        'value_display.text': "{volume:.1f} mL",
+        'left_btn.text': '-',
+        'right_btn.text': '+',
+        'center_btn.text': 'CARGAR',
+    },
+    'MODE_SELECT': {
+        'title_label.text': 'SELECCIONAR MODO',
+        'value_display.text': "¿Cómo expulsar?",
+        'right_btn.text': 'CAUDAL',
+        'left_btn.text': 'TIEMPO',
+        'center_btn.text': 'PROGRAMA',
+    },
+    'CAUDAL_SUBMENU': {
+        'title_label.text': 'CONFIGURAR CAUDAL',
+        'value_display.text': "Tipo de Control",
+        'right_btn.text': 'PRESETS',
+        'left_btn.text': 'MANUAL',
+        'center_btn.text': '...',
+        'center_btn.disabled': True,
+    },
+    'CAUDAL_PRESET': {
+        'title_label.text': 'MODO PRESETS',
+        'value_display.text': "{val_1} uL/min",
+        'sub_display.text': "Repeticiones: {val_2}",
+        'left_btn.text': '<',
+        'right_btn.text': '>',
+        'center_btn.text': 'INICIAR',
+        'extra_panel.opacity': 1,
+        'extra_panel.disabled': False,
+        'extra_btn.text': "Cambiar Repeticiones",
+    },
+    'CAUDAL_MANUAL': {
+        'title_label.text': 'MODO MANUAL',
+        'value_display.text': "{val_1} uL/min",
+        'sub_display.text': "Paso: +/- {val_2}",
+        'left_btn.text': '-',
+        'right_btn.text': '+',
+        'center_btn.text': 'INICIAR',
+        'extra_panel.opacity': 1,
+        'extra_panel.disabled': False,
+        'extra_btn.text': "Cambiar Escala (+/- {val_2})",
+    },
+    'TIME_SETUP': {
+        'title_label.text': 'MODO TIEMPO',
+        'value_display.text': "{val_1} seg",
+        'left_btn.text': '-',
+        'right_btn.text': '+',
+        'center_btn.text': 'INICIAR',
+    },
+    'POST_EXPULSION': {
+        'title_label.text': 'CICLO COMPLETADO',
+        'value_display.text': 'Finalizado',
+        'control_panel.disabled': True,
+    },
+    'PROGRAM': {
+        'title_label.text': 'PROGRAMA EN CURSO',
+        'value_display.text': "{step}",
+        'sub_display.text': "{step_detail}",
+        'control_panel.disabled': True,
+    },
+    # Consignas de caudal en streaming (bomba/flujo.py)
+    'STREAM': {
+        'title_label.text': 'CAUDAL VARIABLE',
+        'value_display.text': 'Streaming',
+        'control_panel.disabled': True,
+    },
+}
+
 class ReturnToZeroPopup(ModalView):
     pass
 
@@ -44,167 +168,343 @@ class ControlBombaWidget(BoxLayout):
     current_val_2 = 0.0 # Loop / Inc
     active_total_vol = 0.0 
     adjustment_event = None
+    adjuster = None
+    adjust_command = None
+    writer = None
+    recorder = None
+    reader = None
+    stop_thread = False
+    batching = False
+    pending_refresh = False
+    homing_bound = False
+    jogging = False
+    program = None
+    program_step = ('', '')
+    syringe_index = 0
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.view = ViewDiff(self)
+        self.parser = Parser()
+        self.handlers = {
+            Status: self.on_status,
+            Info: self.parse_info_packet,
+            Prog: lambda msg: self.update_progress_bar(msg.percent),
+            Vol: self.on_volume,
+            Preset: self.on_setpoint, Custom: self.on_setpoint, Time: self.on_setpoint,
+            Loop: self.on_secondary, Inc: self.on_secondary,
+            Ack: lambda msg: self.handle_ack(msg.event),
+            Snap: self.on_snapshot,
+            Program: self.on_program,
+            Step: self.on_step,
+        }
         self.return_popup = Factory.ReturnToZeroPopup()
         self.progress_popup = Factory.ExpulsionProgressPopup()
+        METRICS.add_source('parser', lambda: dict(self.parser.counts, parsed=self.parser.parsed))
+        METRICS.add_source('view', self.view.stats)
+        # ACK/STATUS en orden y sin pérdidas; VOL/PARAM/PROG: gana el último
+        self.inbox = Inbox()
+        METRICS.add_source('inbox', self.inbox.stats)
         Clock.schedule_once(self.inicializar_ui, 0.5)
 
     def inicializar_ui(self, dt):
-        if not arduino:
+        if arduino:
+            # Puerto ya abierto (p. ej. inyectado por bench_latencia / replay_sesion)
+            self.start_io()
+            return
+        self.ids.title_label.text = "CONECTANDO..."
+        self.ids.value_display.text = SERIAL_PORT
+        threading.Thread(target=self.connect_worker, daemon=True).start()
+
+    def connect_worker(self):
+        """ Hilo aparte: abrir el puerto y esperar a que el firmware conteste """
+        if SERIAL_PORT.startswith('emu://'):
+            from bomba import protocol_emu
+            protocol_emu.register()
+        try:
+            port = serial.serial_for_url(SERIAL_PORT, SERIAL_BAUD, timeout=1)
+        except (serial.SerialException, ValueError) as e:
+            log.error("Error abriendo %s: %s", SERIAL_PORT, e)
+            Clock.schedule_once(lambda dt: self.on_connected(None, None))
+            return
+        ready = wait_ready(port)
+        Clock.schedule_once(lambda dt: self.on_connected(port, ready))
+
+    def on_connected(self, port, ready):
+        global arduino
+        if not ready:
+            if port: port.close()
             self.ids.title_label.text = "ERROR DE CONEXIÓN"
             self.ids.value_display.text = "Revise puerto USB"
             self.disabled = True
-        else:
-            Clock.schedule_interval(self.read_serial_data, 0.05)
-            self.update_ui_for_state()
-    
-    def read_serial_data(self, dt):
+            return
+        log.info("Conexión %s: %s", SERIAL_PORT, ready)
+        arduino = port
+        self.start_io(ready)
+
+    def start_io(self, ready=None):
+        """ Escritor, grabador e hilo lector sobre el puerto ya listo """
+        self.writer = CommandWriter(self.write_to_arduino).start()
+        METRICS.add_source('writer', self.writer.snapshot)
+        if RECORD_SESSIONS:
+            self.recorder = SessionRecorder(SESSIONS_DIR).start()
+            METRICS.add_source('recorder', self.recorder.snapshot)
+        # Un vaciado del buzón por frame como mucho
+        self.read_trigger = Clock.create_trigger(self.read_serial_data)
+        self.stop_thread = False
+        self.reader = SerialLineReader(arduino, self.on_serial_line, lambda: self.stop_thread)
+        if ready:
+            if ready.binary: self.reader.binary = BinaryFramer()
+            # Lo que llegó detrás de la línea de "lista" no se pierde
+            self.reader.feed(ready.rest, time.monotonic())
+        self.reader.start()
+        METRICS.add_source('reader', self.reader.snapshot)
+        self.update_ui_for_state()
+        if ready:
+            # '#A' no vacía la entrada del firmware: puede ir justo antes de 'x'
+            profile = profile_command(MOTION_PROFILE) if MOTION_PROFILE else None
+            if profile: self.send_command(profile)
+            # Retomar donde estaba el firmware (p. ej. tras un corte a mitad de expulsión)
+            self.send_command(CMD_SNAPSHOT)
+
+    def stop_reader(self):
+        self.stop_thread = True
+        if self.reader:
+            self.reader.stop()
+            self.reader = None
+
+    def on_serial_line(self, line, t_rx):
+        """ Hilo lector: lee todo lo disponible, clasifica y encola para la UI """
+        if self.recorder: self.recorder.rx(line, t_rx)
+        msg = line if isinstance(line, tuple) else self.parser.parse(line)
+        if msg is None:
+            firmware_log.info("%s", line.decode('utf-8', errors='ignore'))
+            return
+        METRICS.inc('rx_messages')
+        log.debug("RX: %s", msg)
+        if self.inbox.put(msg, msg.header, t_rx):
+            self.read_trigger()
+
+    def read_serial_data(self, dt=0):
+        """ Hilo de la UI: aplica los mensajes ya procesados y refresca una sola vez """
+        items = self.inbox.drain()
+        if not items: return
+        t0 = time.monotonic()
+        self.batching = True
         try:
-            if arduino and arduino.in_waiting > 0:
-                line = arduino.readline().decode('utf-8', errors='ignore').strip()
-                if not line: return
-                
-                parts = line.split(':')
-                header = parts[0]
-
-                # --- 1. LÓGICA DE ESTADO VISUAL ---
-                if header == "STATUS":
-                    estado = parts[1]
-                    if estado == "EXPULSION":
-                        self.progress_popup.ids.lbl_current.color = (0.2, 1, 0.2, 1)
-                        self.progress_popup.title = "PROCESO: EXPULSANDO..."
-                    elif estado == "RECARGA":
-                        self.progress_popup.ids.lbl_current.color = (1, 0.2, 0.2, 1)
-                        self.progress_popup.title = "PROCESO: RECARGANDO..."
-
-                # --- 2. INFORMACIÓN DE INICIO ---
-                elif header == "INFO":
-                    self.parse_info_packet(parts)
-
-                # --- 3. PROGRESO ---
-                elif header == "PROG":
-                    self.update_progress_bar(parts[1])
-
-                # --- 4. DATOS DE ESTADO ---
-                elif header == "VOL":
-                    self.current_val_1 = float(parts[1])
-                    self.update_ui_for_state()
-                
-                elif header == "PRESET" or header == "CUSTOM" or header == "TIME":
-                    self.current_val_1 = float(parts[1])
-                    if header == "PRESET": self.current_state = 'CAUDAL_PRESET'
-                    if header == "CUSTOM": self.current_state = 'CAUDAL_MANUAL'
-                    if header == "TIME": self.current_state = 'TIME_SETUP'
-                    self.update_ui_for_state()
-                
-                elif header == "LOOP" or header == "INC":
-                    self.current_val_2 = float(parts[1])
-                    self.update_ui_for_state()
-
-                # --- 5. CONFIRMACIONES ---
-                elif header == "ACK":
-                    self.handle_ack(parts[1])
-
-        except Exception as e:
-            print(f"Error lectura: {e}")
-
-    def parse_info_packet(self, parts):
+            for msg, t_rx in items:
+                METRICS.observe('rx_to_ui', t0 - t_rx)
+                self.parser.dispatch(msg, self.handlers)
+        finally:
+            self.batching = False
+        if self.pending_refresh:
+            self.pending_refresh = False
+            self.update_ui_for_state(messages=len(items))
+        METRICS.observe('read_serial_data', time.monotonic() - t0)
+
+    # --- 1. LÓGICA DE ESTADO VISUAL ---
+    def on_status(self, msg):
+        if msg.state == "EXPULSION":
+            self.progress_popup.ids.lbl_current.color = (0.2, 1, 0.2, 1)
+            self.progress_popup.title = "PROCESO: EXPULSANDO..."
+        elif msg.state == "RECARGA":
+            self.progress_popup.ids.lbl_current.color = (1, 0.2, 0.2, 1)
+            self.progress_popup.title = "PROCESO: RECARGANDO..."
+
+    # --- 4. DATOS DE ESTADO ---
+    def on_volume(self, msg):
+        self.current_val_1 = msg.value
+        self.update_ui_for_state()
+
+    def on_setpoint(self, msg):
+        """ PRESET / CUSTOM / TIME: valor principal y pantalla correspondiente """
+        self.current_val_1 = msg.value
+        self.current_state = SETPOINT_STATES[type(msg)]
+        # PRESET trae LOOP y CUSTOM trae INC (0.0 también es un valor)
+        extra = getattr(msg, 'loop', None)
+        if extra is None: extra = getattr(msg, 'inc', None)
+        if extra is not None: self.current_val_2 = extra
+        self.update_ui_for_state()
+
+    def on_secondary(self, msg):
+        """ LOOP / INC """
+        self.current_val_2 = msg.value
+        self.update_ui_for_state()
+
+    def parse_info_packet(self, msg):
         """ Procesa INFO:VOL:VALOR:MODO para abrir el popup """
+        vol = msg.volume
+        val_param = msg.param
+        self.active_total_vol = vol 
         try:
-            vol = float(parts[1])
-            val_param = float(parts[2])
-            mode = parts[3]
-            self.active_total_vol = vol 
-            
-            self.progress_popup.ids.lbl_total.text = f"{vol:.2f} mL"
-            
-            time_est = "---"
-            if mode == "TIME":
-                time_est = f"{int(val_param)} seg"
-            elif mode == "FLOW" and val_param > 0:
-                flow_ml = val_param / 1000.0
-                seconds = (vol / flow_ml) * 60
-                time_est = f"~{int(seconds)} seg"
-
-            self.progress_popup.ids.lbl_time.text = time_est
-            self.progress_popup.ids.lbl_current.color = (0.2, 1, 0.2, 1) 
+            self.syringe_index = syringe(msg.syringe).index
+        except KeyError:
+            pass
+        
+        self.progress_popup.ids.lbl_total.text = f"{vol:.2f} mL"
+        
+        # Duración real: semiperiodo entero del firmware, recargas y pausas entre ciclos
+        plan = None
+        try:
+            if msg.mode == "TIME":
+                plan = plan_time(vol, val_param, msg.syringe)
+            elif msg.mode == "FLOW" and val_param > 0:
+                loops = int(self.current_val_2) if self.current_state == 'CAUDAL_PRESET' else 1
+                plan = plan_flow(vol, val_param, msg.syringe, max(loops, 1))
+        except KeyError:
+            log.warning("Jeringa desconocida en INFO: %s", msg.syringe)
+        time_est = f"~{int(round(plan.duration_s))} seg" if plan else "---"
+        if plan: log.info("Plan: %s", plan.as_dict())
+
+        self.progress_popup.ids.lbl_time.text = time_est
+        self.progress_popup.ids.lbl_current.color = (0.2, 1, 0.2, 1) 
+        self.progress_popup.open()
+
+    def update_progress_bar(self, percent):
+        self.progress_popup.ids.progress_bar.value = percent
+        self.progress_popup.ids.lbl_percent.text = f"{percent}%"
+        
+        if self.progress_popup.ids.lbl_current.color[0] < 0.5: 
+            current_ml = self.active_total_vol * (percent / 100.0)
+            self.progress_popup.ids.lbl_current.text = f"{current_ml:.2f} mL"
+        else:
+            self.progress_popup.ids.lbl_current.text = "RECARGANDO..."
+
+    def on_snapshot(self, msg):
+        """ SNAP: reconstruye estado, valores y popups desde el firmware en un solo viaje """
+        log.info("Resincronizado: %s", msg)
+        self.current_state = msg.state_name or 'HOMING'
+        self.active_total_vol = msg.volume
+        self.syringe_index = msg.syringe
+        self.current_val_1, self.current_val_2 = {
+            'CAUDAL_PRESET': (msg.preset_flow, msg.loops),
+            'CAUDAL_MANUAL': (msg.flow, msg.flow_inc),
+            'TIME_SETUP': (msg.time, 0.0),
+        }.get(self.current_state, (msg.volume, 0.0))
+        if msg.phase_name in ('EXPULSION', 'RECARGA'):
+            # Expulsión en curso: se sigue monitorizando con los PROG que lleguen
+            self.return_popup.dismiss()
+            self.progress_popup.ids.lbl_total.text = f"{msg.volume:.2f} mL"
+            self.progress_popup.ids.lbl_time.text = "---"
             self.progress_popup.open()
-            
-        except Exception as e:
-            print(f"Error INFO: {e}")
+            self.on_status(Status(msg.phase_name, None))
+            self.update_progress_bar(msg.progress)
+        elif self.current_state == 'POST_EXPULSION' and not msg.running:
+            self.progress_popup.dismiss()
+            self.return_popup.open()
+        else:
+            self.progress_popup.dismiss()
+            self.return_popup.dismiss()
+        self.update_ui_for_state()
 
-    def update_progress_bar(self, percent_str):
-        try:
-            percent = int(percent_str)
-            self.progress_popup.ids.progress_bar.value = percent
-            self.progress_popup.ids.lbl_percent.text = f"{percent}%"
-            
-            if self.progress_popup.ids.lbl_current.color[0] < 0.5: 
-                current_ml = self.active_total_vol * (percent / 100.0)
-                self.progress_popup.ids.lbl_current.text = f"{current_ml:.2f} mL"
-            else:
-                self.progress_popup.ids.lbl_current.text = "RECARGANDO..."
-        except: pass
+    def on_program(self, msg):
+        """ Respuesta a '#D' """
+        if msg.steps: self.ids.status_label.text = f"Programa cargado: {msg.steps} pasos x {msg.cycles} ciclos"
+        else: self.ids.status_label.text = "Programa rechazado por la bomba"
+
+    def on_step(self, msg):
+        self.current_state = 'PROGRAM'
+        self.program_step = step_label(msg, self.program)
+        self.update_ui_for_state()
 
     def handle_ack(self, msg):
-        if msg == "ZERO_SET": self.current_state = 'LOAD_SETUP'
-        elif msg == "LOAD_COMPLETE": self.current_state = 'MODE_SELECT'
-        elif msg == "CAUDAL_SUBMENU": self.current_state = 'CAUDAL_SUBMENU'
-        
-        elif msg == "EXPULSION_COMPLETE": 
-            self.current_state = 'POST_EXPULSION'
+        # Estado tras el ACK: la misma tabla que PumpState
+        self.current_state = ACK_STATES.get(msg, self.current_state)
+
+        if msg == "EXPULSION_COMPLETE": 
             self.progress_popup.dismiss()
             self.return_popup.open()
-            
-        elif msg in ["RETURNED_TO_ZERO", "STAYING_POSITION"]: self.current_state = 'LOAD_SETUP'
         elif msg == "RESET": 
-            self.current_state = 'HOMING'
             self.progress_popup.dismiss()
             self.return_popup.dismiss()
+        # El estado final llega en el SNAP que el firmware manda detrás
+        elif msg == "PROGRAM_COMPLETE": self.ids.status_label.text = "Programa completado."
+        elif msg == "PROGRAM_ABORTED": self.ids.status_label.text = "Programa abortado."
+        elif msg == "STREAM_END": self.ids.status_label.text = "Streaming terminado."
         
         self.update_ui_for_state()
 
     # --- BOTONES ---
-    def start_adjustment(self, amount, dt=0):
-        cmd = b'+' if amount > 0 else b'-'
-        if self.current_state in ['LOAD_SETUP', 'CAUDAL_PRESET', 'CAUDAL_MANUAL', 'TIME_SETUP']:
-            self.send_command(cmd.decode())
-            # Actualización Local Optimista
-            if self.current_state == 'LOAD_SETUP': self.current_val_1 += (amount * 0.1)
-            elif self.current_state == 'CAUDAL_MANUAL': self.current_val_1 += (amount * self.current_val_2)
-            elif self.current_state == 'TIME_SETUP': self.current_val_1 += amount
-            self.update_ui_for_state()
+    def start_adjustment(self, amount):
+        """ Ajuste local acelerado; la consigna absoluta se envía al soltar """
+        if self.current_state == 'LOAD_SETUP':
+            self.adjuster = HoldAdjuster(self.current_val_1, amount, 0.1)
+            self.adjust_command = cmd_set_volume
+        elif self.current_state == 'CAUDAL_MANUAL':
+            self.adjuster = HoldAdjuster(self.current_val_1, amount, self.current_val_2 or 10.0)
+            self.adjust_command = cmd_set_flow
+        elif self.current_state == 'TIME_SETUP':
+            self.adjuster = HoldAdjuster(self.current_val_1, amount, 1.0)
+            self.adjust_command = cmd_set_time
+        elif self.current_state == 'CAUDAL_PRESET':
+            # El eco puede venir recortado (caudal mínimo de la jeringa): el preset más cercano
+            index = min(range(len(PRESETS_CAUDAL)), key=lambda i: abs(PRESETS_CAUDAL[i] - self.current_val_1))
+            self.adjuster = CyclicSelector(index, amount, len(PRESETS_CAUDAL))
+            self.adjust_command = cmd_select_preset
+        else:
+            return
+        self.adjust_tick()
+        self.adjustment_event = Clock.schedule_interval(self.adjust_tick, 0.15)
+
+    def adjust_tick(self, dt=0):
+        value = self.adjuster.tick()
+        if self.adjust_command is cmd_select_preset: value = PRESETS_CAUDAL[value]
+        self.current_val_1 = value
+        self.update_ui_for_state()
 
     def stop_adjustment(self, *args):
         if self.adjustment_event:
             Clock.unschedule(self.adjustment_event)
             self.adjustment_event = None
-        if self.current_state == 'HOMING': self.send_command('p')
+        if self.adjuster:
+            # Un solo viaje: el valor final del ajuste
+            self.send_command(self.adjust_command(self.adjuster.value))
+            self.adjuster = None
+        if self.jogging:
+            # Solo si hay un jog en curso: una 'p' suelta haría que el firmware
+            # descartara el comando que llega justo detrás (p. ej. 's')
+            self.send_command('p')
+            self.jogging = False
 
     def handle_plus_press(self):
         self.stop_adjustment()
-        if self.current_state == 'HOMING': self.send_command('-')
+        if self.current_state == 'HOMING':
+            self.send_command('-')
+            self.jogging = True
         elif self.current_state == 'MODE_SELECT': self.send_command('1')
         elif self.current_state == 'CAUDAL_SUBMENU': self.send_command('1')
         else:
             self.start_adjustment(1)
-            self.adjustment_event = Clock.schedule_interval(lambda dt: self.start_adjustment(1, dt), 0.15)
 
     def handle_minus_press(self):
         self.stop_adjustment()
-        if self.current_state == 'HOMING': self.send_command('+')
+        if self.current_state == 'HOMING':
+            self.send_command('+')
+            self.jogging = True
         elif self.current_state == 'MODE_SELECT': self.send_command('2')
         elif self.current_state == 'CAUDAL_SUBMENU': self.send_command('2')
         else:
             self.start_adjustment(-1)
-            self.adjustment_event = Clock.schedule_interval(lambda dt: self.start_adjustment(-1, dt), 0.15)
     
     def handle_select_press(self):
         self.stop_adjustment()
+        if self.current_state == 'MODE_SELECT':
+            self.start_program()
+            return
         self.send_command('s')
 
+    def start_program(self):
+        """ Compila PROGRAM_FILE para la jeringa puesta, lo sube y lo arranca """
+        try:
+            s = syringe(self.syringe_index)
+            self.program = load_program(PROGRAM_FILE, s, s.steps(self.current_val_1))
+        except (OSError, ProgramError) as e:
+            log.error("Programa %s: %s", PROGRAM_FILE, e)
+            self.ids.status_label.text = f"Programa: {e}"
+            return
+        log.info("Programa: %s, ~%.0f s", self.program, self.program.duration_s())
+        for cmd in self.program.commands(): self.send_command(cmd)
+
     def handle_extra_press(self):
         if self.current_state == 'CAUDAL_PRESET': self.send_command('b')
         elif self.current_state == 'CAUDAL_MANUAL': self.send_command('m')
@@ -224,93 +524,60 @@ class ControlBombaWidget(BoxLayout):
         self.ids.status_label.text = "PARADA DE EMERGENCIA"
 
     def send_command(self, cmd):
+        """ Encola el comando; el hilo escritor hace el write() """
+        if self.writer:
+            METRICS.inc('tx_commands')
+            self.writer.send(cmd)
+
+    def write_to_arduino(self, data):
+        """ Ejecutado en el hilo escritor """
         if arduino and arduino.is_open:
-            arduino.write(cmd.encode())
+            arduino.write(data)
+            if self.recorder: self.recorder.tx(data)
 
     # --- UI UPDATE ---
-    def update_ui_for_state(self):
-        self.ids.control_panel.disabled = False
-        self.ids.extra_panel.opacity = 0
-        self.ids.extra_panel.disabled = True
-        self.ids.sub_display.text = ""
-        self.ids.center_btn.disabled = False
-
+    def update_ui_for_state(self, messages=1):
+        if self.batching:
+            # Dentro de read_serial_data: se refresca una vez al final
+            self.pending_refresh = True
+            return
+        t0 = time.monotonic()
+        # El bind del stop en +/- solo cambia al entrar/salir de HOMING
         is_homing = (self.current_state == 'HOMING')
-        self.ids.right_btn.funbind('on_release', self.stop_adjustment)
-        self.ids.left_btn.funbind('on_release', self.stop_adjustment)
-        if is_homing:
-            self.ids.right_btn.fbind('on_release', self.stop_adjustment)
-            self.ids.left_btn.fbind('on_release', self.stop_adjustment)
-
-        if self.current_state == 'HOMING':
-            self.ids.title_label.text = 'CALIBRACIÓN INICIAL'
-            self.ids.value_display.text = 'Ajustar Posición'
-            self.ids.left_btn.text = '-'
-            self.ids.right_btn.text = '+'
-            self.ids.center_btn.text = 'FIJAR CERO'
-
-        elif self.current_state == 'LOAD_SETUP':
-            self.ids.title_label.text = 'CARGAR VOLUMEN'
-            self.ids.value_display.text = f"{max(0, self.current_val_1):.1f} mL"
-            self.ids.left_btn.text = '-'
-            self.ids.right_btn.text = '+'
-            self.ids.center_btn.text = 'CARGAR'
-
-        elif self.current_state == 'MODE_SELECT':
-            self.ids.title_label.text = 'SELECCIONAR MODO'
-            self.ids.value_display.text = "¿Cómo expulsar?"
-            self.ids.right_btn.text = 'CAUDAL'
-            self.ids.left_btn.text = 'TIEMPO'
-            self.ids.center_btn.text = '...'
-            self.ids.center_btn.disabled = True
-
-        elif self.current_state == 'CAUDAL_SUBMENU':
-            self.ids.title_label.text = 'CONFIGURAR CAUDAL'
-            self.ids.value_display.text = "Tipo de Control"
-            self.ids.right_btn.text = 'PRESETS'
-            self.ids.left_btn.text = 'MANUAL'
-            self.ids.center_btn.text = '...'
-            self.ids.center_btn.disabled = True
-
-        elif self.current_state == 'CAUDAL_PRESET':
-            self.ids.title_label.text = 'MODO PRESETS'
-            self.ids.value_display.text = f"{int(self.current_val_1)} uL/min"
-            self.ids.sub_display.text = f"Repeticiones: {int(self.current_val_2)}"
-            self.ids.left_btn.text = '<'
-            self.ids.right_btn.text = '>'
-            self.ids.center_btn.text = 'INICIAR'
-            self.ids.extra_panel.opacity = 1
-            self.ids.extra_panel.disabled = False
-            self.ids.extra_btn.text = "Cambiar Repeticiones"
-
-        elif self.current_state == 'CAUDAL_MANUAL':
-            self.ids.title_label.text = 'MODO MANUAL'
-            self.ids.value_display.text = f"{int(self.current_val_1)} uL/min"
-            self.ids.sub_display.text = f"Paso: +/- {int(self.current_val_2)}"
-            self.ids.left_btn.text = '-'
-            self.ids.right_btn.text = '+'
-            self.ids.center_btn.text = 'INICIAR'
-            self.ids.extra_panel.opacity = 1
-            self.ids.extra_panel.disabled = False
-            self.ids.extra_btn.text = f"Cambiar Escala (+/- {int(self.current_val_2)})"
-
-        elif self.current_state == 'TIME_SETUP':
-            self.ids.title_label.text = 'MODO TIEMPO'
-            self.ids.value_display.text = f"{int(self.current_val_1)} seg"
-            self.ids.left_btn.text = '-'
-            self.ids.right_btn.text = '+'
-            self.ids.center_btn.text = 'INICIAR'
-
-        elif self.current_state == 'POST_EXPULSION':
-            self.ids.title_label.text = 'CICLO COMPLETADO'
-            self.ids.value_display.text = 'Finalizado'
-            self.ids.control_panel.disabled = True
+        if is_homing != self.homing_bound:
+            for btn in (self.ids.right_btn, self.ids.left_btn):
+                if is_homing: btn.fbind('on_release', self.stop_adjustment)
+                else: btn.funbind('on_release', self.stop_adjustment)
+            self.homing_bound = is_homing
+
+        target = build_view(WIDGET_VIEWS, self.current_state, WIDGET_VIEW_BASE,
+                            volume=max(0, self.current_val_1),
+                            val_1=int(self.current_val_1),
+                            val_2=int(self.current_val_2),
+                            step=self.program_step[0],
+                            step_detail=self.program_step[1])
+        self.view.apply(target, messages)
+        if self.recorder: self.recorder.state(self.current_state)
+        METRICS.observe('update_ui', time.monotonic() - t0)
 
 class BombaApp(App):
     def build(self):
+        setup_logging()
+        side_log('firmware', FIRMWARE_LOG)
+        from kivy.core.window import Window
+        Window.bind(on_keyboard=self.on_keyboard)
         return ControlBombaWidget()
+    def on_keyboard(self, window, key, *args):
+        if key == 293:  # F12: volcar métricas a JSON
+            path = METRICS.dump(os.path.join(self.user_data_dir, time.strftime('metricas_%Y%m%d_%H%M%S.json')))
+            log.warning("Métricas volcadas en %s", path)
+            return True
     def on_stop(self):
+        self.root.stop_reader()
+        if self.root.writer: self.root.writer.stop()
+        if self.root.recorder: self.root.recorder.stop()
         if arduino: arduino.close()
+        stop_logging()
 
 if __name__ == '__main__':
     BombaApp().run()
\ No newline at end of file